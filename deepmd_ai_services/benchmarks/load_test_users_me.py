@@ -0,0 +1,146 @@
+"""
+Load test of GET /api/users/me under the two server modes: gunicorn with sync WSGI workers (the
+previous deployment) and the ASGI application on uvicorn workers. Reports requests/s and the
+p50 / p99 latency at a given client concurrency. The servers use a throwaway key pair and, unless
+DATABASE_URL is set (e.g. a local PostgreSQL to include the connection pool), a temporary SQLite db.
+
+    cd deepmd_ai_services
+    python benchmarks/load_test_users_me.py --requests 5000 --concurrency 64 --workers 2
+    python benchmarks/load_test_users_me.py --mode asgi
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def server_env(tmp_dir: str) -> dict:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "deepmd_ai_services.settings",
+        "DJANGO_JWT_PRIVATE_KEY": key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()).decode(),
+        "DJANGO_JWT_PUBLIC_KEY": key.public_key().public_bytes(serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo).decode(),
+        "WORKOS_API_KEY": os.getenv("WORKOS_API_KEY", "bench"),
+        "WORKOS_CLIENT_ID": os.getenv("WORKOS_CLIENT_ID", "bench"),
+        "DEBUG": "False",
+    }
+    env.setdefault("DATABASE_URL", f"sqlite:///{tmp_dir}/db.sqlite3")
+    return env
+
+
+def bench_token(env: dict) -> str:
+    """migrate the db and return the token of a benchmark user, in a subprocess with the servers' env"""
+    subprocess.run([sys.executable, "manage.py", "migrate", "--verbosity", "0"], cwd=PROJECT_DIR, env=env, check=True)
+    script = (
+        "import django; django.setup()\n"
+        "from users.models import User\n"
+        "from users.api import jwt_service\n"
+        "user, _ = User.objects.get_or_create(user_id='user__bench__0', defaults={'username': 'bench-user-0'})\n"
+        "print(jwt_service.generate_token(user))\n"
+    )
+    return subprocess.run([sys.executable, "-c", script], cwd=PROJECT_DIR, env=env, check=True,
+        capture_output=True, text=True).stdout.strip().splitlines()[-1]
+
+
+def server_command(mode: str, port: int, workers: int, threads: int) -> list[str]:
+    bind = ["--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--log-level", "warning"]
+    if mode == "wsgi":
+        return ["gunicorn", "deepmd_ai_services.wsgi:application", "--threads", str(threads), *bind]
+    if shutil.which("gunicorn") and importlib.util.find_spec("uvicorn_worker") is not None:
+        return ["gunicorn", "deepmd_ai_services.asgi:application", "-k", "uvicorn_worker.UvicornWorker", *bind]
+    return ["uvicorn", "deepmd_ai_services.asgi:application", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get("/api/users/.well-known/jwks.json")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise TimeoutError(f"server did not start: {base_url}")
+
+
+async def measure(base_url: str, token: str, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    # as behind the TLS terminating proxy, SECURE_SSL_REDIRECT is on with DEBUG=False
+    headers = {"Authorization": f"Bearer {token}", "X-Forwarded-Proto": "https"}
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.get("/api/users/me")
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+
+        # warm up: connections, per-worker token and user caches
+        await asyncio.gather(*(client.get("/api/users/me") for _ in range(concurrency)))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests_per_s": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = server_env(tmp_dir)
+        token = bench_token(env)
+        for mode in (("wsgi", "asgi") if args.mode == "both" else (args.mode,)):
+            command = server_command(mode, port := free_port(), args.workers, args.threads)
+            if shutil.which(command[0]) is None:
+                print(f"{mode}: {command[0]} not installed, skipped")
+                continue
+            server = subprocess.Popen(command, cwd=PROJECT_DIR, env=env)
+            try:
+                await wait_until_up(f"http://127.0.0.1:{port}")
+                result = await measure(f"http://127.0.0.1:{port}", token, args.requests, args.concurrency)
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{mode} ({command[0]}, {args.workers} workers): {result['requests_per_s']:8.0f} req/s  "
+                f"p50={result['p50_ms']:7.2f}ms  p99={result['p99_ms']:7.2f}ms  errors={result['errors']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["wsgi", "asgi", "both"], default="both")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=1, help="threads per gunicorn sync worker (wsgi mode)")
+    asyncio.run(main(parser.parse_args()))
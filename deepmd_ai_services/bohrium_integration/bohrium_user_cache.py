@@ -0,0 +1,99 @@
+import collections
+import functools
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional
+
+import httpx
+from jose import jwk, jwt
+
+# Configuration
+USER_INFO_CACHE_SECONDS = 600        # Bohrium user info (name, org) per access key
+TOKEN_LIFETIME_SECONDS = 30 * 60     # exp of the minted bohrium-proxy JWTs
+TOKEN_REUSE_MARGIN_SECONDS = 5 * 60  # a minted token is reused until it is this close to its exp
+CACHE_MAX_ENTRIES = 10000
+UPSTREAM_TIMEOUT_SECONDS = 10
+
+
+@functools.lru_cache(maxsize=8)
+def parse_private_key(pem: str):
+    """the signing key object, parsed once per process instead of on every jwt.encode"""
+    return jwk.construct(pem, "RS256")
+
+
+def access_key_digest(access_key: str, app_key: Optional[str]) -> str:
+    """cache key, the access key itself is never kept"""
+    return hashlib.sha256(f"{access_key}\0{app_key or ''}".encode()).hexdigest()
+
+
+class BohriumUserCache:
+    """
+    User info and minted redirect JWTs by access key digest, so repeat page loads of a user need
+    no Bohrium call and no RSA signature. Every OpenSDK client shares one HTTP connection pool.
+    Failed lookups are not cached.
+    """
+
+    def __init__(self, private_key: str, sdk_factory: Callable[..., Any], *,
+            http_client: Optional[httpx.Client] = None,
+            user_info_seconds: float = USER_INFO_CACHE_SECONDS,
+            token_lifetime_seconds: float = TOKEN_LIFETIME_SECONDS,
+            token_reuse_margin_seconds: float = TOKEN_REUSE_MARGIN_SECONDS,
+            max_entries: int = CACHE_MAX_ENTRIES,
+            clock: Callable[[], float] = time.time):
+        self.private_key = private_key
+        self.sdk_factory = sdk_factory
+        self.http_client = http_client if http_client is not None else httpx.Client(timeout=UPSTREAM_TIMEOUT_SECONDS, follow_redirects=True)
+        self.user_info_seconds = user_info_seconds
+        self.token_lifetime_seconds = token_lifetime_seconds
+        self.token_reuse_margin_seconds = token_reuse_margin_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        # digest -> (expires_at, value), least recently used first
+        self._user_data: collections.OrderedDict[str, tuple[float, dict]] = collections.OrderedDict()
+        self._tokens: collections.OrderedDict[str, tuple[float, str]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.upstream_calls = 0
+
+    def _get(self, entries: collections.OrderedDict, key: str, min_remaining: float = 0):
+        with self._lock:
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at - self.clock() <= min_remaining:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return value
+
+    def _set(self, entries: collections.OrderedDict, key: str, value, expires_at: float):
+        with self._lock:
+            entries[key] = (expires_at, value)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def user_data(self, access_key: str, app_key: Optional[str]) -> dict:
+        key = access_key_digest(access_key, app_key)
+        user_data = self._get(self._user_data, key)
+        if user_data is None:
+            client = self.sdk_factory(access_key=access_key, app_key=app_key, http_client=self.http_client)
+            self.upstream_calls += 1
+            user_data = client.user.get_info()["data"]
+            self._set(self._user_data, key, user_data, self.clock() + self.user_info_seconds)
+        return user_data
+
+    def token(self, access_key: str, app_key: Optional[str]) -> str:
+        """bohrium-proxy JWT of the user, a cached one while it has more than the reuse margin left"""
+        key = access_key_digest(access_key, app_key)
+        token = self._get(self._tokens, key, min_remaining=self.token_reuse_margin_seconds)
+        if token is None:
+            user_data = self.user_data(access_key, app_key)
+            now = self.clock()
+            issued_at = datetime.fromtimestamp(now, timezone.utc)
+            payload = {"user_data": user_data, "iat": issued_at, "exp": issued_at + timedelta(seconds=self.token_lifetime_seconds)}
+            token = jwt.encode(payload, parse_private_key(self.private_key), algorithm="RS256")
+            self._set(self._tokens, key, token, now + self.token_lifetime_seconds)
+        return token
@@ -2,12 +2,14 @@ import gradio as gr
 from bohrium_open_sdk import OpenSDK
 from http.cookies import SimpleCookie
 import os
-from jose import jwt
-from datetime import datetime, timedelta, timezone
+from bohrium_user_cache import BohriumUserCache
 
 TARGET_URL = os.getenv("TARGET_URL", "https://deepmodeling-ai.deepmd.us/api/users/jwt/bohrium-proxy/callback")
 BOHRIUM_PROXY_JWT_PRIVATE_KEY = os.getenv("BOHRIUM_PROXY_JWT_PRIVATE_KEY")
 
+# user info and minted tokens by access key digest, one HTTP connection pool for every OpenSDK client
+user_cache = BohriumUserCache(BOHRIUM_PROXY_JWT_PRIVATE_KEY, OpenSDK)
+
 def instant_redirect(request: gr.Request):
     """get cookie and redirect"""
     try:
@@ -18,14 +20,7 @@ def instant_redirect(request: gr.Request):
         access_key = simple_cookie["appAccessKey"].value
         app_key = simple_cookie["clientName"].value
 
-
-        client = OpenSDK(access_key=access_key, app_key=app_key)
-        user_info = client.user.get_info()
-        user_data = user_info['data']
-
-        now = datetime.now(timezone.utc)
-        payload = {"user_data": user_data, "iat": now, "exp": now + timedelta(minutes=30)}
-        auth_token = jwt.encode(payload, BOHRIUM_PROXY_JWT_PRIVATE_KEY, algorithm="RS256")
+        auth_token = user_cache.token(access_key, app_key)
 
         # separator = "&" if "?" in TARGET_URL else "?"
         # redirect_url = f"{TARGET_URL}{separator}external_jwt={auth_token}"
@@ -0,0 +1,102 @@
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+from bohrium_user_cache import BohriumUserCache
+
+
+class FakeOpenSDK:
+    """stands in for bohrium_open_sdk.OpenSDK: user.get_info() answers from a dict of access keys"""
+    users = {}
+    clients = []
+
+    def __init__(self, *, access_key: str, app_key: str, http_client=None):
+        self.access_key = access_key
+        self.http_client = http_client
+        self.user = self
+        FakeOpenSDK.clients.append(self)
+
+    def get_info(self) -> dict:
+        if self.access_key not in self.users:
+            raise RuntimeError("invalid access key")
+        return {"code": 0, "data": self.users[self.access_key]}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_800_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture(scope="module")
+def key_pair() -> tuple[str, str]:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode()
+    public_pem = key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    return private_pem, public_pem
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+@pytest.fixture
+def user_cache(key_pair, clock):
+    FakeOpenSDK.users = {"ak-alice": {"user_id": 1, "name": "alice", "org_id": 7}}
+    FakeOpenSDK.clients = []
+    return BohriumUserCache(key_pair[0], FakeOpenSDK, clock=clock)
+
+
+def test_repeat_loads_need_no_upstream_call(user_cache, key_pair):
+    token = user_cache.token("ak-alice", "app")
+    for _ in range(5):
+        assert user_cache.token("ak-alice", "app") == token
+    assert user_cache.upstream_calls == 1
+    payload = jwt.decode(token, key_pair[1], algorithms=["RS256"], options={"verify_exp": False})
+    assert payload["user_data"]["name"] == "alice"
+    assert FakeOpenSDK.clients[0].http_client is user_cache.http_client
+
+
+def test_tokens_are_reminted_close_to_expiry(user_cache, clock):
+    token = user_cache.token("ak-alice", "app")
+    clock.now += user_cache.token_lifetime_seconds - user_cache.token_reuse_margin_seconds - 1
+    assert user_cache.token("ak-alice", "app") == token
+    clock.now += 2
+    assert user_cache.token("ak-alice", "app") != token
+    # the user info expired meanwhile, the new token carries a fresh one
+    assert user_cache.upstream_calls == 2
+
+
+def test_user_info_is_refetched_after_its_ttl(user_cache, clock):
+    user_cache.user_data("ak-alice", "app")
+    clock.now += user_cache.user_info_seconds - 1
+    user_cache.user_data("ak-alice", "app")
+    assert user_cache.upstream_calls == 1
+    clock.now += 1
+    user_cache.user_data("ak-alice", "app")
+    assert user_cache.upstream_calls == 2
+
+
+def test_failures_are_not_cached_and_keys_are_digests(user_cache):
+    with pytest.raises(RuntimeError):
+        user_cache.token("ak-unknown", "app")
+    FakeOpenSDK.users["ak-unknown"] = {"user_id": 2, "name": "bob", "org_id": 7}
+    assert user_cache.user_data("ak-unknown", "app")["name"] == "bob"
+    assert user_cache.user_data("ak-alice", "other-app")["name"] == "alice"
+    assert user_cache.upstream_calls == 3
+    assert not any("ak-" in key for key in user_cache._user_data)
+
+
+def test_least_recently_used_users_are_evicted(key_pair, clock):
+    FakeOpenSDK.users = {f"ak-{i}": {"user_id": i, "name": f"user{i}", "org_id": 1} for i in range(3)}
+    user_cache = BohriumUserCache(key_pair[0], FakeOpenSDK, max_entries=2, clock=clock)
+    for i in (0, 1, 0, 2):
+        user_cache.user_data(f"ak-{i}", "app")
+    user_cache.user_data("ak-0", "app")
+    assert user_cache.upstream_calls == 3
+    user_cache.user_data("ak-1", "app")
+    assert user_cache.upstream_calls == 4
@@ -0,0 +1,5 @@
+import os
+
+# users.api builds the WorkOS client at import time
+os.environ.setdefault("WORKOS_API_KEY", "test-workos-api-key")
+os.environ.setdefault("WORKOS_CLIENT_ID", "test-workos-client-id")
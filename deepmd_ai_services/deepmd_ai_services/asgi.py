@@ -9,8 +9,34 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'deepmd_ai_services.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+
+class ApiASGIHandler(ASGIHandler):
+    """ASGI handler of the API requests, behind settings.API_MIDDLEWARE instead of settings.MIDDLEWARE"""
+
+    def load_middleware(self, is_async=False):
+        # BaseHandler reads settings.MIDDLEWARE, swapped only while this handler builds its chain at startup
+        middleware = settings.MIDDLEWARE
+        settings.MIDDLEWARE = settings.API_MIDDLEWARE
+        try:
+            super().load_middleware(is_async=is_async)
+        finally:
+            settings.MIDDLEWARE = middleware
+
+
+site_application = ASGIHandler()
+api_application = ApiASGIHandler()
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and scope["path"].startswith(settings.API_PATH_PREFIX):
+        await api_application(scope, receive, send)
+    else:
+        await site_application(scope, receive, send)
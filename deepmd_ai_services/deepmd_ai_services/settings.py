@@ -52,14 +52,14 @@ INSTALLED_APPS = [
     'users',
     'rest_framework',
     'corsheaders',
-    # 'deepmd_modal_batch_queue',
+    'deepmd_modal_batch_queue',
 ]
 
 AUTH_USER_MODEL = 'users.User'
 
 MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'deepmd_ai_services.middleware.AsyncSecurityMiddleware',  # security headers, async capable
+    'deepmd_ai_services.middleware.AsyncWhiteNoiseMiddleware',  # whitenoise, async capable
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,6 +69,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# /api/ requests under ASGI (see asgi.py): JWT auth, no session, csrf exempt ninja views,
+# so only the async capable middleware the API needs, none that hops through a thread
+API_PATH_PREFIX = '/api/'
+API_MIDDLEWARE = [
+    'deepmd_ai_services.middleware.AsyncSecurityMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+]
+
 ROOT_URLCONF = 'deepmd_ai_services.urls'
 
 TEMPLATES = [
@@ -87,6 +95,9 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'deepmd_ai_services.wsgi.application'
+# the ninja views are async; deployed on WSGI until the ASGI app matches it under load (benchmarks/load_test_users_me.py),
+# ASGI: gunicorn -k uvicorn_worker.UvicornWorker deepmd_ai_services.asgi:application
+ASGI_APPLICATION = 'deepmd_ai_services.asgi.application'
 
 
 # Database
@@ -97,6 +108,17 @@ if config('DATABASE_URL', default=None):
     DATABASES = {
         'default': dj_database_url.parse(config('DATABASE_URL'))
     }
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+        # psycopg 3 connection pool per worker process, shared by the threads the async views run queries in
+        # (pooled connections are returned after each request, CONN_MAX_AGE has to stay 0)
+        DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = config('CONN_MAX_AGE', default=60, cast=int)
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = True
 else:
     DATABASES = {
         'default': {
@@ -106,6 +128,28 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Verified tokens and user rows (users.auth_cache). In-process by default,
+# CACHE_URL=redis://host:6379/0 shares it between workers (needs the redis package)
+if config('CACHE_URL', default=None):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('CACHE_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'deepmd-ai-services',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -18,9 +18,11 @@ from django.contrib import admin
 from django.urls import path
 from ninja import NinjaAPI
 from users.api import users_router
+from deepmd_modal_batch_queue.api import queue_router
 
 api = NinjaAPI()
 api.add_router("/users/", users_router) # /api/users/me, /api/users/auth/callback  
+api.add_router("/queue/", queue_router) # /api/queue/jobs, /api/queue/jobs/{job_id}/cancel
 
 
 urlpatterns = [
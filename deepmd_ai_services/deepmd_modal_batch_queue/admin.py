@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 import json
-from .models import Queuejob, QueuejobStatus
+from .models import Queuejob, QueuejobStatus, LammpsThroughput
 
 
 @admin.register(Queuejob)
@@ -15,6 +15,7 @@ class QueuejobAdmin(admin.ModelAdmin):
     list_display = [
         'queuejob_id',
         'queuejob_name',
+        'queuejob_type',
         'user_id_display',
         'status_badge',
         'modal_info',
@@ -25,6 +26,7 @@ class QueuejobAdmin(admin.ModelAdmin):
     # List filters
     list_filter = [
         'current_status',
+        'queuejob_type',
         'modal_app_name',
         'modal_function_name',
         'created_at',
@@ -38,6 +40,7 @@ class QueuejobAdmin(admin.ModelAdmin):
         'user_id',
         'user_email',
         'queuejob_hash',
+        'parent_queuejob_id',
         'modal_function_call_id'
     ]
     
@@ -46,7 +49,8 @@ class QueuejobAdmin(admin.ModelAdmin):
         'id',
         'created_at',
         'updated_at',
-        'status_history_display'
+        'status_history_display',
+        'performance_display'
     ]
     
     # Field organization
@@ -56,7 +60,10 @@ class QueuejobAdmin(admin.ModelAdmin):
                 'id',
                 'queuejob_id',
                 'queuejob_name',
-                'queuejob_hash'
+                'queuejob_type',
+                'queuejob_hash',
+                'parent_queuejob_id',
+                'attempt_index'
             )
         }),
         ('User Information', {
@@ -80,6 +87,13 @@ class QueuejobAdmin(admin.ModelAdmin):
             ),
             'classes': ('collapse',)
         }),
+        ('Resource Telemetry', {
+            'fields': (
+                'performance_display',
+                'resource_telemetry'
+            ),
+            'classes': ('collapse',)
+        }),
         ('Status & History', {
             'fields': (
                 'current_status',
@@ -200,6 +214,26 @@ class QueuejobAdmin(admin.ModelAdmin):
     
     status_history_display.short_description = 'Recent Status History'
     
+    def performance_display(self, obj):
+        """Display LAMMPS performance and peak resource usage"""
+        telemetry = obj.resource_telemetry or {}
+        performance = telemetry.get('performance') or {}
+        if not telemetry:
+            return "No telemetry"
+
+        return format_html(
+            '<code style="font-size: 0.9em;">{} timesteps/s, {} ns/day<br/>'
+            'peak cpu {}%, rss {} MB, gpu {}%, gpu mem {} MB</code>',
+            performance.get('timesteps_per_second', '-'),
+            performance.get('ns_per_day', '-'),
+            telemetry.get('peak_cpu_percent', '-'),
+            telemetry.get('peak_rss_mb', '-'),
+            telemetry.get('peak_gpu_util_percent', '-'),
+            telemetry.get('peak_gpu_mem_mb', '-'),
+        )
+
+    performance_display.short_description = 'Performance'
+
     def mark_as_cancelled(self, request, queryset):
         """Admin action to cancel selected jobs"""
         count = 0
@@ -223,3 +257,15 @@ class QueuejobAdmin(admin.ModelAdmin):
         self.message_user(request, f'{count} jobs marked as failed.')
     
     mark_as_failed.short_description = "Mark selected jobs as failed"
+
+
+@admin.register(LammpsThroughput)
+class LammpsThroughputAdmin(admin.ModelAdmin):
+    """
+    Admin interface for the measured LAMMPS throughput table
+    """
+
+    list_display = ['model_key', 'gpu_type', 'atoms_bucket', 'mean_katom_steps_per_second', 'samples', 'updated_at']
+    list_filter = ['gpu_type']
+    search_fields = ['model_key']
+    readonly_fields = ['samples', 'mean_katom_steps_per_second', 'm2_katom_steps_per_second', 'updated_at']
@@ -0,0 +1,309 @@
+import math
+import os
+import secrets
+from typing import Optional
+
+import modal
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import HttpRequest, JsonResponse
+from django.utils import timezone
+from ninja import Router, Schema, Field
+from loguru import logger
+
+from users.api import auth_required
+from .models import Queuejob, QueuejobStatus, QueuejobType, LammpsThroughput, GPU_HOURLY_PRICE_USD, normalize_gpu_type
+
+
+queue_router = Router()
+
+THROUGHPUT_MIN_LOOP_SECONDS = 10      # shorter runs are dominated by the setup, not recorded
+THROUGHPUT_MAX_BUCKET_DISTANCE = 2    # atom count buckets (factors of two) an estimate may extrapolate over
+RUNTIME_SAFETY_FACTOR = 1.3
+RUNTIME_STARTUP_SECONDS = 300         # container start, model loading, system setup
+MAX_SINGLE_RUN_TIMEOUT_SECONDS = 12 * 3600
+QUEUEJOB_LIST_MAX_LIMIT = 100
+# shared secret of the run service; when set, only its telemetry feeds the shared (/public/ model) throughput rows
+QUEUE_TELEMETRY_SERVICE_TOKEN = os.getenv("QUEUE_TELEMETRY_SERVICE_TOKEN", "")
+TELEMETRY_SERVICE_TOKEN_HEADER = "HTTP_X_TELEMETRY_SERVICE_TOKEN"
+
+
+# Schemas
+class QueuejobCreateSchema(Schema):
+    queuejob_name: str = Field(default="Untitled Queuejob")
+    queuejob_type: str = Field(default=QueuejobType.LAMMPS_SIMULATION)
+    modal_function_call_id: str = Field(default="")
+    modal_app_name: str = Field(default="")
+    modal_function_name: str = Field(default="")
+    modal_volume_name: str = Field(default="")
+    command: str = Field(default="")
+    environment_vars: dict = Field(default_factory=dict)
+    status: str = Field(default=QueuejobStatus.SUBMITTED)
+    parent_queuejob_id: str = Field(default="")
+    attempt_index: int = Field(default=0, ge=0)
+
+
+class QueuejobStatusSchema(Schema):
+    status: str
+    message: str = Field(default="")
+    # the function call that now runs the job, e.g. the continuation of a managed run orchestrator
+    current_modal_function_call_id: str = Field(default="")
+
+
+class QueuejobTelemetrySchema(Schema):
+    telemetry: dict
+    status: str = Field(default="")
+    message: str = Field(default="")
+
+
+def _queuejob_to_dict(job: Queuejob) -> dict:
+    return {
+        "queuejob_id": job.queuejob_id,
+        "queuejob_name": job.queuejob_name,
+        "queuejob_type": job.queuejob_type,
+        "user_id": job.user_id,
+        "modal_function_call_id": job.modal_function_call_id,
+        "current_modal_function_call_id": job.current_modal_function_call_id,
+        "modal_app_name": job.modal_app_name,
+        "modal_function_name": job.modal_function_name,
+        "modal_volume_name": job.modal_volume_name,
+        "command": job.command,
+        "environment_vars": job.environment_vars,
+        "current_status": job.current_status,
+        "status_message": job.status_history[-1].get("data", {}).get("message", "") if job.status_history else "",
+        "parent_queuejob_id": job.parent_queuejob_id,
+        "attempt_index": job.attempt_index,
+        "performance": (job.resource_telemetry or {}).get("performance"),
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+    }
+
+
+async def _get_user_queuejob(request: HttpRequest, job_id: str) -> Optional[Queuejob]:
+    """job_id can be either the queuejob_id or the modal function call id"""
+    return await Queuejob.objects.filter(
+        Q(queuejob_id=job_id) | Q(modal_function_call_id=job_id) | Q(current_modal_function_call_id=job_id),
+        user_id=request.user.user_id,
+    ).order_by("-created_at").afirst()
+
+
+def _is_service_telemetry(request: HttpRequest) -> bool:
+    token = request.META.get(TELEMETRY_SERVICE_TOKEN_HEADER, "")
+    return bool(QUEUE_TELEMETRY_SERVICE_TOKEN) and secrets.compare_digest(token, QUEUE_TELEMETRY_SERVICE_TOKEN)
+
+
+def _record_throughput(job: Queuejob, telemetry: dict, *, from_service: bool = False) -> Optional[LammpsThroughput]:
+    """
+    feed the throughput table from the telemetry of a completed lammps job.
+    Any user can post telemetry: with a configured service token the shared rows only take the run service's,
+    implausible samples are rejected by LammpsThroughput.record_run either way.
+    """
+    performance = telemetry.get("performance") or {}
+    model = (job.environment_vars or {}).get("model")
+    atoms = performance.get("atoms") or (job.environment_vars or {}).get("atoms")
+    gpu_type = normalize_gpu_type(telemetry.get("gpu_name") or "")
+    if not (model and atoms and gpu_type) or performance.get("loop_time_seconds", 0) < THROUGHPUT_MIN_LOOP_SECONDS:
+        return None
+    katom_steps_per_second = performance.get("katom_steps_per_second")
+    if katom_steps_per_second is None and performance.get("timesteps_per_second"):
+        katom_steps_per_second = performance["timesteps_per_second"] * atoms / 1000
+    if not katom_steps_per_second:
+        return None
+    model_key = LammpsThroughput.model_key_for(model, job.user_id)
+    if QUEUE_TELEMETRY_SERVICE_TOKEN and LammpsThroughput.is_shared_model_key(model_key) and not from_service:
+        logger.warning(f"throughput of a shared model without the service token, not recorded: {job.queuejob_id=} {model_key=}")
+        return None
+    return LammpsThroughput.record_run(model_key, gpu_type, int(atoms), katom_steps_per_second)
+
+
+def estimate_lammps_runtime(model_key: str, atoms: int, steps: int) -> dict:
+    """per GPU type: expected runtime, suggested timeout and cost, from the nearest measured atom count bucket"""
+    bucket = LammpsThroughput.atoms_bucket_for(atoms)
+    nearest = {}
+    for row in LammpsThroughput.objects.filter(model_key=model_key):
+        distance = abs(math.log2(row.atoms_bucket) - math.log2(bucket))
+        if distance <= THROUGHPUT_MAX_BUCKET_DISTANCE and (row.gpu_type not in nearest or distance < nearest[row.gpu_type][0]):
+            nearest[row.gpu_type] = (distance, row)
+
+    estimates = []
+    for gpu_type, (_, row) in nearest.items():
+        seconds = steps * atoms / 1000 / row.mean_katom_steps_per_second
+        price = GPU_HOURLY_PRICE_USD.get(gpu_type)
+        estimates.append({
+            "gpu_type": gpu_type,
+            "katom_steps_per_second": round(row.mean_katom_steps_per_second, 3),
+            "samples": row.samples,
+            "measured_atoms_bucket": row.atoms_bucket,
+            "estimated_seconds": round(seconds, 1),
+            "suggested_timeout_seconds": math.ceil(seconds * RUNTIME_SAFETY_FACTOR + RUNTIME_STARTUP_SECONDS),
+            "estimated_cost_usd": None if price is None else round(price * seconds / 3600, 4),
+        })
+    estimates.sort(key=lambda e: (e["estimated_cost_usd"] is None, e["estimated_cost_usd"], e["estimated_seconds"]))
+
+    fitting = [e for e in estimates if e["suggested_timeout_seconds"] <= MAX_SINGLE_RUN_TIMEOUT_SECONDS]
+    return {
+        "model_key": model_key,
+        "atoms": atoms,
+        "steps": steps,
+        "estimates": estimates,
+        # the cheapest GPU that finishes within a single run, a managed run otherwise
+        "suggested": fitting[0] if fitting else None,
+        "needs_managed_run": bool(estimates) and not fitting,
+    }
+
+
+def generate_queuejob_id() -> str:
+    return f"queuejob-{timezone.now().strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}"
+
+
+# Queuejob endpoints
+@queue_router.post("/jobs")
+@auth_required
+async def create_queuejob(request, data: QueuejobCreateSchema):
+    """Record a job submitted to modal"""
+    if data.queuejob_type not in QueuejobType.values:
+        return JsonResponse({"error": f"invalid queuejob_type: {data.queuejob_type}"}, status=400)
+
+    parent_queuejob_id = ""
+    if data.parent_queuejob_id:
+        # the parent can be given by its modal function call id, it has to belong to the same user
+        parent = await _get_user_queuejob(request, data.parent_queuejob_id)
+        if parent is None:
+            return JsonResponse({"error": f"parent job not found: {data.parent_queuejob_id}"}, status=404)
+        parent_queuejob_id = parent.queuejob_id
+
+    job = await Queuejob.objects.acreate(
+        queuejob_id=generate_queuejob_id(),
+        queuejob_name=data.queuejob_name,
+        queuejob_type=data.queuejob_type,
+        user_id=request.user.user_id,
+        user_email=request.user.email or "",
+        modal_function_call_id=data.modal_function_call_id,
+        modal_app_name=data.modal_app_name,
+        modal_function_name=data.modal_function_name,
+        modal_volume_name=data.modal_volume_name,
+        command=data.command,
+        environment_vars=data.environment_vars,
+        parent_queuejob_id=parent_queuejob_id,
+        attempt_index=data.attempt_index,
+    )
+    await sync_to_async(job.add_status)(data.status, "Submitted")
+    return _queuejob_to_dict(job)
+
+
+@queue_router.get("/jobs")
+@auth_required
+async def list_queuejobs(request, status: str = "", queuejob_type: str = "", include_attempts: bool = False, limit: int = 20):
+    """Recent jobs of the user, newest first. Attempts (segments) of managed runs only with include_attempts"""
+    if status and status not in QueuejobStatus.values:
+        return JsonResponse({"error": f"invalid status: {status}"}, status=400)
+    if queuejob_type and queuejob_type not in QueuejobType.values:
+        return JsonResponse({"error": f"invalid queuejob_type: {queuejob_type}"}, status=400)
+
+    jobs = Queuejob.objects.filter(user_id=request.user.user_id)
+    if status:
+        jobs = jobs.filter(current_status=status)
+    if queuejob_type:
+        jobs = jobs.filter(queuejob_type=queuejob_type)
+    if not include_attempts:
+        jobs = jobs.filter(parent_queuejob_id="")
+    limit = max(1, min(limit, QUEUEJOB_LIST_MAX_LIMIT))
+    return {"jobs": [_queuejob_to_dict(job) async for job in jobs.order_by("-created_at")[:limit]]}
+
+
+@queue_router.get("/jobs/{job_id}")
+@auth_required
+async def get_queuejob(request, job_id: str):
+    """Get job by queuejob_id or modal function call id"""
+    job = await _get_user_queuejob(request, job_id)
+    if job is None:
+        return JsonResponse({"error": f"job not found: {job_id}"}, status=404)
+    return _queuejob_to_dict(job)
+
+
+@queue_router.post("/jobs/{job_id}/status")
+@auth_required
+async def update_queuejob_status(request, job_id: str, data: QueuejobStatusSchema):
+    """Append a status change to the job history"""
+    if data.status not in QueuejobStatus.values:
+        return JsonResponse({"error": f"invalid status: {data.status}"}, status=400)
+
+    job = await _get_user_queuejob(request, job_id)
+    if job is None:
+        return JsonResponse({"error": f"job not found: {job_id}"}, status=404)
+
+    if data.current_modal_function_call_id:
+        job.current_modal_function_call_id = data.current_modal_function_call_id
+    await sync_to_async(job.add_status)(data.status, data.message)
+    return _queuejob_to_dict(job)
+
+
+@queue_router.post("/jobs/{job_id}/telemetry")
+@auth_required
+async def record_queuejob_telemetry(request, job_id: str, data: QueuejobTelemetrySchema):
+    """
+    Store the telemetry summary of a finished run, optionally with its final status.
+    The final status is ignored if the job already reached a terminal status (e.g. cancelled).
+    """
+    if data.status and data.status not in QueuejobStatus.values:
+        return JsonResponse({"error": f"invalid status: {data.status}"}, status=400)
+
+    job = await _get_user_queuejob(request, job_id)
+    if job is None:
+        return JsonResponse({"error": f"job not found: {job_id}"}, status=404)
+
+    await sync_to_async(job.record_telemetry)(data.telemetry)
+    if data.status and not job.is_completed:
+        await sync_to_async(job.add_status)(data.status, data.message)
+        if data.status == QueuejobStatus.COMPLETED and job.queuejob_type == QueuejobType.LAMMPS_SIMULATION:
+            await sync_to_async(_record_throughput)(job, data.telemetry, from_service=_is_service_telemetry(request))
+    return _queuejob_to_dict(job)
+
+
+@queue_router.get("/throughput/estimate")
+@auth_required
+async def estimate_runtime(request, model: str, atoms: int, steps: int):
+    """
+    Expected runtime, suggested timeout and GPU type of a run, from the throughput
+    of completed jobs with the same model and a similar atom count
+    """
+    if atoms <= 0 or steps <= 0:
+        return JsonResponse({"error": "atoms and steps must be positive"}, status=400)
+    return await sync_to_async(estimate_lammps_runtime)(LammpsThroughput.model_key_for(model, request.user.user_id), atoms, steps)
+
+
+@queue_router.post("/jobs/{job_id}/cancel")
+@auth_required
+async def cancel_queuejob(request, job_id: str):
+    """
+    Cancel the modal function call of the job.
+    The executor sends SIGTERM to lammps, then SIGKILL after CLEANUP_TIMEOUT_SECONDS.
+    For a managed run the current orchestrator (a continuation of the first one) and the running segments are cancelled.
+    """
+    job = await _get_user_queuejob(request, job_id)
+    if job is None:
+        return JsonResponse({"error": f"job not found: {job_id}"}, status=404)
+
+    if job.is_completed:
+        return {**_queuejob_to_dict(job), "cancelled": False, "message": f"job already {job.current_status}"}
+
+    running_attempts = [attempt async for attempt in Queuejob.objects.filter(parent_queuejob_id=job.queuejob_id)
+        if not attempt.is_completed]
+    call_ids = [call_id for call_id in (job.current_modal_function_call_id or job.modal_function_call_id,
+        *(attempt.modal_function_call_id for attempt in running_attempts)) if call_id]
+    try:
+        for call_id in call_ids:
+            # the blocking modal client in a worker thread, not on the event loop
+            await sync_to_async(lambda: modal.FunctionCall.from_id(call_id).cancel(), thread_sensitive=False)()
+    except Exception as e:
+        logger.warning(f"cancel modal function call failed: {call_ids=} {job.queuejob_id=} {e=}")
+        # keep the current status, only record the failed attempt in the history
+        await sync_to_async(job.add_status)(job.current_status, f"Cancel by {request.user.user_id} failed: {e}")
+        return JsonResponse({"error": f"cancel failed: {e}", "queuejob_id": job.queuejob_id}, status=502)
+    if call_ids:
+        logger.info(f"cancelled modal function calls: {call_ids=} {job.queuejob_id=}")
+
+    for attempt in running_attempts:
+        await sync_to_async(attempt.add_status)(QueuejobStatus.CANCELLED, f"Cancelled with {job.queuejob_id} by {request.user.user_id}")
+    await sync_to_async(job.add_status)(QueuejobStatus.CANCELLED, f"Cancelled by {request.user.user_id}")
+    return {**_queuejob_to_dict(job), "cancelled": True, "message": "job cancelled"}
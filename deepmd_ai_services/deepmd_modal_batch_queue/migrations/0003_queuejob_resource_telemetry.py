@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepmd_modal_batch_queue', '0002_queuejob_modal_volume_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuejob',
+            name='resource_telemetry',
+            field=models.JSONField(blank=True, default=dict, help_text='Compact CPU/RSS/GPU time series and LAMMPS performance summary of the run'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepmd_modal_batch_queue', '0003_queuejob_resource_telemetry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuejob',
+            name='queuejob_type',
+            field=models.CharField(choices=[('LAMMPS_SIMULATION', 'LAMMPS simulation'), ('TRAJECTORY_ANALYSIS', 'Trajectory analysis')], default='LAMMPS_SIMULATION', help_text='Kind of work the queuejob runs', max_length=30),
+        ),
+    ]
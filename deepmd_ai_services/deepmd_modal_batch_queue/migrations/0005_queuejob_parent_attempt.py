@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepmd_modal_batch_queue', '0004_queuejob_queuejob_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuejob',
+            name='attempt_index',
+            field=models.PositiveIntegerField(default=0, help_text='Index of the attempt within the parent queuejob'),
+        ),
+        migrations.AddField(
+            model_name='queuejob',
+            name='parent_queuejob_id',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='queuejob_id of the managed run this queuejob is an attempt (segment) of', max_length=50),
+        ),
+    ]
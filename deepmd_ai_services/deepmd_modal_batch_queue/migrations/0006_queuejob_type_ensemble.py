@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepmd_modal_batch_queue', '0005_queuejob_parent_attempt'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='queuejob',
+            name='queuejob_type',
+            field=models.CharField(choices=[('LAMMPS_SIMULATION', 'LAMMPS simulation'), ('TRAJECTORY_ANALYSIS', 'Trajectory analysis'), ('LAMMPS_ENSEMBLE', 'LAMMPS ensemble')], default='LAMMPS_SIMULATION', help_text='Kind of work the queuejob runs', max_length=30),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepmd_modal_batch_queue', '0006_queuejob_type_ensemble'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LammpsThroughput',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_key', models.CharField(help_text='/public/ model path, or user_id:path for models in the personal volume', max_length=255)),
+                ('gpu_type', models.CharField(help_text='Modal GPU type, e.g. T4', max_length=50)),
+                ('atoms_bucket', models.PositiveIntegerField(help_text='Lower bound of the power of two bucket the atom count falls in')),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('mean_katom_steps_per_second', models.FloatField(default=0.0)),
+                ('m2_katom_steps_per_second', models.FloatField(default=0.0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('model_key', 'gpu_type', 'atoms_bucket'), name='unique_lammps_throughput_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepmd_modal_batch_queue', '0007_lammps_throughput'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuejob',
+            name='current_modal_function_call_id',
+            field=models.CharField(blank=True, default='', help_text='Modal function call now running the queuejob (continuation of a managed run), cancelled with it', max_length=100),
+        ),
+    ]
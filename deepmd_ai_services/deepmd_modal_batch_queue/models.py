@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import datetime
@@ -19,6 +19,13 @@ class QueuejobStatus(models.TextChoices):
     TIMEOUT = 'TIMEOUT', 'Timeout'
 
 
+class QueuejobType(models.TextChoices):
+    """Queue Job type enumeration"""
+    LAMMPS_SIMULATION = 'LAMMPS_SIMULATION', 'LAMMPS simulation'
+    TRAJECTORY_ANALYSIS = 'TRAJECTORY_ANALYSIS', 'Trajectory analysis'
+    LAMMPS_ENSEMBLE = 'LAMMPS_ENSEMBLE', 'LAMMPS ensemble'
+
+
 class QueuejobStatusEvent(BaseModel):
     """
     Queuejob status change event following CloudEvent specification
@@ -42,7 +49,7 @@ class QueuejobStatusEvent(BaseModel):
         description="Event type identifier"
     )
     time: datetime = Field(
-        default_factory=lambda: datetime.now(timezone.utc),
+        default_factory=timezone.now,
         description="Event timestamp"
     )
     
@@ -110,6 +117,26 @@ class Queuejob(models.Model):
         help_text="Human readable queuejob name"
     )
 
+    queuejob_type = models.CharField(
+        max_length=30,
+        choices=QueuejobType.choices,
+        default=QueuejobType.LAMMPS_SIMULATION,
+        help_text="Kind of work the queuejob runs"
+    )
+
+    parent_queuejob_id = models.CharField(
+        max_length=50,
+        blank=True,
+        default="",
+        db_index=True,
+        help_text="queuejob_id of the managed run this queuejob is an attempt (segment) of"
+    )
+
+    attempt_index = models.PositiveIntegerField(
+        default=0,
+        help_text="Index of the attempt within the parent queuejob"
+    )
+
     queuejob_hash = models.CharField(
         max_length=100,
         blank=True,
@@ -136,6 +163,13 @@ class Queuejob(models.Model):
         help_text="Modal function call ID"
     )
 
+    current_modal_function_call_id = models.CharField(
+        max_length=100,
+        blank=True,
+        default="",
+        help_text="Modal function call now running the queuejob (continuation of a managed run), cancelled with it"
+    )
+
     modal_app_name = models.CharField(
         blank=True,
         max_length=100,
@@ -165,6 +199,13 @@ class Queuejob(models.Model):
         help_text="Environment variables as JSON"
     )
     
+    # Resource telemetry
+    resource_telemetry = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Compact CPU/RSS/GPU time series and LAMMPS performance summary of the run"
+    )
+
     # Status tracking
     status_history = models.JSONField(
         default=list,
@@ -199,7 +240,7 @@ class Queuejob(models.Model):
         ]
     
     def __str__(self):
-        return f"{self.job_name} ({self.job_id}) - {self.current_status}"
+        return f"{self.queuejob_name} ({self.queuejob_id}) - {self.current_status}"
     
     def add_status(self, status, message=""):
         """
@@ -213,11 +254,18 @@ class Queuejob(models.Model):
         )
         
         # Store CloudEvent in history
-        self.status_history.append(event.model_dump())
+        self.status_history.append(event.model_dump(mode="json"))
         self.current_status = status
         self.save()
         
         return event
+
+    def record_telemetry(self, telemetry: Dict[str, Any]):
+        """
+        Store the resource telemetry returned by the executor
+        """
+        self.resource_telemetry = telemetry or {}
+        self.save(update_fields=['resource_telemetry', 'updated_at'])
     
 
     
@@ -236,3 +284,99 @@ class Queuejob(models.Model):
             QueuejobStatus.TIMEOUT,
             QueuejobStatus.CLEANED
         ]
+
+
+# Modal prices per GPU hour (USD), used to rank the GPU suggestions of the runtime estimate
+GPU_HOURLY_PRICE_USD = {
+    "T4": 0.59,
+    "L4": 0.80,
+    "A10G": 1.10,
+    "L40S": 1.95,
+    "A100": 2.10,
+    "A100-80GB": 2.50,
+    "H100": 3.95,
+    "H200": 4.54,
+    "B200": 6.25,
+}
+
+
+# throughput samples outside these bounds are not recorded
+THROUGHPUT_MAX_KATOM_STEPS_PER_SECOND = 1e5    # far above any deep potential on a single GPU
+THROUGHPUT_OUTLIER_MIN_SAMPLES = 5             # samples of a row before outliers are rejected
+THROUGHPUT_OUTLIER_MAX_RATIO = 4.0             # accepted factor between a sample and the row mean
+
+
+def normalize_gpu_type(gpu_name: str) -> str:
+    """`Tesla T4` / `NVIDIA A100-SXM4-80GB` (nvidia-smi) -> `T4` / `A100-80GB` (modal gpu types)"""
+    name = (gpu_name or "").upper()
+    for gpu_type in ("B200", "H200", "H100", "A100", "L40S", "A10G", "L4", "T4"):
+        if gpu_type in name:
+            return "A100-80GB" if gpu_type == "A100" and "80GB" in name else gpu_type
+    return gpu_name or ""
+
+
+class LammpsThroughput(models.Model):
+    """
+    Measured LAMMPS throughput (katom-step/s) per (model, GPU type, atom count bucket),
+    fed by the telemetry of completed jobs, running mean/variance (Welford)
+    """
+    model_key = models.CharField(
+        max_length=255,
+        help_text="/public/ model path, or user_id:path for models in the personal volume"
+    )
+    gpu_type = models.CharField(
+        max_length=50,
+        help_text="Modal GPU type, e.g. T4"
+    )
+    atoms_bucket = models.PositiveIntegerField(
+        help_text="Lower bound of the power of two bucket the atom count falls in"
+    )
+    samples = models.PositiveIntegerField(default=0)
+    mean_katom_steps_per_second = models.FloatField(default=0.0)
+    m2_katom_steps_per_second = models.FloatField(default=0.0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model_key', 'gpu_type', 'atoms_bucket'], name='unique_lammps_throughput_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_key} {self.gpu_type} {self.atoms_bucket}+ atoms: {self.mean_katom_steps_per_second:.1f} katom-step/s ({self.samples})"
+
+    @staticmethod
+    def atoms_bucket_for(atoms: int) -> int:
+        return 1 << (max(1, atoms).bit_length() - 1)
+
+    @staticmethod
+    def model_key_for(model_path: str, user_id: str) -> str:
+        # models in /public/ are shared, the same path in two personal volumes is not the same model
+        return model_path if model_path.startswith("/public/") else f"{user_id}:{model_path}"
+
+    @staticmethod
+    def is_shared_model_key(model_key: str) -> bool:
+        return model_key.startswith("/public/")
+
+    @classmethod
+    def record_run(cls, model_key: str, gpu_type: str, atoms: int, katom_steps_per_second: float) -> Optional["LammpsThroughput"]:
+        """add a sample to the running mean, None if it is rejected as implausible (the row is not changed)"""
+        if not 0 < katom_steps_per_second <= THROUGHPUT_MAX_KATOM_STEPS_PER_SECOND:
+            return None
+        with transaction.atomic():
+            row, _ = cls.objects.select_for_update().get_or_create(
+                model_key=model_key, gpu_type=gpu_type, atoms_bucket=cls.atoms_bucket_for(atoms),
+            )
+            if row.samples >= THROUGHPUT_OUTLIER_MIN_SAMPLES and not (
+                    row.mean_katom_steps_per_second / THROUGHPUT_OUTLIER_MAX_RATIO
+                    <= katom_steps_per_second <= row.mean_katom_steps_per_second * THROUGHPUT_OUTLIER_MAX_RATIO):
+                return None
+            row.samples += 1
+            delta = katom_steps_per_second - row.mean_katom_steps_per_second
+            row.mean_katom_steps_per_second += delta / row.samples
+            row.m2_katom_steps_per_second += delta * (katom_steps_per_second - row.mean_katom_steps_per_second)
+            row.save()
+        return row
+
+    @property
+    def std_katom_steps_per_second(self) -> Optional[float]:
+        return (self.m2_katom_steps_per_second / (self.samples - 1)) ** 0.5 if self.samples > 1 else None
@@ -1,3 +1,279 @@
+from unittest import mock
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 from django.test import TestCase
 
-# Create your tests here.
+from users.api import jwt_service
+from users.models import User
+from .models import Queuejob, QueuejobStatus, LammpsThroughput, normalize_gpu_type
+
+
+def generate_rsa_key_pair() -> tuple[str, str]:
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    return private_pem, public_pem
+
+
+class QueueApiTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._saved_keys = (jwt_service.django_jwt_private_key, jwt_service.django_jwt_public_key)
+        jwt_service.django_jwt_private_key, jwt_service.django_jwt_public_key = generate_rsa_key_pair()
+
+    @classmethod
+    def tearDownClass(cls):
+        jwt_service.django_jwt_private_key, jwt_service.django_jwt_public_key = cls._saved_keys
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create(username="alice", user_id="user__test__alice", email="alice@example.com")
+        self.other_user = User.objects.create(username="bob", user_id="user__test__bob", email="bob@example.com")
+
+    def auth_headers(self, user: User) -> dict:
+        return {"HTTP_AUTHORIZATION": f"Bearer {jwt_service.generate_token(user)}"}
+
+    def post(self, path: str, data: dict = None, user: User = None):
+        return self.client.post(f"/api/queue{path}", data or {}, content_type="application/json",
+            **self.auth_headers(user or self.user))
+
+    def create_job(self, **data) -> dict:
+        response = self.post("/jobs", {"modal_function_call_id": "fc-test-0001", **data})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+
+class QueuejobTelemetryTests(QueueApiTestCase):
+    def test_record_telemetry_with_final_status(self):
+        job = self.create_job()
+        telemetry = {"peak_rss_mb": 512.0, "performance": {"ns_per_day": 1.5}}
+
+        response = self.post(f"/jobs/{job['queuejob_id']}/telemetry",
+            {"telemetry": telemetry, "status": "COMPLETED", "message": "return_code=0"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["performance"], {"ns_per_day": 1.5})
+        stored = Queuejob.objects.get(queuejob_id=job["queuejob_id"])
+        self.assertEqual(stored.resource_telemetry, telemetry)
+        self.assertEqual(stored.current_status, QueuejobStatus.COMPLETED)
+
+    def test_final_status_does_not_override_cancelled(self):
+        job = self.create_job()
+        Queuejob.objects.get(queuejob_id=job["queuejob_id"]).add_status(QueuejobStatus.CANCELLED)
+
+        response = self.post(f"/jobs/{job['queuejob_id']}/telemetry", {"telemetry": {}, "status": "FAILED"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["current_status"], QueuejobStatus.CANCELLED)
+
+    def test_record_telemetry_of_other_user_job(self):
+        job = self.create_job()
+        response = self.post(f"/jobs/{job['queuejob_id']}/telemetry", {"telemetry": {}}, user=self.other_user)
+        self.assertEqual(response.status_code, 404)
+
+
+class QueuejobApiTests(QueueApiTestCase):
+    def test_create_and_get_job(self):
+        job = self.create_job(queuejob_name="melting", command="lmp -in in.lammps")
+
+        self.assertTrue(job["queuejob_id"].startswith("queuejob-"))
+        self.assertEqual(job["user_id"], self.user.user_id)
+        self.assertEqual(job["current_status"], QueuejobStatus.SUBMITTED)
+
+        # by queuejob id or by modal function call id
+        for job_id in (job["queuejob_id"], "fc-test-0001"):
+            response = self.client.get(f"/api/queue/jobs/{job_id}", **self.auth_headers(self.user))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["queuejob_id"], job["queuejob_id"])
+
+    def test_list_jobs(self):
+        first = self.create_job(modal_function_call_id="fc-test-0001", environment_vars={"job_dir": "/workspace/a/"})
+        second = self.create_job(modal_function_call_id="fc-test-0002")
+        self.create_job(modal_function_call_id="fc-segment-1", parent_queuejob_id="fc-test-0002", attempt_index=1)
+        self.create_job(modal_function_call_id="fc-test-0003", queuejob_type="TRAJECTORY_ANALYSIS")
+        Queuejob.objects.get(queuejob_id=first["queuejob_id"]).add_status(QueuejobStatus.COMPLETED, "return_code=0")
+        headers = self.auth_headers(self.user)
+
+        jobs = self.client.get("/api/queue/jobs", {"queuejob_type": "LAMMPS_SIMULATION"}, **headers).json()["jobs"]
+        self.assertEqual([job["queuejob_id"] for job in jobs], [second["queuejob_id"], first["queuejob_id"]])
+        self.assertEqual(jobs[1]["environment_vars"], {"job_dir": "/workspace/a/"})
+        self.assertEqual(jobs[1]["status_message"], "return_code=0")
+
+        jobs = self.client.get("/api/queue/jobs", {"status": "COMPLETED"}, **headers).json()["jobs"]
+        self.assertEqual([job["queuejob_id"] for job in jobs], [first["queuejob_id"]])
+        jobs = self.client.get("/api/queue/jobs", {"include_attempts": True, "limit": 2}, **headers).json()["jobs"]
+        self.assertEqual(len(jobs), 2)
+        self.assertEqual(self.client.get("/api/queue/jobs", **self.auth_headers(self.other_user)).json()["jobs"], [])
+        self.assertEqual(self.client.get("/api/queue/jobs", {"status": "DONE"}, **headers).status_code, 400)
+
+    def test_create_job_rejects_unknown_type(self):
+        response = self.post("/jobs", {"queuejob_type": "UNKNOWN"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_requires_auth(self):
+        response = self.client.get("/api/queue/jobs/fc-test-0001")
+        self.assertEqual(response.status_code, 401)
+
+    def test_other_user_job_not_found(self):
+        job = self.create_job()
+
+        response = self.client.get(f"/api/queue/jobs/{job['queuejob_id']}", **self.auth_headers(self.other_user))
+        self.assertEqual(response.status_code, 404)
+
+        with mock.patch("deepmd_modal_batch_queue.api.modal.FunctionCall.from_id") as from_id:
+            response = self.post("/jobs/fc-test-0001/cancel", user=self.other_user)
+        self.assertEqual(response.status_code, 404)
+        from_id.assert_not_called()
+        self.assertEqual(Queuejob.objects.get(queuejob_id=job["queuejob_id"]).current_status, QueuejobStatus.SUBMITTED)
+
+    def test_cancel_job(self):
+        job = self.create_job()
+
+        with mock.patch("deepmd_modal_batch_queue.api.modal.FunctionCall.from_id") as from_id:
+            response = self.post(f"/jobs/{job['queuejob_id']}/cancel")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["cancelled"])
+        from_id.assert_called_once_with("fc-test-0001")
+        from_id.return_value.cancel.assert_called_once()
+        self.assertEqual(Queuejob.objects.get(queuejob_id=job["queuejob_id"]).current_status, QueuejobStatus.CANCELLED)
+
+    def test_cancel_completed_job_is_noop(self):
+        job = self.create_job()
+        Queuejob.objects.get(queuejob_id=job["queuejob_id"]).add_status(QueuejobStatus.COMPLETED)
+
+        with mock.patch("deepmd_modal_batch_queue.api.modal.FunctionCall.from_id") as from_id:
+            response = self.post(f"/jobs/{job['queuejob_id']}/cancel")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()["cancelled"])
+        from_id.assert_not_called()
+
+    def test_cancel_failure_keeps_status(self):
+        job = self.create_job()
+
+        with mock.patch("deepmd_modal_batch_queue.api.modal.FunctionCall.from_id") as from_id:
+            from_id.return_value.cancel.side_effect = ConnectionError("modal unreachable")
+            response = self.post(f"/jobs/{job['queuejob_id']}/cancel")
+
+        self.assertEqual(response.status_code, 502)
+        self.assertIn("modal unreachable", response.json()["error"])
+        stored = Queuejob.objects.get(queuejob_id=job["queuejob_id"])
+        self.assertEqual(stored.current_status, QueuejobStatus.SUBMITTED)
+        self.assertIn("failed", stored.status_history[-1]["data"]["message"])
+
+
+class QueuejobAttemptTests(QueueApiTestCase):
+    def test_attempt_linked_by_parent_function_call_id(self):
+        parent = self.create_job(modal_function_call_id="fc-managed-run")
+
+        attempt = self.create_job(modal_function_call_id="fc-segment-1", parent_queuejob_id="fc-managed-run", attempt_index=1)
+
+        self.assertEqual(attempt["parent_queuejob_id"], parent["queuejob_id"])
+        self.assertEqual(attempt["attempt_index"], 1)
+
+    def test_parent_of_other_user_not_found(self):
+        self.create_job(modal_function_call_id="fc-managed-run")
+        response = self.post("/jobs", {"modal_function_call_id": "fc-segment-1", "parent_queuejob_id": "fc-managed-run"},
+            user=self.other_user)
+        self.assertEqual(response.status_code, 404)
+
+    def test_cancel_reaches_continuation_and_running_segment(self):
+        parent = self.create_job(modal_function_call_id="fc-managed-run")
+        self.create_job(modal_function_call_id="fc-segment-0", parent_queuejob_id="fc-managed-run", attempt_index=0)
+        self.post(f"/jobs/{parent['queuejob_id']}/status",
+            {"status": "RUNNING", "message": "orchestrator continued", "current_modal_function_call_id": "fc-continuation"})
+
+        # the continuation id finds the managed run too
+        self.assertEqual(self.client.get("/api/queue/jobs/fc-continuation", **self.auth_headers(self.user)).status_code, 200)
+        with mock.patch("deepmd_modal_batch_queue.api.modal.FunctionCall.from_id") as from_id:
+            response = self.post(f"/jobs/{parent['queuejob_id']}/cancel")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([call.args[0] for call in from_id.call_args_list], ["fc-continuation", "fc-segment-0"])
+        self.assertEqual(Queuejob.objects.get(modal_function_call_id="fc-segment-0").current_status, QueuejobStatus.CANCELLED)
+
+
+class LammpsThroughputTests(QueueApiTestCase):
+    def complete_job(self, katom_steps_per_second: float, atoms: int = 3000, model: str = "/public/models/dpa3.pth", gpu_name: str = "Tesla T4"):
+        job = self.create_job(environment_vars={"job_dir": "/workspace/", "model": model})
+        telemetry = {"gpu_name": gpu_name, "performance": {
+            "loop_time_seconds": 120.0, "atoms": atoms, "katom_steps_per_second": katom_steps_per_second}}
+        response = self.post(f"/jobs/{job['queuejob_id']}/telemetry", {"telemetry": telemetry, "status": "COMPLETED"})
+        self.assertEqual(response.status_code, 200)
+
+    def estimate(self, model: str = "/public/models/dpa3.pth", atoms: int = 3000, steps: int = 1_000_000, user=None):
+        response = self.client.get("/api/queue/throughput/estimate", {"model": model, "atoms": atoms, "steps": steps},
+            **self.auth_headers(user or self.user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_completed_jobs_feed_the_estimate(self):
+        self.complete_job(30.0)
+        self.complete_job(34.0)
+        self.complete_job(300.0, gpu_name="NVIDIA H100 80GB HBM3")
+
+        row = LammpsThroughput.objects.get(gpu_type="T4")
+        self.assertEqual((row.samples, row.atoms_bucket), (2, 2048))
+        self.assertAlmostEqual(row.mean_katom_steps_per_second, 32.0)
+        self.assertAlmostEqual(row.std_katom_steps_per_second, 8 ** 0.5)
+
+        estimate = self.estimate()
+        by_gpu = {e["gpu_type"]: e for e in estimate["estimates"]}
+        # 1e6 steps * 3000 atoms at 32 katom-step/s
+        self.assertAlmostEqual(by_gpu["T4"]["estimated_seconds"], 93750.0)
+        self.assertAlmostEqual(by_gpu["H100"]["estimated_seconds"], 10000.0)
+        self.assertEqual(estimate["suggested"]["gpu_type"], "H100")
+        self.assertFalse(estimate["needs_managed_run"])
+
+        # the same public model is shared between users, far away atom counts are not extrapolated
+        self.assertEqual(len(self.estimate(user=self.other_user)["estimates"]), 2)
+        self.assertEqual(self.estimate(atoms=300_000)["estimates"], [])
+
+    def test_short_failed_or_personal_runs(self):
+        job = self.create_job(environment_vars={"model": "/public/models/dpa3.pth"})
+        self.post(f"/jobs/{job['queuejob_id']}/telemetry", {"status": "FAILED", "telemetry": {
+            "gpu_name": "Tesla T4", "performance": {"loop_time_seconds": 120.0, "atoms": 3000, "katom_steps_per_second": 1.0}}})
+        job = self.create_job(environment_vars={"model": "/public/models/dpa3.pth"})
+        self.post(f"/jobs/{job['queuejob_id']}/telemetry", {"status": "COMPLETED", "telemetry": {
+            "gpu_name": "Tesla T4", "performance": {"loop_time_seconds": 1.0, "atoms": 3000, "katom_steps_per_second": 1.0}}})
+        self.assertFalse(LammpsThroughput.objects.exists())
+
+        self.complete_job(30.0, model="/workspace/model.pb")
+        self.assertEqual(len(self.estimate(model="/workspace/model.pb")["estimates"]), 1)
+        self.assertEqual(self.estimate(model="/workspace/model.pb", user=self.other_user)["estimates"], [])
+
+    def test_implausible_samples_are_rejected(self):
+        for _ in range(5):
+            self.complete_job(30.0)
+        self.complete_job(3000.0)
+        self.complete_job(1e9, model="/workspace/model.pb")
+
+        row = LammpsThroughput.objects.get(gpu_type="T4")
+        self.assertEqual(row.samples, 5)
+        self.assertAlmostEqual(row.mean_katom_steps_per_second, 30.0)
+        self.assertFalse(LammpsThroughput.objects.filter(model_key__contains="model.pb").exists())
+
+    def test_shared_rows_need_the_service_token_when_configured(self):
+        with mock.patch("deepmd_modal_batch_queue.api.QUEUE_TELEMETRY_SERVICE_TOKEN", "run-service-secret"):
+            self.complete_job(30.0)
+            self.complete_job(30.0, model="/workspace/model.pb")
+            self.assertEqual(list(LammpsThroughput.objects.values_list("model_key", flat=True)), ["user__test__alice:/workspace/model.pb"])
+
+            job = self.create_job(environment_vars={"model": "/public/models/dpa3.pth"})
+            self.client.post(f"/api/queue/jobs/{job['queuejob_id']}/telemetry", {"status": "COMPLETED", "telemetry": {
+                "gpu_name": "Tesla T4", "performance": {"loop_time_seconds": 120.0, "atoms": 3000, "katom_steps_per_second": 30.0}}},
+                content_type="application/json", HTTP_X_TELEMETRY_SERVICE_TOKEN="run-service-secret", **self.auth_headers(self.user))
+        self.assertEqual(LammpsThroughput.objects.get(model_key="/public/models/dpa3.pth").samples, 1)
+
+    def test_normalize_gpu_type(self):
+        self.assertEqual(normalize_gpu_type("Tesla T4"), "T4")
+        self.assertEqual(normalize_gpu_type("NVIDIA L40S"), "L40S")
+        self.assertEqual(normalize_gpu_type("NVIDIA L4"), "L4")
+        self.assertEqual(normalize_gpu_type("NVIDIA A100-SXM4-80GB"), "A100-80GB")
@@ -0,0 +1,85 @@
+"""
+Requests/sec through AuthMiddleware on the bypassed /health path and on an authenticated path,
+with the verified-token cache and without it (every request verifies the RS256 signature, twice).
+Tokens are signed with a throwaway key, no network.
+
+    cd deepmd_ai_services/deepmd_workbench
+    python benchmarks/bench_auth_middleware.py --requests 2000 --rounds 3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI
+from jose import jwt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deepmd_auth_midware  # noqa: E402
+from deepmd_auth_midware import AuthMiddleware, JWT_CACHE_MAX_ENTRIES  # noqa: E402
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(AuthMiddleware)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    @app.get("/whoami")
+    async def whoami():
+        return {"ok": True}
+
+    return app
+
+
+def signed_token() -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    deepmd_auth_midware.DJANGO_JWT_PUBLIC_KEY = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return jwt.encode({"user_id": "bench-user", "exp": int(time.time() + 3600)}, private_pem, algorithm="RS256")
+
+
+async def requests_per_second(client: httpx.AsyncClient, path: str, headers: dict, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path, headers=headers)
+        assert response.status_code == 200, response.text
+    return requests / (time.perf_counter() - started)
+
+
+async def main(requests: int, rounds: int):
+    token = signed_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=make_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await requests_per_second(client, "/health", {}, requests // 10)  # warm up
+        results = {}
+        # best of a few interleaved rounds, single rounds are noisy
+        for _ in range(rounds):
+            for cached in (False, True):
+                AuthMiddleware.verified_tokens.clear()
+                # max_entries 0 drops every entry as it is stored
+                AuthMiddleware.verified_tokens.max_entries = JWT_CACHE_MAX_ENTRIES if cached else 0
+                for path, path_headers in (("/health", {}), ("/whoami", headers)):
+                    rate = await requests_per_second(client, path, path_headers, requests)
+                    results[(path, cached)] = max(results.get((path, cached), 0.0), rate)
+
+    for path in ("/health", "/whoami"):
+        before, after = results[(path, False)], results[(path, True)]
+        print(f"{path:8s} uncached={before:8.0f} req/s  cached={after:8.0f} req/s  speedup={after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.rounds))
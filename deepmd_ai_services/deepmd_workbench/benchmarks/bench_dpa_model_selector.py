@@ -0,0 +1,39 @@
+"""
+Time of select_dpa_model (element parsing + registry match + ranking), no LLM and no network,
+the round trip it replaces is a full LLM call of deepmd_select_dpa_model_agent.
+
+    cd deepmd_ai_services/deepmd_workbench
+    python benchmarks/bench_dpa_model_selector.py --rounds 20000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "deepmd_agent_services"))
+
+from deepmd_agent.dpa_model_registry import dpa_model_selector, parse_elements, select_dpa_model  # noqa: E402
+
+CASES = [
+    ("H2O", ""),
+    ("LiCoO2", "battery cathode"),
+    ("H C N O", ""),
+    ("pair_coeff * * Ba Ti O", "perovskite ferroelectric"),
+]
+
+
+def main(args):
+    for structure, task in CASES:
+        elements = parse_elements(structure)
+        match_us = min(timeit.repeat(lambda: dpa_model_selector.select(elements, task), number=args.rounds, repeat=3)) / args.rounds * 1e6
+        total_us = min(timeit.repeat(lambda: select_dpa_model(structure, task), number=args.rounds, repeat=3)) / args.rounds * 1e6
+        result = select_dpa_model(structure, task)
+        print(f"{structure!r:28} {task!r:28} match {match_us:6.1f}us  with parsing {total_us:6.1f}us  -> "
+            f"{os.path.basename(result['model'] or '') or 'ambiguous'}"
+            f"{'' if result['model'] or not result['candidates'] else ', top ' + result['candidates'][0]['model']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20000)
+    main(parser.parse_args())
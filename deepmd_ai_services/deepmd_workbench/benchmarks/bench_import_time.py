@@ -0,0 +1,75 @@
+"""
+Import time of the run service entry points, from `python -X importtime` in fresh interpreters
+(median of --rounds). The executor module is what every GPU / CPU executor container imports
+before its first input, the web and MCP modules are what the web containers import.
+With --check the run fails (exit 1) when the executor imports any of the web / agent packages
+or takes longer than --max-executor-ms, so it can run as a regression check.
+
+    cd deepmd_ai_services/deepmd_workbench
+    python benchmarks/bench_import_time.py --rounds 5
+    python benchmarks/bench_import_time.py --check --max-executor-ms 1000
+    python benchmarks/bench_import_time.py --module deepmd_lammps_executor --top 20
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+WORKBENCH_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_MODULES = ["deepmd_lammps_executor", "deepmd_modal_run_service", "deepmd_dpa_lammps_mcp"]
+# must never be imported by the executor containers
+EXECUTOR_FORBIDDEN_IMPORTS = ["google.adk", "fastmcp", "fastapi", "starlette", "jose", "deepmd_modal_run_service"]
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_profile(module: str) -> list[tuple[int, int, int, str]]:
+    """(self_us, cumulative_us, depth, name) of every module imported by `import module`"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=WORKBENCH_DIR, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            rows.append((int(match[1]), int(match[2]), len(match[3]) // 2, match[4]))
+    return rows
+
+
+def forbidden_imports(rows, forbidden: list[str]) -> list[str]:
+    return sorted({name for *_, name in rows for prefix in forbidden if name == prefix or name.startswith(prefix + ".")})
+
+
+def main(args):
+    failed = False
+    for module in args.module or ENTRY_MODULES:
+        profiles = [import_profile(module) for _ in range(args.rounds)]
+        total_ms = statistics.median(cumulative for rows in profiles for _, cumulative, depth, name in rows
+            if depth == 0 and name == module) / 1000
+        print(f"{module}: {total_ms:8.1f}ms  ({len(profiles[-1])} modules)")
+        # the heaviest direct imports of the module
+        direct = sorted((row for row in profiles[-1] if row[2] == 1), key=lambda row: row[1], reverse=True)
+        for _, cumulative, _, name in direct[:args.top]:
+            print(f"    {cumulative / 1000:8.1f}ms  {name}")
+
+        if module == "deepmd_lammps_executor":
+            forbidden = forbidden_imports(profiles[-1], EXECUTOR_FORBIDDEN_IMPORTS)
+            if forbidden:
+                print(f"    executor imports web / agent packages: {forbidden}")
+                failed = True
+            if args.max_executor_ms and total_ms > args.max_executor_ms:
+                print(f"    executor import slower than {args.max_executor_ms}ms")
+                failed = True
+    return 1 if args.check and failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", action="append", help="module to profile, repeatable (default: the entry points)")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--top", type=int, default=8, help="heaviest direct imports listed per module")
+    parser.add_argument("--check", action="store_true", help="exit 1 on forbidden executor imports or over --max-executor-ms")
+    parser.add_argument("--max-executor-ms", type=float, default=0)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,71 @@
+"""
+Lookup latency and hit rate of the agent response cache for a replayed question mix, against the round trip
+it saves (--llm-ms, a typical LiteLLM proxy latency). Each question is asked in --variants spellings
+(case / punctuation / whitespace), the exact tier catches the whitespace ones, the embedding tier the rest.
+
+    cd deepmd_ai_services/deepmd_workbench
+    python benchmarks/bench_response_cache.py
+    python benchmarks/bench_response_cache.py --questions 500 --similarity-threshold 0.9
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "deepmd_agent_services"))
+
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+from deepmd_agent.response_cache import ResponseCache
+
+TOPICS = ["train a DPA-3 model", "run an NPT simulation of water", "fine-tune DPA on my alloy data",
+    "compute the RDF of liquid silicon", "choose a branch model for LiCoO2", "restart a LAMMPS run"]
+
+
+def variants(question: str) -> list[str]:
+    return [question, f"  {question} ", question.lower(), question.rstrip("?"), question.upper()]
+
+
+def request(text: str) -> LlmRequest:
+    return LlmRequest(contents=[types.Content(role="user", parts=[types.Part(text=text)])],
+        config=types.GenerateContentConfig(system_instruction="You answer DeePMD questions."))
+
+
+def main(args):
+    rng = random.Random(0)
+    questions = [f"How do I {rng.choice(TOPICS)} with {rng.randint(2, 500)} atoms?" for _ in range(args.questions)]
+    asked = [rng.choice(variants(question)[:args.variants]) for question in questions for _ in range(args.repeats)]
+    rng.shuffle(asked)
+
+    cache = ResponseCache(ttl=3600, max_entries=args.questions * 4, similarity_threshold=args.similarity_threshold)
+    answer = [LlmResponse(content=types.Content(role="model", parts=[types.Part(text="answer")]))]
+    lookup_seconds = []
+    for text in asked:
+        llm_request = request(text)
+        started = time.perf_counter()
+        cached = cache.get("gemini/gemini-2.5-flash", llm_request)
+        lookup_seconds.append(time.perf_counter() - started)
+        if cached is None:
+            cache.set("gemini/gemini-2.5-flash", llm_request, answer)
+
+    stats = cache.stats()
+    lookup_seconds.sort()
+    mean_ms = sum(lookup_seconds) / len(lookup_seconds) * 1000
+    print(f"{len(asked)} requests, {stats['entries']} cached, hit rate {stats['hit_rate']:.1%} "
+        f"(exact {stats['exact_hits']}, similar {stats['similar_hits']})")
+    print(f"lookup: mean {mean_ms:.3f}ms  p50 {lookup_seconds[len(lookup_seconds) // 2] * 1000:.3f}ms  "
+        f"p99 {lookup_seconds[int(len(lookup_seconds) * 0.99)] * 1000:.3f}ms")
+    print(f"model time saved at {args.llm_ms:.0f}ms per round trip: {stats['hits'] * args.llm_ms / 1000:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=5, help="times each question is asked")
+    parser.add_argument("--variants", type=int, default=5, help="spellings of each question, 1 to 5")
+    parser.add_argument("--similarity-threshold", type=float, default=0.9, help="0 for the exact tier only")
+    parser.add_argument("--llm-ms", type=float, default=1500)
+    main(parser.parse_args())
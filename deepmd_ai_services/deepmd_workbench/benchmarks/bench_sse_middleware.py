@@ -0,0 +1,115 @@
+"""
+SSE chunk throughput and time-to-first-byte of an authenticated text/event-stream endpoint behind
+the pure ASGI AuthMiddleware and behind the same check in a BaseHTTPMiddleware (the previous
+implementation), served by uvicorn on localhost. Tokens are signed with a throwaway key.
+
+    cd deepmd_ai_services/deepmd_workbench
+    python benchmarks/bench_sse_middleware.py --chunks 20000 --requests 50
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from jose import jwt
+from starlette.middleware.base import BaseHTTPMiddleware
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deepmd_auth_midware  # noqa: E402
+from deepmd_auth_midware import AuthMiddleware  # noqa: E402
+
+
+class BaseHttpAuthMiddleware(BaseHTTPMiddleware):
+    """the same check wrapped the way the previous AuthMiddleware was"""
+
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path not in AuthMiddleware.bypass_paths:
+            try:
+                request.state.user = AuthMiddleware.authenticate(request)
+            except HTTPException as e:
+                return JSONResponse({"detail": e.detail}, status_code=e.status_code)
+        return await call_next(request)
+
+
+def make_app(middleware) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(middleware)
+
+    @app.get("/stream")
+    async def stream(chunks: int = 1000):
+        async def events():
+            for i in range(chunks):
+                yield f"data: {i} 300.0 -1000.0\n\n".encode()
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def signed_token() -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    deepmd_auth_midware.DJANGO_JWT_PUBLIC_KEY = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return jwt.encode({"user_id": "bench-user", "exp": int(time.time() + 3600)}, private_pem, algorithm="RS256")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def measure(base_url: str, headers: dict, chunks: int, requests: int) -> dict:
+    ttfb, throughput = [], []
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=60) as client:
+        for _ in range(requests):
+            started = time.perf_counter()
+            first_byte = None
+            received = 0
+            async with client.stream("GET", "/stream", params={"chunks": chunks}) as response:
+                assert response.status_code == 200
+                async for data in response.aiter_raw():
+                    if first_byte is None:
+                        first_byte = time.perf_counter()
+                    received += data.count(b"\n\n")
+            assert received == chunks
+            ttfb.append(first_byte - started)
+            throughput.append(chunks / (time.perf_counter() - started))
+    return {"ttfb_ms": statistics.median(ttfb) * 1000, "chunks_per_s": statistics.median(throughput)}
+
+
+async def main(chunks: int, requests: int):
+    headers = {"Authorization": f"Bearer {signed_token()}"}
+    for name, middleware in (("BaseHTTPMiddleware", BaseHttpAuthMiddleware), ("pure ASGI", AuthMiddleware)):
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(make_app(middleware), host="127.0.0.1", port=port, log_level="warning"))
+        # own thread and loop, a client on the server's loop would only read once the server yields
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        while not server.started:
+            await asyncio.sleep(0.01)
+        try:
+            result = await measure(f"http://127.0.0.1:{port}", headers, chunks, requests)
+        finally:
+            server.should_exit = True
+            thread.join()
+        print(f"{name:20s} ttfb={result['ttfb_ms']:6.2f}ms  throughput={result['chunks_per_s']:9.0f} chunks/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20000, help="SSE events per response")
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.chunks, args.requests))
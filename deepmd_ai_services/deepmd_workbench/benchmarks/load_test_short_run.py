@@ -0,0 +1,100 @@
+"""
+Load test of short_run_lammps_simulation: N concurrent tool calls against a fake executor
+stream (no GPU, no modal calls), reports the wall time and the event loop lag.
+With async consumption the calls overlap, the wall time stays close to one run;
+--blocking replays the old synchronous `remote_gen(...)` iteration for comparison.
+
+    cd deepmd_ai_services/deepmd_workbench
+    python benchmarks/load_test_short_run.py --calls 50
+    python benchmarks/load_test_short_run.py --calls 50 --blocking
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deepmd_dpa_lammps_mcp import mcp_providers, SHORT_RUNS_PER_SESSION, DEFAULT_OWNER_USER_ID  # noqa: E402
+from deepmd_admission import admission_controller, AdmissionLimits  # noqa: E402
+
+
+class FakeContext:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.messages = 0
+
+    async def info(self, message: str):
+        self.messages += 1
+
+    async def warning(self, message: str):
+        self.messages += 1
+
+
+def make_fake_instance(lines: int, line_seconds: float, blocking: bool):
+    async def remote_gen_aio(**kwargs):
+        for i in range(lines):
+            await asyncio.sleep(line_seconds)
+            yield f"  {i * 100}  300.0  -1000.0\n".encode()
+
+    async def remote_gen_blocking(**kwargs):
+        # what iterating the sync remote_gen inside an async def does: the loop is stuck in time.sleep
+        for i in range(lines):
+            time.sleep(line_seconds)
+            yield f"  {i * 100}  300.0  -1000.0\n".encode()
+
+    stream = SimpleNamespace(remote_gen=SimpleNamespace(aio=remote_gen_blocking if blocking else remote_gen_aio))
+    return SimpleNamespace(lammps_simulation_stream=stream)
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    max_lag = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - started - interval)
+    return max_lag
+
+
+async def main(calls: int, sessions: int, lines: int, line_seconds: float, blocking: bool):
+    mcp_provider = mcp_providers.get(DEFAULT_OWNER_USER_ID)
+    mcp_provider._personal_lammps_instance = make_fake_instance(lines, line_seconds, blocking)
+    run_seconds = lines * line_seconds
+    # all calls come from one user, the admission limits are not what is measured here
+    admission_controller.user_limits = admission_controller.org_limits = AdmissionLimits(calls, 60 * calls, calls)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        mcp_provider.short_run_lammps_simulation(commands="lmp -in in.lammps", job_dir="/workspace/",
+            skip_preflight=True, ctx=FakeContext(f"session-{i % sessions}"))
+        for i in range(calls)
+    ))
+    wall = time.perf_counter() - started
+    stop.set()
+    max_lag = await lag_task
+
+    # each session runs at most SHORT_RUNS_PER_SESSION calls at a time
+    calls_per_session = -(-calls // sessions)
+    expected = -(-calls_per_session // SHORT_RUNS_PER_SESSION) * run_seconds
+    print(f"{calls=} {sessions=} {blocking=} run={run_seconds:.2f}s")
+    print(f"wall={wall:.2f}s expected={expected:.2f}s serialized={calls * run_seconds:.2f}s max_loop_lag={max_lag * 1000:.0f}ms")
+    print(f"completed={sum('Simulation completed' in result for result in results)}/{calls}")
+    overlapped = wall < expected + run_seconds
+    print("OK: calls overlap" if overlapped else "FAIL: calls serialize")
+    return overlapped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=50, help="distinct MCP sessions the calls are spread over")
+    parser.add_argument("--lines", type=int, default=40, help="output lines per fake run")
+    parser.add_argument("--line-seconds", type=float, default=0.05)
+    parser.add_argument("--blocking", action="store_true", help="replay the old synchronous iteration")
+    args = parser.parse_args()
+    ok = asyncio.run(main(args.calls, args.sessions, args.lines, args.line_seconds, args.blocking))
+    sys.exit(0 if ok else 1)
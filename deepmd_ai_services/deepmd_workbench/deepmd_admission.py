@@ -0,0 +1,259 @@
+#%%
+import asyncio
+import contextlib
+import json
+import os
+import secrets
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Optional, Protocol
+
+from loguru import logger
+
+#%%
+# Configuration
+# e.g. sqlite:////shared/admission.sqlite3 to share the limits between processes, in-process if empty
+DEEPMD_ADMISSION_STORE = os.getenv("DEEPMD_ADMISSION_STORE", "")
+
+USER_GPU_CALL_BURST = 4              # GPU calls a user can start at once ...
+USER_GPU_CALLS_PER_MINUTE = 6        # ... and the sustained rate after the burst
+USER_MAX_IN_FLIGHT = 4               # running GPU calls / spawned runs of one user
+ORG_GPU_CALL_BURST = 16
+ORG_GPU_CALLS_PER_MINUTE = 30
+ORG_MAX_IN_FLIGHT = 16
+
+ADMISSION_POLL_SECONDS = 1.0
+ADMISSION_QUEUE_TIMEOUT_SECONDS = 600
+QUEUE_TICKET_TTL_SECONDS = 30        # waiting tickets not refreshed for this long are dropped (crashed caller)
+DEFAULT_SLOT_LEASE_SECONDS = 3600    # in-flight slots expire after their lease if never released
+ADMISSION_LEASE_MARGIN_SECONDS = 600 # leases outlive the timeout of the call they cover by this much
+
+#%%
+
+class AdmissionTimeout(Exception):
+    """the call waited in the admission queue for longer than its timeout"""
+
+
+@dataclass(frozen=True)
+class AdmissionLimits:
+    burst: int
+    calls_per_minute: float
+    max_in_flight: int
+
+
+USER_LIMITS = AdmissionLimits(USER_GPU_CALL_BURST, USER_GPU_CALLS_PER_MINUTE, USER_MAX_IN_FLIGHT)
+ORG_LIMITS = AdmissionLimits(ORG_GPU_CALL_BURST, ORG_GPU_CALLS_PER_MINUTE, ORG_MAX_IN_FLIGHT)
+
+
+@dataclass
+class AdmissionTicket:
+    scopes: list[tuple[str, AdmissionLimits]]   # the first scope (the user) orders the waiting calls
+    lease_seconds: float = DEFAULT_SLOT_LEASE_SECONDS
+    ticket_id: str = field(default_factory=lambda: secrets.token_hex(8))
+
+    @property
+    def scope_keys(self) -> list[str]:
+        return [scope for scope, _ in self.scopes]
+
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    position: int = 0                # 1-based position in the user's queue while waiting
+    retry_after: float = 0.0
+    reason: str = ""
+
+    def to_dict(self) -> dict:
+        return {"admitted": self.admitted, "position": self.position, "retry_after": round(self.retry_after, 1), "reason": self.reason}
+
+
+def decide_admission(states: dict[str, dict], ticket: AdmissionTicket, now: float) -> AdmissionDecision:
+    """
+    One admission attempt against the scope states, updated in place: token bucket, in-flight slots
+    and, in the first scope, the FIFO queue of waiting tickets. Only the head of the queue is admitted,
+    a waiting ticket keeps its place as long as it is refreshed by its polls.
+    Stores run it inside their own transaction.
+    """
+    for scope, limits in ticket.scopes:
+        state = states.setdefault(scope, {"queue": [], "tokens": float(limits.burst), "updated_at": now, "slots": {}})
+        state["tokens"] = min(float(limits.burst), state["tokens"] + (now - state["updated_at"]) * limits.calls_per_minute / 60)
+        state["updated_at"] = now
+        state["slots"] = {ticket_id: expires_at for ticket_id, expires_at in state["slots"].items() if expires_at > now}
+        state["queue"] = [entry for entry in state["queue"] if entry[1] > now]
+
+    queue = states[ticket.scopes[0][0]]["queue"]
+    entry = next((entry for entry in queue if entry[0] == ticket.ticket_id), None)
+    if entry is None:
+        entry = [ticket.ticket_id, 0.0]
+        queue.append(entry)
+    entry[1] = now + QUEUE_TICKET_TTL_SECONDS
+    position = queue.index(entry) + 1
+    if position > 1:
+        return AdmissionDecision(False, position, ADMISSION_POLL_SECONDS, f"{position - 1} earlier calls waiting")
+
+    for scope, limits in ticket.scopes:
+        state = states[scope]
+        if len(state["slots"]) >= limits.max_in_flight:
+            return AdmissionDecision(False, position, ADMISSION_POLL_SECONDS, f"{scope} has {len(state['slots'])} calls in flight")
+        if state["tokens"] < 1:
+            retry_after = (1 - state["tokens"]) * 60 / limits.calls_per_minute
+            return AdmissionDecision(False, position, retry_after, f"{scope} rate limit of {limits.calls_per_minute} calls per minute")
+
+    for scope, _ in ticket.scopes:
+        states[scope]["tokens"] -= 1
+        states[scope]["slots"][ticket.ticket_id] = now + ticket.lease_seconds
+    queue.remove(entry)
+    return AdmissionDecision(True)
+
+
+def remove_ticket(states: dict[str, dict], ticket: AdmissionTicket):
+    """release the slots of an admitted ticket, or take a waiting one out of the queue"""
+    for state in states.values():
+        state["slots"].pop(ticket.ticket_id, None)
+        state["queue"] = [entry for entry in state["queue"] if entry[0] != ticket.ticket_id]
+
+
+class AdmissionStore(Protocol):
+    async def try_admit(self, ticket: AdmissionTicket, now: float) -> AdmissionDecision: ...
+
+    async def remove(self, ticket: AdmissionTicket) -> None: ...
+
+
+class InMemoryAdmissionStore:
+    """limits of one process"""
+
+    def __init__(self):
+        self.states: dict[str, dict] = {}
+
+    async def try_admit(self, ticket: AdmissionTicket, now: float) -> AdmissionDecision:
+        return decide_admission(self.states, ticket, now)
+
+    async def remove(self, ticket: AdmissionTicket):
+        remove_ticket({scope: self.states[scope] for scope in ticket.scope_keys if scope in self.states}, ticket)
+
+
+class SqliteAdmissionStore:
+    """
+    limits shared by the processes using the same database file, one json row per scope,
+    every decision in an immediate (write locked) transaction. Stand-in for a Redis / DB store
+    with the same two operations.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with contextlib.closing(self._connect()) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS admission_scopes (scope TEXT PRIMARY KEY, state TEXT NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def _transaction(self, scopes: list[str], update: Callable[[dict[str, dict]], object]):
+        with contextlib.closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute(
+                    f"SELECT scope, state FROM admission_scopes WHERE scope IN ({','.join('?' * len(scopes))})", scopes).fetchall()
+                states = {scope: json.loads(state) for scope, state in rows}
+                result = update(states)
+                connection.executemany("INSERT OR REPLACE INTO admission_scopes (scope, state) VALUES (?, ?)",
+                    [(scope, json.dumps(state)) for scope, state in states.items()])
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        return result
+
+    async def try_admit(self, ticket: AdmissionTicket, now: float) -> AdmissionDecision:
+        return await asyncio.to_thread(self._transaction, ticket.scope_keys, lambda states: decide_admission(states, ticket, now))
+
+    async def remove(self, ticket: AdmissionTicket):
+        await asyncio.to_thread(self._transaction, ticket.scope_keys, lambda states: remove_ticket(states, ticket))
+
+
+def get_admission_store(url: str = DEEPMD_ADMISSION_STORE) -> AdmissionStore:
+    if url.startswith("sqlite:///"):
+        return SqliteAdmissionStore(url[len("sqlite:///"):])
+    if url:
+        raise ValueError(f"unsupported admission store: {url=}")
+    return InMemoryAdmissionStore()
+
+
+class AdmissionController:
+    """
+    Per-user and per-organization admission of GPU-backed calls: a token bucket (burst, then a sustained
+    rate) plus a maximum of calls in flight per scope. Calls over the limits wait in a FIFO queue per user
+    and see their position, they are not rejected unless they wait longer than the timeout.
+    """
+
+    def __init__(self, store: Optional[AdmissionStore] = None, *, user_limits: AdmissionLimits = USER_LIMITS,
+            org_limits: AdmissionLimits = ORG_LIMITS, poll_seconds: float = ADMISSION_POLL_SECONDS,
+            clock: Callable[[], float] = time.time):
+        self.store = store if store is not None else InMemoryAdmissionStore()
+        self.user_limits = user_limits
+        self.org_limits = org_limits
+        self.poll_seconds = poll_seconds
+        self.clock = clock
+
+    def ticket(self, user_id: str, organization: Optional[str] = None, *, lease_seconds: float = DEFAULT_SLOT_LEASE_SECONDS) -> AdmissionTicket:
+        scopes = [(f"user:{user_id}", self.user_limits)]
+        if organization:
+            scopes.append((f"org:{organization}", self.org_limits))
+        return AdmissionTicket(scopes, lease_seconds)
+
+    async def updates(self, ticket: AdmissionTicket, *, timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS) -> AsyncIterator[AdmissionDecision]:
+        """
+        poll the store until the ticket is admitted, yields the decisions whose queue position (or the limit
+        it waits for) changed and last the admitting one. The caller removes the ticket if it stops early.
+        """
+        deadline = self.clock() + timeout
+        last_reported = None
+        while True:
+            decision = await self.store.try_admit(ticket, self.clock())
+            if decision.admitted:
+                yield decision
+                return
+            if (decision.position, decision.reason) != last_reported:
+                last_reported = (decision.position, decision.reason)
+                yield decision
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                raise AdmissionTimeout(f"not admitted within {timeout}s: {ticket.scope_keys} {decision.to_dict()}")
+            await asyncio.sleep(min(max(decision.retry_after, 0.05), self.poll_seconds, remaining))
+
+    async def acquire(self, user_id: str, organization: Optional[str] = None, *,
+            lease_seconds: float = DEFAULT_SLOT_LEASE_SECONDS, timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+            on_queued: Optional[Callable[[AdmissionDecision], Awaitable[None]]] = None) -> AdmissionTicket:
+        """
+        wait until the call is admitted, `on_queued` is called whenever its queue position changes.
+        The slot is held until release() or the end of its lease.
+        """
+        ticket = self.ticket(user_id, organization, lease_seconds=lease_seconds)
+        try:
+            async for decision in self.updates(ticket, timeout=timeout):
+                if not decision.admitted and on_queued is not None:
+                    await on_queued(decision)
+        except BaseException:
+            # leave the queue, also when the waiting call is cancelled
+            await asyncio.shield(self.store.remove(ticket))
+            raise
+        return ticket
+
+    async def release(self, ticket: AdmissionTicket):
+        try:
+            await self.store.remove(ticket)
+        except Exception as e:
+            # the slot expires with its lease
+            logger.warning(f"admission release failed: {ticket.scope_keys=} {e=}")
+
+    @contextlib.asynccontextmanager
+    async def admitted(self, user_id: str, organization: Optional[str] = None, **kwargs):
+        """slot held for the duration of the block"""
+        ticket = await self.acquire(user_id, organization, **kwargs)
+        try:
+            yield ticket
+        finally:
+            await asyncio.shield(self.release(ticket))
+
+
+admission_controller = AdmissionController(get_admission_store())
@@ -1,17 +1,21 @@
 #%%
+import time
+
+_started_at = time.perf_counter()
+
 from google.adk.agents import LlmAgent, Agent, SequentialAgent
 from google.adk.tools import google_search
 from google.adk.tools import agent_tool
-from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
-from google.adk.tools.mcp_tool.mcp_session_manager import StreamableHTTPConnectionParams
 
-from google.adk.models.lite_llm import LiteLlm
-import litellm 
 import os
 from google.adk.code_executors import BuiltInCodeExecutor
 # import dotenv
 # from dotenv import load_dotenv
 
+from .connection_pool import AgentConnectionPool, PooledLiteLlm, PooledMcpToolset
+from .dpa_model_registry import select_dpa_model
+from .response_cache import RESPONSE_CACHE_TTL_SECONDS, TOOL_CACHE_TTL_SECONDS, ResponseCache, ToolResultCache
+
 #%%
 # os.environ["LITELLM_PROXY_API_BASE"] = "https://litellm.deepmd.us"
 # os.environ["LITELLM_PROXY_API_KEY"] = "sk-...XOOw"
@@ -20,12 +24,25 @@ from google.adk.code_executors import BuiltInCodeExecutor
 
 # os.environ["GOOGLE_API_KEY"] = 'AI..._cQ'
 
-litellm.use_litellm_proxy = True
+# Configuration
+# a local stand-in MCP server: DEEPMD_LAMMPS_MCP_URL=http://localhost:8002/mcp
+DEEPMD_LAMMPS_MCP_URL = os.getenv("DEEPMD_LAMMPS_MCP_URL", "https://deepmodeling-ai-services-mcp.zeabur.app/mcp")
+DEEPMD_DOCS_RAG_MCP_URL = os.getenv("DEEPMD_DOCS_RAG_MCP_URL", "https://zqibhdki.sealosbja.site/api/mcp/app/tRmg19AXvG2GL46rZXadjsIb/mcp")
+GENERAL_MODEL = os.getenv("DEEPMD_AGENT_GENERAL_MODEL", "gemini/gemini-2.5-flash")
+CODING_MODEL = os.getenv("DEEPMD_AGENT_CODING_MODEL", "gemini/gemini-2.5-flash")
 
 # model_original = "gemini-2.5-flash"
 
-general_model = LiteLlm(model="gemini/gemini-2.5-flash"
-    , api_base=os.getenv("LITELLM_PROXY_API_BASE"),
+# mcp toolsets and model clients are built on first use, shared by all the agents below;
+# repeated model requests and read only / idempotent tool calls are answered from the caches
+agent_pool = AgentConnectionPool(
+    response_cache=ResponseCache() if RESPONSE_CACHE_TTL_SECONDS > 0 else None,
+    # the docs rag server sends no tool annotations, its tools are all lookups
+    tool_cache=ToolResultCache(cacheable_endpoints={DEEPMD_DOCS_RAG_MCP_URL: TOOL_CACHE_TTL_SECONDS}),
+)
+
+general_model = PooledLiteLlm(GENERAL_MODEL, agent_pool,
+    api_base=os.getenv("LITELLM_PROXY_API_BASE"),
     api_key=os.getenv("LITELLM_PROXY_API_KEY"),
     )
 # general_model = LiteLlm(model="gemini/deepseek-chat"
@@ -33,7 +50,7 @@ general_model = LiteLlm(model="gemini/gemini-2.5-flash"
 #     api_key=os.getenv("LITELLM_PROXY_API_KEY"),
 #     )
 
-coding_model = LiteLlm(model='gemini/gemini-2.5-flash',
+coding_model = PooledLiteLlm(CODING_MODEL, agent_pool,
     api_base=os.getenv("LITELLM_PROXY_API_BASE"),
     api_key=os.getenv("LITELLM_PROXY_API_KEY"),
 )
@@ -49,6 +66,9 @@ deepmd_select_dpa_model_agent = LlmAgent(
     instruction=("""You are an agent that select and provides the deepmd dpa model.
     Selctet the best dpa model for the given task.
     If you are not sure about the best dpa model, you can ask user for more information.
+    You are asked when the select_dpa_model tool found several models fitting equally well, or none,
+    or when its element coverage is only the built-in estimate (then check the top candidate fits the system).
+    Use its candidates and reason, and the user's application to decide, or ask the user.
     These model files are locate at /public/DPA-3.1-3M/branch_models/
     Available dpa models are:
     Domains_Alloy.pth , for alloy materials.
@@ -64,7 +84,7 @@ deepmd_select_dpa_model_agent = LlmAgent(
     Others_HfO2.pth , for HfO2 materials.
     Organic_Reactions.pth , for organic reactions.
     """),
-    # tools=[get_deepmd_dpa_select_model]
+    tools=[select_dpa_model]
 )
 
 
@@ -76,28 +96,11 @@ deepmd_select_dpa_model_agent = LlmAgent(
 #   capitals = {"france": "Paris", "japan": "Tokyo", "canada": "Ottawa"}
 #   return capitals.get(country.lower(), f"Sorry, I don't know the capital of {country}.")
 
-deepmd_lammps_mcp_toolset = McpToolset(
-    connection_params=StreamableHTTPConnectionParams(
-        url="https://deepmodeling-ai-services-mcp.zeabur.app/mcp",
-        # url="https://deepmodeling--deepmd-lammps-agent-services-mcp-app.modal.run", # remote mcp
-        timeout=300,
-        # url="http://localhost:8002/mcp",
-        # headers={"Authorization": "Bearer your-auth-token"}
-    ),
-)
-
+deepmd_lammps_mcp_toolset = PooledMcpToolset(agent_pool, DEEPMD_LAMMPS_MCP_URL)
+# DEEPMD_LAMMPS_MCP_URL="https://deepmodeling--deepmd-lammps-agent-services-mcp-app.modal.run", # remote mcp
 
 
-deepmd_docs_rag_toolset = McpToolset(
-    connection_params=StreamableHTTPConnectionParams(
-        # url="http://localhost:8002/mcp",
-        url="https://zqibhdki.sealosbja.site/api/mcp/app/tRmg19AXvG2GL46rZXadjsIb/mcp",
-        # url="https://deepmodeling--deepmd-lammps-agent-services-mcp-app.modal.run", # remote mcp
-        timeout=300,
-        
-        # headers={"Authorization": "Bearer your-auth-token"}
-    ),
-)
+deepmd_docs_rag_toolset = PooledMcpToolset(agent_pool, DEEPMD_DOCS_RAG_MCP_URL)
 
 
 deepmd_docs_rag_agent = LlmAgent(
@@ -236,7 +239,8 @@ deepmd_lammps_dpa3_model_agent = LlmAgent(
     you can also use the deepmd_docs_rag_toolset to search the deepmd or some domain specific related docs and provide the correct information.(such as code, paper, release note, software usage, etc.)
     In order to help user to use the dpa3 model you need to do the following steps: (and some files or models may be directly provided by the user.)
     1. deepmd_docs_rag_agent: Sometime you need Query the deepmd docs with deepmd_docs_rag_agent agent to get the correct information (including code, paper, release note, software usage, etc.)
-    2. deepmd_select_dpa_model_agent: select the best dpa3 model for the given task.  (There are some default dpa models provided by the developer but user can also use their own models.)
+    2. select_dpa_model tool: select the best dpa3 model for the given elements (formula, element list or pair_coeff line) and task. Use the returned model directly.
+       Only when it returns ambiguous, transfer to deepmd_select_dpa_model_agent. (There are some default dpa models provided by the developer but user can also use their own models.)
     3. deepmd_structure_prepare_agent: prepare the structure for the given task.
     4. deepmd_lammps_input_script_agent: to generate the lammps input script for the given task. (you can ask user to provide more details if you are not sure about the task.)
     5. deepmd_lammps_simulations_agent: run the lammps simulations. (usually you need short lammps simulation first to test the lammps simulation environment then long lammps simulation for production use)
@@ -244,11 +248,12 @@ deepmd_lammps_dpa3_model_agent = LlmAgent(
     If your user ask you something that you do not know clearly, you can just use the deepmd_lammps_mcp_toolset to search the deepmd docs and provide the correct information.
     """,
     sub_agents=[metainfo_agent, deepmd_docs_rag_agent, deepmd_structure_prepare_agent, deepmd_select_dpa_model_agent, deepmd_lammps_input_script_agent, deepmd_lammps_simulations_agent],
-    tools=[deepmd_lammps_mcp_toolset, deepmd_docs_rag_toolset]
+    tools=[select_dpa_model, deepmd_lammps_mcp_toolset, deepmd_docs_rag_toolset]
 )
 
 
 root_agent = deepmd_lammps_dpa3_model_agent
+agent_pool.record_startup(time.perf_counter() - _started_at)
 
 
 # google_search_tool_agent = LlmAgent(
@@ -0,0 +1,218 @@
+#%%
+import asyncio
+import copy
+import logging
+import os
+import time
+from typing import Any, AsyncGenerator, Callable, Optional
+
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.tools.base_tool import BaseTool
+from google.adk.tools.base_toolset import BaseToolset
+from pydantic import PrivateAttr
+
+from .response_cache import ResponseCache, ToolResultCache
+
+logger = logging.getLogger(__name__)
+
+#%%
+# Configuration
+MCP_TIMEOUT_SECONDS = float(os.getenv("MCP_TIMEOUT_SECONDS", "300"))
+MCP_MAX_CONCURRENT_CALLS = int(os.getenv("MCP_MAX_CONCURRENT_CALLS", "8"))          # tool calls in flight per mcp endpoint
+MCP_TOOL_LIST_CACHE_SECONDS = float(os.getenv("MCP_TOOL_LIST_CACHE_SECONDS", "300"))  # tools/list reused between turns
+
+
+def build_mcp_toolset(url: str, *, timeout: float, tool_list_cache_seconds: float) -> BaseToolset:
+    """streamable http McpToolset, its session manager keeps the MCP session open between calls"""
+    # the mcp client stack is imported on first use, not when the agent module is loaded
+    from google.adk.tools.mcp_tool.mcp_session_manager import StreamableHTTPConnectionParams
+    from google.adk.tools.mcp_tool.mcp_toolset import McpToolset
+
+    return McpToolset(
+        connection_params=StreamableHTTPConnectionParams(url=url, timeout=timeout),
+        tool_list_cache_ttl_seconds=tool_list_cache_seconds,
+    )
+
+
+def build_lite_llm(model: str, **kwargs) -> BaseLlm:
+    import litellm
+    from google.adk.models.lite_llm import LiteLlm
+
+    litellm.use_litellm_proxy = True
+    return LiteLlm(model=model, **kwargs)
+
+
+class AgentConnectionPool:
+    """
+    McpToolsets by endpoint url and LiteLlm clients by model, built on first use and shared by all agents
+    of the process. Importing the agent module connects nowhere; a toolset keeps its MCP session
+    (keep-alive) and tool list, and the tool calls per endpoint are bounded by max_concurrent_calls.
+    `metrics` has the startup time and the first list / first call latency per endpoint.
+    With a response_cache / tool_cache, repeated model requests and idempotent tool calls are served
+    without the round trip, `cache_stats()` has their hit rates.
+    """
+
+    def __init__(self, *,
+            timeout_seconds: float = MCP_TIMEOUT_SECONDS,
+            max_concurrent_calls: int = MCP_MAX_CONCURRENT_CALLS,
+            tool_list_cache_seconds: float = MCP_TOOL_LIST_CACHE_SECONDS,
+            toolset_factory: Callable[..., BaseToolset] = build_mcp_toolset,
+            llm_factory: Callable[..., BaseLlm] = build_lite_llm,
+            response_cache: Optional[ResponseCache] = None,
+            tool_cache: Optional[ToolResultCache] = None,
+            clock: Callable[[], float] = time.perf_counter):
+        self.timeout_seconds = timeout_seconds
+        self.max_concurrent_calls = max_concurrent_calls
+        self.tool_list_cache_seconds = tool_list_cache_seconds
+        self.toolset_factory = toolset_factory
+        self.llm_factory = llm_factory
+        self.response_cache = response_cache
+        self.tool_cache = tool_cache
+        self.clock = clock
+        self.toolsets: dict[str, BaseToolset] = {}
+        self.llms: dict[tuple, BaseLlm] = {}
+        self._call_slots: dict[str, asyncio.Semaphore] = {}
+        self.metrics: dict[str, Any] = {
+            "startup_seconds": None,
+            "first_list_seconds": {},
+            "first_call_seconds": {},
+            "llm_build_seconds": {},
+            "calls": {},
+        }
+
+    def record_startup(self, seconds: float):
+        self.metrics["startup_seconds"] = seconds
+        logger.info(f"deepmd agent loaded in {seconds * 1000:.1f}ms, no mcp connection or model client built yet")
+
+    def toolset(self, url: str) -> BaseToolset:
+        toolset = self.toolsets.get(url)
+        if toolset is None:
+            toolset = self.toolsets[url] = self.toolset_factory(url, timeout=self.timeout_seconds,
+                tool_list_cache_seconds=self.tool_list_cache_seconds)
+            self._call_slots[url] = asyncio.Semaphore(self.max_concurrent_calls)
+        return toolset
+
+    async def get_tools(self, url: str, readonly_context: Optional[ReadonlyContext] = None) -> list[BaseTool]:
+        first = url not in self.metrics["first_list_seconds"]
+        started = self.clock()
+        tools = await self.toolset(url).get_tools(readonly_context)
+        if first:
+            # connect + initialize + tools/list of the first agent turn that needs the endpoint
+            self.metrics["first_list_seconds"][url] = self.clock() - started
+            logger.info(f"mcp tools listed: {url=} {len(tools)=} in {self.metrics['first_list_seconds'][url] * 1000:.1f}ms")
+        return [self._bounded_tool(url, tool) for tool in tools]
+
+    def _bounded_tool(self, url: str, tool: BaseTool) -> BaseTool:
+        """a copy of the tool whose calls wait for a slot of the endpoint, as BaseToolset copies prefixed tools"""
+        run_async = tool.run_async
+        call_slots = self._call_slots[url]
+        cache_ttl = self.tool_cache.ttl_for(tool, url) if self.tool_cache is not None else None
+
+        async def run_async_bounded(*, args: dict[str, Any], tool_context):
+            user_id = getattr(tool_context, "user_id", None)
+            if cache_ttl is not None:
+                result = self.tool_cache.get(url, tool, args, user_id)
+                if result is not None:
+                    return result
+            async with call_slots:
+                started = self.clock()
+                try:
+                    result = await run_async(args=args, tool_context=tool_context)
+                    if cache_ttl is not None:
+                        self.tool_cache.set(url, tool, args, result, cache_ttl, user_id)
+                    return result
+                finally:
+                    self.metrics["calls"][url] = self.metrics["calls"].get(url, 0) + 1
+                    if url not in self.metrics["first_call_seconds"]:
+                        self.metrics["first_call_seconds"][url] = self.clock() - started
+                        logger.info(f"first mcp tool call: {url=} {tool.name=} in {self.metrics['first_call_seconds'][url] * 1000:.1f}ms")
+
+        bounded = copy.copy(tool)
+        bounded.run_async = run_async_bounded  # type: ignore[method-assign]
+        return bounded
+
+    def llm(self, model: str, **kwargs) -> BaseLlm:
+        key = (model, tuple(sorted(kwargs.items())))
+        llm = self.llms.get(key)
+        if llm is None:
+            started = self.clock()
+            llm = self.llms[key] = self.llm_factory(model, **kwargs)
+            self.metrics["llm_build_seconds"][model] = self.clock() - started
+            logger.info(f"model client built: {model=} in {self.metrics['llm_build_seconds'][model] * 1000:.1f}ms")
+        return llm
+
+    def cache_stats(self) -> dict:
+        return {
+            "responses": self.response_cache.stats() if self.response_cache is not None else None,
+            "tools": self.tool_cache.stats() if self.tool_cache is not None else None,
+        }
+
+    async def close_toolset(self, url: str):
+        toolset = self.toolsets.pop(url, None)
+        self._call_slots.pop(url, None)
+        if toolset is not None:
+            await toolset.close()
+
+    async def close(self):
+        for url in list(self.toolsets):
+            await self.close_toolset(url)
+
+
+class PooledMcpToolset(BaseToolset):
+    """the MCP tools of an endpoint, the toolset of the pool is only built on the first get_tools"""
+
+    def __init__(self, pool: AgentConnectionPool, url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+        self.url = url
+
+    async def get_tools(self, readonly_context: Optional[ReadonlyContext] = None) -> list[BaseTool]:
+        tools = await self.pool.get_tools(self.url, readonly_context)
+        return [tool for tool in tools if self._is_tool_selected(tool, readonly_context)]
+
+    async def close(self) -> None:
+        # shared by the agents of the process, closed once, a later get_tools reconnects
+        await self.pool.close_toolset(self.url)
+
+
+class PooledLiteLlm(BaseLlm):
+    """
+    LiteLlm stand-in, litellm is imported and the client of the pool built on the first request.
+    Responses are replayed from the response cache of the pool when the request was seen before.
+    """
+
+    _pool: AgentConnectionPool = PrivateAttr()
+    _llm_kwargs: dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, model: str, pool: AgentConnectionPool, **kwargs):
+        super().__init__(model=model)
+        self._pool = pool
+        self._llm_kwargs = kwargs
+
+    @property
+    def llm(self) -> BaseLlm:
+        return self._pool.llm(self.model, **self._llm_kwargs)
+
+    @property
+    def capabilities(self):
+        return self.llm.capabilities
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        cache = self._pool.response_cache
+        cached = cache.get(self.model, llm_request) if cache is not None else None
+        if cached is not None:
+            for response in cached:
+                yield response
+            return
+        responses = []
+        async for response in self.llm.generate_content_async(llm_request, stream=stream):
+            responses.append(response)
+            yield response
+        if cache is not None:
+            cache.set(self.model, llm_request, responses)
+
+    def connect(self, llm_request: LlmRequest):
+        return self.llm.connect(llm_request)
@@ -0,0 +1,250 @@
+#%%
+import argparse
+import json
+import os
+import posixpath
+import re
+from dataclasses import dataclass
+from typing import Iterable
+
+#%%
+# Configuration
+DPA_MODEL_DIR = os.getenv("DPA_MODEL_DIR", "/public/DPA-3.1-3M/branch_models/")
+# optional json list of {"file", "elements", "domains", "description", "system_specific", "elements_from_type_map"}
+# replacing the built-in registry, written with the type maps of the model files by
+# `python -m deepmd_agent.dpa_model_registry --output registry.json` (needs deepmd-kit)
+DPA_MODEL_REGISTRY_PATH = os.getenv("DPA_MODEL_REGISTRY_PATH", "")
+MAX_CANDIDATES = 5
+MODEL_FILE_SUFFIXES = (".pth", ".pt", ".pb")
+
+PERIODIC_TABLE = (
+    "H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se Br Kr "
+    "Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb Lu "
+    "Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr "
+    "Rf Db Sg Bh Hs Mt Ds Rg Cn Nh Fl Mc Lv Ts Og"
+).split()
+ELEMENT_BITS = {symbol: 1 << index for index, symbol in enumerate(PERIODIC_TABLE)}
+ATOMIC_NUMBERS = {symbol: index + 1 for index, symbol in enumerate(PERIODIC_TABLE)}
+
+FORMULA_TOKEN = re.compile(r"^(?:[A-Z][a-z]?(?:\d+(?:\.\d+)?)?)+$")
+FORMULA_ELEMENT = re.compile(r"[A-Z][a-z]?")
+FLOAT_TOKEN = re.compile(r"^[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?$")
+
+
+@dataclass(frozen=True)
+class DpaModel:
+    file: str
+    elements: frozenset[str]
+    domains: tuple[str, ...]
+    description: str
+    # trained on one chemical system (water, HfO2, AlMgCu), preferred over the broad domain heads that also cover it
+    system_specific: bool = False
+    # elements read from the type_map of the model file; the built-in table below is an estimate
+    verified: bool = False
+
+    @property
+    def path(self) -> str:
+        return posixpath.join(DPA_MODEL_DIR, self.file)
+
+    @property
+    def element_mask(self) -> int:
+        return element_mask(self.elements)
+
+    def to_dict(self) -> dict:
+        return {"model": self.file, "path": self.path, "domains": list(self.domains), "description": self.description,
+            "elements": sorted(self.elements, key=ATOMIC_NUMBERS.get), "elements_verified": self.verified}
+
+
+def elements_of(symbols: str) -> frozenset[str]:
+    return frozenset(symbols.split())
+
+
+# estimated element coverage of the training data of each branch head, not read from the model files:
+# a choice made from it alone is reported ambiguous (advisory)
+DPA_MODELS = (
+    DpaModel("H2O_H2O_PD.pth", elements_of("H O"), ("water", "ice", "h2o", "phase diagram", "liquid water"),
+        "water and ice, phase diagram simulation", system_specific=True),
+    DpaModel("Metals_AlMgCu.pth", elements_of("Al Mg Cu"), ("almgcu", "aluminium", "aluminum", "magnesium", "copper", "light alloy"),
+        "Al Mg Cu alloys", system_specific=True),
+    DpaModel("Others_HfO2.pth", elements_of("Hf O"), ("hfo2", "hafnia", "hafnium oxide", "high-k"),
+        "HfO2", system_specific=True),
+    DpaModel("solvated_protein_fragments.pt", elements_of("H C N O S"), ("protein", "peptide", "amino acid", "solvated", "biomolecule"),
+        "protein fragments in solvent"),
+    DpaModel("Organic_Reactions.pth", elements_of("H C N O"), ("reaction", "organic reaction", "transition state", "bond breaking", "combustion"),
+        "organic reactions"),
+    DpaModel("Domains_Drug.pth", elements_of("H C N O F P S Cl Br I"), ("drug", "small molecule", "ligand", "molecule", "pharmaceutical"),
+        "drug like small molecules"),
+    DpaModel("Domains_Alloy.pth", elements_of(
+        "Li Be Na Mg Al Si K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb "
+        "Cs Ba La Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi"),
+        ("alloy", "metal", "metallic", "high entropy", "intermetallic"),
+        "alloy materials"),
+    DpaModel("Domains_Anode.pth", elements_of("H Li B C N O F Na Mg Al Si P S K Ca Ti Mn Fe Co Ni Cu Zn Ge Nb Sn"),
+        ("anode", "battery", "lithium", "sodium", "electrode", "intercalation"),
+        "anode materials in batteries"),
+    DpaModel("Domains_Cluster.pth", elements_of("H B C N O Al Si P S Fe Co Ni Cu Zn Ru Rh Pd Ag Ir Pt Au"),
+        ("cluster", "nanocluster", "nanoparticle", "catalyst"),
+        "cluster materials"),
+    DpaModel("Domains_FerroEle.pth", elements_of("Li O F Na Mg K Ca Sc Ti Mn Fe Ga Ge Rb Sr Zr Nb In Sn Cs Ba La Hf Ta Pb Bi"),
+        ("ferroelectric", "perovskite", "piezoelectric", "polarization"),
+        "ferroelectric materials"),
+    DpaModel("Domains_SemiCond.pth", elements_of(
+        "B C N O F Mg Al Si P S Cl Ca Ti Cu Zn Ga Ge As Se Br Sr Zr Mo Ag Cd In Sn Sb Te I Cs Ba Hf W Hg Pb Bi"),
+        ("semiconductor", "semi-conductor", "band gap", "dopant", "2d material", "perovskite solar"),
+        "semi-conductor materials"),
+)
+
+
+def element_mask(elements: Iterable[str]) -> int:
+    mask = 0
+    for element in elements:
+        mask |= ELEMENT_BITS[element]
+    return mask
+
+
+def normalize_words(text: str) -> str:
+    """lowercase words between single spaces, padded, so `" ice " in task` does not match lattice"""
+    return f" {' '.join(re.findall(r'[a-z0-9]+', text.lower()))} "
+
+
+def load_registry(path: str = DPA_MODEL_REGISTRY_PATH) -> tuple[DpaModel, ...]:
+    if not path:
+        return DPA_MODELS
+    with open(path) as f:
+        return tuple(DpaModel(entry["file"], frozenset(entry["elements"]), tuple(entry.get("domains", ())),
+            entry.get("description", ""), entry.get("system_specific", False), entry.get("elements_from_type_map", False))
+            for entry in json.load(f))
+
+
+def read_type_map(path: str) -> list[str]:
+    """element symbols of a frozen model, needs deepmd-kit (installed in the GPU image, not in the agent)"""
+    from deepmd.infer import DeepPot
+    return list(DeepPot(path).get_type_map())
+
+
+def build_registry(model_dir: str = DPA_MODEL_DIR, *, type_map_reader=read_type_map) -> list[dict]:
+    """
+    registry entries of the model files in model_dir, elements from their type_map, domains and descriptions
+    from the built-in table. A type_map listing the whole periodic table (shared by the heads of a multi-task
+    model) says nothing about the training data: the built-in estimate is kept, not marked as read.
+    """
+    known = {model.file: model for model in DPA_MODELS}
+    entries = []
+    for file in sorted(os.listdir(model_dir)):
+        if not file.endswith(MODEL_FILE_SUFFIXES):
+            continue
+        model = known.get(file, DpaModel(file, frozenset(), (), ""))
+        type_map = [element for element in type_map_reader(os.path.join(model_dir, file)) if element in ELEMENT_BITS]
+        from_type_map = 0 < len(type_map) < len(PERIODIC_TABLE)
+        entries.append({
+            "file": file,
+            "elements": type_map if from_type_map else sorted(model.elements, key=ATOMIC_NUMBERS.get),
+            "domains": list(model.domains),
+            "description": model.description,
+            "system_specific": model.system_specific,
+            "elements_from_type_map": from_type_map,
+        })
+    return entries
+
+
+def parse_elements(text: str) -> list[str]:
+    """
+    element symbols in a LAMMPS deck (pair_coeff * * O H), an xyz / extxyz structure,
+    chemical formulas (LiCoO2, H2O) or a plain list (Li, Co, O). In order of appearance, unknown symbols are dropped.
+    """
+    found: list[str] = []
+    lines = text.splitlines()
+    for line in lines:
+        tokens = line.split("#", 1)[0].split()
+        if len(tokens) > 3 and tokens[0] == "pair_coeff" and tokens[1] == tokens[2] == "*":
+            found += [token for token in tokens[3:] if token in ELEMENT_BITS]
+    if not found:
+        for line in lines:
+            tokens = line.split()
+            if len(tokens) >= 4 and tokens[0] in ELEMENT_BITS and all(FLOAT_TOKEN.match(token) for token in tokens[1:4]):
+                found.append(tokens[0])
+    if not found:
+        for token in re.split(r"[\s,;/+\-]+", text):
+            if FORMULA_TOKEN.match(token):
+                found += [symbol for symbol in FORMULA_ELEMENT.findall(token) if symbol in ELEMENT_BITS]
+    return list(dict.fromkeys(found))
+
+
+class DpaModelSelector:
+    """
+    Ranks the registry models covering all elements of a system, element coverage checked with one bitmask AND per model.
+    Decided without an LLM when the task keywords or a system specific model single out one candidate,
+    otherwise the result is flagged ambiguous with the ranked candidates.
+    """
+
+    def __init__(self, models: Iterable[DpaModel] = DPA_MODELS):
+        self.models = tuple(models)
+        self._masks = tuple((model, model.element_mask) for model in self.models)
+        self._domains = {model: tuple(normalize_words(domain) for domain in model.domains) for model in self.models}
+        self._dicts = {model: model.to_dict() for model in self.models}
+
+    def compatible(self, elements: Iterable[str]) -> list[DpaModel]:
+        mask = element_mask(elements)
+        return [model for model, model_mask in self._masks if mask & ~model_mask == 0]
+
+    def select(self, elements: Iterable[str], task: str = "") -> dict:
+        elements = list(dict.fromkeys(elements))
+        unknown = [element for element in elements if element not in ELEMENT_BITS]
+        elements = [element for element in elements if element in ELEMENT_BITS]
+        if not elements:
+            return {"elements": [], "unknown": unknown, "model": None, "ambiguous": True, "candidates": [],
+                "reason": "no element symbols found, ask for the elements or the structure of the system"}
+
+        task = normalize_words(task)
+        ranked = sorted(
+            ((sum(domain in task for domain in self._domains[model]), model.system_specific, -len(model.elements), model)
+                for model in self.compatible(elements)),
+            key=lambda entry: entry[:3], reverse=True)
+        candidates = [{**self._dicts[model], "domain_matches": score} for score, _, _, model in ranked[:MAX_CANDIDATES]]
+        result = {"elements": elements, "unknown": unknown, "candidates": candidates}
+
+        if not ranked:
+            covering = max(self.models, key=lambda model: len(model.elements & set(elements)))
+            missing = sorted(set(elements) - covering.elements, key=ATOMIC_NUMBERS.get)
+            return {**result, "model": None, "ambiguous": True,
+                "reason": f"no branch model covers {'-'.join(elements)} ({covering.file} lacks {' '.join(missing)}), "
+                    "a fine-tuned or user provided model is needed"}
+        if len(ranked) == 1 or ranked[0][:2] > ranked[1][:2]:
+            score, system_specific, _, model = ranked[0]
+            why = "only compatible model" if len(ranked) == 1 else ("matches the task" if score > ranked[1][0] else "trained on this chemical system")
+            if not model.verified:
+                return {**result, "model": None, "ambiguous": True, "reason": f"{model.file}: {why}, but its element coverage "
+                    "is the built-in estimate, not read from the model's type_map: confirm it fits the system"}
+            return {**result, "model": model.path, "ambiguous": False, "reason": f"{model.file}: {why}"}
+        tied = [model.file for score, system_specific, _, model in ranked if (score, system_specific) == ranked[0][:2]]
+        return {**result, "model": None, "ambiguous": True,
+            "reason": f"{len(tied)} models fit {'-'.join(elements)} equally well ({', '.join(tied)}), the application decides"}
+
+
+dpa_model_selector = DpaModelSelector(load_registry())
+
+
+def select_dpa_model(structure: str, task: str = "") -> dict:
+    """Selects the DPA-3.1-3M branch model for a system, without an LLM call.
+
+    Args:
+        structure: the elements of the system: a list of element symbols ("Li Co O"), a chemical formula ("LiCoO2"),
+            the pair_coeff line of a LAMMPS input, or an xyz structure.
+        task: what is simulated, e.g. "ice melting", "lithium battery anode", "drug ligand".
+
+    Returns:
+        dict: `model` is the model path to use in `pair_style deepmd <model>` unless `ambiguous` is true,
+            then choose among `candidates` by the application or ask the user. `reason` explains the choice.
+    """
+    return dpa_model_selector.select(parse_elements(structure), task)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="write the DPA_MODEL_REGISTRY_PATH json from the type maps of the model files")
+    parser.add_argument("--model-dir", default=DPA_MODEL_DIR)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+    registry = build_registry(args.model_dir)
+    with open(args.output, "w") as f:
+        json.dump(registry, f, indent=2)
+    print(f"{len(registry)} models, {sum(entry['elements_from_type_map'] for entry in registry)} with the elements of their type_map: {args.output}")
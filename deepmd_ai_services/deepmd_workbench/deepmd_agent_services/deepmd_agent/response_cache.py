@@ -0,0 +1,266 @@
+#%%
+import collections
+import copy
+import hashlib
+import json
+import os
+import re
+import time
+import zlib
+from typing import Any, Callable, Hashable, Optional
+
+#%%
+# Configuration
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))   # 0 disables the model response cache
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048"))
+# cosine similarity of the last user message for the embedding tier, 0 keeps the exact tier only
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0"))
+EMBEDDING_DIMENSIONS = 512
+TOOL_CACHE_TTL_SECONDS = float(os.getenv("MCP_TOOL_CACHE_TTL_SECONDS", "300"))
+# mcp tools whose results are cached besides those annotated read only + idempotent, "name" or "name:ttl_seconds"
+MCP_CACHEABLE_TOOLS = os.getenv("MCP_CACHEABLE_TOOLS", "")
+
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def parse_cacheable_tools(spec: str, default_ttl: float = TOOL_CACHE_TTL_SECONDS) -> dict[str, float]:
+    tools = {}
+    for item in filter(None, (item.strip() for item in spec.split(","))):
+        name, _, ttl = item.partition(":")
+        tools[name] = float(ttl) if ttl else default_ttl
+    return tools
+
+
+class TtlLruCache:
+    """LRU entries with a ttl each, hit / miss counters"""
+
+    def __init__(self, *, max_entries: int, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: collections.OrderedDict[Hashable, tuple[float, Any]] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None and self.clock() >= entry[0]:
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        self._entries[key] = (self.clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class HashingEmbedder:
+    """character trigram counts hashed into a unit vector, local and deterministic, no embedding model needed"""
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def __call__(self, text: str):
+        import numpy as np
+
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            padded = f" {word} "
+            for i in range(max(1, len(padded) - 2)):
+                vector[zlib.crc32(padded[i:i + 3].encode()) % self.dimensions] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SimilarityIndex:
+    """
+    Embeddings of cached questions per bucket (same model, instructions, tools and history) in a NumPy matrix,
+    a lookup is one matrix-vector product. Expired rows are dropped when the bucket is written.
+    """
+
+    def __init__(self, embedder: Callable[[str], Any], *, threshold: float, max_entries: int,
+            clock: Callable[[], float] = time.monotonic):
+        import numpy as np
+
+        self.np = np
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.clock = clock
+        # bucket -> (matrix of unit vectors, [(expires_at, value)])
+        self._buckets: dict[str, tuple[Any, list[tuple[float, Any]]]] = {}
+        self.hits = 0
+
+    def get(self, bucket: str, text: str) -> Optional[Any]:
+        entry = self._buckets.get(bucket)
+        if entry is None:
+            return None
+        matrix, values = entry
+        scores = matrix @ self.embedder(text)
+        now = self.clock()
+        for index in self.np.argsort(scores)[::-1]:
+            if scores[index] < self.threshold:
+                return None
+            if values[index][0] > now:
+                self.hits += 1
+                return values[index][1]
+        return None
+
+    def set(self, bucket: str, text: str, value: Any, ttl: float):
+        now = self.clock()
+        matrix, values = self._buckets.get(bucket, (self.np.zeros((0, 0), dtype=self.np.float32), []))
+        keep = [index for index, (expires_at, _) in enumerate(values) if expires_at > now][-(self.max_entries - 1):]
+        vector = self.embedder(text)[None, :]
+        matrix = self.np.vstack([matrix[keep], vector]) if keep else vector
+        self._buckets[bucket] = (matrix, [values[index] for index in keep] + [(now + ttl, value)])
+        while sum(len(values) for _, values in self._buckets.values()) > self.max_entries and len(self._buckets) > 1:
+            self._buckets.pop(next(iter(self._buckets)))
+
+
+class ResponseCache:
+    """
+    Model responses by request: an exact tier keyed on the normalized contents, system instruction and tool
+    declarations, and optionally an embedding tier that serves plain text answers to nearly identical last
+    user messages (same history, instructions and tools). Requests with non-text inputs are not cached.
+    """
+
+    def __init__(self, *, ttl: float = RESPONSE_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+            similarity_threshold: float = RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+            embedder: Optional[Callable[[str], Any]] = None,
+            clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.exact = TtlLruCache(max_entries=max_entries, clock=clock)
+        self.similar = None
+        if similarity_threshold > 0:
+            self.similar = SimilarityIndex(embedder or HashingEmbedder(), threshold=similarity_threshold,
+                max_entries=max_entries, clock=clock)
+
+    @staticmethod
+    def request_keys(model: str, llm_request) -> Optional[tuple[str, str, Optional[str]]]:
+        """(exact key, similarity bucket, last user message or None if only the exact tier applies)"""
+        contents = []
+        for content in llm_request.contents:
+            parts = []
+            for part in content.parts or []:
+                if part.text is not None:
+                    parts.append({"text": normalize_text(part.text)})
+                elif part.function_call is not None:
+                    parts.append({"call": part.function_call.name, "args": part.function_call.args})
+                elif part.function_response is not None:
+                    parts.append({"response": part.function_response.name, "result": part.function_response.response})
+                elif part.thought_signature is None:
+                    return None
+            contents.append({"role": content.role, "parts": parts})
+        config = llm_request.config
+        system_instruction = config.system_instruction if config is not None else None
+        if system_instruction is not None and not isinstance(system_instruction, str):
+            system_instruction = " ".join(part.text or "" for part in getattr(system_instruction, "parts", None) or [])
+        tools = sorted(tool.model_dump_json(exclude_none=True) for tool in (config.tools or [] if config is not None else []))
+        context = {"model": model, "system": normalize_text(system_instruction or ""), "tools": tools}
+
+        def digest(value) -> str:
+            return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+        exact_key = digest({**context, "contents": contents})
+        question = None
+        if contents and contents[-1]["role"] == "user" and all("text" in part for part in contents[-1]["parts"]):
+            question = " ".join(part["text"] for part in contents[-1]["parts"])
+        # numbers (atom counts, temperatures, steps) barely move the embedding but change the answer, they must match
+        numbers = NUMBER.findall(question or "")
+        return exact_key, digest({**context, "history": contents[:-1], "numbers": numbers}), question
+
+    def get(self, model: str, llm_request) -> Optional[list]:
+        keys = self.request_keys(model, llm_request)
+        if keys is None:
+            return None
+        exact_key, bucket, question = keys
+        responses = self.exact.get(exact_key)
+        if responses is None and self.similar is not None and question:
+            responses = self.similar.get(bucket, question)
+        if responses is not None:
+            return [response.model_copy(deep=True) for response in responses]
+        return None
+
+    def set(self, model: str, llm_request, responses: list):
+        # streamed chunks are not replayed, the final aggregated response is
+        responses = [response for response in responses if not response.partial]
+        if not responses or any(response.error_code for response in responses):
+            return
+        keys = self.request_keys(model, llm_request)
+        if keys is None:
+            return
+        exact_key, bucket, question = keys
+        responses = [response.model_copy(deep=True) for response in responses]
+        self.exact.set(exact_key, responses, self.ttl)
+        # function calls depend on the exact arguments asked for, only text answers are served to similar questions
+        text_only = all(part.text is not None for response in responses if response.content for part in response.content.parts or [])
+        if self.similar is not None and question and text_only:
+            self.similar.set(bucket, question, responses, self.ttl)
+
+    def stats(self) -> dict:
+        stats = self.exact.stats()
+        similar_hits = self.similar.hits if self.similar is not None else 0
+        # a similarity hit is counted as an exact miss first
+        lookups = stats["hits"] + stats["misses"]
+        hits = stats["hits"] + similar_hits
+        return {**stats, "exact_hits": stats["hits"], "similar_hits": similar_hits, "hits": hits,
+            "misses": lookups - hits, "hit_rate": hits / lookups if lookups else 0.0}
+
+
+class ToolResultCache:
+    """
+    Results of idempotent MCP tool calls by endpoint, user, tool and arguments. A tool is cached if the server annotates
+    it read only and idempotent, if it is listed in MCP_CACHEABLE_TOOLS, or if its endpoint is in cacheable_endpoints
+    (servers without annotations whose tools are all lookups). Error results are not cached.
+    """
+
+    def __init__(self, *, cacheable_tools: Optional[dict[str, float]] = None, cacheable_endpoints: Optional[dict[str, float]] = None,
+            ttl: float = TOOL_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, clock: Callable[[], float] = time.monotonic):
+        self.cacheable_tools = parse_cacheable_tools(MCP_CACHEABLE_TOOLS, ttl) if cacheable_tools is None else cacheable_tools
+        self.cacheable_endpoints = cacheable_endpoints or {}
+        self.ttl = ttl
+        self.results = TtlLruCache(max_entries=max_entries, clock=clock)
+
+    def ttl_for(self, tool, url: Optional[str] = None) -> Optional[float]:
+        if tool.name in self.cacheable_tools:
+            return self.cacheable_tools[tool.name]
+        if url in self.cacheable_endpoints:
+            return self.cacheable_endpoints[url]
+        annotations = getattr(getattr(tool, "raw_mcp_tool", None), "annotations", None)
+        if annotations is not None and getattr(annotations, "read_only_hint", None) and getattr(annotations, "idempotent_hint", None):
+            return self.ttl
+        return None
+
+    @staticmethod
+    def key(url: str, tool_name: str, args: dict, user_id: Optional[str] = None) -> str:
+        # the same arguments read another user's job dir or jobs: results are never shared between users
+        return hashlib.sha256(json.dumps([url, user_id, tool_name, args], sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, url: str, tool, args: dict, user_id: Optional[str] = None) -> Optional[Any]:
+        result = self.results.get(self.key(url, tool.name, args, user_id))
+        return copy.deepcopy(result) if result is not None else None
+
+    def set(self, url: str, tool, args: dict, result: Any, ttl: float, user_id: Optional[str] = None):
+        if result is None or (isinstance(result, dict) and (result.get("error") or result.get("isError"))):
+            return
+        self.results.set(self.key(url, tool.name, args, user_id), copy.deepcopy(result), ttl)
+
+    def stats(self) -> dict:
+        return self.results.stats()
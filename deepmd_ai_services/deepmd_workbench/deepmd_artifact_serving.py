@@ -0,0 +1,401 @@
+#%%
+import asyncio
+import collections
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import urllib.parse
+import zlib
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from deepmd_volume_paths import workspace_path_to_volume_path
+
+#%%
+# Configuration
+ARTIFACT_CHUNK_SIZE = 1024 * 1024            # constant server memory per download
+ETAG_CONTENT_HASH_MAX_BYTES = 64 * 1024**2   # larger files get a weak validator until a full download hashed them
+ETAG_CACHE_MAX_ENTRIES = 4096
+GZIP_MIN_SIZE = 1024
+# larger text files (trajectories) are sent as they are, with a content-length and zero-copy, not compressed on the fly
+GZIP_MAX_SIZE = int(os.getenv("ARTIFACT_GZIP_MAX_BYTES", str(16 * 1024**2)))
+
+TEXT_ARTIFACT_SUFFIXES = {
+    ".lammps", ".in", ".log", ".txt", ".data", ".lmp", ".dump", ".lammpstrj",
+    ".xyz", ".json", ".csv", ".yaml", ".yml", ".out", ".py", ".sh",
+}
+TEXT_ARTIFACT_PREFIXES = ("log.", "in.", "data.", "dump.")
+
+RANGE_PATTERN = re.compile(r"^bytes=(?P<start>\d*)-(?P<end>\d*)$")
+
+#%%
+
+@dataclass
+class ArtifactEntry:
+    path: str
+    is_dir: bool
+    size: int
+    mtime: float
+
+    def to_dict(self) -> dict:
+        return {"path": self.path, "is_dir": self.is_dir, "size": self.size, "mtime": self.mtime}
+
+
+class LocalArtifactBackend:
+    """artifacts on a locally mounted volume, served with zero-copy sends where the server supports it"""
+
+    is_local = True
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+
+    def local_path(self, volume_path: str) -> str:
+        local_path = os.path.realpath(os.path.join(self.root, volume_path))
+        if local_path != self.root and not local_path.startswith(self.root + os.sep):
+            raise ValueError(f"path escapes the artifact root: {volume_path=}")
+        return local_path
+
+    async def list(self, volume_path: str) -> list[ArtifactEntry]:
+        local_path = self.local_path(volume_path)
+
+        def _scan():
+            return [
+                ArtifactEntry(
+                    path=posixpath.join(volume_path, entry.name),
+                    is_dir=entry.is_dir(),
+                    size=0 if entry.is_dir() else entry.stat().st_size,
+                    mtime=entry.stat().st_mtime,
+                )
+                for entry in os.scandir(local_path)
+            ]
+        return await asyncio.to_thread(_scan)
+
+    async def stat(self, volume_path: str) -> Optional[ArtifactEntry]:
+        try:
+            st = await asyncio.to_thread(os.stat, self.local_path(volume_path))
+        except FileNotFoundError:
+            return None
+        return ArtifactEntry(path=volume_path, is_dir=os.path.isdir(self.local_path(volume_path)), size=st.st_size, mtime=st.st_mtime)
+
+    async def iter_bytes(self, volume_path: str, offset: int, count: int) -> AsyncIterator[bytes]:
+        fd = os.open(self.local_path(volume_path), os.O_RDONLY)
+        try:
+            end = offset + count
+            while offset < end:
+                chunk = await asyncio.to_thread(os.pread, fd, min(ARTIFACT_CHUNK_SIZE, end - offset), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+
+class VolumeArtifactBackend:
+    """artifacts read through the modal volume api (no local mount)"""
+
+    is_local = False
+
+    def __init__(self, volume):
+        self.volume = volume
+
+    async def list(self, volume_path: str) -> list[ArtifactEntry]:
+        entries = await self.volume.listdir.aio(volume_path or "/")
+        return [self._to_artifact_entry(entry) for entry in entries]
+
+    async def stat(self, volume_path: str) -> Optional[ArtifactEntry]:
+        parent, name = posixpath.split(volume_path)
+        try:
+            entries = await self.volume.listdir.aio(parent or "/")
+        except Exception as e:  # modal raises NotFoundError for missing dirs
+            logger.info(f"artifact parent not found: {volume_path=} {e=}")
+            return None
+        for entry in entries:
+            if posixpath.basename(entry.path.rstrip("/")) == name:
+                return self._to_artifact_entry(entry)
+        return None
+
+    async def iter_bytes(self, volume_path: str, offset: int, count: int) -> AsyncIterator[bytes]:
+        # the volume api has no ranged reads, skip the bytes before the range
+        position = 0
+        end = offset + count
+        async for chunk in self.volume.read_file.aio(volume_path):
+            chunk_end = position + len(chunk)
+            if chunk_end > offset:
+                yield chunk[max(offset - position, 0):min(end - position, len(chunk))]
+            position = chunk_end
+            if position >= end:
+                break
+
+    @staticmethod
+    def _to_artifact_entry(entry) -> ArtifactEntry:
+        return ArtifactEntry(
+            path=entry.path,
+            is_dir=entry.type.name == "DIRECTORY",
+            size=entry.size,
+            mtime=entry.mtime,
+        )
+
+
+class ArtifactETagCache:
+    """content hash etags keyed by (path, size, mtime), bounded LRU"""
+
+    def __init__(self, max_entries: int = ETAG_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._etags = collections.OrderedDict()
+
+    @staticmethod
+    def key(entry: ArtifactEntry) -> tuple:
+        return (entry.path, entry.size, entry.mtime)
+
+    def get(self, entry: ArtifactEntry) -> Optional[str]:
+        key = self.key(entry)
+        etag = self._etags.get(key)
+        if etag is not None:
+            self._etags.move_to_end(key)
+        return etag
+
+    def set(self, entry: ArtifactEntry, content_hash: str) -> str:
+        etag = f'"{content_hash}"'
+        self._etags[self.key(entry)] = etag
+        self._etags.move_to_end(self.key(entry))
+        while len(self._etags) > self.max_entries:
+            self._etags.popitem(last=False)
+        return etag
+
+    async def get_or_compute(self, backend, entry: ArtifactEntry) -> str:
+        etag = self.get(entry)
+        if etag is not None:
+            return etag
+        if entry.size > ETAG_CONTENT_HASH_MAX_BYTES:
+            return f'W/"{entry.size:x}-{int(entry.mtime):x}"'
+
+        digest = hashlib.blake2b(digest_size=16)
+        async for chunk in backend.iter_bytes(entry.path, 0, entry.size):
+            digest.update(chunk)
+        return self.set(entry, digest.hexdigest())
+
+
+artifact_etag_cache = ArtifactETagCache()
+
+#%%
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """
+    Parse a single `bytes=` range into (offset, count).
+    Returns None when the header is absent or not a single byte range (the full file is served),
+    raises ValueError when the range is not satisfiable.
+    """
+    if not range_header:
+        return None
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        return None
+
+    start, end = match.group("start"), match.group("end")
+    if start == "" and end == "":
+        return None
+    if start == "":
+        # suffix range: the last N bytes
+        length = min(int(end), size)
+        if length == 0:
+            raise ValueError(f"unsatisfiable range {range_header=} {size=}")
+        return size - length, length
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError(f"unsatisfiable range {range_header=} {size=}")
+    return start, end - start + 1
+
+
+def is_text_artifact(path: str) -> bool:
+    name = posixpath.basename(path)
+    _, suffix = posixpath.splitext(name)
+    content_type, _ = mimetypes.guess_type(name)
+    return (
+        suffix.lower() in TEXT_ARTIFACT_SUFFIXES
+        or name.startswith(TEXT_ARTIFACT_PREFIXES)
+        or (content_type or "").startswith("text/")
+    )
+
+
+def content_disposition(filename: str) -> str:
+    """attachment header with an ascii fallback name and the utf-8 name (RFC 6266 / RFC 5987)"""
+    fallback = "".join(c if " " <= c <= "~" else "_" for c in filename).replace("\\", "\\\\").replace('"', '\\"')
+    if fallback == filename:
+        return f'attachment; filename="{fallback}"'
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{urllib.parse.quote(filename, safe='')}"
+
+
+def _accepts_gzip(headers: Headers) -> bool:
+    for coding in headers.get("accept-encoding", "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*") and params.replace(" ", "") != "q=0":
+            return True
+    return False
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # weak comparison, as required for If-None-Match
+    if if_none_match.strip() == "*":
+        return True
+    wanted = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in wanted
+
+#%%
+
+class ArtifactResponse(Response):
+    """
+    ASGI response for one artifact: conditional requests, single Range requests,
+    on-the-fly gzip for text files up to GZIP_MAX_SIZE and chunked reads with constant memory.
+    Local files use the ASGI zero-copy send extension when the server offers it.
+    Status and headers depend on the request, so they are decided in __call__.
+    """
+
+    def __init__(self, backend, entry: ArtifactEntry, etag: str, *, download_name: Optional[str] = None,
+            background: Optional[BackgroundTask] = None):
+        self.backend = backend
+        self.entry = entry
+        self.etag = etag
+        self.download_name = download_name or posixpath.basename(entry.path)
+        self.status_code = 200
+        self.background = background
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await self._respond(scope, send)
+        if self.background is not None:
+            await self.background()
+
+    async def _respond(self, scope: Scope, send: Send):
+        request_headers = Headers(scope=scope)
+        send_body = scope["method"] != "HEAD"
+        size = self.entry.size
+
+        content_type, _ = mimetypes.guess_type(self.download_name)
+        if content_type is None:
+            content_type = "text/plain; charset=utf-8" if is_text_artifact(self.download_name) else "application/octet-stream"
+
+        headers = {
+            "content-type": content_type,
+            "etag": self.etag,
+            "accept-ranges": "bytes",
+            "content-disposition": content_disposition(self.download_name),
+            "vary": "Accept-Encoding",
+        }
+
+        # a range request is always served as identity, the gzip representation has its own etag
+        gzip_eligible = (
+            "range" not in request_headers
+            and GZIP_MIN_SIZE <= size <= GZIP_MAX_SIZE
+            and is_text_artifact(self.download_name)
+            and _accepts_gzip(request_headers)
+        )
+        if gzip_eligible:
+            headers["etag"] = self.etag[:-1] + '-gzip"'
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, headers["etag"]):
+            await self._send_start(send, 304, headers)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        byte_range = None
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and (if_range is None or (if_range == self.etag and not self.etag.startswith("W/"))):
+            try:
+                byte_range = parse_range_header(range_header, size)
+            except ValueError:
+                await self._send_start(send, 416, {**headers, "content-range": f"bytes */{size}", "content-length": "0"})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        if gzip_eligible:
+            headers["content-encoding"] = "gzip"
+            await self._send_start(send, 200, headers)
+            if send_body:
+                await self._send_gzip(send)
+            else:
+                await send({"type": "http.response.body", "body": b""})
+            return
+
+        if byte_range is None:
+            status, (offset, count) = 200, (0, size)
+        else:
+            status, (offset, count) = 206, byte_range
+            headers["content-range"] = f"bytes {offset}-{offset + count - 1}/{size}"
+        headers["content-length"] = str(count)
+
+        await self._send_start(send, status, headers)
+        if not send_body or count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if self.backend.is_local and "http.response.zerocopysend" in extensions:
+            await self._send_zerocopy(send, offset, count)
+        else:
+            await self._send_chunks(send, offset, count, full_download=status == 200)
+
+    @staticmethod
+    async def _send_start(send: Send, status: int, headers: dict):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(key.encode("latin-1"), value.encode("latin-1")) for key, value in headers.items()],
+        })
+
+    async def _send_zerocopy(self, send: Send, offset: int, count: int):
+        with open(self.backend.local_path(self.entry.path), "rb") as file:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": file,
+                "offset": offset,
+                "count": count,
+                "more_body": False,
+            })
+
+    async def _send_chunks(self, send: Send, offset: int, count: int, *, full_download: bool):
+        # a full identity download hashes the content on the way, later requests get a strong etag
+        digest = hashlib.blake2b(digest_size=16) if full_download and self.etag.startswith("W/") else None
+        async for chunk in self.backend.iter_bytes(self.entry.path, offset, count):
+            if digest is not None:
+                digest.update(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+        if digest is not None:
+            artifact_etag_cache.set(self.entry, digest.hexdigest())
+
+    async def _send_gzip(self, send: Send):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+        async for chunk in self.backend.iter_bytes(self.entry.path, 0, self.entry.size):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                await send({"type": "http.response.body", "body": compressed, "more_body": True})
+        await send({"type": "http.response.body", "body": compressor.flush()})
+
+#%%
+
+async def list_artifacts(backend, path: str) -> list[dict]:
+    volume_path = workspace_path_to_volume_path(path)
+    entries = await backend.list(volume_path)
+    return [entry.to_dict() for entry in sorted(entries, key=lambda entry: entry.path)]
+
+
+async def get_artifact_response(backend, path: str) -> Optional[ArtifactResponse]:
+    """None if the artifact does not exist or is a directory"""
+    volume_path = workspace_path_to_volume_path(path)
+    entry = await backend.stat(volume_path)
+    if entry is None or entry.is_dir:
+        return None
+    etag = await artifact_etag_cache.get_or_compute(backend, entry)
+    return ArtifactResponse(backend, entry, etag)
@@ -1,13 +1,37 @@
 
 #%%
-from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi import Request, HTTPException
+from fastapi.responses import JSONResponse
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Receive, Scope, Send
+import asyncio
+import functools
+import hashlib
 import os
-from jose import jwt
+import threading
+import time
+from typing import Callable, Optional
+from jose import jwk, jwt
+from jose.backends.base import Key
+from loguru import logger
+import requests
+
+from deepmd_ttl_cache import TtlCache
 
 #%%
+# Configuration
+JWT_CACHE_MAX_ENTRIES = 4096
+JWT_CACHE_MAX_SECONDS = 3600         # claims of tokens without exp are re-verified after this long
+DEFAULT_OWNER_USER_ID = 'default_unnamed_user'
+# e.g. https://deepmodeling-ai.deepmd.us/api/users/.well-known/jwks.json, only the built-in key below if empty
+DEEPMD_JWKS_URL = os.getenv("DEEPMD_JWKS_URL", "")
+JWKS_REFRESH_SECONDS = 300
+JWKS_MIN_REFETCH_SECONDS = 30        # tokens with an unknown kid (fresh rotation) refetch at most this often
+JWKS_FETCH_TIMEOUT_SECONDS = 5
+
 
-DJANGO_JWT_PUBLIC_KEY = """-----BEGIN PUBLIC KEY-----
+# fallback key for tokens without kid and when no JWKS is configured
+DJANGO_JWT_PUBLIC_KEY = os.getenv("DJANGO_JWT_PUBLIC_KEY") or """-----BEGIN PUBLIC KEY-----
 MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAoZL6XkXNV7ZZh9HobhNC
 XD9TPeD8he6ev5V8W4LkjONnmU+lg1RM3Hax1eA/0cnD0WVMOSE92s82lsVaIXE/
 DdjsGcTrbry1ly31umgYlt5b8M369p+E0BPWc2HMqFkat3uZ6emURrU8IOMfP5/t
@@ -19,36 +43,156 @@ MQIDAQAB
 
 
 #%%
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
 
-        bypass_paths = ["/health", "/docs", "/openapi.json", "/info",]
+@functools.lru_cache(maxsize=16)
+def parse_public_key(pem: str) -> Key:
+    """parsed once per process, jose parses PEM strings on every decode"""
+    return jwk.construct(pem, "RS256")
 
-        if request.url.path in bypass_paths:
-            return await call_next(request)
 
+class JwksKeySet:
+    """
+    Verification keys by kid from the JWKS of the users API, parsed once per key, fetched when the
+    refresher thread starts and refreshed by it. A kid not seen yet (a key rotated in since the last refresh)
+    triggers a refetch, at most every min_refetch_seconds: `get` never fetches, it wakes the refresher
+    and returns the known key, `load` / `aload` fetch in the calling / a worker thread.
+    Failed fetches keep the previous keys.
+    """
 
-        
-        auth_token = self._extract_token(request)
-        # jwt_user_id = aut
-        owner_user_id = self.get_owner_user_id(request=request)
-    
-        if not auth_token and owner_user_id=='default_unnamed_user':
-            return await call_next(request)
+    def __init__(self, url: str, *, refresh_seconds: float = JWKS_REFRESH_SECONDS,
+            min_refetch_seconds: float = JWKS_MIN_REFETCH_SECONDS, fetch: Optional[Callable[[], dict]] = None,
+            clock: Callable[[], float] = time.monotonic):
+        self.url = url
+        self.refresh_seconds = refresh_seconds
+        self.min_refetch_seconds = min_refetch_seconds
+        self.clock = clock
+        self._fetch = fetch or self._http_fetch
+        self._keys: dict[str, Key] = {}
+        self._fetched_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    def _http_fetch(self) -> dict:
+        response = requests.get(self.url, timeout=JWKS_FETCH_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.json()
+
+    def refresh(self):
+        with self._lock:
+            self._fetched_at = self.clock()
+            try:
+                jwks = self._fetch()
+            except Exception as e:
+                logger.warning(f"jwks fetch failed, keeping {len(self._keys)} keys: {self.url=} {e=}")
+                return
+            keys = {}
+            for entry in jwks.get("keys", []):
+                kid = entry.get("kid")
+                if kid and entry.get("kty") == "RSA":
+                    keys[kid] = self._keys.get(kid) or jwk.construct(entry, "RS256")
+            self._keys = keys
+        logger.info(f"jwks refreshed: kids={list(keys)}")
+
+    def _refetch_due(self) -> bool:
+        return self._fetched_at is None or self.clock() - self._fetched_at >= self.min_refetch_seconds
+
+    def get(self, kid: str) -> Optional[Key]:
+        """known key of kid, never blocks: an unknown kid is fetched by the refresher thread"""
+        self.start()
+        key = self._keys.get(kid)
+        if key is None and self._refetch_due():
+            self._wake.set()
+        return key
+
+    def load(self, kid: str) -> Optional[Key]:
+        """key of kid, an unknown kid is fetched in the calling thread (not on the event loop)"""
+        self.start()
+        key = self._keys.get(kid)
+        if key is None and self._refetch_due():
+            self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    async def aload(self, kid: str) -> Optional[Key]:
+        key = self._keys.get(kid)
+        if key is not None or not self._refetch_due():
+            return key
+        return await asyncio.to_thread(self.load, kid)
+
+    def start(self):
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="jwks-refresh", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        self.refresh()
+        while True:
+            woken = self._wake.wait(self.refresh_seconds)
+            self._wake.clear()
+            if not woken or self._refetch_due():
+                self.refresh()
+
+
+#%%
+class AuthMiddleware:
+    """
+    Pure ASGI auth middleware, for the FastAPI service and the MCP app: the token is checked before the app
+    runs, responses (long lived text/event-stream included) are passed through without being wrapped.
+    The verified claims are in request.state.user. With allow_anonymous, requests without token run as
+    the default user (stdio-like MCP use), a token that is sent must still be valid.
+    """
+
+    bypass_paths = ("/health", "/docs", "/openapi.json", "/info",)
+
+    def __init__(self, app: ASGIApp, *, allow_anonymous: bool = False):
+        self.app = app
+        self.allow_anonymous = allow_anonymous
+        if self.jwks is not None:
+            # the first JWKS fetch at startup, not with the first request
+            self.jwks.start()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket") or scope["path"] in self.bypass_paths:
+            await self.app(scope, receive, send)
+            return
+
+        connection = HTTPConnection(scope)
+        auth_token = self.get_optional_auth_token(connection)
+        if auth_token:
+            await self.load_verification_key(auth_token)
+        try:
+            payload = self.authenticate(connection, allow_anonymous=self.allow_anonymous)
+        except HTTPException as e:
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 1008, "reason": f"{e.detail}"[:120]})
+            else:
+                await JSONResponse({"detail": e.detail}, status_code=e.status_code)(scope, receive, send)
+            return
+        if payload is not None:
+            connection.state.user = payload
+        await self.app(scope, receive, send)
+
+    @classmethod
+    def authenticate(cls, request: HTTPConnection, *, allow_anonymous: bool = False) -> Optional[dict]:
+        """claims of the request's token, None for an accepted anonymous request, HTTPException otherwise"""
+        auth_token = cls.get_optional_auth_token(request)
+        # path params are not resolved before routing, only the query can name the owner here
+        owner_user_id = request.query_params.get("owner_user_id")
 
         if not auth_token:
+            if owner_user_id == DEFAULT_OWNER_USER_ID or (allow_anonymous and owner_user_id is None):
+                return None
             raise HTTPException(status_code=401, detail="Missing auth token")
-        
+
         try:
-            payload = self._validate_token(auth_token)
-            request.state.user = payload 
-        except jwt.InvalidTokenError as e:
-            raise HTTPException(status_code=401, detail=f"Invalid token. {payload=} {auth_token=} {e=}")
+            payload = cls._validate_token(auth_token)
+        except jwt.JWTError as e:
+            raise HTTPException(status_code=401, detail=f"Invalid token. {e=}")
 
         if owner_user_id and ( owner_user_id != payload["user_id"] ):
             raise HTTPException(status_code=403, detail=f"owner_user_id does not match token user_id. {owner_user_id=} != {payload['user_id']=}")
-        
-        return await call_next(request)
+        return payload
 
     @classmethod
     def get_auth_token(cls, request: Request) -> str:
@@ -59,6 +203,34 @@ class AuthMiddleware(BaseHTTPMiddleware):
         payload = cls._validate_token(auth_token=auth_token)
         return auth_token
 
+    @classmethod
+    def get_optional_auth_token(cls, request: Request) -> Optional[str]:
+        try:
+            return cls._extract_token(request=request)
+        except HTTPException:
+            return None
+
+    @classmethod
+    def get_optional_token_payload(cls, request: Request) -> Optional[dict]:
+        """claims of a valid token (user_id, organization, ...), None without token, 401 for an invalid token"""
+        payload = getattr(request.state, "user", None)
+        if payload is not None:
+            # already verified by the middleware
+            return dict(payload)
+        auth_token = cls.get_optional_auth_token(request)
+        if not auth_token:
+            return None
+        try:
+            return cls._validate_token(auth_token)
+        except jwt.JWTError as e:
+            raise HTTPException(status_code=401, detail=f"Invalid token. {e=}")
+
+    @classmethod
+    def get_optional_user_id(cls, request: Request) -> Optional[str]:
+        """user_id of a valid token, None without token, 401 for an invalid token"""
+        payload = cls.get_optional_token_payload(request)
+        return payload["user_id"] if payload else None
+
     @classmethod
     def get_owner_user_id(cls,request: Request) -> str:
         path_owner_user_id = request.path_params.get("owner_user_id")
@@ -103,10 +275,45 @@ class AuthMiddleware(BaseHTTPMiddleware):
             raise HTTPException(status_code=401, detail="Missing auth token")
         return auth_token
     
-    @staticmethod
-    def _validate_token(auth_token: str) -> dict:
-        # DJANGO_JWT_PUBLIC_KEY = os.environ["DJANGO_JWT_PUBLIC_KEY"]
-        payload = jwt.decode(auth_token, DJANGO_JWT_PUBLIC_KEY, algorithms=["RS256"])
+    # verified claims by token digest, kept until the token expires: one RSA verification per token lifetime
+    verified_tokens = TtlCache(ttl=JWT_CACHE_MAX_SECONDS, max_entries=JWT_CACHE_MAX_ENTRIES)
+    jwks: Optional[JwksKeySet] = JwksKeySet(DEEPMD_JWKS_URL) if DEEPMD_JWKS_URL else None
+
+    @classmethod
+    async def load_verification_key(cls, auth_token: str):
+        """fetch the JWKS in a worker thread if the kid of the token is unknown, verification_key then finds it"""
+        if cls.jwks is None:
+            return
+        try:
+            kid = jwt.get_unverified_header(auth_token).get("kid")
+        except jwt.JWTError:
+            return
+        if kid:
+            await cls.jwks.aload(kid)
+
+    @classmethod
+    def verification_key(cls, auth_token: str) -> Key:
+        kid = jwt.get_unverified_header(auth_token).get("kid")
+        if kid and cls.jwks is not None:
+            key = cls.jwks.get(kid)
+            if key is not None:
+                return key
+        # tokens without kid, unknown kids and no JWKS configured: the built-in key (signature check decides)
+        return parse_public_key(DJANGO_JWT_PUBLIC_KEY)
+
+    @classmethod
+    def _validate_token(cls, auth_token: str) -> dict:
+        key = hashlib.sha256(auth_token.encode()).digest()
+        payload = cls.verified_tokens.get(key)
+        if payload is not None:
+            return dict(payload)
+
+        payload = jwt.decode(auth_token, cls.verification_key(auth_token), algorithms=["RS256"])
         if not payload.get("user_id"):
-            raise jwt.InvalidTokenError(f"user_id cannot be None {payload=} {auth_token=}")
-        return payload
\ No newline at end of file
+            raise jwt.JWTError(f"user_id cannot be None {payload=} {auth_token=}")
+        ttl = JWT_CACHE_MAX_SECONDS
+        if "exp" in payload:
+            ttl = min(ttl, float(payload["exp"]) - time.time())
+        if ttl > 0:
+            cls.verified_tokens.set(key, payload, ttl=ttl)
+        return dict(payload)
\ No newline at end of file
@@ -1,19 +1,52 @@
 #%%
 
 from fastmcp import FastMCP, Context
+from fastmcp.exceptions import ToolError
+from fastmcp.server.dependencies import get_http_request
+from mcp.types import ToolAnnotations
 from loguru import logger
 import modal
 import uvicorn
-from typing import ClassVar, Optional, Annotated
-from pydantic import Field
+from typing import ClassVar, Literal, Optional, Annotated
+from pydantic import BaseModel, Field
 import fastapi
 from fastapi import Request
 from fastapi.responses import PlainTextResponse
+from starlette.middleware import Middleware
 import hashlib
 from pathlib import Path
-from deepmd_modal_run_service import get_lammps_simulation_executor_instance
+from deepmd_lammps_executor import get_lammps_simulation_executor_instance, get_trajectory_analysis_executor_instance
+from deepmd_modal_run_service import cancel_lammps_job, register_spawned_function_call, get_preflight_backends, spawned_function_call_ids
+from deepmd_lammps_preflight import preflight_lammps_input
+from deepmd_artifact_serving import VolumeArtifactBackend
+from deepmd_output_condenser import LammpsOutputCondenser, find_lammps_log_file, read_log_lines, CHARS_PER_TOKEN, DEFAULT_OUTPUT_TOKENS
+from deepmd_volume_paths import WORKSPACE_MOUNT_PATH
+from deepmd_auth_midware import AuthMiddleware
+from deepmd_queue_client import queue_client, DeepmdQueueApiError
+from deepmd_job_status import (
+    job_log_path, modal_call_state, run_result_status, tail_log_lines, summarize_thermo_log, last_thermo_step,
+    JOB_STATUS_CACHE_SECONDS, JOB_LIST_CACHE_SECONDS, FINISHED_JOB_CACHE_SECONDS, TERMINAL_STATUSES, CALL_RUNNING,
+)
+from deepmd_ttl_cache import TtlCache
+from deepmd_volume_upload import bulk_upload_job_files, decode_upload_content, MAX_BULK_UPLOAD_FILES, UPLOAD_ENCODINGS
+from deepmd_admission import admission_controller, AdmissionDecision, AdmissionTicket, AdmissionTimeout, ADMISSION_LEASE_MARGIN_SECONDS
+import anyio
+import asyncio
+import collections
+import contextlib
+import inspect
+import json
 import os
+import re
+import time
+import weakref
 #%%
+# Configuration
+SHORT_RUN_TIMEOUT_SECONDS = 30
+SHORT_RUNS_PER_SESSION = 2           # concurrent short runs of one MCP session, further calls wait
+DEFAULT_OWNER_USER_ID = 'default_unnamed_user'   # stdio and anonymous calls
+MAX_MCP_PROVIDERS = 1000             # per-user providers kept, least recently used ones are closed beyond that
+PROVIDER_IDLE_SECONDS = 30 * 60      # providers without calls for this long are closed
 
 mcp_instance = FastMCP(
     """DeepMD Run Service. Support long run lammps simulation and short run lammps simulation. 
@@ -26,6 +59,12 @@ mcp_instance = FastMCP(
 #     """Run LAMMPS script"""
 #     return f"LAMMPS script: {lammps_script}"
 
+class JobFile(BaseModel):
+    path: str = Field(description="Path relative to job_dir, e.g. in.lammps or potentials/graph.pb")
+    content: str = Field(description="The file content, encoded as given by encoding")
+    encoding: Literal[UPLOAD_ENCODINGS] = Field(default="text", description="text, base64, or gzip+base64 for large or binary files")
+
+
 class McpLoggerProxy:
     def __init__(self, ctx: Context):
         self.ctx = ctx
@@ -55,21 +94,45 @@ class DeepmdDpaLammpsMcp:
     personal_lammps_instance: "LammpsSimulationExecutor" = None # type: ignore
 
 
-    def __init__(self, mcp_instance: FastMCP, *, owner_user_id: str = 'default_unnamed_user'):
-        self.mcp_instance = mcp_instance
+    def __init__(self, *, owner_user_id: str = DEFAULT_OWNER_USER_ID, background_tasks: Optional[set[asyncio.Task]] = None):
         self.owner_user_id = owner_user_id
+        # from the auth token of the latest call, admission limits are shared within the organization
+        self.organization: Optional[str] = None
         self._personal_lammps_instance = None
-
-        self.init_mcp_instance()
+        self._personal_analysis_instance = None
+        self._preflight_backends = None
+        # owned by the pool, watchers of spawned runs outlive the provider
+        self._background_tasks: set[asyncio.Task] = set() if background_tasks is None else background_tasks
+        self.in_flight = 0
+        self.last_used_at = time.monotonic()
+        self.closed = False
+        # dropped once no call of the session holds it
+        self._session_semaphores: weakref.WeakValueDictionary[str, asyncio.Semaphore] = weakref.WeakValueDictionary()
+        # job status / log / list lookups, agents poll them in loops
+        self._job_cache = TtlCache(ttl=JOB_STATUS_CACHE_SECONDS)
 
         # self.initialization()
 
-    def init_mcp_instance(self):
-
-        mcp_instance.custom_route("/health", methods=["GET"])(self.health_check)
-        mcp_instance.resource("config://version")(self.get_version)
-        mcp_instance.tool(self.submit_long_run_lammps_simulation,)
-        mcp_instance.tool(self.short_run_lammps_simulation, )
+    @contextlib.contextmanager
+    def in_use(self):
+        """a tool call running on this provider, keeps it from being evicted"""
+        self.in_flight += 1
+        self.last_used_at = time.monotonic()
+        try:
+            yield self
+        finally:
+            self.in_flight -= 1
+            self.last_used_at = time.monotonic()
+
+    def close(self):
+        """drop the modal handles and caches, spawned runs and their watchers are not affected"""
+        self.closed = True
+        self._personal_lammps_instance = None
+        self._personal_analysis_instance = None
+        self._preflight_backends = None
+        self.personal_volume = None
+        self._job_cache.clear()
+        self._session_semaphores.clear()
 
     
     @property
@@ -84,6 +147,50 @@ class DeepmdDpaLammpsMcp:
             pass
         
         return self._personal_lammps_instance
+
+    async def get_personal_lammps_instance(self):
+        """the first lookup talks to modal synchronously, keep it off the event loop"""
+        if self._personal_lammps_instance is None:
+            return await asyncio.to_thread(lambda: self.personal_lammps_instance)
+        return self._personal_lammps_instance
+
+    def session_semaphore(self, ctx: Optional[Context]) -> asyncio.Semaphore:
+        session_id = getattr(ctx, "session_id", None) or "default"
+        semaphore = self._session_semaphores.get(session_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(SHORT_RUNS_PER_SESSION)
+            self._session_semaphores[session_id] = semaphore
+        return semaphore
+
+    @property
+    def preflight_backends(self):
+        """lazy initialization"""
+        if self._preflight_backends is None:
+            self.personal_volume = modal.Volume.from_name(f"jupyterlab-personal-{self.owner_user_id}", create_if_missing=True)
+            self._preflight_backends = get_preflight_backends(VolumeArtifactBackend(self.personal_volume))
+        return self._preflight_backends
+
+    async def run_preflight(self, commands: str, job_dir: str, ctx: Context = None, input_script_text: Optional[str] = None):
+        result = await preflight_lammps_input(commands, self.preflight_backends, job_dir, input_script_text=input_script_text)
+        if not result.ok and ctx is not None:
+            await ctx.warning(f"lammps preflight failed: {[issue.message for issue in result.errors]}")
+        return result
+
+    async def estimate_runtime(self, preflight) -> Optional[dict]:
+        """runtime estimate of a preflighted deck from the throughput of completed jobs, None without data"""
+        if not (preflight.models and preflight.atoms and preflight.total_run_steps):
+            return None
+        return await asyncio.to_thread(queue_client.estimate_runtime, self.get_request_auth_token(),
+            preflight.models[0], preflight.atoms, preflight.total_run_steps)
+
+    @property
+    def personal_analysis_instance(self):
+        """lazy initialization"""
+        if self._personal_analysis_instance is None:
+            self._personal_analysis_instance = get_trajectory_analysis_executor_instance.local(
+                owner_user_id=self.owner_user_id
+            )
+        return self._personal_analysis_instance
         
     
     def initialization(self):
@@ -91,99 +198,584 @@ class DeepmdDpaLammpsMcp:
         return instance
         
 
-    # @mcp_instance.resource("config://version")
-    def get_version(self): 
-        # return
-        version_info = {
-            'file_name': Path(__file__).name,
-            'file_hash': hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:8]
-        }
-        return version_info
-
     def get_dpa_model_path(self):
         pass
 
 
 
-    # @mcp.custom_route("/health", methods=["GET"])
-    async def health_check(self, request: Request) -> PlainTextResponse:
-        return PlainTextResponse("OK")
-
-    async def write_file_to_job_dir(self, file_content: str, file_name: str, job_dir: Annotated[str, Field(description="The job directory to  put the file")] = '/workspace/'):
+    @staticmethod
+    def get_request_auth_token() -> Optional[str]:
+        """auth token of the current mcp http request, None for stdio or anonymous calls"""
+        try:
+            request = get_http_request()
+        except RuntimeError:
+            return None
+        return AuthMiddleware.get_optional_auth_token(request)
+
+    async def admit(self, ctx: Optional[Context], *, lease_seconds: float) -> AdmissionTicket:
+        """wait for a GPU call slot of the user and organization, the queue position is reported to the client"""
+        async def on_queued(decision: AdmissionDecision):
+            logger.info(f"gpu call queued: owner_user_id={self.owner_user_id} {decision=}")
+            if ctx is not None:
+                await ctx.info(f"queued for a GPU slot: position {decision.position}, waiting for: {decision.reason}")
+        try:
+            return await admission_controller.acquire(self.owner_user_id, self.organization,
+                lease_seconds=lease_seconds, on_queued=on_queued)
+        except AdmissionTimeout as e:
+            raise ToolError(f"{e}") from e
+
+    @contextlib.asynccontextmanager
+    async def admitted(self, ctx: Optional[Context], *, lease_seconds: float):
+        ticket = await self.admit(ctx, lease_seconds=lease_seconds)
+        try:
+            yield ticket
+        finally:
+            with anyio.CancelScope(shield=True):
+                await admission_controller.release(ticket)
+
+    def start_watcher(self, function_call: modal.FunctionCall, auth_token: Optional[str], queuejob_id: Optional[str], ticket: Optional[AdmissionTicket],
+            *, analysis: bool = False):
+        watch_task = asyncio.create_task(self.watch_long_run(function_call, auth_token, queuejob_id, ticket, analysis=analysis))
+        self._background_tasks.add(watch_task)
+        watch_task.add_done_callback(self._background_tasks.discard)
+
+    async def write_files_to_job_dir(self,
+        files: Annotated[list[JobFile], Field(description="The files to write, paths relative to job_dir (subdirectories are created)", min_length=1, max_length=MAX_BULK_UPLOAD_FILES)],
+        job_dir: Annotated[str, Field(description="The job directory to put the files")] = '/workspace/',
+        ctx: Context = None,
+        ) -> str:
         """
-        This function will write the file to the job directory.
-        Use this if you want to upload something your workspace.
+        Write several files (input deck, data file, settings...) to the job directory in one call and one volume commit.
+        Large or binary files can be sent as base64 or gzip+base64. Files whose content is already in the volume are skipped.
+        Returns the manifest: path, size, sha256 and status (created / updated / unchanged) of every file.
         """
+        try:
+            contents = [(file.path, decode_upload_content(file.content, file.encoding)) for file in files]
+            backend = self.preflight_backends[WORKSPACE_MOUNT_PATH]
+            manifest = await bulk_upload_job_files(self.personal_volume, backend, job_dir, contents)
+        except ValueError as e:
+            return f"write failed: {e}"
+        await ctx.info(f"wrote {manifest['written']} files to {job_dir}, {manifest['unchanged']} unchanged")
+        return json.dumps(manifest)
+
+    async def check_lammps_input(self,
+        commands: Annotated[str, Field(description="The commands to run lammps, e.g. `lmp -in in.lammps -var T 300`")] = 'lmp -in in.lammps',
+        job_dir: Annotated[str, Field(description="The job directory to run lammps")] = '/workspace/',
+        lammps_input_script: Annotated[Optional[str], Field(description="Check this inline input script instead of the -in file of the commands")] = None,
+        ctx: Context = None,
+        ) -> str:
+        """
+        Static preflight of a lammps run, takes milliseconds and no GPU container.
+        Follows include and variables, checks that read_data / read_restart / include / pair_style deepmd model files exist
+        in the job dir or /public/, and that `pair_coeff * *` maps as many elements as the data file has atom types.
+        Returns json with `ok`, structured `errors` / `warnings` (code, message, file, line) and the parsed system summary.
+        `runtime_estimate` has the expected runtime, suggested timeout and GPU type from earlier runs of the same model and size.
+        """
+        result = await self.run_preflight(commands, job_dir, ctx, input_script_text=lammps_input_script)
+        return json.dumps({**result.to_dict(), "runtime_estimate": await self.estimate_runtime(result)})
 
-        with self.personal_lammps_instance.personal_volume.batch_upload() as batch:
-            batch.put_file(file_content, os.path.join(job_dir, file_name))
-        # with open(os.path.join(job_dir, file_name), "w") as f:
-
-    
     async def submit_long_run_lammps_simulation(self,
         commands: Annotated[str, Field(description="The commands to run lammps")] = 'lmp -h', 
         job_dir: Annotated[str, Field(description="The job directory to run lammps")] = '/workspace/', 
+        skip_preflight: Annotated[bool, Field(description="Skip the static check of the input script and referenced files")] = False,
         ctx: Context = None,
         ) -> str:
         """
         long run lammps simulation, timeout is 12hours (in T4 GPU environment)
         Production use. note that Price for GPU is approximately $0.59 USD per hour.
+        The input is checked by check_lammps_input first, failing decks are not submitted.
+        Runs whose projected runtime (from the thermo progress) cannot fit the timeout are stopped early.
         """
-        function_call = self.personal_lammps_instance.lammps_simulation_job.spawn(commands=commands, job_dir=job_dir, timeout=60*60*12)
+        preflight = estimate = None
+        if not skip_preflight:
+            preflight = await self.run_preflight(commands, job_dir, ctx)
+            if not preflight.ok:
+                return f"not submitted, lammps preflight failed: {json.dumps(preflight.to_dict())}"
+            estimate = await self.estimate_runtime(preflight)
+            if estimate and estimate["needs_managed_run"]:
+                await ctx.warning(f"the run is expected to take longer than 12 hours, use submit_managed_lammps_simulation: {estimate['estimates']}")
+
+        timeout = 60*60*12
+        instance = await self.get_personal_lammps_instance()
+        # the slot is held until the watcher sees the run finish
+        ticket = await self.admit(ctx, lease_seconds=timeout + ADMISSION_LEASE_MARGIN_SECONDS)
+        try:
+            function_call = await instance.lammps_simulation_job.spawn.aio(commands=commands, job_dir=job_dir, timeout=timeout,
+                total_steps=preflight.total_run_steps if preflight else None)
+        except BaseException:
+            await admission_controller.release(ticket)
+            raise
 
         function_call_id = function_call.object_id
+        register_spawned_function_call(self.owner_user_id, function_call_id)
 
         logger.info(f"submitted long run lammps simulation: {function_call_id=}. {commands=}, {job_dir=} ")
-        ctx.info(f"submitted long run lammps simulation: {function_call_id=}. {commands=}, {job_dir=} ")
+        await ctx.info(f"submitted long run lammps simulation: {function_call_id=}. {commands=}, {job_dir=} ")
+
+        auth_token = self.get_request_auth_token()
+        queuejob = await asyncio.to_thread(queue_client.create_job,
+            auth_token,
+            modal_function_call_id=function_call_id,
+            modal_function_name="LammpsSimulationExecutor.lammps_simulation_job",
+            modal_volume_name=f"jupyterlab-personal-{self.owner_user_id}",
+            command=commands,
+            environment_vars={"job_dir": job_dir, **(preflight.run_environment_vars() if preflight else {})},
+        )
+        queuejob_id = queuejob["queuejob_id"] if queuejob else None
+        self.start_watcher(function_call, auth_token, queuejob_id, ticket)
+
+        suggestion = f" expected runtime: {estimate['suggested']}" if estimate and estimate["suggested"] else ""
+        return f"success submitted function call id: {function_call_id} {queuejob_id=} {commands=}, {job_dir=}{suggestion}"
+
+    async def submit_managed_lammps_simulation(self,
+        commands: Annotated[str, Field(description="The commands to run lammps, must use an input script: `lmp -in in.lammps`")] = 'lmp -in in.lammps',
+        job_dir: Annotated[str, Field(description="The job directory to run lammps")] = '/workspace/',
+        segment_minutes: Annotated[int, Field(description="GPU time per segment in minutes, at most 50", ge=5, le=50)] = 50,
+        restart_every: Annotated[int, Field(description="Steps between periodic restart files, the fallback if a segment is preempted", ge=100)] = 10000,
+        skip_preflight: Annotated[bool, Field(description="Skip the static check of the input script and referenced files")] = False,
+        ctx: Context = None,
+        ) -> str:
+        """
+        Managed long run for simulations of any length (multi-day): runs as a chain of bounded GPU segments.
+        Each segment stops gracefully (`timer timeout`) and writes a restart file, the next segment continues
+        from it with `read_restart` and `run N upto`, no work is lost on timeout or preemption.
+        Segment logs are stitched into log.managed.lammps in the job dir, dumps are appended.
+        Not supported in the input script: jump/next loops, clear, reset_timestep or minimize after the first run.
+        """
+        if not skip_preflight:
+            preflight = await self.run_preflight(commands, job_dir, ctx)
+            if not preflight.ok:
+                return f"not submitted, lammps preflight failed: {json.dumps(preflight.to_dict())}"
+
+        auth_token = self.get_request_auth_token()
+        managed_lammps_run = modal.Function.from_name(app_name='deepmd-run-service', name='managed_lammps_run')
+        # rate limited only, a multi-day chain of segments would hold an in-flight slot for days
+        async with self.admitted(ctx, lease_seconds=ADMISSION_LEASE_MARGIN_SECONDS):
+            function_call = await managed_lammps_run.spawn.aio(self.owner_user_id, commands, job_dir,
+                auth_token=auth_token, segment_seconds=segment_minutes * 60, restart_every=restart_every)
+        function_call_id = function_call.object_id
+
+        logger.info(f"submitted managed lammps simulation: {function_call_id=} {commands=} {job_dir=} {segment_minutes=}")
+        await ctx.info(f"submitted managed lammps simulation: {function_call_id=} {commands=} {job_dir=}")
+
+        queuejob = await asyncio.to_thread(queue_client.create_job,
+            auth_token,
+            modal_function_call_id=function_call_id,
+            modal_function_name="managed_lammps_run",
+            queuejob_name=f"managed {commands}",
+            modal_volume_name=f"jupyterlab-personal-{self.owner_user_id}",
+            command=commands,
+            environment_vars={"job_dir": job_dir, "segment_minutes": segment_minutes, "restart_every": restart_every},
+        )
+        queuejob_id = queuejob["queuejob_id"] if queuejob else None
+        return f"success submitted managed run function call id: {function_call_id} {queuejob_id=}. Segments are recorded as attempts of this job, the stitched log is {os.path.join(job_dir, 'log.managed.lammps')}"
+
+    async def submit_lammps_ensemble(self,
+        commands: Annotated[str, Field(description="The commands to run lammps, must use an input script: `lmp -in in.lammps`")] = 'lmp -in in.lammps',
+        job_dir: Annotated[str, Field(description="The job directory, replicas run in job_dir/ensemble/replica-NNN/")] = '/workspace/',
+        n_replicas: Annotated[int, Field(description="Number of replicas, they differ in the velocity seed only", ge=1, le=64)] = 4,
+        seed_variable: Annotated[str, Field(description="The lammps variable the seed is passed in, the input script must use it, e.g. `velocity all create 300 ${SEED}`")] = 'SEED',
+        replicas_per_gpu: Annotated[int, Field(description="Replicas sharing one GPU, 0 packs as many as fit in the GPU memory", ge=0)] = 0,
+        equilibration_steps: Annotated[int, Field(description="Thermo rows before this step are left out of the averages", ge=0)] = 0,
+        timeout_minutes: Annotated[int, Field(description="Timeout of the whole ensemble in minutes, below the 60 minute limit of the GPU container", ge=1, le=55)] = 55,
+        wait: Annotated[bool, Field(description="Wait for the ensemble and return the aggregated statistics, otherwise return the job id")] = False,
+        skip_preflight: Annotated[bool, Field(description="Skip the static check of the input script and referenced files")] = False,
+        ctx: Context = None,
+        ) -> str:
+        """
+        Ensemble of N replicas of one simulation that differ only in the velocity seed, for uncertainty estimates.
+        Replicas are packed several per GPU where the memory allows, each replica writes its own log and dumps.
+        Returns (or records in the queue job) the aggregated thermo statistics: per observable the ensemble mean,
+        the standard deviation between replicas and the standard error, plus the mean/std curve over the steps.
+        """
+        if not skip_preflight:
+            preflight = await self.run_preflight(f"{commands} -var {seed_variable} 1 -var REPLICA 0", job_dir, ctx)
+            if not preflight.ok:
+                return f"not submitted, lammps preflight failed: {json.dumps(preflight.to_dict())}"
+
+        instance = await self.get_personal_lammps_instance()
+        ticket = await self.admit(ctx, lease_seconds=timeout_minutes * 60 + ADMISSION_LEASE_MARGIN_SECONDS)
+        try:
+            function_call = await instance.lammps_ensemble_job.spawn.aio(commands, job_dir, n_replicas,
+                seed_variable=seed_variable, replicas_per_gpu=replicas_per_gpu, equilibration_steps=equilibration_steps,
+                timeout=timeout_minutes * 60)
+        except BaseException:
+            await admission_controller.release(ticket)
+            raise
+        function_call_id = function_call.object_id
+        register_spawned_function_call(self.owner_user_id, function_call_id)
+
+        logger.info(f"submitted lammps ensemble: {function_call_id=} {commands=} {job_dir=} {n_replicas=}")
+        await ctx.info(f"submitted lammps ensemble of {n_replicas} replicas: {function_call_id=}")
+
+        auth_token = self.get_request_auth_token()
+        queuejob = await asyncio.to_thread(queue_client.create_job,
+            auth_token,
+            modal_function_call_id=function_call_id,
+            modal_function_name="LammpsSimulationExecutor.lammps_ensemble_job",
+            queuejob_name=f"ensemble x{n_replicas} {commands}",
+            queuejob_type="LAMMPS_ENSEMBLE",
+            modal_volume_name=f"jupyterlab-personal-{self.owner_user_id}",
+            command=commands,
+            environment_vars={"job_dir": job_dir, "n_replicas": n_replicas, "seed_variable": seed_variable,
+                "replicas_per_gpu": replicas_per_gpu, "equilibration_steps": equilibration_steps},
+        )
+        queuejob_id = queuejob["queuejob_id"] if queuejob else None
+
+        if wait:
+            try:
+                result = await function_call.get.aio()
+            finally:
+                with anyio.CancelScope(shield=True):
+                    await admission_controller.release(ticket)
+            if queuejob_id is not None:
+                await self.record_long_run_result(auth_token, queuejob_id, result)
+            return json.dumps({key: result[key] for key in ("return_code", "return_codes", "seeds", "timed_out", "replica_dirs", "ensemble")})
+
+        self.start_watcher(function_call, auth_token, queuejob_id, ticket)
+        return f"success submitted ensemble function call id: {function_call_id} {queuejob_id=}. The aggregated statistics are recorded in the queue job performance"
+
+    async def watch_long_run(self, function_call: modal.FunctionCall, auth_token: Optional[str], queuejob_id: Optional[str],
+            ticket: Optional[AdmissionTicket] = None, *, analysis: bool = False):
+        """wait for a spawned long run, free its admission slot and persist its final status and telemetry summary in the queue"""
+        status = None
+        try:
+            result = await function_call.get.aio()
+        except modal.exception.FunctionTimeoutError as e:
+            status, message, telemetry = "TIMEOUT", f"{e}", {}
+        except asyncio.CancelledError:
+            # shutting down, the slot of the still running call expires with its lease
+            raise
+        except Exception as e:
+            # also raised for cancelled calls, the queue keeps the CANCELLED status in that case
+            status, message, telemetry = "FAILED", f"{type(e).__name__}: {e}", {}
+
+        if ticket is not None:
+            await admission_controller.release(ticket)
+        if queuejob_id is None:
+            return
+        if status is None and analysis:
+            # a trajectory analysis returns its summary, no lammps return code
+            status, message = "COMPLETED", f"{result.get('n_frames')} frames analyzed"
+            telemetry = {"analysis": {key: result.get(key) for key in ("n_frames", "n_atoms", "timing_seconds")}}
+        elif status is None:
+            await self.record_long_run_result(auth_token, queuejob_id, result)
+            return
+
+        logger.info(f"long run finished: {queuejob_id=} {status=} {message=}")
+        await asyncio.to_thread(queue_client.record_telemetry, auth_token, queuejob_id, telemetry, status, message)
+
+    async def record_long_run_result(self, auth_token: Optional[str], queuejob_id: str, result: dict):
+        status, message = run_result_status(result)
+        telemetry = result.get("telemetry") or {}
+        if "ensemble" in result:
+            telemetry = {**telemetry, "ensemble": result["ensemble"], "return_codes": result.get("return_codes")}
+        logger.info(f"long run finished: {queuejob_id=} {status=} {message=}")
+        await asyncio.to_thread(queue_client.record_telemetry, auth_token, queuejob_id, telemetry, status, message)
+
+    async def cancel_lammps_simulation(self,
+        job_id: Annotated[str, Field(description="The queuejob id or the function call id returned by submit_long_run_lammps_simulation")],
+        ctx: Context = None,
+        ) -> str:
+        """
+        Cancel a submitted long run lammps simulation.
+        lammps gets SIGTERM first and is killed if it has not exited after the cleanup grace period.
+        """
+        try:
+            result = await asyncio.to_thread(cancel_lammps_job, job_id, self.get_request_auth_token(), owner_user_id=self.owner_user_id)
+        except (LookupError, PermissionError, RuntimeError) as e:
+            return f"cancel failed: {e}"
 
-        return f"success submitted function call id: {function_call_id} {commands=}, {job_dir=}"
+        logger.info(f"cancel lammps simulation: {job_id=} {result=}")
+        self._job_cache.clear()
+        await ctx.info(f"cancel lammps simulation: {job_id=} {result.get('message')=}")
+        return f"cancel lammps simulation {job_id}: {result.get('message')} (cancelled={result.get('cancelled')})"
 
 
+    async def lookup_job(self, job_id: str, job_dir: Optional[str] = None) -> dict:
+        """
+        queue record of a job by queuejob_id or function call id (cached).
+        Without queue api only function calls spawned by this process are known, with the job_dir given by the caller.
+        """
+        auth_token = self.get_request_auth_token()
+
+        async def load():
+            try:
+                job = await asyncio.to_thread(queue_client.get_job, auth_token, job_id)
+            except DeepmdQueueApiError as e:
+                if e.status_code == 401:
+                    raise LookupError(f"auth token rejected by the queue api, job not found: {job_id}") from e
+                raise LookupError(f"job not found: {job_id}") from e
+            if job is None:
+                if job_id not in spawned_function_call_ids[self.owner_user_id]:
+                    raise LookupError(f"job not found (queue api not available): {job_id}")
+                job = {"modal_function_call_id": job_id, "queuejob_type": "LAMMPS_SIMULATION"}
+            return job
+
+        job = await self._job_cache.get_or_load(("job", auth_token, job_id), load,
+            ttl=lambda job: FINISHED_JOB_CACHE_SECONDS if job.get("current_status") in TERMINAL_STATUSES else None)
+        if job_dir:
+            job = {**job, "environment_vars": {**(job.get("environment_vars") or {}), "job_dir": job_dir}}
+        return job
+
+    async def cached_log_read(self, kind: str, job: dict, path: str, reader, **kwargs) -> dict:
+        """log reads of running jobs are cached briefly, of finished jobs for longer"""
+        ttl = FINISHED_JOB_CACHE_SECONDS if job.get("current_status") in TERMINAL_STATUSES else None
+        return await self._job_cache.get_or_load((kind, path, tuple(sorted(kwargs.items()))),
+            lambda: reader(self.preflight_backends[WORKSPACE_MOUNT_PATH], path, **kwargs), ttl=lambda _: ttl)
+
+    async def get_lammps_job_status(self,
+        job_id: Annotated[str, Field(description="The queuejob id or the function call id returned by the submit tools")],
+        job_dir: Annotated[Optional[str], Field(description="The job directory, only needed if the job has no queue record")] = None,
+        ctx: Context = None,
+        ) -> str:
+        """
+        Status of a submitted job: queue status, state of the modal call, the last thermo step against
+        the total steps of the input and the time since the log was last written.
+        Results are cached for a few seconds, poll at most every 30 seconds.
+        """
+        try:
+            job = await self.lookup_job(job_id, job_dir)
+        except LookupError as e:
+            return f"status failed: {e}"
+
+        status = {key: job.get(key) for key in ("queuejob_id", "queuejob_name", "queuejob_type", "current_status",
+            "status_message", "modal_function_call_id", "created_at", "updated_at", "performance")}
+        function_call_id = job.get("modal_function_call_id")
+        if function_call_id and job.get("current_status") not in TERMINAL_STATUSES:
+            # the queue status is updated when the watcher sees the call finish, ask modal for running jobs
+            status["call"] = await self._job_cache.get_or_load(("call", function_call_id),
+                lambda: modal_call_state(function_call_id), ttl=lambda state: None if state["state"] == CALL_RUNNING else FINISHED_JOB_CACHE_SECONDS)
+
+        path = job_log_path(job)
+        total_steps = (job.get("environment_vars") or {}).get("total_steps")
+        if path is not None:
+            try:
+                tail = await self.cached_log_read("tail", job, path, tail_log_lines, lines=20)
+            except (FileNotFoundError, ValueError):
+                status["log"] = {"path": path, "exists": False}
+            else:
+                last_step = last_thermo_step(tail["lines"])
+                status["log"] = {
+                    "path": path,
+                    "size": tail["size"],
+                    "seconds_since_update": round(max(0.0, time.time() - tail["mtime"]), 1),
+                    "last_step": last_step,
+                    "total_steps": total_steps,
+                    # the Step column restarts with reset_timestep, the fraction is approximate for multi-run decks
+                    "fraction": round(min(1.0, last_step / total_steps), 4) if last_step is not None and total_steps else None,
+                    "last_line": tail["lines"][-1] if tail["lines"] else None,
+                }
+        return json.dumps(status)
+
+    async def tail_lammps_job_log(self,
+        job_id: Annotated[str, Field(description="The queuejob id or the function call id returned by the submit tools")],
+        lines: Annotated[int, Field(description="Number of lines from the end of the log", ge=1, le=200)] = 50,
+        replica: Annotated[int, Field(description="Replica index, for ensembles only", ge=0)] = 0,
+        job_dir: Annotated[Optional[str], Field(description="The job directory, only needed if the job has no queue record")] = None,
+        ctx: Context = None,
+        ) -> str:
+        """
+        The last lines of the lammps log of a submitted job (managed runs: the stitched log).
+        The log is read from the volume and lags the running job by a few seconds.
+        """
+        try:
+            job = await self.lookup_job(job_id, job_dir)
+        except LookupError as e:
+            return f"tail failed: {e}"
+        path = job_log_path(job, replica=replica)
+        if path is None:
+            return f"tail failed: job {job_id} has no lammps log (job_dir unknown or not a lammps job)"
+        try:
+            tail = await self.cached_log_read("tail", job, path, tail_log_lines, lines=lines)
+        except (FileNotFoundError, ValueError) as e:
+            return f"tail failed: {e}"
+        return f"{path} (last {len(tail['lines'])} lines, {tail['size']} bytes):\n" + "\n".join(tail["lines"])
+
+    async def get_lammps_job_thermo(self,
+        job_id: Annotated[str, Field(description="The queuejob id or the function call id returned by the submit tools")],
+        max_rows: Annotated[int, Field(description="Rows of the downsampled thermo table per run", ge=2, le=200)] = 20,
+        replica: Annotated[int, Field(description="Replica index, for ensembles only", ge=0)] = 0,
+        job_dir: Annotated[Optional[str], Field(description="The job directory, only needed if the job has no queue record")] = None,
+        ctx: Context = None,
+        ) -> str:
+        """
+        Thermo summary of the lammps log of a submitted job, per run: mean / std / min / max / first / last
+        of every thermo column, a downsampled thermo table, the performance line, and the distinct warnings.
+        """
+        try:
+            job = await self.lookup_job(job_id, job_dir)
+        except LookupError as e:
+            return f"thermo failed: {e}"
+        path = job_log_path(job, replica=replica)
+        if path is None:
+            return f"thermo failed: job {job_id} has no lammps log (job_dir unknown or not a lammps job)"
+        try:
+            summary = await self.cached_log_read("thermo", job, path, summarize_thermo_log, max_rows=max_rows)
+        except (FileNotFoundError, ValueError) as e:
+            return f"thermo failed: {e}"
+        return json.dumps({"queuejob_id": job.get("queuejob_id"), "current_status": job.get("current_status"), **summary})
+
+    async def list_lammps_jobs(self,
+        status: Annotated[str, Field(description="Only jobs with this status, e.g. RUNNING, COMPLETED, FAILED. All if empty")] = '',
+        queuejob_type: Annotated[str, Field(description="Only jobs of this type: LAMMPS_SIMULATION, LAMMPS_ENSEMBLE, TRAJECTORY_ANALYSIS. All if empty")] = '',
+        limit: Annotated[int, Field(description="Number of jobs", ge=1, le=100)] = 10,
+        ctx: Context = None,
+        ) -> str:
+        """Recent jobs of the user, newest first, from the queue records."""
+        auth_token = self.get_request_auth_token()
+        result = await self._job_cache.get_or_load(("list", auth_token, status, queuejob_type, limit),
+            lambda: asyncio.to_thread(queue_client.list_jobs, auth_token, status=status, queuejob_type=queuejob_type, limit=limit),
+            ttl=lambda result: JOB_LIST_CACHE_SECONDS if result is not None else 0)
+        if result is None:
+            return "list failed: queue api not available"
+        jobs = [{
+            "queuejob_id": job["queuejob_id"],
+            "queuejob_name": job["queuejob_name"],
+            "queuejob_type": job["queuejob_type"],
+            "current_status": job["current_status"],
+            "status_message": job.get("status_message"),
+            "job_dir": (job.get("environment_vars") or {}).get("job_dir"),
+            "created_at": job["created_at"],
+            "performance": job.get("performance"),
+        } for job in result["jobs"]]
+        return json.dumps(jobs)
+
+    async def analyze_lammps_trajectory(self,
+        dump_file: Annotated[str, Field(description="The lammps dump file (dump custom with id type x y z or xu yu zu) relative to job_dir")],
+        job_dir: Annotated[str, Field(description="The job directory of the simulation")] = '/workspace/',
+        analyses: Annotated[list[str], Field(description="Analyses to run: rdf, msd, density")] = ["rdf", "msd", "density"],
+        rdf_types_a: Annotated[Optional[list[int]], Field(description="Atom types of the rdf center atoms, all types if empty")] = None,
+        rdf_types_b: Annotated[Optional[list[int]], Field(description="Atom types of the rdf neighbor atoms, all types if empty")] = None,
+        rdf_r_max: Annotated[Optional[float], Field(description="rdf cutoff in Angstrom, default half of the shortest box edge")] = None,
+        timestep_ps: Annotated[Optional[float], Field(description="The lammps `timestep` in ps (0.001 for metal units with timestep 0.001), not the time between dump frames; gives the diffusion coefficient in Angstrom^2/ps")] = None,
+        stride: Annotated[int, Field(description="Analyze every n-th frame")] = 1,
+        wait: Annotated[bool, Field(description="Wait for the analysis and return the summary, otherwise return the job id")] = True,
+        ctx: Context = None,
+        ) -> str:
+        """
+        Post-run analysis (rdf, msd, density profile) of a lammps dump file in a CPU container.
+        The trajectory is never loaded into the conversation, only a compact json summary is returned.
+        """
+        analysis_kwargs = {
+            "rdf_types_a": rdf_types_a,
+            "rdf_types_b": rdf_types_b,
+            "rdf_r_max": rdf_r_max,
+            "timestep_ps": timestep_ps,
+            "stride": stride,
+        }
+        function_call = await self.personal_analysis_instance.trajectory_analysis_job.spawn.aio(
+            dump_file=dump_file, job_dir=job_dir, analyses=analyses, **analysis_kwargs)
+        function_call_id = function_call.object_id
+        register_spawned_function_call(self.owner_user_id, function_call_id)
+
+        logger.info(f"submitted trajectory analysis: {function_call_id=} {dump_file=} {job_dir=} {analyses=}")
+        await ctx.info(f"submitted trajectory analysis: {function_call_id=} {dump_file=} {analyses=}")
+
+        auth_token = self.get_request_auth_token()
+        queuejob = await asyncio.to_thread(queue_client.create_job,
+            auth_token,
+            modal_function_call_id=function_call_id,
+            modal_function_name="TrajectoryAnalysisExecutor.trajectory_analysis_job",
+            queuejob_name=f"analysis {dump_file}",
+            queuejob_type="TRAJECTORY_ANALYSIS",
+            modal_volume_name=f"jupyterlab-personal-{self.owner_user_id}",
+            command=f"analyze {dump_file} {analyses}",
+            environment_vars={"job_dir": job_dir, **analysis_kwargs},
+        )
+        queuejob_id = queuejob["queuejob_id"] if queuejob else None
+        self.start_watcher(function_call, auth_token, queuejob_id, None, analysis=True)
+
+        if not wait:
+            return f"success submitted trajectory analysis function call id: {function_call_id} {queuejob_id=}"
+
+        summary = await function_call.get.aio()
+        return json.dumps(summary)
+
     # @mcp_server.tool()
     async def short_run_lammps_simulation(self,
         commands: Annotated[str, Field(description="The commands to run lammps")] = 'lmp -h', 
         job_dir: Annotated[str, Field(description="The job directory to run lammps")] = '/workspace/',
         lammps_input_script: Annotated[Optional[str], Field(description="The input script to run lammps. Usually a multi-line script. Used for casesif it is not convenient to provide seperate in.lammps file. ")] = None,
+        skip_preflight: Annotated[bool, Field(description="Skip the static check of the input script and referenced files")] = False,
+        max_output_tokens: Annotated[int, Field(description="Token budget of the returned output digest", ge=200, le=20000)] = DEFAULT_OUTPUT_TOKENS,
         ctx: Context = None,
         ) -> str:
         """
         short run lammps simulation, timeout is 30 seconds. (in T4 GPU environment)
-        Only for testing if the lammps simulation environment is working / if the lammps input script is not valid/ if the files are uploaded correctly.
+        Only for testing if the lammps simulation environment is working.
+        Missing files and invalid input are caught by check_lammps_input without starting a GPU container, failing decks are not run.
+        Returns a digest of the output (head, tail, errors / warnings, downsampled thermo table),
+        the full log can be read with get_lammps_run_log.
         """
+        if not skip_preflight:
+            preflight = await self.run_preflight(commands, job_dir, ctx)
+            if not preflight.ok:
+                return f"not run, lammps preflight failed: {json.dumps(preflight.to_dict())}"
 
+        instance = await self.get_personal_lammps_instance()
         buffer = []
         current_length = 0
 
-        total_output = []
+        condenser = LammpsOutputCondenser()
 
         # if lammps_input_script is not None:
         #     with open(os.path.join(job_dir, "in.lammps"), "w") as f:
         #         f.write(lammps_input_script)
-        
 
-        # async for chunk in instance.lammps_simulation_stream.remote.aio(
-        for chunk in self.personal_lammps_instance.lammps_simulation_stream.remote_gen(
-            commands=commands, 
-            job_dir=job_dir, 
-            timeout=30
-        ):
-
-            line = chunk.decode()
-            buffer.append(line)
-            current_length += len(line)
-            total_output.append(line)
-            
-            if len(buffer) >= 20 or current_length >= 2000:
-                await ctx.info("".join(buffer))
-                buffer.clear()
-                current_length = 0
-        
+        semaphore = self.session_semaphore(ctx)
+        if semaphore.locked():
+            await ctx.info(f"waiting for an earlier short run of this session to finish (at most {SHORT_RUNS_PER_SESSION} at a time)...")
+        async with semaphore, self.admitted(ctx, lease_seconds=SHORT_RUN_TIMEOUT_SECONDS + ADMISSION_LEASE_MARGIN_SECONDS):
+            # async consumption, the event loop keeps serving the other sessions while lammps runs
+            remote_gen = instance.lammps_simulation_stream.remote_gen.aio(
+                commands=commands,
+                job_dir=job_dir,
+                timeout=SHORT_RUN_TIMEOUT_SECONDS,
+            )
+            try:
+                async for chunk in remote_gen:
+                    line = chunk.decode()
+                    buffer.append(line)
+                    current_length += len(line)
+                    condenser.feed(line)
+
+                    if len(buffer) >= 20 or current_length >= 2000:
+                        await ctx.info("".join(buffer))
+                        buffer.clear()
+                        current_length = 0
+            finally:
+                # a cancelled tool call closes the remote stream, which terminates lmp in the executor
+                with anyio.CancelScope(shield=True):
+                    await remote_gen.aclose()
+
         if buffer:
             await ctx.info("".join(buffer))
 
-        total_output_str = f"event: [DEEPMD] Simulation completed. total output: \n" + "".join(total_output)
-        
-        return total_output_str
+        digest = condenser.render(max_output_tokens * CHARS_PER_TOKEN, log_reference=find_lammps_log_file(commands, job_dir))
+        return f"event: [DEEPMD] Simulation completed. output digest: \n" + digest
+
+    async def get_lammps_run_log(self,
+        log_file: Annotated[str, Field(description="The log file, relative to job_dir or an absolute /workspace/ path")] = 'log.lammps',
+        job_dir: Annotated[str, Field(description="The job directory of the simulation")] = '/workspace/',
+        start_line: Annotated[int, Field(description="Skip the first n lines", ge=0)] = 0,
+        max_lines: Annotated[int, Field(description="Number of lines to return", ge=1, le=500)] = 200,
+        pattern: Annotated[Optional[str], Field(description="Only return lines matching this regex, e.g. ERROR|WARNING")] = None,
+        ctx: Context = None,
+        ) -> str:
+        """
+        Read a page of a lammps log (or any text output) of a run, with line numbers.
+        Tool results of runs only carry a digest, use this for the lines in between.
+        """
+        path = os.path.join(job_dir, log_file)
+        try:
+            page = await read_log_lines(self.preflight_backends[WORKSPACE_MOUNT_PATH], path,
+                start_line=start_line, max_lines=max_lines, pattern=pattern)
+        except (FileNotFoundError, ValueError, re.error) as e:
+            return f"cannot read log: {e}"
+        header = f"{path}: lines after {start_line} of {page['total_lines']}" + (f" matching {pattern!r}" if pattern else "")
+        footer = f"\n[more lines, continue with start_line={page['last_line']}]" if page["truncated"] else ""
+        return header + "\n" + "\n".join(page["lines"]) + footer
 
     async def dpa_freeze_model(self, ctx: Context = None) -> str:
         """
@@ -196,7 +788,128 @@ class DeepmdDpaLammpsMcp:
     # async def 
 
 
-mcp_provider = DeepmdDpaLammpsMcp(mcp_instance)
+class DeepmdMcpProviderPool:
+    """
+    Per-user DeepmdDpaLammpsMcp providers behind the tools of one FastMCP server.
+    Each tool call is routed to the provider of the user of its auth token, providers are created
+    on first use (their modal handles are set up once per user), kept in an LRU and closed when idle
+    for PROVIDER_IDLE_SECONDS or beyond MAX_MCP_PROVIDERS. Providers with running calls are never closed.
+    """
+
+    tool_names: ClassVar[tuple[str, ...]] = (
+        "write_files_to_job_dir",
+        "check_lammps_input",
+        "submit_long_run_lammps_simulation",
+        "submit_managed_lammps_simulation",
+        "submit_lammps_ensemble",
+        "short_run_lammps_simulation",
+        "get_lammps_run_log",
+        "get_lammps_job_status",
+        "tail_lammps_job_log",
+        "get_lammps_job_thermo",
+        "list_lammps_jobs",
+        "cancel_lammps_simulation",
+        "analyze_lammps_trajectory",
+    )
+    # no side effects and the same answer for the same arguments while the files stay: agents cache their results
+    read_only_tool_names: ClassVar[frozenset[str]] = frozenset({"check_lammps_input", "get_lammps_run_log"})
+
+    def __init__(self, *, max_providers: int = MAX_MCP_PROVIDERS, idle_seconds: float = PROVIDER_IDLE_SECONDS):
+        self.max_providers = max_providers
+        self.idle_seconds = idle_seconds
+        self._providers: collections.OrderedDict[str, DeepmdDpaLammpsMcp] = collections.OrderedDict()
+        self._background_tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._providers)
+
+    def get(self, owner_user_id: str) -> DeepmdDpaLammpsMcp:
+        provider = self._providers.get(owner_user_id)
+        if provider is None:
+            provider = DeepmdDpaLammpsMcp(owner_user_id=owner_user_id, background_tasks=self._background_tasks)
+            self._providers[owner_user_id] = provider
+            logger.info(f"created mcp provider: {owner_user_id=} providers={len(self._providers)}")
+        self._providers.move_to_end(owner_user_id)
+        provider.last_used_at = time.monotonic()
+        self.evict()
+        return provider
+
+    def evict(self):
+        """close idle providers and the least recently used ones beyond max_providers"""
+        now = time.monotonic()
+        for owner_user_id, provider in list(self._providers.items()):
+            over_capacity = len(self._providers) > self.max_providers
+            if not over_capacity and now - provider.last_used_at < self.idle_seconds:
+                break  # the rest was used more recently
+            if provider.in_flight:
+                continue
+            del self._providers[owner_user_id]
+            provider.close()
+            logger.info(f"closed mcp provider: {owner_user_id=} {over_capacity=} providers={len(self._providers)}")
+
+    def close_all(self):
+        for provider in self._providers.values():
+            provider.close()
+        self._providers.clear()
+
+    @staticmethod
+    def get_request_token_payload() -> dict:
+        """claims of the auth token of the current mcp http request, empty for stdio or anonymous calls"""
+        try:
+            request = get_http_request()
+        except RuntimeError:
+            return {}
+        try:
+            return AuthMiddleware.get_optional_token_payload(request) or {}
+        except fastapi.HTTPException as e:
+            raise ToolError(e.detail) from e
+
+    @classmethod
+    def get_request_owner_user_id(cls) -> str:
+        """user_id of the auth token of the current mcp http request, the default user for stdio or anonymous calls"""
+        return cls.get_request_token_payload().get("user_id") or DEFAULT_OWNER_USER_ID
+
+    def route(self, name: str):
+        """a tool with the signature and doc of DeepmdDpaLammpsMcp.<name>, calling it on the provider of the request's user"""
+        method = getattr(DeepmdDpaLammpsMcp, name)
+        signature = inspect.signature(method)
+
+        async def tool(**kwargs):
+            payload = self.get_request_token_payload()
+            provider = self.get(payload.get("user_id") or DEFAULT_OWNER_USER_ID)
+            provider.organization = payload.get("organization")
+            with provider.in_use():
+                return await getattr(provider, name)(**kwargs)
+
+        tool.__name__ = name
+        tool.__doc__ = method.__doc__
+        tool.__signature__ = signature.replace(parameters=list(signature.parameters.values())[1:])
+        tool.__annotations__ = dict(method.__annotations__)
+        return tool
+
+    def init_mcp_instance(self, mcp_instance: FastMCP):
+        mcp_instance.custom_route("/health", methods=["GET"])(self.health_check)
+        mcp_instance.resource("config://version")(self.get_version)
+        for name in self.tool_names:
+            annotations = ToolAnnotations(readOnlyHint=True, idempotentHint=True) if name in self.read_only_tool_names else None
+            mcp_instance.tool(self.route(name), annotations=annotations)
+
+    async def health_check(self, request: Request) -> PlainTextResponse:
+        return PlainTextResponse("OK")
+
+    def get_version(self):
+        version_info = {
+            'file_name': Path(__file__).name,
+            'file_hash': hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:8],
+            'providers': len(self._providers),
+        }
+        return version_info
+
+
+mcp_providers = DeepmdMcpProviderPool()
+mcp_providers.init_mcp_instance(mcp_instance)
+# the same token check as the FastAPI service, anonymous calls run as the default user
+mcp_middleware = [Middleware(AuthMiddleware, allow_anonymous=True)]
 
 # mcp_server = 
 
@@ -211,7 +924,7 @@ mcp_provider = DeepmdDpaLammpsMcp(mcp_instance)
 #%%
 
 if __name__ == "__main__":
-    mcp_instance.run(transport="streamable-http", port=8002, host="0.0.0.0")
+    mcp_instance.run(transport="streamable-http", port=8002, host="0.0.0.0", middleware=mcp_middleware)
     # mcp_instance.http_app(transport="streamable-http", stateless_http=True)
 
 #%%
\ No newline at end of file
@@ -0,0 +1,235 @@
+#%%
+import collections
+import posixpath
+from typing import Optional
+
+import modal
+import numpy as np
+
+from deepmd_lammps_ensemble import LammpsThermoParser, WelfordAccumulator, ENSEMBLE_DIR_NAME, WELFORD_BATCH_ROWS
+from deepmd_lammps_managed_run import MANAGED_LOG_NAME
+from deepmd_output_condenser import find_lammps_log_file, MAX_LINE_CHARS
+from deepmd_run_telemetry import parse_lammps_performance_line
+from deepmd_volume_paths import workspace_path_to_volume_path
+
+#%%
+# Configuration
+JOB_STATUS_CACHE_SECONDS = 10        # agents polling in a loop hit the cache, not modal / the queue api / the volume
+JOB_LIST_CACHE_SECONDS = 30
+FINISHED_JOB_CACHE_SECONDS = 600     # terminal jobs do not change any more
+TAIL_MAX_LINES = 200
+TAIL_BYTES_PER_LINE = 128            # first guess of the tail window, widened if it holds too few lines
+THERMO_SUMMARY_ROWS = 20
+MAX_DISTINCT_WARNINGS = 100
+
+TERMINAL_STATUSES = {"COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "CLEANED"}
+
+# modal function call states
+CALL_RUNNING = "running"
+CALL_FINISHED = "finished"
+CALL_FAILED = "failed"
+CALL_TIMED_OUT = "timed_out"
+CALL_EXPIRED = "expired"             # finished, the result is no longer kept by modal
+
+#%%
+
+def job_log_path(job: dict, *, replica: int = 0) -> Optional[str]:
+    """workspace path of the lammps log of a queue job, None if the job writes no lammps log"""
+    environment_vars = job.get("environment_vars") or {}
+    job_dir = environment_vars.get("job_dir")
+    if not job_dir or job.get("queuejob_type") == "TRAJECTORY_ANALYSIS":
+        return None
+    if job.get("modal_function_name") == "managed_lammps_run":
+        return posixpath.join(job_dir, MANAGED_LOG_NAME)
+    if job.get("queuejob_type") == "LAMMPS_ENSEMBLE":
+        job_dir = posixpath.join(job_dir, ENSEMBLE_DIR_NAME, f"replica-{replica:03d}")
+    return find_lammps_log_file(job.get("command") or "lmp", job_dir)
+
+
+async def modal_call_state(function_call_id: str) -> dict:
+    """state of a spawned modal function call, without waiting for it"""
+    function_call = modal.FunctionCall.from_id(function_call_id)
+    try:
+        result = await function_call.get.aio(timeout=0)
+    except modal.exception.FunctionTimeoutError as e:
+        return {"state": CALL_TIMED_OUT, "message": f"{e}"}
+    except TimeoutError:
+        return {"state": CALL_RUNNING}
+    except modal.exception.OutputExpiredError:
+        return {"state": CALL_EXPIRED}
+    except Exception as e:
+        # also raised for cancelled calls
+        return {"state": CALL_FAILED, "message": f"{type(e).__name__}: {e}"}
+    return_code = result.get("return_code") if isinstance(result, dict) else None
+    return {"state": CALL_FINISHED, "return_code": return_code, "stopped_early": bool(isinstance(result, dict) and result.get("stopped_early"))}
+
+
+def run_result_status(result: dict) -> tuple[str, str]:
+    """final queue status and message of a lammps run from the result of its executor"""
+    return_code = result.get("return_code")
+    if result.get("stopped_early"):
+        progress = (result.get("telemetry") or {}).get("progress") or {}
+        return "TIMEOUT", f"stopped early, projected runtime {progress.get('projected_seconds')}s exceeds the timeout of {progress.get('budget_seconds')}s"
+    if return_code is None:
+        # lmp was killed by the in-container timeout (or a replica of an ensemble did not finish in time)
+        return "TIMEOUT", "lammps did not finish within the timeout"
+    return ("COMPLETED" if return_code == 0 else "FAILED"), f"{return_code=}"
+
+
+async def tail_log_lines(backend, path: str, lines: int = 50) -> dict:
+    """the last lines of a log in the volume, reading only a window at the end of the file"""
+    volume_path = workspace_path_to_volume_path(path)
+    entry = await backend.stat(volume_path)
+    if entry is None or entry.is_dir:
+        raise FileNotFoundError(f"log file not found: {path}")
+    lines = min(lines, TAIL_MAX_LINES)
+
+    window = (lines + 1) * TAIL_BYTES_PER_LINE
+    while True:
+        start = max(0, entry.size - window)
+        data = b"".join([chunk async for chunk in backend.iter_bytes(volume_path, start, entry.size - start)])
+        tail = data.split(b"\n")
+        if start > 0:
+            tail = tail[1:]  # partial first line
+        if tail and tail[-1] == b"":
+            tail = tail[:-1]
+        if len(tail) >= lines or start == 0:
+            break
+        window *= 4
+
+    return {
+        "path": path,
+        "size": entry.size,
+        "mtime": entry.mtime,
+        "lines": [line.decode(errors="replace").rstrip("\r")[:MAX_LINE_CHARS] for line in tail[-lines:]],
+    }
+
+
+def last_thermo_step(lines: list[str]) -> Optional[int]:
+    """Step of the last thermo row in the lines, None if there is none"""
+    for line in reversed(lines):
+        tokens = line.split()
+        if len(tokens) > 1 and tokens[0].isdigit():
+            try:
+                [float(token) for token in tokens[1:]]
+            except ValueError:
+                continue
+            return int(tokens[0])
+    return None
+
+
+class ThermoRunSummary:
+    """statistics of one thermo table (one `run`), bounded memory whatever the log size"""
+
+    def __init__(self, columns: list[str], max_rows: int = THERMO_SUMMARY_ROWS):
+        self.columns = columns
+        self.max_rows = max_rows
+        self.stats = WelfordAccumulator(len(columns))
+        self.minimum = np.full(len(columns), np.inf)
+        self.maximum = np.full(len(columns), -np.inf)
+        self.first: Optional[np.ndarray] = None
+        self.last: Optional[np.ndarray] = None
+        self.rows: list[np.ndarray] = []
+        self.row_stride = 1
+        self.row_count = 0
+        self.performance: Optional[dict] = None
+        self._pending: list[np.ndarray] = []
+
+    def add_row(self, row: np.ndarray):
+        if self.first is None:
+            self.first = row
+        self.last = row
+        if self.row_count % self.row_stride == 0:
+            self.rows.append(row)
+            if len(self.rows) >= 2 * self.max_rows:
+                self.rows = self.rows[::2]
+                self.row_stride *= 2
+        self.row_count += 1
+        self._pending.append(row)
+        if len(self._pending) >= WELFORD_BATCH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            batch = np.vstack(self._pending)
+            self.stats.update_batch(batch)
+            self.minimum = np.minimum(self.minimum, batch.min(axis=0))
+            self.maximum = np.maximum(self.maximum, batch.max(axis=0))
+            self._pending = []
+
+    def to_dict(self) -> dict:
+        self._flush()
+        rows = self.rows[::max(1, -(-len(self.rows) // self.max_rows))]
+        if self.last is not None and (not rows or rows[-1] is not self.last):
+            rows.append(self.last)
+        observables = {}
+        for i, column in enumerate(self.columns[1:], start=1):
+            observables[column] = {
+                "mean": _round(self.stats.mean[i]),
+                "std": _round(self.stats.std[i]),
+                "min": _round(self.minimum[i]),
+                "max": _round(self.maximum[i]),
+                "first": _round(self.first[i]),
+                "last": _round(self.last[i]),
+            }
+        return {
+            "columns": self.columns,
+            "rows": self.row_count,
+            "first_step": int(self.first[0]) if self.first is not None else None,
+            "last_step": int(self.last[0]) if self.last is not None else None,
+            "observables": observables,
+            "performance": self.performance,
+            "sampled_rows": [[_round(v) for v in row] for row in rows],
+        }
+
+
+def _round(value) -> Optional[float]:
+    value = float(value)
+    return None if not np.isfinite(value) else float(f"{value:.6g}")
+
+
+async def summarize_thermo_log(backend, path: str, *, max_rows: int = THERMO_SUMMARY_ROWS) -> dict:
+    """per run thermo statistics and a downsampled table of a lammps log, streamed with constant memory"""
+    volume_path = workspace_path_to_volume_path(path)
+    entry = await backend.stat(volume_path)
+    if entry is None or entry.is_dir:
+        raise FileNotFoundError(f"log file not found: {path}")
+
+    parser = LammpsThermoParser()
+    runs: list[ThermoRunSummary] = []
+    run_indices: list[int] = []
+    warnings = collections.Counter()
+
+    def take(raw: bytes):
+        line = raw.decode(errors="replace")
+        row = parser.feed_line(line)
+        if row is not None:
+            if not run_indices or run_indices[-1] != parser.run_index:
+                runs.append(ThermoRunSummary(parser.columns, max_rows))
+                run_indices.append(parser.run_index)
+            runs[-1].add_row(row)
+            return
+        if line.startswith(("WARNING", "ERROR")):
+            key = line.strip()[:MAX_LINE_CHARS]
+            # distinct lines are capped (e.g. `Lost atoms at step N`), the rest is only counted
+            warnings[key if key in warnings or len(warnings) < MAX_DISTINCT_WARNINGS else "(other warnings)"] += 1
+            return
+        performance = parse_lammps_performance_line(line)
+        if performance is not None and runs:
+            runs[-1].performance = {**(runs[-1].performance or {}), **performance}
+
+    pending = b""
+    async for chunk in backend.iter_bytes(volume_path, 0, entry.size):
+        *complete, pending = (pending + chunk).split(b"\n")
+        for raw in complete:
+            take(raw)
+    if pending:
+        take(pending)
+
+    return {
+        "path": path,
+        "size": entry.size,
+        "mtime": entry.mtime,
+        "runs": [run.to_dict() for run in runs],
+        "warnings": [{"line": line, "count": count} for line, count in warnings.most_common(10)],
+    }
@@ -0,0 +1,335 @@
+#%%
+import asyncio
+import os
+import shlex
+import shutil
+from dataclasses import dataclass
+from typing import Optional, Sequence, Union
+
+import numpy as np
+from loguru import logger
+
+from deepmd_lammps_managed_run import read_input_commands
+from deepmd_lammps_preflight import parse_lammps_command_line, FILE_INPUT_COMMANDS, DEEPMD_PAIR_STYLES, DEEPMD_MODEL_SUFFIXES
+
+#%%
+# Configuration
+ENSEMBLE_DIR_NAME = "ensemble"
+MAX_ENSEMBLE_REPLICAS = 64
+LAMMPS_MAX_SEED = 900_000_000
+GPU_MEMORY_HEADROOM = 0.85           # fraction of the gpu memory replicas may fill when packed automatically
+SUMMARY_MAX_POINTS = 200
+WELFORD_BATCH_ROWS = 64              # thermo rows buffered per replica before a vectorized update
+
+#%%
+
+class EnsembleError(ValueError):
+    pass
+
+
+class WelfordAccumulator:
+    """
+    Running mean / variance of a vector of observables (numpy, one slot per observable).
+    Batches are merged with the parallel formula of Chan et al., so a batch update
+    and a merge of two accumulators are the same operation.
+    """
+
+    def __init__(self, n_observables: int):
+        self.count = 0
+        self.mean = np.zeros(n_observables)
+        self.m2 = np.zeros(n_observables)
+
+    def update(self, values: Union[Sequence[float], np.ndarray]):
+        self.update_batch(np.asarray(values, dtype=np.float64)[np.newaxis, :])
+
+    def update_batch(self, rows: np.ndarray):
+        if len(rows) == 0:
+            return
+        batch_mean = rows.mean(axis=0)
+        batch_m2 = ((rows - batch_mean) ** 2).sum(axis=0)
+        self._merge(len(rows), batch_mean, batch_m2)
+
+    def merge(self, other: "WelfordAccumulator"):
+        self._merge(other.count, other.mean, other.m2)
+
+    def _merge(self, count: int, mean: np.ndarray, m2: np.ndarray):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / total)
+        self.count = total
+
+    @property
+    def variance(self) -> np.ndarray:
+        return self.m2 / (self.count - 1) if self.count > 1 else np.full_like(self.mean, np.nan)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+
+class LammpsThermoParser:
+    """rows of the tabular thermo output (thermo_style one/custom) from lammps screen output lines"""
+
+    def __init__(self):
+        self.columns: Optional[list[str]] = None
+        self.run_index = -1
+        self._in_table = False
+
+    def feed_line(self, line: Union[str, bytes]) -> Optional[np.ndarray]:
+        if isinstance(line, bytes):
+            line = line.decode(errors="replace")
+        tokens = line.split()
+        if not tokens:
+            return None
+        if tokens[0] == "Step" and len(tokens) > 1:
+            self.columns = tokens
+            self.run_index += 1
+            self._in_table = True
+            return None
+        if tokens[0] == "Loop" or tokens[0] == "ERROR:":
+            self._in_table = False
+            return None
+        if not self._in_table or len(tokens) != len(self.columns):
+            return None
+        try:
+            return np.array([float(token) for token in tokens])
+        except ValueError:
+            return None
+
+
+class EnsembleAggregator:
+    """
+    Thermo statistics of N replicas:
+    - per replica time averages (after the equilibration steps), Welford over the thermo rows
+    - per step mean / std across the replicas, Welford over the replicas reaching that step
+    """
+
+    def __init__(self, n_replicas: int, *, equilibration_steps: int = 0):
+        self.n_replicas = n_replicas
+        self.equilibration_steps = equilibration_steps
+        self.observables: Optional[list[str]] = None
+        self.replica_stats: list[Optional[WelfordAccumulator]] = [None] * n_replicas
+        self.step_stats: dict[int, WelfordAccumulator] = {}
+        self._pending_rows: list[list[np.ndarray]] = [[] for _ in range(n_replicas)]
+
+    def update(self, replica_index: int, columns: list[str], row: np.ndarray):
+        if self.observables is None:
+            self.observables = columns[1:]
+        if columns[1:] != self.observables:
+            return
+
+        step, values = int(row[0]), row[1:]
+        if step not in self.step_stats:
+            self.step_stats[step] = WelfordAccumulator(len(values))
+        self.step_stats[step].update(values)
+
+        if step >= self.equilibration_steps:
+            pending = self._pending_rows[replica_index]
+            pending.append(values)
+            if len(pending) >= WELFORD_BATCH_ROWS:
+                self._flush(replica_index)
+
+    def _flush(self, replica_index: int):
+        pending = self._pending_rows[replica_index]
+        if not pending:
+            return
+        if self.replica_stats[replica_index] is None:
+            self.replica_stats[replica_index] = WelfordAccumulator(len(self.observables))
+        self.replica_stats[replica_index].update_batch(np.vstack(pending))
+        pending.clear()
+
+    def summary(self) -> dict:
+        for replica_index in range(self.n_replicas):
+            self._flush(replica_index)
+        if self.observables is None:
+            return {"observables": [], "ensemble": {}, "replicas": [], "series": {}}
+
+        finished = [stats for stats in self.replica_stats if stats is not None and stats.count > 0]
+        replica_means = np.array([stats.mean for stats in finished]) if finished else np.empty((0, len(self.observables)))
+        pooled = WelfordAccumulator(len(self.observables))
+        for stats in finished:
+            pooled.merge(stats)
+
+        ensemble = {}
+        for i, observable in enumerate(self.observables):
+            n = len(replica_means)
+            std = float(np.std(replica_means[:, i], ddof=1)) if n > 1 else None
+            ensemble[observable] = {
+                "mean": float(np.mean(replica_means[:, i])) if n else None,
+                "std_between_replicas": std,
+                "stderr": std / np.sqrt(n) if std is not None else None,
+                "pooled_std": float(pooled.std[i]) if pooled.count > 1 else None,
+            }
+
+        # per step curve over the steps every replica reached
+        steps = sorted(step for step, stats in self.step_stats.items() if stats.count == self.n_replicas) \
+            or sorted(self.step_stats)
+        picked = steps[::max(1, -(-len(steps) // SUMMARY_MAX_POINTS))]
+        series = {"step": picked}
+        for i, observable in enumerate(self.observables):
+            series[observable] = {
+                "mean": [round(float(self.step_stats[step].mean[i]), 6) for step in picked],
+                "std": [None if self.step_stats[step].count < 2 else round(float(self.step_stats[step].std[i]), 6) for step in picked],
+            }
+
+        return {
+            "observables": self.observables,
+            "equilibration_steps": self.equilibration_steps,
+            "ensemble": ensemble,
+            "replicas": [
+                {"index": index, "rows": stats.count if stats else 0,
+                 "mean": dict(zip(self.observables, stats.mean.round(6).tolist())) if stats else None}
+                for index, stats in enumerate(self.replica_stats)
+            ],
+            "series": series,
+        }
+
+
+class ReplicaSlots:
+    """concurrency limit of replicas on the gpu(s) that can grow once the memory of one replica is known"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_use < self.capacity)
+            self.in_use += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_use -= 1
+            self._condition.notify_all()
+
+    async def resize(self, capacity: int):
+        async with self._condition:
+            self.capacity = max(1, capacity)
+            self._condition.notify_all()
+
+
+@dataclass
+class ReplicaSpec:
+    index: int
+    seed: int
+    work_dir: str
+    commands_list: list[str]
+
+
+def generate_replica_seeds(n_replicas: int, base_seed: int = 2025) -> list[int]:
+    """distinct positive velocity seeds in the range lammps accepts"""
+    state = np.random.SeedSequence(base_seed).generate_state(n_replicas, dtype=np.uint64)
+    return [int(value % (LAMMPS_MAX_SEED - 1)) + 1 for value in state]
+
+
+def estimate_replicas_per_gpu(gpu_total_mb: float, replica_peak_mb: float, headroom: float = GPU_MEMORY_HEADROOM) -> int:
+    if not gpu_total_mb or not replica_peak_mb:
+        return 1
+    return max(1, int(gpu_total_mb * headroom // replica_peak_mb))
+
+
+def prepare_ensemble_replicas(commands: str, job_dir: str, n_replicas: int, *, seeds: Optional[list[int]] = None,
+        seed_variable: str = "SEED") -> list[ReplicaSpec]:
+    """
+    One working dir per replica (job_dir/ensemble/replica-NNN) holding links to the input files of the job dir
+    (script, includes, data / restart / molecule files, models), so relative inputs resolve
+    and every replica writes its own log / dumps instead of sharing the ones of the job dir.
+    The replicas get `-var <seed_variable> <seed> -var REPLICA <index>`.
+    """
+    if not 1 <= n_replicas <= MAX_ENSEMBLE_REPLICAS:
+        raise EnsembleError(f"n_replicas must be between 1 and {MAX_ENSEMBLE_REPLICAS}, got {n_replicas}")
+    seeds = seeds or generate_replica_seeds(n_replicas)
+    if len(seeds) != n_replicas or len(set(seeds)) != n_replicas:
+        raise EnsembleError(f"{n_replicas} distinct seeds are needed, got {seeds}")
+
+    input_script, variables = parse_lammps_command_line(commands)
+    if input_script is None:
+        raise EnsembleError("ensemble runs need an input script (-in <script>)")
+    references = (f"${{{seed_variable}}}", f"v_{seed_variable}") + ((f"${seed_variable}",) if len(seed_variable) == 1 else ())
+    included = []
+    raw_commands = read_input_commands(input_script, job_dir, {**variables, seed_variable: "1", "REPLICA": "0"}, included=included)
+    if not any(reference in raw for raw, _ in raw_commands for reference in references):
+        raise EnsembleError(f"the input script does not use ${{{seed_variable}}}, all replicas would be identical "
+            f"(e.g. `velocity all create 300 ${{{seed_variable}}}`)")
+
+    ensemble_dir = os.path.join(job_dir, ENSEMBLE_DIR_NAME)
+    input_files = _replica_input_files(job_dir, [input_script, *included], [args for _, args in raw_commands])
+    tokens = [token for token in shlex.split(commands)]
+    specs = []
+    for index, seed in enumerate(seeds):
+        work_dir = os.path.join(ensemble_dir, f"replica-{index:03d}")
+        os.makedirs(work_dir, exist_ok=True)
+        _unlink_stale_links(work_dir, input_files)
+        for path in input_files:
+            _link_into(os.path.join(job_dir, path), os.path.join(work_dir, path))
+        specs.append(ReplicaSpec(
+            index=index,
+            seed=seed,
+            work_dir=work_dir,
+            commands_list=tokens + ["-var", seed_variable, str(seed), "-var", "REPLICA", str(index)],
+        ))
+    logger.info(f"prepared ensemble replicas: {job_dir=} {n_replicas=} {seeds=}")
+    return specs
+
+
+def _replica_input_files(job_dir: str, scripts: list[str], commands_args: list[list[str]]) -> list[str]:
+    """relative paths of the job dir files the input reads, absolute paths (/public/ ...) resolve in every replica"""
+    paths = list(scripts)
+    for args in commands_args:
+        position = FILE_INPUT_COMMANDS.get(args[0])
+        if position is not None and len(args) > position:
+            paths.append(args[position])
+        elif args[0] == "pair_style" and any(style in args for style in DEEPMD_PAIR_STYLES):
+            paths.extend(token for token in args[2:] if token.endswith(DEEPMD_MODEL_SUFFIXES))
+    inputs = []
+    for path in paths:
+        path = os.path.normpath(path)
+        if os.path.isabs(path) or path.startswith("..") or path in inputs or not os.path.exists(os.path.join(job_dir, path)):
+            continue
+        inputs.append(path)
+    return inputs
+
+
+def _unlink_stale_links(work_dir: str, input_files: list[str]):
+    """links of a previous preparation that are not inputs now, e.g. to a log.lammps the replicas would all write"""
+    top_level = {path.split(os.sep)[0] for path in input_files}
+    for name in os.listdir(work_dir):
+        if name not in top_level and os.path.islink(os.path.join(work_dir, name)):
+            os.unlink(os.path.join(work_dir, name))
+
+
+def _link_into(source: str, target: str):
+    if os.path.lexists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.symlink(os.path.relpath(source, os.path.dirname(target)), target)
+    except OSError:
+        # volumes without symlink support get a copy of the (small) input files
+        if os.path.isfile(source):
+            shutil.copy2(source, target)
+
+
+async def query_gpu_memory_total_mb() -> list[float]:
+    """total memory of every visible gpu, empty without nvidia-smi"""
+    nvidia_smi = shutil.which("nvidia-smi")
+    if nvidia_smi is None:
+        return []
+    process = None
+    try:
+        process = await asyncio.create_subprocess_exec(
+            nvidia_smi, "--query-gpu=memory.total", "--format=csv,noheader,nounits",
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout=10)
+        return [float(line) for line in stdout.decode().split() if line.strip()]
+    except (OSError, ValueError, asyncio.TimeoutError) as e:
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        logger.warning(f"cannot query the gpu memory, replicas are not packed: {e=}")
+        return []
@@ -0,0 +1,487 @@
+"""
+The GPU / CPU executor containers of the run service: lmp runs, ensembles, managed segments and
+the trajectory analysis. Deliberately imports nothing of the web / agent stack (fastapi, fastmcp,
+google.adk, jose), modal imports the defining module in every container it starts, so this module
+is all an executor container pays for at cold start. The web endpoints are in deepmd_modal_run_service,
+which includes this app. `python benchmarks/bench_import_time.py` keeps the import cost in check.
+"""
+import asyncio
+import json
+import os
+import shlex
+from typing import Optional, Union
+
+import modal
+from loguru import logger
+
+from deepmd_run_telemetry import LammpsRunTelemetry
+from deepmd_lammps_managed_run import prepare_managed_segment, finish_managed_segment, DEFAULT_RESTART_EVERY_STEPS
+from deepmd_lammps_ensemble import (
+    prepare_ensemble_replicas, query_gpu_memory_total_mb, estimate_replicas_per_gpu,
+    EnsembleAggregator, EnsembleError, LammpsThermoParser, ReplicaSlots,
+)
+from deepmd_run_progress import LammpsProgressEstimator, log_progress_verdict, VERDICT_AT_RISK, VERDICT_WILL_TIME_OUT
+
+#%%
+# Configuration
+DEFAULT_LAMMPS_TIMEOUT_SECONDS = 30 
+CLEANUP_TIMEOUT_SECONDS = 60         # 1 minute for graceful shutdown
+MANAGED_SEGMENT_SECONDS = 3000       # lammps time per managed segment, below the executor timeout of 3600
+MANAGED_SEGMENT_GRACE_SECONDS = 300  # final write_restart and log stitching after the timer timeout
+ANALYSIS_CPU = 4.0                   # reservation of the trajectory analysis container
+ANALYSIS_MEMORY_MB = 4096
+ANALYSIS_WORKER_MEMORY_MB = 1024     # chunk buffers and histograms of one analysis worker process
+
+
+#%%
+def analysis_worker_count(cpu_limit: float = ANALYSIS_CPU, memory_mb: int = ANALYSIS_MEMORY_MB) -> int:
+    """
+    process pool size of a trajectory analysis: the cores this process may run on, capped by the cpu and memory
+    reservation of the container (os.cpu_count() is the host's core count inside a container)
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # no sched_getaffinity outside linux
+        cores = os.cpu_count() or 1
+    return max(1, min(cores, int(cpu_limit), memory_mb // ANALYSIS_WORKER_MEMORY_MB))
+
+
+async def terminate_lammps_process(process: asyncio.subprocess.Process, grace_seconds: int = CLEANUP_TIMEOUT_SECONDS):
+    """SIGTERM, then SIGKILL if the process is still alive after the grace period."""
+    if process.returncode is not None:
+        return process.returncode
+
+    try:
+        process.terminate()
+        return await asyncio.wait_for(process.wait(), timeout=grace_seconds)
+    except ProcessLookupError:
+        return await process.wait()
+    except asyncio.TimeoutError:
+        logger.warning(f"lammps process {process.pid=} did not exit after SIGTERM in {grace_seconds=}s, killing it.")
+        process.kill()
+        return await process.wait()
+
+
+async def run_lammps_process(commands_list: list[str], job_dir: str, timeout: float, *,
+        total_steps: Optional[int] = None, stop_early: bool = True) -> dict:
+    """
+    run lmp to completion with resource telemetry, SIGTERM/SIGKILL on cancellation.
+    With total_steps (from the preflight) the ETA is estimated from the thermo output,
+    runs that cannot finish within the timeout are stopped early (stop_early).
+    """
+    program = commands_list[0]
+    args = commands_list[1:]
+
+    process = await asyncio.create_subprocess_exec(
+        program,
+        *args,
+        shell=False,
+        cwd=job_dir,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT
+    )
+    telemetry = await LammpsRunTelemetry(process.pid).start()
+    estimator = LammpsProgressEstimator(total_steps, timeout)
+    stopped_early = False
+
+    async def consume_output():
+        nonlocal stopped_early
+        last_verdict = None
+        # the pipe has to be drained, otherwise lmp blocks once the pipe buffer is full
+        async for line in process.stdout:
+            telemetry.feed_output_line(line)
+            if not estimator.feed_output_line(line) or total_steps is None:
+                continue
+            progress = estimator.progress()
+            if progress["verdict"] != last_verdict:
+                log_progress_verdict(progress, job_dir)
+                last_verdict = progress["verdict"]
+            if stop_early and progress["verdict"] == VERDICT_WILL_TIME_OUT:
+                stopped_early = True
+                await terminate_lammps_process(process)
+                return None
+        return await process.wait()
+
+    return_code = None
+    try:
+        return_code = await asyncio.wait_for(consume_output(), timeout=timeout)    
+    except asyncio.TimeoutError:
+        # return_code stays None for runs stopped by the timeout
+        logger.info(f"lammps simulation timed out in {job_dir=} after {timeout=}s, terminating {process.pid=}.")
+        await terminate_lammps_process(process)
+    except asyncio.CancelledError:
+        # FunctionCall.cancel() on the spawned job
+        logger.info(f"lammps simulation cancelled in {job_dir=}, terminating {process.pid=}.")
+        await asyncio.shield(terminate_lammps_process(process))
+        raise
+    finally:
+        telemetry_summary = await telemetry.stop()
+    telemetry_summary["progress"] = estimator.progress()
+    
+    logger.info(f"lammps simulation finished in {job_dir=} {return_code=} {stopped_early=} {telemetry_summary['performance']=}.")
+    return {"return_code": return_code, "stopped_early": stopped_early, "telemetry": telemetry_summary}
+
+
+async def run_lammps_ensemble(commands: str, job_dir: str, n_replicas: int, *, seeds: Optional[list[int]] = None,
+        seed_variable: str = "SEED", replicas_per_gpu: int = 0, equilibration_steps: int = 0, timeout: float = 3600):
+    """
+    Run N seeded replicas of one input side by side and yield their events (dicts):
+    replica_started / thermo / replica_finished / packing / telemetry, and a final `summary`
+    with the aggregated thermo statistics.
+    replicas_per_gpu=0 packs automatically: one replica per gpu first, then as many as fit
+    in the gpu memory once the memory of a running replica is known.
+    """
+    specs = prepare_ensemble_replicas(commands, job_dir, n_replicas, seeds=seeds, seed_variable=seed_variable)
+    gpu_memory_mb = await query_gpu_memory_total_mb()
+    n_gpus = max(1, len(gpu_memory_mb))
+    gpu_devices = os.environ.get("CUDA_VISIBLE_DEVICES", "").split(",") if os.environ.get("CUDA_VISIBLE_DEVICES") else [str(i) for i in range(n_gpus)]
+    auto_packing = replicas_per_gpu <= 0 and bool(gpu_memory_mb)
+    slots = ReplicaSlots(n_gpus if auto_packing else max(1, replicas_per_gpu) * n_gpus)
+    aggregator = EnsembleAggregator(n_replicas, equilibration_steps=equilibration_steps)
+    # replicas are children of this process, the telemetry of the container covers all of them
+    telemetry = await LammpsRunTelemetry(os.getpid()).start()
+    events: asyncio.Queue = asyncio.Queue()
+    processes: dict[int, asyncio.subprocess.Process] = {}
+    return_codes: list[Optional[int]] = [None] * n_replicas
+
+    async def run_replica(spec):
+        await slots.acquire()
+        try:
+            env = {**os.environ, "TF_FORCE_GPU_ALLOW_GROWTH": "true"}  # tensorflow models must not grab the whole gpu
+            if gpu_memory_mb:
+                env["CUDA_VISIBLE_DEVICES"] = gpu_devices[spec.index % len(gpu_devices)]
+            process = await asyncio.create_subprocess_exec(
+                *spec.commands_list,
+                cwd=spec.work_dir,
+                env=env,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+            processes[spec.index] = process
+            await events.put({"event": "replica_started", "replica": spec.index, "seed": spec.seed})
+            parser = LammpsThermoParser()
+            async for line in process.stdout:
+                telemetry.feed_output_line(line)
+                row = parser.feed_line(line)
+                if row is not None:
+                    aggregator.update(spec.index, parser.columns, row)
+                    await events.put({"event": "thermo", "replica": spec.index, **dict(zip(parser.columns, row.tolist()))})
+            return_codes[spec.index] = await process.wait()
+            await events.put({"event": "replica_finished", "replica": spec.index, "return_code": return_codes[spec.index]})
+        finally:
+            await slots.release()
+
+    tasks = [asyncio.create_task(run_replica(spec)) for spec in specs]
+    packed = not auto_packing
+    thermo_seen = False
+    timed_out = False
+    try:
+        async with asyncio.timeout(timeout):
+            while not (all(task.done() for task in tasks) and events.empty()):
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=telemetry.interval)
+                except asyncio.TimeoutError:
+                    event = None
+                for sample in telemetry.pop_pending_samples():
+                    yield {"event": "telemetry", **sample}
+                    if not packed and thermo_seen and sample["gpu_mem_mb"]:
+                        # the model is loaded once thermo output appears, the memory per replica is known
+                        per_gpu = estimate_replicas_per_gpu(min(gpu_memory_mb), sample["gpu_mem_mb"] / max(1, slots.in_use))
+                        await slots.resize(per_gpu * n_gpus)
+                        packed = True
+                        yield {"event": "packing", "replicas_per_gpu": per_gpu, "gpus": n_gpus}
+                if event is not None:
+                    thermo_seen = thermo_seen or event["event"] == "thermo"
+                    yield event
+        for task in tasks:
+            if task.exception() is not None:
+                raise task.exception()
+    except TimeoutError:
+        timed_out = True
+        logger.info(f"lammps ensemble timed out in {job_dir=} after {timeout=}s, terminating the replicas.")
+    finally:
+        # also on cancellation / consumer disconnect, no replica is left running
+        await asyncio.shield(asyncio.gather(*(terminate_lammps_process(p) for p in processes.values()), return_exceptions=True))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        telemetry_summary = await telemetry.stop()
+
+    failed = [code for code in return_codes if code != 0]
+    return_code = None if timed_out or None in return_codes else (failed[0] if failed else 0)
+    logger.info(f"lammps ensemble finished in {job_dir=} {n_replicas=} {return_codes=}")
+    yield {
+        "event": "summary",
+        "return_code": return_code,
+        "return_codes": return_codes,
+        "seeds": [spec.seed for spec in specs],
+        "timed_out": timed_out,
+        "replica_dirs": [os.path.relpath(spec.work_dir, job_dir) for spec in specs],
+        "ensemble": aggregator.summary(),
+        "telemetry": telemetry_summary,
+    }
+
+#%%
+app_name = "deepmd-run-service"
+
+# only what the executor code imports, the web / agent packages are in the web_image of deepmd_modal_run_service
+executor_pip_packages = [
+    "modal",
+    "loguru",
+    "psutil",
+]
+
+
+lammps_image = (
+    modal.Image.from_registry("deepmodeling/deepmd-kit:3.1.0_cuda129"
+    ).pip_install(executor_pip_packages
+    ).run_commands([
+        "python -c 'import deepmd; print(\"deepmd installed\")'",
+    ])
+    .run_commands([
+        "lmp -h"
+    ]).add_local_python_source("deepmd_run_telemetry", "deepmd_volume_paths", "deepmd_trajectory_analysis",
+        "deepmd_lammps_preflight", "deepmd_lammps_managed_run", "deepmd_lammps_ensemble", "deepmd_run_progress",
+))
+
+public_volume = modal.Volume.from_name(
+    name="jupyterlab-public",
+    create_if_missing=True
+)
+
+app = modal.App(name=app_name,  secrets=[modal.Secret.from_name("openmeter-token")], volumes={"/public/": public_volume.read_only()})
+
+
+#%% 
+default_personal_volume = modal.Volume.from_name(
+    name="jupyterlab-personal-default_unnamed_user",
+    create_if_missing=True
+)
+
+
+@app.cls(image=lammps_image, 
+    gpu='T4',
+    timeout=3600,
+    scaledown_window=20,
+    restrict_modal_access=True,
+    max_inputs=1
+    )
+class LammpsSimulationExecutor:
+
+    owner_user_id: str = modal.parameter(default='default_unnamed_user')
+
+    personal_volume: modal.Volume = modal.parameter(default=default_personal_volume, init=False)
+
+    @modal.method()
+    def setup_before_enter(self):
+        pass
+
+    @modal.method()
+    def cleanup_before_exit(self):
+        pass
+
+    @modal.method()
+    async def lammps_simulation_job(self, commands: str, job_dir: str, timeout=60, total_steps: Optional[int] = None, stop_early: bool = True):
+        logger.info(f"lammps job running in job_dir: {commands=}, {timeout=}, {job_dir=} {total_steps=}.")
+        return await run_lammps_process(shlex.split(commands), job_dir, timeout, total_steps=total_steps, stop_early=stop_early)
+
+    @modal.method()
+    async def lammps_managed_segment(self, commands: str, job_dir: str, segment_index: int,
+            segment_seconds: int = MANAGED_SEGMENT_SECONDS, restart_every: int = DEFAULT_RESTART_EVERY_STEPS):
+        """one bounded segment of a managed long run, continues from the latest restart file in job_dir/managed/"""
+        segment = prepare_managed_segment(commands, job_dir, segment_index, segment_seconds=segment_seconds, restart_every=restart_every)
+        logger.info(f"lammps managed segment running: {job_dir=} {segment=}")
+        result = await run_lammps_process(segment.commands_list, job_dir, segment_seconds + MANAGED_SEGMENT_GRACE_SECONDS)
+        return {**result, **finish_managed_segment(job_dir, segment)}
+
+    @modal.method()
+    async def lammps_ensemble_job(self, commands: str, job_dir: str, n_replicas: int, *, seeds: Optional[list[int]] = None,
+            seed_variable: str = "SEED", replicas_per_gpu: int = 0, equilibration_steps: int = 0, timeout: int = 3600):
+        """N seeded replicas in job_dir/ensemble/replica-NNN/, returns the aggregated thermo statistics"""
+        logger.info(f"lammps ensemble job running: {commands=} {job_dir=} {n_replicas=} {replicas_per_gpu=}")
+        summary = None
+        async for event in run_lammps_ensemble(commands, job_dir, n_replicas, seeds=seeds, seed_variable=seed_variable,
+                replicas_per_gpu=replicas_per_gpu, equilibration_steps=equilibration_steps, timeout=timeout):
+            if event["event"] == "summary":
+                summary = event
+            elif event["event"] not in ("thermo", "telemetry"):
+                logger.info(f"lammps ensemble event: {event=}")
+        return summary
+
+    @modal.method(is_generator=True)
+    async def lammps_ensemble_stream(self, commands: str, job_dir: str, n_replicas: int, *, seeds: Optional[list[int]] = None,
+            seed_variable: str = "SEED", replicas_per_gpu: int = 0, equilibration_steps: int = 0, timeout: int = DEFAULT_LAMMPS_TIMEOUT_SECONDS):
+        yield f"data: [DEEPMD] ensemble of {n_replicas} replicas in {job_dir=} (timeout: {timeout}s)...\n\n".encode()
+        try:
+            async for event in run_lammps_ensemble(commands, job_dir, n_replicas, seeds=seeds, seed_variable=seed_variable,
+                    replicas_per_gpu=replicas_per_gpu, equilibration_steps=equilibration_steps, timeout=timeout):
+                tag = "ENSEMBLE_SUMMARY" if event["event"] == "summary" else "ENSEMBLE"
+                yield f"data: [DEEPMD] [{tag}] {json.dumps(event)}\n\n".encode()
+        except EnsembleError as e:
+            yield f"data: [DEEPMD] [ERROR] {e}\n\n".encode()
+
+    @modal.method(is_generator=True)
+    async def lammps_simulation_stream(self, commands: Union[str, list[str]], job_dir: str = '/workspace/', timeout: int = DEFAULT_LAMMPS_TIMEOUT_SECONDS,
+            total_steps: Optional[int] = None, stop_early: bool = True):
+        max_seconds = DEFAULT_LAMMPS_TIMEOUT_SECONDS
+
+        yield f"data: [DEEPMD] remote stream executing {self.owner_user_id=} ...\n\n".encode()
+        yield f"data: [DEEPMD] Starting LAMMPS (timeout: {max_seconds}s)...\n\n".encode()
+        
+        
+        commands_list = shlex.split(commands)
+
+        program = commands_list[0]
+        args = commands_list[1:]
+
+        logger.info(f"lammps stream running in {self.owner_user_id=} {job_dir=} {os.listdir(job_dir)=} {commands_list=} {program=} {args=}")
+
+        yield f"data: [DEEPMD] Running in {self.owner_user_id=} {job_dir=} {os.listdir(job_dir)=} , {timeout=}s .\n\n".encode()
+        yield f"data: [DEEPMD] Running  {commands_list=}. {program=}, with args: {args=}\n\n".encode()
+
+        yield f"data: [DEEPMD] ---origin LAMMPS output below---\n\n".encode()
+
+        process = await asyncio.create_subprocess_exec(
+            program,
+            *args,
+            shell=False,
+            cwd=job_dir,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+
+        telemetry = await LammpsRunTelemetry(process.pid).start()
+        estimator = LammpsProgressEstimator(total_steps, timeout)
+        last_verdict = None
+
+        try:
+            async with asyncio.timeout(timeout):
+                line_count = 0
+                line = b""
+                while True:
+                    try:
+                        next_line = await asyncio.wait_for(process.stdout.readline(), timeout=telemetry.interval)
+                    except asyncio.TimeoutError:
+                        next_line = None
+                    for sample in telemetry.pop_pending_samples():
+                        yield f"data: [DEEPMD] [TELEMETRY] {json.dumps(sample)}\n\n".encode()
+                    if next_line is None:
+                        continue
+                    if not next_line:
+                        break
+                    line = next_line
+                    line_count += 1
+                    logger.info(f"{line_count=}:::{line=}")
+                    telemetry.feed_output_line(line)
+                    yield line
+
+                    if total_steps is None or not estimator.feed_output_line(line):
+                        continue
+                    progress = estimator.pop_progress_event()
+                    if progress is not None:
+                        yield f"data: [DEEPMD] [PROGRESS] {json.dumps(progress)}\n\n".encode()
+                    progress = estimator.progress()
+                    if progress["verdict"] != last_verdict:
+                        log_progress_verdict(progress, job_dir)
+                        last_verdict = progress["verdict"]
+                        if progress["verdict"] in (VERDICT_AT_RISK, VERDICT_WILL_TIME_OUT):
+                            yield f"data: [DEEPMD] [ETA_WARNING] {json.dumps(progress)}\n\n".encode()
+                    if stop_early and progress["verdict"] == VERDICT_WILL_TIME_OUT:
+                        yield (f"data: [DEEPMD] [EARLY_STOP] projected runtime {progress['projected_seconds']}s exceeds the timeout of {timeout}s, "
+                            f"stopping now instead of at the timeout. Resubmit with a longer timeout or as a managed run.\n\n").encode()
+                        await terminate_lammps_process(process)
+                        break
+
+                return_code = await process.wait()
+
+            yield f"data: [DEEPMD] Total lines received: {line_count=} last line: {line}\n\n".encode()
+            yield f"data: [DEEPMD] ---finished origin LAMMPS simulation output above {return_code=}---\n\n".encode()
+            
+        except asyncio.TimeoutError:
+            yield f"data: [DEEPMD] ---timeout origin LAMMPS simulation output above---\n\n".encode()
+            yield (f"data: [DEEPMD] [TIMEOUT] The program is still runnning, "
+                f"but the execution exceeded {max_seconds}s limit, terminating now and will kill it in {CLEANUP_TIMEOUT_SECONDS} seconds...\n\n").encode()
+            process.terminate()  # Send SIGTERM
+            
+            # Read any remaining output during cleanup
+            try:
+                await asyncio.wait_for(process.wait(), timeout=CLEANUP_TIMEOUT_SECONDS)
+                # Try to read any final output
+                async for line in process.stdout:
+                    yield line
+                yield f"\ndata: [DEEPMD] [TIMEOUT] Clean shutdown completed\n\n".encode()
+            except asyncio.TimeoutError:
+                process.kill()  # Force kill
+                yield f"data: [DEEPMD] [TIMEOUT] Force kill after {CLEANUP_TIMEOUT_SECONDS} seconds\n\n".encode()
+        except Exception as e:
+            yield f"data: [DEEPMD] [ERROR] {e}\n\n".encode()
+        finally:
+            if process.returncode is None:
+                # the consumer went away (client disconnect or cancel), do not leave lmp running
+                logger.info(f"lammps stream closed before the process exited, terminating {process.pid=}.")
+                await asyncio.shield(terminate_lammps_process(process))
+            telemetry_summary = await telemetry.stop()
+            telemetry_summary["progress"] = estimator.progress()
+            logger.info(f"lammps stream finished in {job_dir=} {process.returncode=}.")
+
+        yield f"data: [DEEPMD] [TELEMETRY_SUMMARY] {json.dumps(telemetry_summary)}\n\n".encode()
+
+    # @modal.method()
+
+        
+
+
+@app.function(image=lammps_image)
+def get_lammps_simulation_executor_instance(owner_user_id: str = 'default_unnamed_user'):
+    personal_volume_name = f"jupyterlab-personal-{owner_user_id}"
+
+    personal_volume = modal.Volume.from_name(personal_volume_name, create_if_missing=True)
+
+    logger.info(f" {personal_volume.listdir('/')=}")
+    LammpsSimulationExecutor_cls = modal.Cls.from_name(app_name='deepmd-run-service',
+            name='LammpsSimulationExecutor'
+        )
+
+    personal_lammps_cls = LammpsSimulationExecutor_cls.with_options(
+            volumes={'/workspace/': personal_volume}
+            )
+    personal_lammps_instance = personal_lammps_cls(owner_user_id=owner_user_id)
+
+    return personal_lammps_instance
+    # return LammpsSimulationExecutor(owner_user_id=owner_user_id)
+
+
+@app.cls(image=lammps_image,
+    cpu=ANALYSIS_CPU,
+    memory=ANALYSIS_MEMORY_MB,
+    timeout=3600,
+    scaledown_window=20,
+    restrict_modal_access=True,
+    max_inputs=1
+    )
+class TrajectoryAnalysisExecutor:
+    """CPU container for the post-run analysis of dump files in the personal volume"""
+
+    owner_user_id: str = modal.parameter(default='default_unnamed_user')
+
+    @modal.method()
+    def trajectory_analysis_job(self, dump_file: str, job_dir: str = '/workspace/', analyses: list[str] = ["rdf", "msd", "density"], **analysis_kwargs):
+        # only this container needs it (concurrent.futures, the analysis code), not the lammps one
+        from deepmd_trajectory_analysis import analyze_lammps_dump
+
+        dump_path = os.path.join(job_dir, dump_file)
+        logger.info(f"trajectory analysis running: {self.owner_user_id=} {dump_path=} {analyses=} {analysis_kwargs=}")
+        return analyze_lammps_dump(dump_path, analyses, workers=analysis_worker_count(), **analysis_kwargs)
+
+
+@app.function(image=lammps_image)
+def get_trajectory_analysis_executor_instance(owner_user_id: str = 'default_unnamed_user'):
+    personal_volume = modal.Volume.from_name(f"jupyterlab-personal-{owner_user_id}", create_if_missing=True)
+
+    TrajectoryAnalysisExecutor_cls = modal.Cls.from_name(app_name='deepmd-run-service',
+            name='TrajectoryAnalysisExecutor'
+        )
+    return TrajectoryAnalysisExecutor_cls.with_options(
+            volumes={'/workspace/': personal_volume}
+            )(owner_user_id=owner_user_id)
@@ -0,0 +1,263 @@
+#%%
+import os
+import re
+import shlex
+from dataclasses import dataclass
+from typing import Optional
+
+from loguru import logger
+
+from deepmd_lammps_preflight import (
+    parse_lammps_command_line, iter_lammps_input_lines, substitute_variables, split_lammps_args,
+    define_lammps_variable, NUMBER_PATTERN, MAX_INCLUDE_DEPTH,
+)
+
+#%%
+# Configuration
+MANAGED_DIR_NAME = "managed"
+MANAGED_LOG_NAME = "log.managed.lammps"   # segment logs stitched in the job dir
+DEFAULT_RESTART_EVERY_STEPS = 10000       # periodic restart files, the fallback when a segment is preempted
+KEEP_PERIODIC_RESTARTS = 2
+
+# commands building the system, replaced by `read_restart` in continuation segments
+BOX_COMMANDS = {"read_data", "read_restart", "create_box"}
+CONTINUATION_DROPPED_COMMANDS = BOX_COMMANDS | {"create_atoms", "displace_atoms", "delete_atoms", "replicate", "read_dump"}
+SETUP_ONLY_COMMANDS = {"minimize", "reset_timestep"}  # allowed before the first run only
+UNSUPPORTED_COMMANDS = {"jump", "next", "label", "clear"}
+
+RESTART_FILE_PATTERN = re.compile(r"^(?P<kind>segment-\d+|periodic)\.(?P<step>\d+)\.restart$")
+
+#%%
+
+class ManagedRunError(ValueError):
+    """the input script cannot be split into resumable segments"""
+
+
+@dataclass
+class ManagedSegment:
+    segment_index: int
+    commands_list: list[str]
+    script_path: str
+    log_path: str
+    restart_file: Optional[str]
+    restart_step: int
+    target_step: int
+
+
+def read_input_commands(script_path: str, job_dir: str, variables: dict[str, str], _depth: int = 0, *,
+        included: Optional[list[str]] = None) -> list[tuple[str, list[str]]]:
+    """(raw command, substituted args) of a script with includes inlined, paths relative to the job dir.
+    The paths of the inlined include files are appended to `included`."""
+    if _depth > MAX_INCLUDE_DEPTH:
+        raise ManagedRunError(f"more than {MAX_INCLUDE_DEPTH} nested includes")
+    with open(os.path.join(job_dir, script_path)) as f:
+        text = f.read()
+
+    commands = []
+    for _, raw_command in iter_lammps_input_lines(text):
+        command, _ = substitute_variables(raw_command, variables)
+        args = split_lammps_args(command)
+        if not args:
+            continue
+        if args[0] == "variable" and len(args) >= 4:
+            define_lammps_variable(variables, args)
+        if args[0] == "include" and len(args) >= 2:
+            if included is not None:
+                included.append(args[1])
+            commands.extend(read_input_commands(args[1], job_dir, variables, _depth + 1, included=included))
+            continue
+        commands.append((raw_command, args))
+    return commands
+
+
+def format_timer_timeout(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def build_segment_script(commands: list[tuple[str, list[str]]], *, segment_index: int, segment_seconds: int,
+        restart_every: int, restart_file: Optional[str] = None, restart_step: int = 0) -> tuple[str, int]:
+    """
+    Input script of one bounded segment, returns (script, target step of the whole run).
+    - `timer timeout` ends the segment gracefully, the remaining runs are skipped by lammps
+      and the final `write_restart` stores the state for the next segment
+    - `restart` writes periodic restart files in case the container is preempted
+    - every `run N` becomes `run <cumulative step> upto`, so a continuation from any restart
+      finishes exactly the remaining steps; runs already done are dropped
+    - continuations replace the system setup with `read_restart` and append to dumps
+    """
+    managed_dir = MANAGED_DIR_NAME
+    is_continuation = restart_file is not None
+    lines = [
+        f"# deepmd managed run, segment {segment_index}" + (f", continued from {restart_file} at step {restart_step}" if is_continuation else ""),
+        f"timer timeout {format_timer_timeout(segment_seconds)}",
+    ]
+
+    target_step = 0
+    seen_run = False
+    restart_injected = False
+    box_replaced = False
+    for raw_command, args in commands:
+        name = args[0]
+        if name in UNSUPPORTED_COMMANDS:
+            raise ManagedRunError(f"`{name}` is not supported in managed runs: {raw_command}")
+        if name in SETUP_ONLY_COMMANDS and seen_run:
+            raise ManagedRunError(f"`{name}` after the first run is not supported in managed runs: {raw_command}")
+        if name == "minimize" and not any(a[0] == "reset_timestep" for _, a in commands):
+            raise ManagedRunError("`minimize` has to be followed by `reset_timestep` before the first run in managed runs")
+
+        if name == "run":
+            if len(args) < 2 or not NUMBER_PATTERN.match(args[1]):
+                raise ManagedRunError(f"run steps must be a number or a static variable in managed runs: {raw_command}")
+            steps = int(float(args[1]))
+            options = [arg for arg in args[2:] if arg != "upto"]
+            target_step = steps if "upto" in args[2:] else target_step + steps
+            seen_run = True
+            if not restart_injected:
+                lines.append(f"restart {restart_every} {managed_dir}/periodic.*.restart")
+                restart_injected = True
+            if target_step <= restart_step:
+                lines.append(f"# done in an earlier segment: {raw_command}")
+                continue
+            lines.append(" ".join(["run", str(target_step), "upto"] + options))
+            continue
+
+        if is_continuation:
+            if name in CONTINUATION_DROPPED_COMMANDS:
+                if not box_replaced:
+                    lines.append(f"read_restart {restart_file}")
+                    box_replaced = True
+                lines.append(f"# replaced by read_restart: {raw_command}")
+                continue
+            if name in SETUP_ONLY_COMMANDS or (name == "velocity" and "create" in args):
+                lines.append(f"# setup already done: {raw_command}")
+                continue
+
+        lines.append(raw_command)
+        if is_continuation and name == "dump" and len(args) >= 2:
+            lines.append(f"dump_modify {args[1]} append yes")
+
+    if not seen_run:
+        raise ManagedRunError("no `run` command, nothing to manage")
+    if is_continuation and not box_replaced:
+        raise ManagedRunError("no read_data / read_restart / create_box to replace with the restart file")
+
+    lines.append(f"write_restart {managed_dir}/segment-{segment_index:03d}.*.restart")
+    return "\n".join(lines) + "\n", target_step
+
+
+def list_restart_files(job_dir: str) -> list[tuple[int, str, str]]:
+    """(step, kind, path relative to the job dir) of the managed restart files, oldest first"""
+    managed_path = os.path.join(job_dir, MANAGED_DIR_NAME)
+    if not os.path.isdir(managed_path):
+        return []
+    restart_files = []
+    for name in os.listdir(managed_path):
+        match = RESTART_FILE_PATTERN.match(name)
+        if match:
+            kind = "periodic" if match.group("kind") == "periodic" else "segment"
+            restart_files.append((int(match.group("step")), kind, f"{MANAGED_DIR_NAME}/{name}"))
+    # at equal steps the final restart of a segment wins over a periodic one
+    return sorted(restart_files, key=lambda item: (item[0], item[1] == "segment"))
+
+
+def find_latest_restart(job_dir: str) -> tuple[Optional[str], int]:
+    restart_files = list_restart_files(job_dir)
+    if not restart_files:
+        return None, 0
+    step, _, path = restart_files[-1]
+    return path, step
+
+
+def prune_restart_files(job_dir: str, keep: int = KEEP_PERIODIC_RESTARTS):
+    """keep the latest restart files only, a restart of a large system is hundreds of MB"""
+    restart_files = list_restart_files(job_dir)
+    for _, kind, path in restart_files[:-keep]:
+        os.remove(os.path.join(job_dir, path))
+        logger.info(f"pruned managed restart file: {job_dir=} {path=} {kind=}")
+
+
+def prepare_managed_segment(commands: str, job_dir: str, segment_index: int, *, segment_seconds: int,
+        restart_every: int = DEFAULT_RESTART_EVERY_STEPS) -> ManagedSegment:
+    """write the input script of the next segment and return the lammps command line to run it"""
+    input_script, variables = parse_lammps_command_line(commands)
+    if input_script is None:
+        raise ManagedRunError("managed runs need an input script (-in <script>)")
+
+    if segment_index == 0:
+        # a fresh run, restart files of an earlier managed run in the same job dir must not count as progress
+        for _, _, path in list_restart_files(job_dir):
+            os.remove(os.path.join(job_dir, path))
+        if os.path.exists(os.path.join(job_dir, MANAGED_LOG_NAME)):
+            os.remove(os.path.join(job_dir, MANAGED_LOG_NAME))
+
+    restart_file, restart_step = find_latest_restart(job_dir)
+    if segment_index > 0 and restart_file is None:
+        # the earlier segments were preempted before their first restart file
+        logger.warning(f"no restart file to continue from, segment starts from the beginning: {job_dir=} {segment_index=}")
+    is_continuation = segment_index > 0 and restart_file is not None
+
+    input_commands = read_input_commands(input_script, job_dir, dict(variables))
+    script, target_step = build_segment_script(
+        input_commands,
+        segment_index=segment_index,
+        segment_seconds=segment_seconds,
+        restart_every=restart_every,
+        restart_file=restart_file if is_continuation else None,
+        restart_step=restart_step if is_continuation else 0,
+    )
+
+    os.makedirs(os.path.join(job_dir, MANAGED_DIR_NAME), exist_ok=True)
+    script_path = f"{MANAGED_DIR_NAME}/segment-{segment_index:03d}.in"
+    log_path = f"{MANAGED_DIR_NAME}/segment-{segment_index:03d}.log"
+    with open(os.path.join(job_dir, script_path), "w") as f:
+        f.write(script)
+
+    # same command line with the segment script and log
+    tokens = shlex.split(commands)
+    commands_list = []
+    skip = 0
+    for i, token in enumerate(tokens):
+        if skip:
+            skip -= 1
+            continue
+        if token in ("-in", "-i"):
+            commands_list += [token, script_path]
+            skip = 1
+        elif token in ("-log", "-l"):
+            skip = 1
+        else:
+            commands_list.append(token)
+    commands_list += ["-log", log_path]
+
+    return ManagedSegment(
+        segment_index=segment_index,
+        commands_list=commands_list,
+        script_path=script_path,
+        log_path=log_path,
+        restart_file=restart_file if is_continuation else None,
+        restart_step=restart_step if is_continuation else 0,
+        target_step=target_step,
+    )
+
+
+def finish_managed_segment(job_dir: str, segment: ManagedSegment) -> dict:
+    """stitch the segment log, prune old restart files and report the progress of the whole run"""
+    segment_log = os.path.join(job_dir, segment.log_path)
+    with open(os.path.join(job_dir, MANAGED_LOG_NAME), "ab") as stitched:
+        stitched.write(f"\n# ---- deepmd managed segment {segment.segment_index} (from step {segment.restart_step}) ----\n".encode())
+        if os.path.exists(segment_log):
+            with open(segment_log, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    stitched.write(chunk)
+
+    restart_file, restart_step = find_latest_restart(job_dir)
+    prune_restart_files(job_dir)
+    return {
+        "segment_index": segment.segment_index,
+        "restart_file": restart_file,
+        "restart_step": restart_step,
+        "start_step": segment.restart_step,
+        "target_step": segment.target_step,
+        "completed": restart_step >= segment.target_step,
+        "log_file": MANAGED_LOG_NAME,
+    }
@@ -0,0 +1,456 @@
+#%%
+import posixpath
+import re
+import shlex
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from loguru import logger
+
+from deepmd_volume_paths import WORKSPACE_MOUNT_PATH, PUBLIC_MOUNT_PATH, workspace_path_to_volume_path
+
+#%%
+# Configuration
+MAX_INCLUDE_DEPTH = 16
+MAX_INPUT_SCRIPT_BYTES = 4 * 1024**2
+DATA_FILE_HEADER_BYTES = 64 * 1024   # the header (counts, box) is always at the top of a data file
+
+# https://docs.deepmodeling.com/projects/deepmd/en/latest/third-party/lammps-command.html
+DEEPMD_PAIR_STYLES = ("deepmd", "deepspin")
+DEEPMD_PAIR_STYLE_KEYWORDS = {
+    "out_freq", "out_file", "fparam", "fparam_from_compute", "aparam", "aparam_from_compute",
+    "ttm", "relative", "relative_v", "virtual_len", "spin_norm", "atomic",
+}
+DEEPMD_MODEL_SUFFIXES = (".pb", ".pth", ".pt", ".savedmodel")
+
+# commands whose (first) argument is an input file, by argument position
+FILE_INPUT_COMMANDS = {"read_data": 1, "read_restart": 1, "read_dump": 1, "include": 1, "molecule": 2}
+# commands writing files that later commands may read
+FILE_OUTPUT_COMMANDS = {"write_data": 1, "write_restart": 1, "write_dump": 3}
+
+VARIABLE_PATTERN = re.compile(r"\$\{(?P<braced>[^}]+)\}|\$\((?P<immediate>[^)]*)\)|\$(?P<single>[A-Za-z0-9_])")
+ATOM_TYPES_PATTERN = re.compile(r"^\s*(?P<count>\d+)\s+atom\s+types\b")
+ATOMS_PATTERN = re.compile(r"^\s*(?P<count>\d+)\s+atoms\b")
+NUMBER_PATTERN = re.compile(r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$")
+
+#%%
+
+@dataclass
+class LammpsPreflightIssue:
+    code: str
+    message: str
+    file: Optional[str] = None
+    line: Optional[int] = None
+    severity: str = "error"
+
+    def to_dict(self) -> dict:
+        return {"code": self.code, "message": self.message, "file": self.file, "line": self.line, "severity": self.severity}
+
+
+@dataclass
+class LammpsPreflightResult:
+    input_script: Optional[str] = None
+    issues: list[LammpsPreflightIssue] = field(default_factory=list)
+    files: dict[str, bool] = field(default_factory=dict)
+    atom_types: Optional[int] = None
+    atoms: Optional[int] = None
+    pair_style: Optional[str] = None
+    models: list[str] = field(default_factory=list)
+    elements: list[str] = field(default_factory=list)
+    run_steps: list[int] = field(default_factory=list)
+    elapsed_ms: float = 0.0
+
+    @property
+    def errors(self) -> list[LammpsPreflightIssue]:
+        return [issue for issue in self.issues if issue.severity == "error"]
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def total_run_steps(self) -> Optional[int]:
+        return sum(self.run_steps) if self.run_steps else None
+
+    def run_environment_vars(self) -> dict:
+        """model, atom count and steps recorded with the queue job, they key the throughput table"""
+        if not self.models:
+            return {}
+        return {"model": self.models[0], "atoms": self.atoms, "total_steps": self.total_run_steps}
+
+    def to_dict(self) -> dict:
+        return {
+            "ok": self.ok,
+            "input_script": self.input_script,
+            "errors": [issue.to_dict() for issue in self.errors],
+            "warnings": [issue.to_dict() for issue in self.issues if issue.severity != "error"],
+            "files": self.files,
+            "atom_types": self.atom_types,
+            "atoms": self.atoms,
+            "pair_style": self.pair_style,
+            "models": self.models,
+            "elements": self.elements,
+            "total_run_steps": self.total_run_steps,
+            "elapsed_ms": round(self.elapsed_ms, 2),
+        }
+
+
+class LammpsPreflightFiles:
+    """
+    Read-only view of the files a lammps run will see, keyed by mount prefix
+    ({'/workspace/': backend, '/public/': backend}), backends are the artifact backends
+    (LocalArtifactBackend / VolumeArtifactBackend). Relative paths resolve against the job dir.
+    """
+
+    def __init__(self, backends: dict, job_dir: str = WORKSPACE_MOUNT_PATH):
+        self.backends = backends
+        self.job_dir = job_dir
+        self._stat_cache = {}
+
+    def resolve(self, path: str) -> str:
+        return posixpath.normpath(path if path.startswith("/") else posixpath.join(self.job_dir, path))
+
+    def _backend_path(self, path: str) -> tuple[Optional[object], str]:
+        if (path + "/").startswith(WORKSPACE_MOUNT_PATH):
+            return self.backends.get(WORKSPACE_MOUNT_PATH), workspace_path_to_volume_path(path)
+        if (path + "/").startswith(PUBLIC_MOUNT_PATH):
+            return self.backends.get(PUBLIC_MOUNT_PATH), path[len(PUBLIC_MOUNT_PATH):]
+        return None, path
+
+    def is_mounted(self, path: str) -> bool:
+        return self._backend_path(path)[0] is not None
+
+    async def exists(self, path: str) -> bool:
+        if path not in self._stat_cache:
+            backend, backend_path = self._backend_path(path)
+            entry = await backend.stat(backend_path) if backend is not None else None
+            self._stat_cache[path] = entry is not None
+        return self._stat_cache[path]
+
+    async def read_text(self, path: str, max_bytes: int) -> Optional[str]:
+        backend, backend_path = self._backend_path(path)
+        if backend is None or not await self.exists(path):
+            return None
+        chunks = [chunk async for chunk in backend.iter_bytes(backend_path, 0, max_bytes)]
+        return b"".join(chunks).decode(errors="replace")
+
+
+#%%
+
+def parse_lammps_command_line(commands: str) -> tuple[Optional[str], dict[str, str]]:
+    """input script (-in/-i) and index variables (-var/-v) of a `lmp ...` command line"""
+    tokens = shlex.split(commands)
+    input_script, variables = None, {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("-in", "-i") and i + 1 < len(tokens):
+            input_script = tokens[i + 1]
+            i += 2
+        elif token in ("-var", "-v") and i + 2 < len(tokens):
+            # -var name value1 value2 ..., index style, first value is the active one
+            variables[tokens[i + 1]] = tokens[i + 2]
+            i += 3
+            while i < len(tokens) and not tokens[i].startswith("-"):
+                i += 1
+        else:
+            i += 1
+    return input_script, variables
+
+
+def iter_lammps_input_lines(text: str):
+    """(line number, command) with comments stripped and `&` continuations joined"""
+    pending, pending_lineno = "", None
+    for lineno, raw in enumerate(text.splitlines(), start=1):
+        line = _strip_comment(raw).rstrip()
+        if pending_lineno is None:
+            pending_lineno = lineno
+        if line.endswith("&"):
+            pending += line[:-1] + " "
+            continue
+        command = (pending + line).strip()
+        if command:
+            yield pending_lineno, command
+        pending, pending_lineno = "", None
+    if pending.strip():
+        yield pending_lineno, pending.strip()
+
+
+def _strip_comment(line: str) -> str:
+    quote = None
+    for i, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == "#":
+            return line[:i]
+    return line
+
+
+def substitute_variables(command: str, variables: dict[str, str]) -> tuple[str, list[str]]:
+    """expand ${name}, $x; unknown variables and immediate $(...) expressions are left as is and reported"""
+    unresolved = []
+
+    def _replace(match):
+        name = match.group("braced") or match.group("single")
+        if name is not None and name in variables:
+            return variables[name]
+        unresolved.append(match.group(0))
+        return match.group(0)
+
+    return VARIABLE_PATTERN.sub(_replace, command), unresolved
+
+
+def split_lammps_args(command: str) -> list[str]:
+    try:
+        return shlex.split(command, comments=False)
+    except ValueError:
+        return command.split()
+
+
+def define_lammps_variable(variables: dict[str, str], args: list[str]):
+    """apply a `variable name style values...` command to the known (static) variable values"""
+    name, style, values = args[1], args[2], args[3:]
+    if style in ("index", "loop", "world", "universe", "uloop") and name in variables:
+        # lammps ignores redefinitions of index-like styles, e.g. of a -var set on the command line
+        return
+    if style in ("index", "world", "universe", "string", "getenv", "format"):
+        variables[name] = values[0] if style != "string" else " ".join(values)
+    elif style in ("loop", "uloop"):
+        variables[name] = "1" if len(values) == 1 or not values[0].isdigit() else values[0]
+    elif style == "equal" and len(values) == 1 and NUMBER_PATTERN.match(values[0]):
+        variables[name] = values[0]
+    else:
+        variables.pop(name, None)
+
+
+def parse_data_file_atom_types(header: str) -> Optional[int]:
+    for line in header.splitlines():
+        match = ATOM_TYPES_PATTERN.match(line)
+        if match:
+            return int(match.group("count"))
+    return None
+
+
+def parse_data_file_atoms(header: str) -> Optional[int]:
+    for line in header.splitlines():
+        match = ATOMS_PATTERN.match(line)
+        if match:
+            return int(match.group("count"))
+    return None
+
+
+#%%
+
+class LammpsPreflightChecker:
+    def __init__(self, files: LammpsPreflightFiles, variables: Optional[dict[str, str]] = None):
+        self.files = files
+        self.variables = dict(variables or {})
+        self.result = LammpsPreflightResult()
+        self._produced_files = set()
+        self._pair_coeff_seen = False
+        self._pair_coeff_elements: Optional[tuple[list[str], str, int]] = None
+        self._has_box = False
+
+    def add_issue(self, code: str, message: str, file: Optional[str] = None, line: Optional[int] = None, severity: str = "error"):
+        self.result.issues.append(LammpsPreflightIssue(code=code, message=message, file=file, line=line, severity=severity))
+
+    async def check_file(self, path: str, *, file: str, line: int, what: str) -> Optional[str]:
+        resolved = self.files.resolve(path)
+        if resolved in self._produced_files:
+            return resolved
+        if "*" in posixpath.basename(resolved) or "%" in posixpath.basename(resolved):
+            self.add_issue("WILDCARD_NOT_CHECKED", f"{what} {path} is a wildcard pattern and is not checked", file, line, "warning")
+            return None
+        if not self.files.is_mounted(resolved):
+            self.add_issue("PATH_OUTSIDE_VOLUMES", f"{what} {path} is outside {WORKSPACE_MOUNT_PATH} and {PUBLIC_MOUNT_PATH}", file, line)
+            return None
+        exists = await self.files.exists(resolved)
+        self.result.files[resolved] = exists
+        if not exists:
+            self.add_issue("FILE_NOT_FOUND", f"{what} not found: {path} (resolved to {resolved})", file, line)
+            return None
+        return resolved
+
+    async def check_script(self, path: str, *, include_stack: tuple = (), file: Optional[str] = None, line: Optional[int] = None):
+        resolved = await self.check_file(path, file=file, line=line, what="input script" if not include_stack else "include file")
+        if resolved is None:
+            return
+        if resolved in include_stack:
+            self.add_issue("INCLUDE_CYCLE", f"include cycle: {' -> '.join(include_stack + (resolved,))}", file, line)
+            return
+        if len(include_stack) >= MAX_INCLUDE_DEPTH:
+            self.add_issue("INCLUDE_TOO_DEEP", f"more than {MAX_INCLUDE_DEPTH} nested includes", file, line)
+            return
+
+        text = await self.files.read_text(resolved, MAX_INPUT_SCRIPT_BYTES)
+        await self.check_text(text or "", source=resolved, include_stack=include_stack + (resolved,))
+
+    async def check_text(self, text: str, *, source: str, include_stack: tuple = ()):
+        for lineno, raw_command in iter_lammps_input_lines(text):
+            command, unresolved = substitute_variables(raw_command, self.variables)
+            args = split_lammps_args(command)
+            if not args:
+                continue
+            await self.check_command(args, unresolved, source=source, line=lineno, include_stack=include_stack)
+
+    async def check_command(self, args: list[str], unresolved: list[str], *, source: str, line: int, include_stack: tuple):
+        name = args[0]
+
+        if name == "variable" and len(args) >= 4:
+            define_lammps_variable(self.variables, args)
+            return
+        if name == "clear":
+            self._has_box = False
+            self.result.atom_types = None
+            self.result.atoms = None
+            return
+        if name in ("jump", "next"):
+            self.add_issue("LOOP_NOT_FOLLOWED", f"`{name}` is not followed by the preflight, later commands are checked once", source, line, "warning")
+            return
+
+        if name in FILE_INPUT_COMMANDS or name in FILE_OUTPUT_COMMANDS or name in ("pair_style", "pair_coeff"):
+            if unresolved:
+                self.add_issue("UNDEFINED_VARIABLE", f"cannot resolve {', '.join(unresolved)} in `{' '.join(args)}`", source, line)
+                return
+
+        if name in FILE_OUTPUT_COMMANDS and len(args) > FILE_OUTPUT_COMMANDS[name]:
+            self._produced_files.add(self.files.resolve(args[FILE_OUTPUT_COMMANDS[name]]))
+        elif name == "restart" and len(args) >= 3:
+            self._produced_files.update(self.files.resolve(path) for path in args[2:4] if "*" not in path)
+
+        if name == "include" and len(args) >= 2:
+            await self.check_script(args[1], include_stack=include_stack, file=source, line=line)
+        elif name == "read_data" and len(args) >= 2:
+            await self.read_data(args, source=source, line=line)
+        elif name in ("read_restart", "read_dump") and len(args) >= 2:
+            # binary restart / dump: only the existence is checked
+            if await self.check_file(args[1], file=source, line=line, what=name) and name == "read_restart":
+                self._has_box = True
+                self.result.atom_types = None
+                self.result.atoms = None
+        elif name == "molecule" and len(args) >= 3:
+            await self.check_file(args[2], file=source, line=line, what="molecule file")
+        elif name == "create_box" and len(args) >= 2 and args[1].isdigit():
+            self._has_box = True
+            self.result.atom_types = int(args[1])
+        elif name == "replicate" and len(args) >= 4 and self.result.atoms is not None:
+            if all(arg.isdigit() for arg in args[1:4]):
+                self.result.atoms *= int(args[1]) * int(args[2]) * int(args[3])
+            else:
+                self.result.atoms = None
+        elif name == "pair_style" and len(args) >= 2:
+            await self.pair_style(args, source=source, line=line)
+        elif name == "pair_coeff":
+            self.pair_coeff(args, source=source, line=line)
+        elif name in ("run", "minimize", "rerun") and not self._has_box:
+            self.add_issue("NO_SIMULATION_BOX", f"`{name}` before read_data / read_restart / create_box", source, line)
+        elif name == "run" and len(args) >= 2:
+            if NUMBER_PATTERN.match(args[1]):
+                self.result.run_steps.append(int(float(args[1])))
+
+    async def read_data(self, args: list[str], *, source: str, line: int):
+        resolved = await self.check_file(args[1], file=source, line=line, what="data file")
+        self._has_box = True
+        if resolved is None or resolved in self._produced_files:
+            self.result.atom_types = None
+            self.result.atoms = None
+            return
+
+        header = await self.files.read_text(resolved, DATA_FILE_HEADER_BYTES)
+        self.result.atoms = parse_data_file_atoms(header or "")
+        atom_types = parse_data_file_atom_types(header or "")
+        if atom_types is None:
+            self.add_issue("DATA_FILE_NO_ATOM_TYPES", f"no `N atom types` line in the header of {args[1]}", source, line)
+            return
+        if "extra/atom/types" in args:
+            extra_index = args.index("extra/atom/types") + 1
+            if extra_index < len(args) and args[extra_index].isdigit():
+                atom_types += int(args[extra_index])
+        self.result.atom_types = atom_types
+
+    async def pair_style(self, args: list[str], *, source: str, line: int):
+        self.result.pair_style = " ".join(args[1:])
+        self._pair_coeff_seen = False
+        self._pair_coeff_elements = None
+        for style in DEEPMD_PAIR_STYLES:
+            if style not in args[1:]:
+                continue
+            start = args.index(style) + 1
+            models = []
+            for token in args[start:]:
+                if token in DEEPMD_PAIR_STYLE_KEYWORDS or (args[1].startswith("hybrid") and not token.endswith(DEEPMD_MODEL_SUFFIXES)):
+                    break
+                models.append(token)
+            if not models:
+                self.add_issue("MISSING_MODEL", f"pair_style {style} without a model file", source, line)
+            for model in models:
+                if not model.endswith(DEEPMD_MODEL_SUFFIXES):
+                    self.add_issue("UNKNOWN_MODEL_FORMAT", f"model {model} does not end with {', '.join(DEEPMD_MODEL_SUFFIXES)}", source, line, "warning")
+                resolved = await self.check_file(model, file=source, line=line, what="deepmd model")
+                if resolved:
+                    self.result.models.append(resolved)
+
+    def pair_coeff(self, args: list[str], *, source: str, line: int):
+        if len(args) < 3 or args[1:3] != ["*", "*"]:
+            return
+        pair_styles = (self.result.pair_style or "").split()
+        elements = args[3:]
+        if elements and elements[0] in DEEPMD_PAIR_STYLES:
+            elements = elements[1:]
+        elif pair_styles and pair_styles[0].startswith("hybrid"):
+            # pair_coeff * * <other sub-style> ...
+            return
+        if not any(style in pair_styles for style in DEEPMD_PAIR_STYLES):
+            return
+        self._pair_coeff_seen = True
+        # without elements the type map order of the model is used
+        if elements:
+            self.result.elements = elements
+            self._pair_coeff_elements = (elements, source, line)
+
+    def finish(self):
+        uses_deepmd = any(style in (self.result.pair_style or "").split() for style in DEEPMD_PAIR_STYLES)
+        if uses_deepmd and not self._pair_coeff_seen:
+            self.add_issue("MISSING_PAIR_COEFF", "pair_style deepmd without `pair_coeff * *`, lammps stops with `All pair coeffs are not set`")
+        if self._pair_coeff_elements is not None and self.result.atom_types is not None:
+            elements, source, line = self._pair_coeff_elements
+            if len(elements) != self.result.atom_types:
+                self.add_issue(
+                    "PAIR_COEFF_TYPE_MISMATCH",
+                    f"pair_coeff maps {len(elements)} elements ({' '.join(elements)}) but the system has {self.result.atom_types} atom types",
+                    source, line,
+                )
+
+
+async def preflight_lammps_input(commands: str, backends: dict, job_dir: str = WORKSPACE_MOUNT_PATH, *,
+        input_script_text: Optional[str] = None) -> LammpsPreflightResult:
+    """
+    Static check of a lammps run before it is sent to a GPU container:
+    resolves the input script, includes, data/restart/model files against the job dir and /public/,
+    and checks that `pair_coeff * *` maps as many elements as the data file has atom types.
+    `input_script_text` checks an inline script instead of the `-in` file of the command line.
+    """
+    started_at = time.perf_counter()
+    files = LammpsPreflightFiles(backends, job_dir=job_dir)
+    input_script, variables = parse_lammps_command_line(commands)
+    checker = LammpsPreflightChecker(files, variables)
+    result = checker.result
+
+    if input_script_text is not None:
+        result.input_script = "<inline>"
+        await checker.check_text(input_script_text, source="<inline>")
+        checker.finish()
+    elif input_script is not None:
+        result.input_script = files.resolve(input_script)
+        await checker.check_script(input_script)
+        checker.finish()
+    else:
+        checker.add_issue("NO_INPUT_SCRIPT", "no -in <script> in the command line, only the command itself is run", severity="warning")
+
+    result.elapsed_ms = (time.perf_counter() - started_at) * 1000
+    logger.info(f"lammps preflight: {commands=} {job_dir=} {result.ok=} {len(result.issues)=} {result.elapsed_ms=:.1f}")
+    return result
@@ -1,39 +1,46 @@
 import modal
-import requests
 import time
 import json
-from fastapi import UploadFile, File, Form
 from typing import Optional
 import os
 import asyncio
-from fastmcp import FastMCP
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import StreamingResponse, JSONResponse
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import UploadFile, File, Form
-from pydantic import BaseModel
+from jose import jwt
 
-import aiofiles
-import shlex
-from datetime import datetime
-import secrets
+import anyio
+import collections
+import posixpath
 from loguru import logger
-from fastmcp import Context, FastMCP
-from google.adk.cli.fast_api import get_fast_api_app
-from google.adk.sessions import DatabaseSessionService
-from typing import Union
-from starlette.middleware.base import BaseHTTPMiddleware
-from jose import jwt
 from modal import FilePatternMatcher
 
 
 
 from deepmd_auth_midware import AuthMiddleware
+from deepmd_queue_client import queue_client, DeepmdQueueApiError
+from deepmd_volume_paths import workspace_path_to_volume_path, WORKSPACE_MOUNT_PATH, PUBLIC_MOUNT_PATH
+from deepmd_lammps_preflight import preflight_lammps_input
+from deepmd_lammps_managed_run import DEFAULT_RESTART_EVERY_STEPS
+from deepmd_lammps_ensemble import MAX_ENSEMBLE_REPLICAS
+from deepmd_artifact_serving import LocalArtifactBackend, VolumeArtifactBackend, list_artifacts, get_artifact_response
+from deepmd_admission import admission_controller, AdmissionTicket, AdmissionTimeout, ADMISSION_LEASE_MARGIN_SECONDS
+from deepmd_job_status import run_result_status
+# the executor containers import deepmd_lammps_executor only, not this module and its web stack
+import deepmd_lammps_executor
+from deepmd_lammps_executor import (
+    get_lammps_simulation_executor_instance, public_volume, app_name,
+    DEFAULT_LAMMPS_TIMEOUT_SECONDS, MANAGED_SEGMENT_SECONDS, MANAGED_SEGMENT_GRACE_SECONDS,
+)
 
 #%%
 # Configuration
-DEFAULT_LAMMPS_TIMEOUT_SECONDS = 30 
-CLEANUP_TIMEOUT_SECONDS = 60         # 1 minute for graceful shutdown
+DETACHED_LOG_POLL_SECONDS = 5        # log.lammps polling interval of detached runs
+MANAGED_ORCHESTRATOR_TIMEOUT_SECONDS = 24 * 3600   # modal maximum, the orchestrator re-spawns itself before
+MANAGED_MAX_SEGMENTS = 240
+MANAGED_MAX_FAILED_SEGMENTS = 3      # consecutive segments without progress before the run is given up
+ARTIFACT_LOCAL_ROOT = os.getenv("ARTIFACT_LOCAL_ROOT", "")  # set when the personal volume is mounted locally
+
 
 #%%
 # Simple Modal app
@@ -59,21 +66,10 @@ pip_packages = [
     "asyncpg",
     "cloudevents",
     "openmeter==1.0.0b188",
+    "psutil",
 ]
 
 
-lammps_image = (
-    modal.Image.from_registry("deepmodeling/deepmd-kit:3.1.0_cuda129"
-    ).pip_install(pip_packages
-    ).run_commands([
-        "python -c 'import deepmd; print(\"deepmd installed\")'",
-    ])
-    .run_commands([
-        "lmp -h"
-    ]).add_local_python_source("deepmd_lammps_template","draft_metering_midware", "deepmd_auth_midware"
-))
-
-
 web_image = (
     modal.Image.debian_slim(python_version="3.11")
     .pip_install(pip_packages).env({
@@ -85,156 +81,294 @@ web_image = (
     # ).add_local_dir("agent_services", "/app/agent_services")
 )
 
-public_volume = modal.Volume.from_name(
-    name="jupyterlab-public",
-    create_if_missing=True
-)
-
-
-app_name = "deepmd-run-service"
 app = modal.App(name=app_name,  secrets=[modal.Secret.from_name("openmeter-token")], volumes={"/public/": public_volume.read_only()})
-
-#%% 
-default_personal_volume = modal.Volume.from_name(
-    name="jupyterlab-personal-default_unnamed_user",
-    create_if_missing=True
-)
-
-
-@app.cls(image=lammps_image, 
-    gpu='T4',
-    timeout=3600,
-    scaledown_window=20,
-    restrict_modal_access=True,
-    max_inputs=1
-    )
-class LammpsSimulationExecutor:
-
-    owner_user_id: str = modal.parameter(default='default_unnamed_user')
-
-    personal_volume: modal.Volume = modal.parameter(default=default_personal_volume, init=False)
-
-    @modal.method()
-    def setup_before_enter(self):
-        pass
-
-    @modal.method()
-    def cleanup_before_exit(self):
-        pass
-
-    @modal.method()
-    async def lammps_simulation_job(self, commands: str, job_dir: str, timeout=60):
-
-        commands_list = shlex.split(commands)
-        program = commands_list[0]
-        args = commands_list[1:]
-        logger.info(f"lammps stream running in job_dir: {commands_list=}, {timeout=}, {job_dir=}.")
-
-        process = await asyncio.create_subprocess_exec(
-            program,
-            *args,
-            shell=False,
-            cwd=job_dir,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT
-        )
-
-        return_code = None
-        try:
-            return_code = await asyncio.wait_for(process.wait(), timeout=timeout)    
-        except asyncio.TimeoutError:
-            process.terminate()
-        
-        logger.info(f"lammps simulation finished in {job_dir=} {return_code=}.")
-        return {"return_code": return_code}
-        
-
-    @modal.method(is_generator=True)
-    async def lammps_simulation_stream(self, commands: Union[str, list[str]], job_dir: str = '/workspace/', timeout: int = DEFAULT_LAMMPS_TIMEOUT_SECONDS):
-        max_seconds = DEFAULT_LAMMPS_TIMEOUT_SECONDS
-
-        yield f"data: [DEEPMD] remote stream executing {self.owner_user_id=} ...\n\n".encode()
-        yield f"data: [DEEPMD] Starting LAMMPS (timeout: {max_seconds}s)...\n\n".encode()
-        
-        
-        commands_list = shlex.split(commands)
-
-        program = commands_list[0]
-        args = commands_list[1:]
-
-        logger.info(f"lammps stream running in {self.owner_user_id=} {job_dir=} {os.listdir(job_dir)=} {commands_list=} {program=} {args=}")
-
-        yield f"data: [DEEPMD] Running in {self.owner_user_id=} {job_dir=} {os.listdir(job_dir)=} , {timeout=}s .\n\n".encode()
-        yield f"data: [DEEPMD] Running  {commands_list=}. {program=}, with args: {args=}\n\n".encode()
-
-        yield f"data: [DEEPMD] ---origin LAMMPS output below---\n\n".encode()
-
-        process = await asyncio.create_subprocess_exec(
-            program,
-            *args,
-            shell=False,
-            cwd=job_dir,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
+# LammpsSimulationExecutor, TrajectoryAnalysisExecutor and their instance getters, deployed with this app
+app.include(deepmd_lammps_executor.app)
+
+
+def get_preflight_backends(workspace_backend) -> dict:
+    """file backends the lammps preflight resolves /workspace/ and /public/ paths with"""
+    if os.path.isdir(PUBLIC_MOUNT_PATH):
+        public_backend = LocalArtifactBackend(PUBLIC_MOUNT_PATH)
+    else:
+        public_backend = VolumeArtifactBackend(public_volume)
+    return {WORKSPACE_MOUNT_PATH: workspace_backend, PUBLIC_MOUNT_PATH: public_backend}
+
+
+# function call ids spawned by this process, per owner. Only used to check ownership
+# when no queue api is configured, the queue records are the source of truth otherwise.
+spawned_function_call_ids: dict[str, set[str]] = collections.defaultdict(set)
+
+
+def register_spawned_function_call(owner_user_id: str, function_call_id: str):
+    spawned_function_call_ids[owner_user_id].add(function_call_id)
+
+
+async def _record_managed_status(auth_token: Optional[str], job_id: Optional[str], status: str, message: str, telemetry: Optional[dict] = None,
+        *, current_modal_function_call_id: str = ""):
+    if job_id is None:
+        return
+    if telemetry is None:
+        await asyncio.to_thread(queue_client.update_status, auth_token, job_id, status, message,
+            current_modal_function_call_id=current_modal_function_call_id)
+    else:
+        await asyncio.to_thread(queue_client.record_telemetry, auth_token, job_id, telemetry, status, message)
+
+
+def _auth_token_expires_at(auth_token: Optional[str]) -> Optional[float]:
+    """exp claim of the jwt, not verified (the queue api verifies it), None if there is none"""
+    if not auth_token:
+        return None
+    try:
+        exp = jwt.get_unverified_claims(auth_token).get("exp")
+    except Exception:
+        return None
+    return float(exp) if exp is not None else None
+
+
+async def _managed_run_stop_reason(auth_token: Optional[str], job_id: str, segment_seconds: int) -> Optional[str]:
+    """
+    Why the managed run must stop before its next segment, None to go on.
+    A run whose token is rejected could neither be cancelled nor record its progress, so it stops instead of running blind.
+    """
+    expires_at = _auth_token_expires_at(auth_token)
+    if expires_at is not None and expires_at < time.time() + segment_seconds + 2 * MANAGED_SEGMENT_GRACE_SECONDS:
+        return f"auth token expires before the next segment ends ({expires_at=:.0f}), resubmit to continue from the restart file"
+    try:
+        job = await asyncio.to_thread(queue_client.get_job, auth_token, job_id)
+    except DeepmdQueueApiError as e:
+        if e.status_code == 401:
+            return f"auth token rejected by the queue api: {e.detail}"
+        return None
+    if job is not None and job.get("current_status") == "CANCELLED":
+        return "cancelled"
+    return None
+
+
+@app.function(image=web_image, timeout=MANAGED_ORCHESTRATOR_TIMEOUT_SECONDS)
+async def managed_lammps_run(owner_user_id: str, commands: str, job_dir: str, *,
+        auth_token: Optional[str] = None,
+        queue_job_id: Optional[str] = None,
+        segment_index: int = 0,
+        segment_seconds: int = MANAGED_SEGMENT_SECONDS,
+        restart_every: int = DEFAULT_RESTART_EVERY_STEPS,
+        max_segments: int = MANAGED_MAX_SEGMENTS,
+        failed_segments: int = 0,
+        ):
+    """
+    Managed long run: a chain of bounded GPU segments, each continuing from the latest restart file.
+    Segments end gracefully on `timer timeout` (or are preempted, then the periodic restart is used),
+    each segment is recorded in the queue as an attempt linked to the managed run.
+    Runs outside the executor (which has no modal api access) and re-spawns itself before its own timeout.
+    """
+    started_at = time.monotonic()
+    # the queue record of the managed run is keyed by the function call id of the first orchestrator
+    queue_job_id = queue_job_id or modal.current_function_call_id()
+    executor = get_lammps_simulation_executor_instance.local(owner_user_id=owner_user_id)
+    segments = []
+    last_restart_step = None
+
+    while segment_index < max_segments:
+        elapsed = time.monotonic() - started_at
+        if elapsed + segment_seconds + 2 * MANAGED_SEGMENT_GRACE_SECONDS > MANAGED_ORCHESTRATOR_TIMEOUT_SECONDS:
+            continuation = await managed_lammps_run.spawn.aio(owner_user_id, commands, job_dir,
+                auth_token=auth_token, queue_job_id=queue_job_id, segment_index=segment_index,
+                segment_seconds=segment_seconds, restart_every=restart_every, max_segments=max_segments,
+                failed_segments=failed_segments)
+            # the queue cancels the current orchestrator, not only the first one the record is keyed by
+            await _record_managed_status(auth_token, queue_job_id, "RUNNING", f"orchestrator continued as {continuation.object_id}",
+                current_modal_function_call_id=continuation.object_id)
+            return {"continued_as": continuation.object_id, "segment_index": segment_index, "segments": segments}
+
+        stop_reason = await _managed_run_stop_reason(auth_token, queue_job_id, segment_seconds)
+        if stop_reason == "cancelled":
+            logger.info(f"managed run cancelled: {queue_job_id=} {segment_index=}")
+            return {"cancelled": True, "segment_index": segment_index, "segments": segments}
+        if stop_reason is not None:
+            logger.error(f"managed run stopped: {queue_job_id=} {segment_index=} {stop_reason=}")
+            await _record_managed_status(auth_token, queue_job_id, "FAILED", f"stopped at segment {segment_index}: {stop_reason}")
+            return {"completed": False, "stopped": stop_reason, "segment_index": segment_index, "segments": segments}
+
+        segment_call = await executor.lammps_managed_segment.spawn.aio(commands, job_dir, segment_index,
+            segment_seconds=segment_seconds, restart_every=restart_every)
+        attempt = await asyncio.to_thread(queue_client.create_job, auth_token,
+            modal_function_call_id=segment_call.object_id,
+            modal_function_name="LammpsSimulationExecutor.lammps_managed_segment",
+            queuejob_name=f"managed segment {segment_index}",
+            modal_volume_name=f"jupyterlab-personal-{owner_user_id}",
+            command=commands,
+            environment_vars={"job_dir": job_dir, "segment_seconds": segment_seconds},
+            parent_queuejob_id=queue_job_id,
+            attempt_index=segment_index,
         )
+        attempt_id = attempt["queuejob_id"] if attempt else None
+        await _record_managed_status(auth_token, queue_job_id, "RUNNING", f"segment {segment_index} running as {segment_call.object_id}")
 
         try:
-            async with asyncio.timeout(timeout):
-                line_count = 0
-                async for line in process.stdout:
-                    line_count += 1
-                    logger.info(f"{line_count=}:::{line=}")
-                    yield line
-
-                return_code = await process.wait()
-
-            yield f"data: [DEEPMD] Total lines received: {line_count=} last line: {line}\n\n".encode()
-            yield f"data: [DEEPMD] ---finished origin LAMMPS simulation output above {return_code=}---\n\n".encode()
-            
-        except asyncio.TimeoutError:
-            yield f"data: [DEEPMD] ---timeout origin LAMMPS simulation output above---\n\n".encode()
-            yield (f"data: [DEEPMD] [TIMEOUT] The program is still runnning, "
-                f"but the execution exceeded {max_seconds}s limit, terminating now and will kill it in {CLEANUP_TIMEOUT_SECONDS} seconds...\n\n").encode()
-            process.terminate()  # Send SIGTERM
-            
-            # Read any remaining output during cleanup
-            try:
-                await asyncio.wait_for(process.wait(), timeout=CLEANUP_TIMEOUT_SECONDS)
-                # Try to read any final output
-                async for line in process.stdout:
-                    yield line
-                yield f"\ndata: [DEEPMD] [TIMEOUT] Clean shutdown completed\n\n".encode()
-            except asyncio.TimeoutError:
-                process.kill()  # Force kill
-                yield f"data: [DEEPMD] [TIMEOUT] Force kill after {CLEANUP_TIMEOUT_SECONDS} seconds\n\n".encode()
+            segment = await segment_call.get.aio()
+        except asyncio.CancelledError:
+            with anyio.CancelScope(shield=True):
+                await segment_call.cancel.aio()
+            raise
         except Exception as e:
-            yield f"data: [DEEPMD] [ERROR] {e}\n\n".encode()
-        finally:
-            logger.info(f"lammps stream finished in {job_dir=} {process.returncode=}.")
-
-    # @modal.method()
-
-        
-
-
-@app.function(image=lammps_image)
-def get_lammps_simulation_executor_instance(owner_user_id: str = 'default_unnamed_user'):
-    personal_volume_name = f"jupyterlab-personal-{owner_user_id}"
-
-    personal_volume = modal.Volume.from_name(personal_volume_name, create_if_missing=True)
-
-    logger.info(f" {personal_volume.listdir('/')=}")
-    LammpsSimulationExecutor_cls = modal.Cls.from_name(app_name='deepmd-run-service',
-            name='LammpsSimulationExecutor'
-        )
-
-    personal_lammps_cls = LammpsSimulationExecutor_cls.with_options(
-            volumes={'/workspace/': personal_volume}
-            )
-    personal_lammps_instance = personal_lammps_cls(owner_user_id=owner_user_id)
-
-    return personal_lammps_instance
-    # return LammpsSimulationExecutor(owner_user_id=owner_user_id)
+            # preempted container, executor timeout, input error of a continuation...
+            logger.warning(f"managed segment failed: {queue_job_id=} {segment_index=} {e=}")
+            await _record_managed_status(auth_token, attempt_id, "FAILED", f"{type(e).__name__}: {e}")
+            segment = None
+
+        if segment is not None:
+            segments.append({key: segment[key] for key in ("segment_index", "return_code", "start_step", "restart_step", "target_step")})
+            # a segment ended by its `timer timeout` exits 0, a crashed or killed lmp is FAILED or TIMEOUT
+            attempt_status, attempt_message = run_result_status(segment)
+            await _record_managed_status(auth_token, attempt_id, attempt_status,
+                f"steps {segment['start_step']} -> {segment['restart_step']} of {segment['target_step']}, {attempt_message}",
+                telemetry=segment["telemetry"])
+            if segment["completed"]:
+                await _record_managed_status(auth_token, queue_job_id, "COMPLETED",
+                    f"finished after {len(segments)} segments, log in {segment['log_file']}", telemetry=segment["telemetry"])
+                return {"completed": True, "segments": segments, "log_file": segment["log_file"]}
+
+        made_progress = segment is not None and segment["restart_step"] != last_restart_step and segment["restart_step"] > segment["start_step"]
+        failed_segments = 0 if made_progress else failed_segments + 1
+        if failed_segments >= MANAGED_MAX_FAILED_SEGMENTS:
+            await _record_managed_status(auth_token, queue_job_id, "FAILED", f"{failed_segments} segments in a row without progress, last {segment_index=}")
+            return {"completed": False, "segments": segments}
+        if segment is not None:
+            last_restart_step = segment["restart_step"]
+        segment_index += 1
+
+    await _record_managed_status(auth_token, queue_job_id, "FAILED", f"not finished after {max_segments=}")
+    return {"completed": False, "segments": segments}
+
+
+def cancel_lammps_job(job_id: str, auth_token: Optional[str] = None, *, owner_user_id: str = 'default_unnamed_user') -> dict:
+    """
+    Cancel a spawned lammps job by queuejob_id or modal function call id.
+    Goes through the queue api, which checks the ownership and records CANCELLED on the Queuejob.
+    Without a configured queue api or without an auth token the modal function call is cancelled directly,
+    and only if it was spawned by this process for the same owner.
+    Raises LookupError if the job is not found (or not owned by the caller), PermissionError if only the queue api
+    knows the job and there is no auth token, RuntimeError if it could not be cancelled.
+    """
+    registered = job_id in spawned_function_call_ids[owner_user_id]
+    if queue_client.is_configured and (auth_token or not registered):
+        if not auth_token:
+            raise PermissionError(f"auth token required to cancel through the queue api: {job_id=}")
+        try:
+            result = queue_client.cancel_job(auth_token, job_id)
+        except DeepmdQueueApiError as e:
+            if e.status_code in (403, 404):
+                raise LookupError(f"job not found: {job_id=}") from e
+            raise RuntimeError(f"job not cancelled: {e.detail}") from e
+        if result is None:
+            raise RuntimeError(f"queue api unavailable, job not cancelled: {job_id=}")
+        return result
+
+    if not registered:
+        raise LookupError(f"job not found: {job_id=}")
+
+    modal.FunctionCall.from_id(job_id).cancel()
+    spawned_function_call_ids[owner_user_id].discard(job_id)
+    reason = "no auth token" if queue_client.is_configured else "queue api not configured"
+    logger.info(f"cancelled modal function call without queue record: {owner_user_id=} {job_id=} {reason=}")
+    return {"modal_function_call_id": job_id, "cancelled": True, "message": f"function call cancelled ({reason})"}
+
+
+async def stream_until_disconnect(remote_gen):
+    """
+    Relay a remote lammps stream to the client.
+    When the client disconnects the remote generator is closed, which cancels the remote call
+    and terminates lmp on the executor.
+    """
+    finished = False
+    try:
+        async for chunk in remote_gen:
+            yield chunk
+        finished = True
+    finally:
+        if not finished:
+            logger.info("client disconnected from lammps stream, cancelling remote run.")
+            # the request scope is being cancelled, shield the close so the remote cancel is actually sent
+            with anyio.CancelScope(shield=True):
+                await remote_gen.aclose()
+
+
+async def admission_queue_events(ticket: AdmissionTicket):
+    """wait for the GPU slot of the ticket, the queue position is streamed as [QUEUED] events"""
+    async for decision in admission_controller.updates(ticket):
+        if not decision.admitted:
+            yield f"data: [DEEPMD] [QUEUED] {json.dumps(decision.to_dict())}\n\n".encode()
+
+
+async def stream_after_admission(ticket: AdmissionTicket, remote_gen):
+    """
+    Relay a remote lammps stream once the ticket is admitted, until then the client sees its queue position.
+    The slot is released when the stream ends or the client disconnects.
+    """
+    try:
+        async for event in admission_queue_events(ticket):
+            yield event
+        async for chunk in stream_until_disconnect(remote_gen):
+            yield chunk
+    except AdmissionTimeout as e:
+        yield f"data: [DEEPMD] not run: {e}\n\n".encode()
+    finally:
+        with anyio.CancelScope(shield=True):
+            await admission_controller.release(ticket)
+
+
+async def release_when_finished(function_call: modal.FunctionCall, ticket: AdmissionTicket):
+    """free the admission slot of a spawned run once it finished, whatever its result"""
+    try:
+        await function_call.get.aio()
+    except asyncio.CancelledError:
+        # shutting down, the slot of the still running call expires with its lease
+        raise
+    except Exception:
+        pass
+    await admission_controller.release(ticket)
+
+
+async def follow_detached_lammps_job(function_call: modal.FunctionCall, artifact_backend, log_volume_path: str, *,
+        queuejob_id: Optional[str] = None, poll_interval: float = DETACHED_LOG_POLL_SECONDS):
+    """
+    Stream the log.lammps of a spawned (detached) run from the personal volume until the run finishes.
+    The run does not depend on this stream, a client disconnect only stops the tailing.
+    """
+    function_call_id = function_call.object_id
+    yield f"data: [DEEPMD] detached run submitted: {function_call_id=} {queuejob_id=}. Disconnecting does not stop it.\n\n".encode()
+
+    offset = 0
+    partial_line = b""
+    while True:
+        result, error = None, None
+        try:
+            result = await function_call.get.aio(timeout=0)
+        except TimeoutError:
+            pass
+        except modal.exception.Error as e:
+            error = e
+
+        entry = await artifact_backend.stat(log_volume_path)
+        if entry is not None and entry.size > offset:
+            data = b"".join([chunk async for chunk in artifact_backend.iter_bytes(log_volume_path, offset, entry.size - offset)])
+            offset += len(data)
+            lines = (partial_line + data).split(b"\n")
+            partial_line = lines.pop()
+            for line in lines:
+                yield b"data: " + line + b"\n\n"
+
+        if result is not None or error is not None:
+            break
+        await asyncio.sleep(poll_interval)
+
+    if partial_line:
+        yield b"data: " + partial_line + b"\n\n"
+    if error is not None:
+        yield f"data: [DEEPMD] detached run failed: {function_call_id=} {error=}\n\n".encode()
+        return
+    yield f"data: [DEEPMD] [TELEMETRY_SUMMARY] {json.dumps(result.get('telemetry'))}\n\n".encode()
+    yield f"data: [DEEPMD] detached run finished: {function_call_id=} return_code={result.get('return_code')}\n\n".encode()
 
 
 # @app.function(image=image, gpu='T4')
@@ -271,6 +405,14 @@ class DPLammpsService:
             )
         self.personal_lammps_instance = self.personal_lammps_cls(owner_user_id=self.owner_user_id)
 
+        if ARTIFACT_LOCAL_ROOT and os.path.isdir(ARTIFACT_LOCAL_ROOT):
+            self.artifact_backend = LocalArtifactBackend(ARTIFACT_LOCAL_ROOT)
+        else:
+            self.artifact_backend = VolumeArtifactBackend(self.personal_volume)
+        self.preflight_backends = get_preflight_backends(self.artifact_backend)
+        # releases the admission slots of detached runs when they finish
+        self.background_tasks: set[asyncio.Task] = set()
+
         
         # DeepmdAgentServices_cls = modal.Cls.from_name(app_name='deepmd-run-service',
         #     name='DeepmdAgentServices'
@@ -374,14 +516,59 @@ class DPLammpsService:
         @fastapi_app.get("/test-lammps-stream")
         async def test_lammps_stream_endpoint():
             return StreamingResponse(
-                self.personal_lammps_instance.lammps_simulation_stream.remote_gen(commands="lmp -h", job_dir="/workspace/", timeout=20),
+                stream_until_disconnect(
+                    self.personal_lammps_instance.lammps_simulation_stream.remote_gen.aio(commands="lmp -h", job_dir="/workspace/", timeout=20)
+                ),
                 media_type="text/event-stream"
             )
 
+        @fastapi_app.post("/lammps-simulation/{job_id}/cancel")
+        async def cancel_lammps_simulation_endpoint(request: Request, job_id: str):
+            """cancel a spawned long run by queuejob_id or modal function call id"""
+            auth_token = AuthMiddleware.get_optional_auth_token(request)
+            try:
+                result = await asyncio.to_thread(cancel_lammps_job, job_id, auth_token, owner_user_id=self.owner_user_id)
+            except LookupError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            except PermissionError as e:
+                raise HTTPException(status_code=401, detail=str(e))
+            except RuntimeError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+            return JSONResponse(result)
+
         @fastapi_app.get("/health")
         async def health_check_endpoint():
             return {"status": "healthy"}
 
+        @fastapi_app.get("/artifacts")
+        async def list_artifacts_endpoint(path: str = '/workspace/'):
+            """list the files of a job dir in the personal volume"""
+            try:
+                entries = await list_artifacts(self.artifact_backend, path)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return {"path": path, "entries": entries}
+
+        @fastapi_app.api_route("/artifacts/{path:path}", methods=["GET", "HEAD"])
+        async def download_artifact_endpoint(path: str):
+            """download a file (dump, log.lammps, restart...) with Range/ETag support, text files gzip on the fly"""
+            try:
+                response = await get_artifact_response(self.artifact_backend, path)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if response is None:
+                raise HTTPException(status_code=404, detail=f"artifact not found: {path}")
+            return response
+
+        async def upload_job_files(files: list[UploadFile], job_dir_in_volume: str):
+            with self.personal_volume.batch_upload() as batch:
+                for file in files:
+                    await file.seek(0)
+                    file_basename = os.path.basename(file.filename)
+                    remote_file_path = os.path.join(job_dir_in_volume, file_basename)
+                    batch.put_file(file.file, remote_file_path)
+                    logger.info(f"uploaded file: {file_basename=} to {remote_file_path=}.")
+
         @fastapi_app.post("/lammps-simulation-stream")
         async def lammps_simulation_stream_endpoint(
             request: Request,
@@ -389,6 +576,8 @@ class DPLammpsService:
             commands: str = Form('lmp -h', description="The commands to run lammps"), 
             job_dir: Optional[str] = Form('/workspace/', description="The job_dir of the lammps simulation. default is /workspace/"),
             timeout: Optional[int] = Form(40, description="The timeout of the lammps simulation. default is 20 to just test the service"),
+            skip_preflight: bool = Form(False, description="Skip the static check of the input script and referenced files. default failing decks are rejected with 422 before any GPU container starts"),
+            detached: bool = Form(False, description="Spawn the run independently of the request and stream its log.lammps, disconnecting does not stop it. default the run is cancelled on disconnect"),
             # basedir: Optional[str] = Form('/workspace/', description="The basedir of the lammps simulation.  /workspace/ or subfolder. it will combine job_dir/ (default auto generated) "),
             # job_dirname: Optional[str] = Form(None, description="(default auto generated if is None. set to empty to disable auto generated).it will combine `basedir` ")
         ):
@@ -409,29 +598,115 @@ class DPLammpsService:
 
             # job_dir = os.path.join(basedir, job_dirname)
 
-            job_dir_in_volume = job_dir.strip("/workspace")
+            job_dir_in_volume = workspace_path_to_volume_path(job_dir)
 
             logger.info(f"lammps stream running in job_dir: {self.owner_user_id=} {commands=}, {timeout=}, {job_dir=} {self.personal_volume=} {job_dir_in_volume=}.")  
 
             
-            with self.personal_volume.batch_upload() as batch:
-                for file in files:
-                    await file.seek(0)
-                    file_basename = os.path.basename(file.filename)
-                    remote_file_path = os.path.join(job_dir_in_volume, file_basename)
-                    batch.put_file(file.file, remote_file_path)
-                    logger.info(f"uploaded file: {file_basename=} to {remote_file_path=}.")
-
+            await upload_job_files(files, job_dir_in_volume)
             logger.info(f"uploaded files to job_dir: {job_dir=}.")
 
+            preflight = None
+            if not skip_preflight:
+                preflight = await preflight_lammps_input(commands, self.preflight_backends, job_dir)
+                if not preflight.ok:
+                    return JSONResponse({"error": "lammps input failed the preflight check", "preflight": preflight.to_dict()}, status_code=422)
+            # the executor estimates the ETA against the timeout and stops runs that cannot make it
+            total_steps = preflight.total_run_steps if preflight else None
+
+            # GPU calls of the user and organization are admitted in order, over the limits the stream starts with the queue position
+            organization = (AuthMiddleware.get_optional_token_payload(request) or {}).get("organization")
+            ticket = admission_controller.ticket(self.owner_user_id, organization, lease_seconds=(timeout or DEFAULT_LAMMPS_TIMEOUT_SECONDS) + ADMISSION_LEASE_MARGIN_SECONDS)
+
+            if detached:
+                # spawned independently of this request, the stream only follows its log.lammps
+                async def detached_stream():
+                    try:
+                        async for event in admission_queue_events(ticket):
+                            yield event
+                        function_call = await self.personal_lammps_instance.lammps_simulation_job.spawn.aio(commands=commands, job_dir=job_dir, timeout=timeout,
+                            total_steps=total_steps)
+                    except AdmissionTimeout as e:
+                        await admission_controller.release(ticket)
+                        yield f"data: [DEEPMD] not submitted: {e}\n\n".encode()
+                        return
+                    except BaseException:
+                        with anyio.CancelScope(shield=True):
+                            await admission_controller.release(ticket)
+                        raise
+                    # the slot is held until the run finishes, not until the client disconnects
+                    release_task = asyncio.create_task(release_when_finished(function_call, ticket))
+                    self.background_tasks.add(release_task)
+                    release_task.add_done_callback(self.background_tasks.discard)
+
+                    register_spawned_function_call(self.owner_user_id, function_call.object_id)
+                    queuejob = await asyncio.to_thread(queue_client.create_job,
+                        AuthMiddleware.get_optional_auth_token(request),
+                        modal_function_call_id=function_call.object_id,
+                        modal_function_name="LammpsSimulationExecutor.lammps_simulation_job",
+                        modal_volume_name=f"jupyterlab-personal-{self.owner_user_id}",
+                        command=commands,
+                        environment_vars={"job_dir": job_dir, **(preflight.run_environment_vars() if preflight else {})},
+                    )
+                    logger.info(f"detached lammps run spawned: {function_call.object_id=} {queuejob=}")
+                    async for chunk in follow_detached_lammps_job(
+                        function_call,
+                        self.artifact_backend,
+                        posixpath.join(job_dir_in_volume, "log.lammps"),
+                        queuejob_id=queuejob["queuejob_id"] if queuejob else None,
+                    ):
+                        yield chunk
+
+                return StreamingResponse(detached_stream(), media_type="text/event-stream")
+
             response = StreamingResponse(
                 # lammps_simulation_stream.remote_gen(commands),
-                self.personal_lammps_instance.lammps_simulation_stream.remote_gen(commands=commands, job_dir=job_dir, timeout=timeout),
+                stream_after_admission(
+                    ticket,
+                    self.personal_lammps_instance.lammps_simulation_stream.remote_gen.aio(commands=commands, job_dir=job_dir, timeout=timeout,
+                        total_steps=total_steps),
+                ),
                 media_type="text/event-stream"
             )
 
             return response
 
+        @fastapi_app.post("/lammps-ensemble-stream")
+        async def lammps_ensemble_stream_endpoint(
+            request: Request,
+            files: list[UploadFile] = File([], description="The files to run lammps, will be saved to the workdir, with file basename"),
+            commands: str = Form('lmp -in in.lammps', description="The commands to run lammps, the input script must use the seed variable, e.g. `velocity all create 300 ${SEED}`"),
+            job_dir: Optional[str] = Form('/workspace/', description="The job_dir of the ensemble, replicas run in job_dir/ensemble/replica-NNN/"),
+            n_replicas: int = Form(4, ge=1, le=MAX_ENSEMBLE_REPLICAS, description="Number of replicas, they differ in the velocity seed only"),
+            seed_variable: str = Form('SEED', description="The lammps variable each replica gets its seed in (-var SEED <seed>)"),
+            replicas_per_gpu: int = Form(0, ge=0, description="Replicas sharing one GPU. default 0 packs as many as fit in the GPU memory"),
+            equilibration_steps: int = Form(0, ge=0, description="Thermo rows before this step are left out of the time averages"),
+            timeout: Optional[int] = Form(40, description="The timeout of the whole ensemble"),
+            skip_preflight: bool = Form(False, description="Skip the static check of the input script and referenced files"),
+        ):
+            """stream the thermo rows of all replicas as they run, the last event is the aggregated [ENSEMBLE_SUMMARY]"""
+            job_dir_in_volume = workspace_path_to_volume_path(job_dir)
+            await upload_job_files(files, job_dir_in_volume)
+            logger.info(f"lammps ensemble stream in job_dir: {self.owner_user_id=} {commands=} {job_dir=} {n_replicas=}")
+
+            if not skip_preflight:
+                # the replicas get the seed variable on the command line
+                preflight = await preflight_lammps_input(f"{commands} -var {seed_variable} 1 -var REPLICA 0", self.preflight_backends, job_dir)
+                if not preflight.ok:
+                    return JSONResponse({"error": "lammps input failed the preflight check", "preflight": preflight.to_dict()}, status_code=422)
+
+            organization = (AuthMiddleware.get_optional_token_payload(request) or {}).get("organization")
+            ticket = admission_controller.ticket(self.owner_user_id, organization, lease_seconds=(timeout or DEFAULT_LAMMPS_TIMEOUT_SECONDS) + ADMISSION_LEASE_MARGIN_SECONDS)
+            return StreamingResponse(
+                stream_after_admission(
+                    ticket,
+                    self.personal_lammps_instance.lammps_ensemble_stream.remote_gen.aio(commands, job_dir, n_replicas,
+                        seed_variable=seed_variable, replicas_per_gpu=replicas_per_gpu,
+                        equilibration_steps=equilibration_steps, timeout=timeout),
+                ),
+                media_type="text/event-stream"
+            )
+
         return fastapi_app
         # fastapi_app.lifespan = self.personal_agent_instance.get_agent_app().lifespan
 
@@ -0,0 +1,225 @@
+#%%
+import collections
+import json
+import posixpath
+import re
+import shlex
+from typing import Optional, Union
+
+from deepmd_lammps_ensemble import LammpsThermoParser
+from deepmd_volume_paths import workspace_path_to_volume_path
+
+#%%
+# Configuration
+CHARS_PER_TOKEN = 4                  # rough size of a token in lammps output, used to turn token budgets into characters
+DEFAULT_OUTPUT_TOKENS = 3000
+HEAD_LINES = 40
+TAIL_LINES = 40
+MAX_NOTICE_LINES = 40                # errors / warnings, the first and the last half are kept
+MAX_THERMO_ROWS = 64                 # thermo rows are downsampled in place once full
+MAX_LINE_CHARS = 400
+LOG_PAGE_MAX_LINES = 500
+
+NOTICE_PATTERN = re.compile(r"\b(ERROR|WARNING)\b|\[(ERROR|TIMEOUT|EARLY_STOP|ETA_WARNING)\]")
+# periodic samples of the executor stream, only counted
+SAMPLE_PATTERN = re.compile(r"\[DEEPMD\] \[(TELEMETRY|PROGRESS|ENSEMBLE)\] ")
+TELEMETRY_SUMMARY_PATTERN = re.compile(r"\[DEEPMD\] \[TELEMETRY_SUMMARY\] (?P<json>\{.*\})")
+
+#%%
+
+class LammpsOutputCondenser:
+    """
+    Streaming, bounded-memory digest of a lammps run output for tool results:
+    head and tail lines, every error / warning line (capped), a downsampled thermo table
+    and the telemetry summary, rendered within a character budget.
+    """
+
+    def __init__(self, *, head_lines: int = HEAD_LINES, tail_lines: int = TAIL_LINES,
+            max_notice_lines: int = MAX_NOTICE_LINES, max_thermo_rows: int = MAX_THERMO_ROWS):
+        self.head: list[tuple[int, str]] = []
+        self.head_lines = head_lines
+        self.tail: collections.deque[tuple[int, str]] = collections.deque(maxlen=tail_lines)
+        self.first_notices: list[tuple[int, str]] = []
+        self.last_notices: collections.deque[tuple[int, str]] = collections.deque(maxlen=max_notice_lines - max_notice_lines // 2)
+        self.max_first_notices = max_notice_lines // 2
+        self.notice_count = 0
+
+        self.thermo_parser = LammpsThermoParser()
+        self.thermo_columns: Optional[list[str]] = None
+        self.thermo_rows: list[str] = []
+        self.thermo_stride = 1
+        self.thermo_count = 0
+        self.last_thermo_row: Optional[str] = None
+        self.max_thermo_rows = max_thermo_rows
+
+        self.telemetry_summary: Optional[dict] = None
+        self.sample_count = 0
+        self.line_count = 0
+        self.char_count = 0
+
+    def feed(self, line: Union[str, bytes]):
+        if isinstance(line, bytes):
+            line = line.decode(errors="replace")
+        for part in line.splitlines() or [""]:
+            self._feed_line(part)
+
+    def _feed_line(self, line: str):
+        self.char_count += len(line) + 1
+        if SAMPLE_PATTERN.search(line):
+            self.sample_count += 1
+            return
+        match = TELEMETRY_SUMMARY_PATTERN.search(line)
+        if match:
+            self.telemetry_summary = compact_telemetry_summary(match.group("json"))
+            return
+
+        if len(line) > MAX_LINE_CHARS:
+            line = line[:MAX_LINE_CHARS] + f" ... [{len(line) - MAX_LINE_CHARS} chars cut]"
+        index = self.line_count
+        self.line_count += 1
+        if len(self.head) < self.head_lines:
+            self.head.append((index, line))
+        self.tail.append((index, line))
+
+        if NOTICE_PATTERN.search(line):
+            self.notice_count += 1
+            if len(self.first_notices) < self.max_first_notices:
+                self.first_notices.append((index, line))
+            else:
+                self.last_notices.append((index, line))
+
+        if self.thermo_parser.feed_line(line) is not None:
+            self._feed_thermo_row(line.strip())
+        elif self.thermo_parser.columns is not None and self.thermo_columns is None:
+            self.thermo_columns = self.thermo_parser.columns
+
+    def _feed_thermo_row(self, row: str):
+        if self.thermo_parser.columns != self.thermo_columns:
+            # a later run with another thermo_style starts a new table
+            self.thermo_columns = self.thermo_parser.columns
+            self.thermo_rows, self.thermo_stride, self.thermo_count = [], 1, 0
+        index = self.thermo_count
+        self.thermo_count += 1
+        self.last_thermo_row = row
+        if index % self.thermo_stride:
+            return
+        self.thermo_rows.append(row)
+        if len(self.thermo_rows) >= self.max_thermo_rows:
+            self.thermo_rows = self.thermo_rows[::2]
+            self.thermo_stride *= 2
+
+    def render(self, max_chars: int = DEFAULT_OUTPUT_TOKENS * CHARS_PER_TOKEN, *, log_reference: Optional[str] = None) -> str:
+        """the digest, shrinking thermo, head, tail and notices in turn until it fits max_chars"""
+        limits = {"thermo": len(self.thermo_rows), "head": len(self.head), "tail": len(self.tail), "notices": MAX_NOTICE_LINES}
+        text = self._render(limits, log_reference)
+        sections = ["thermo", "head", "tail", "notices"]
+        while len(text) > max_chars and any(limits.values()):
+            section = next(s for s in sections if limits[s])
+            limits[section] //= 2
+            # thermo goes first, then the sections take turns, the notices last
+            sections.append(sections.pop(sections.index(section)))
+            text = self._render(limits, log_reference)
+        if len(text) > max_chars:
+            keep = max(0, max_chars - 80)
+            text = text[:keep // 2] + f"\n... [{len(text) - keep} chars cut to fit the output budget] ...\n" + text[-(keep - keep // 2):]
+        return text
+
+    def _render(self, limits: dict, log_reference: Optional[str]) -> str:
+        head = self.head[:limits["head"]]
+        shown_head = head[-1][0] + 1 if head else 0
+        tail = [(i, line) for i, line in list(self.tail)[len(self.tail) - limits["tail"]:] if i >= shown_head] if limits["tail"] else []
+        omitted = (tail[0][0] if tail else self.line_count) - shown_head
+
+        lines = [f"[condensed output: {self.line_count} lines, {self.char_count} chars, "
+            f"{self.notice_count} errors/warnings, {self.thermo_count} thermo rows, {self.sample_count} telemetry samples]"]
+        lines += [line for _, line in head]
+        if omitted > 0:
+            lines.append(f"... [{omitted} lines omitted] ...")
+
+        notices = [(i, line) for i, line in self.first_notices + list(self.last_notices) if i >= shown_head and (not tail or i < tail[0][0])]
+        if notices:
+            half = limits["notices"] // 2
+            picked = notices if len(notices) <= limits["notices"] else notices[:half] + notices[len(notices) - (limits["notices"] - half):]
+            lines.append(f"--- errors and warnings in the omitted lines ({len(picked)} of {len(notices)} kept) ---")
+            lines += [f"{i + 1}: {line}" for i, line in picked]
+
+        rows = self._thermo_rows(limits["thermo"])
+        if rows:
+            lines.append(f"--- thermo, {len(rows)} of {self.thermo_count} rows ---")
+            lines.append(" ".join(self.thermo_columns))
+            lines += rows
+
+        if tail:
+            lines.append("--- tail ---")
+            lines += [line for _, line in tail]
+        if self.telemetry_summary:
+            lines.append(f"[telemetry] {json.dumps(self.telemetry_summary)}")
+        if log_reference:
+            lines.append(f"[full log: {log_reference}, read it with get_lammps_run_log]")
+        return "\n".join(lines)
+
+    def _thermo_rows(self, limit: int) -> list[str]:
+        if limit <= 0 or not self.thermo_rows:
+            return []
+        stride = -(-len(self.thermo_rows) // limit)
+        rows = self.thermo_rows[::stride]
+        if self.last_thermo_row is not None and rows[-1] != self.last_thermo_row:
+            rows.append(self.last_thermo_row)
+        return rows
+
+
+def compact_telemetry_summary(summary_json: str) -> Optional[dict]:
+    """the telemetry summary without its time series"""
+    try:
+        summary = json.loads(summary_json)
+    except ValueError:
+        return None
+    return {key: value for key, value in summary.items() if key not in ("series", "performance_per_run")}
+
+
+def find_lammps_log_file(commands: str, job_dir: str) -> Optional[str]:
+    """workspace path of the log file the commands write (`-log`, default log.lammps), None for `-log none`"""
+    tokens = shlex.split(commands)
+    log_file = "log.lammps"
+    for i, token in enumerate(tokens[:-1]):
+        if token in ("-log", "-l"):
+            log_file = tokens[i + 1]
+    if log_file == "none":
+        return None
+    return log_file if log_file.startswith("/") else posixpath.join(job_dir, log_file)
+
+
+async def read_log_lines(backend, path: str, *, start_line: int = 0, max_lines: int = 200,
+        pattern: Optional[str] = None) -> dict:
+    """
+    One page of a (possibly huge) log in the volume, streamed with constant memory.
+    With a regex pattern only matching lines are returned. Line numbers are 1-based.
+    """
+    volume_path = workspace_path_to_volume_path(path)
+    entry = await backend.stat(volume_path)
+    if entry is None or entry.is_dir:
+        raise FileNotFoundError(f"log file not found: {path}")
+    max_lines = min(max_lines, LOG_PAGE_MAX_LINES)
+    regex = re.compile(pattern) if pattern else None
+
+    lines, total_lines, last_line, pending = [], 0, start_line, b""
+
+    def take(raw: bytes):
+        nonlocal total_lines, last_line
+        total_lines += 1
+        if total_lines <= start_line or len(lines) >= max_lines:
+            return
+        last_line = total_lines
+        line = raw.decode(errors="replace").rstrip("\r")
+        if regex is None or regex.search(line):
+            lines.append(f"{total_lines}: {line[:MAX_LINE_CHARS]}")
+
+    async for chunk in backend.iter_bytes(volume_path, 0, entry.size):
+        *complete, pending = (pending + chunk).split(b"\n")
+        for raw in complete:
+            take(raw)
+    if pending:
+        take(pending)
+
+    return {"path": path, "size": entry.size, "total_lines": total_lines, "start_line": start_line, "last_line": last_line,
+        "pattern": pattern, "lines": lines, "truncated": last_line < total_lines}
@@ -0,0 +1,120 @@
+#%%
+import os
+from typing import Optional
+
+import requests
+from loguru import logger
+
+#%%
+# Configuration
+# e.g. https://deepmodeling-ai.deepmd.us/api/queue
+DEEPMD_QUEUE_API_BASE = os.getenv("DEEPMD_QUEUE_API_BASE", "")
+QUEUE_API_TIMEOUT_SECONDS = 10
+# shared secret with the queue api, marks the telemetry of the run service (it feeds the shared throughput table)
+QUEUE_TELEMETRY_SERVICE_TOKEN = os.getenv("QUEUE_TELEMETRY_SERVICE_TOKEN", "")
+
+#%%
+
+class DeepmdQueueApiError(Exception):
+    """the queue api answered with a status the caller asked to handle itself (e.g. 404/403)"""
+
+    def __init__(self, status_code: int, detail: str = ""):
+        super().__init__(f"queue api error {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class DeepmdQueueClient:
+    """
+    Thin client of the django batch queue api (/api/queue/).
+    Every call is authenticated with the user's own jwt, so records always belong to the caller.
+    All methods return None (and log) when the api is not configured or not reachable,
+    the queue bookkeeping must never break a simulation.
+    """
+
+    def __init__(self, api_base: str = DEEPMD_QUEUE_API_BASE, *, timeout: int = QUEUE_API_TIMEOUT_SECONDS,
+            telemetry_service_token: str = QUEUE_TELEMETRY_SERVICE_TOKEN):
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.telemetry_service_token = telemetry_service_token
+        self.session = requests.Session()
+
+    @property
+    def is_configured(self) -> bool:
+        return bool(self.api_base)
+
+    def _request(self, method: str, path: str, auth_token: Optional[str], *,
+            passthrough_statuses: tuple[int, ...] = (), headers: Optional[dict] = None, **kwargs) -> Optional[dict]:
+        if not self.is_configured:
+            logger.info(f"queue api not configured, skip {method} {path}.")
+            return None
+        if not auth_token:
+            logger.warning(f"no auth token for queue api, skip {method} {path}.")
+            return None
+
+        try:
+            response = self.session.request(
+                method,
+                f"{self.api_base}{path}",
+                headers={"Authorization": f"Bearer {auth_token}", **(headers or {})},
+                timeout=self.timeout,
+                **kwargs,
+            )
+        except requests.RequestException as e:
+            logger.warning(f"queue api request failed: {method} {path} {e=}")
+            return None
+
+        if response.status_code in passthrough_statuses:
+            raise DeepmdQueueApiError(response.status_code, response.text)
+        if response.status_code >= 400:
+            logger.warning(f"queue api error: {method} {path} {response.status_code=} {response.text=}")
+            return None
+        return response.json()
+
+    def create_job(self, auth_token: Optional[str], *, modal_function_call_id: str, modal_function_name: str,
+            command: str = "", queuejob_name: str = "Untitled Queuejob", queuejob_type: str = "LAMMPS_SIMULATION",
+            modal_app_name: str = "deepmd-run-service", modal_volume_name: str = "",
+            environment_vars: Optional[dict] = None, parent_queuejob_id: str = "", attempt_index: int = 0) -> Optional[dict]:
+        return self._request("POST", "/jobs", auth_token, json={
+            "queuejob_name": queuejob_name,
+            "queuejob_type": queuejob_type,
+            "modal_function_call_id": modal_function_call_id,
+            "modal_app_name": modal_app_name,
+            "modal_function_name": modal_function_name,
+            "modal_volume_name": modal_volume_name,
+            "command": command,
+            "environment_vars": environment_vars or {},
+            "parent_queuejob_id": parent_queuejob_id,
+            "attempt_index": attempt_index,
+        })
+
+    def get_job(self, auth_token: Optional[str], job_id: str) -> Optional[dict]:
+        """raises DeepmdQueueApiError if the auth token is rejected, the job does not exist or belongs to another user"""
+        return self._request("GET", f"/jobs/{job_id}", auth_token, passthrough_statuses=(401, 403, 404))
+
+    def list_jobs(self, auth_token: Optional[str], *, status: str = "", queuejob_type: str = "",
+            include_attempts: bool = False, limit: int = 20) -> Optional[dict]:
+        """recent jobs of the caller, newest first"""
+        return self._request("GET", "/jobs", auth_token, params={
+            "status": status, "queuejob_type": queuejob_type, "include_attempts": include_attempts, "limit": limit})
+
+    def update_status(self, auth_token: Optional[str], job_id: str, status: str, message: str = "", *,
+            current_modal_function_call_id: str = "") -> Optional[dict]:
+        return self._request("POST", f"/jobs/{job_id}/status", auth_token, json={"status": status, "message": message,
+            "current_modal_function_call_id": current_modal_function_call_id})
+
+    def record_telemetry(self, auth_token: Optional[str], job_id: str, telemetry: dict, status: str = "", message: str = "") -> Optional[dict]:
+        headers = {"X-Telemetry-Service-Token": self.telemetry_service_token} if self.telemetry_service_token else None
+        return self._request("POST", f"/jobs/{job_id}/telemetry", auth_token, headers=headers,
+            json={"telemetry": telemetry, "status": status, "message": message})
+
+    def estimate_runtime(self, auth_token: Optional[str], model: str, atoms: int, steps: int) -> Optional[dict]:
+        """runtime, suggested timeout and gpu type from the throughput of completed jobs"""
+        return self._request("GET", "/throughput/estimate", auth_token, params={"model": model, "atoms": atoms, "steps": steps})
+
+    def cancel_job(self, auth_token: Optional[str], job_id: str) -> Optional[dict]:
+        """raises DeepmdQueueApiError if the job does not exist, belongs to another user or the cancel failed"""
+        return self._request("POST", f"/jobs/{job_id}/cancel", auth_token, passthrough_statuses=(403, 404, 502))
+
+
+queue_client = DeepmdQueueClient()
@@ -0,0 +1,123 @@
+#%%
+import time
+from typing import Callable, Optional, Union
+
+from loguru import logger
+
+from deepmd_lammps_ensemble import LammpsThermoParser
+
+#%%
+# Configuration
+PROGRESS_MIN_ELAPSED_SECONDS = 60    # no verdict before the run had a minute (or a fifth of a short budget) to get going
+PROGRESS_MIN_BUDGET_FRACTION = 0.2
+PROGRESS_MIN_FRACTION = 0.01         # ... and finished 1% of its steps
+EARLY_STOP_MARGIN = 1.5              # stop only if the projected runtime misses the budget by 50%
+PROGRESS_EVENT_SECONDS = 30          # minimum interval of progress events in streams
+
+VERDICT_UNKNOWN = "unknown"          # total steps unknown (loops, variable run lengths) or too early
+VERDICT_ON_TRACK = "on_track"
+VERDICT_AT_RISK = "at_risk"          # projected runtime above the budget
+VERDICT_WILL_TIME_OUT = "will_time_out"
+
+#%%
+
+class LammpsProgressEstimator:
+    """
+    Online ETA of a lammps run from the Step column of its thermo output.
+    total_steps comes from the preflight (sum of the `run N` of the input), steps of consecutive
+    runs are accumulated so `reset_timestep` and several runs are fine.
+    The rate is the average over the current run after its first thermo row, which excludes
+    the setup time and is robust to the block-buffered output of lmp in a pipe
+    (`thermo_modify flush yes` gives smoother estimates).
+    """
+
+    def __init__(self, total_steps: Optional[int], budget_seconds: Optional[float], *, clock: Callable[[], float] = time.monotonic):
+        self.total_steps = total_steps
+        self.budget_seconds = budget_seconds
+        self.clock = clock
+        self.started_at = clock()
+        self.parser = LammpsThermoParser()
+
+        self.completed_run_steps = 0
+        self.steps_per_second: Optional[float] = None
+        self._run_index = -1
+        self._run_first_step: Optional[int] = None
+        self._run_last_step: Optional[int] = None
+        self._rate_origin: Optional[tuple[int, float]] = None
+        self._last_event_at = float("-inf")
+
+    @property
+    def steps_done(self) -> int:
+        if self._run_first_step is None:
+            return self.completed_run_steps
+        return self.completed_run_steps + self._run_last_step - self._run_first_step
+
+    def feed_output_line(self, line: Union[str, bytes]) -> bool:
+        """True if the line was a thermo row"""
+        row = self.parser.feed_line(line)
+        if row is None:
+            return False
+        self.feed_step(int(row[0]), run_index=self.parser.run_index)
+        return True
+
+    def feed_step(self, step: int, *, run_index: int, now: Optional[float] = None):
+        now = self.clock() if now is None else now
+        if run_index != self._run_index:
+            if self._run_first_step is not None:
+                self.completed_run_steps += self._run_last_step - self._run_first_step
+            self._run_index = run_index
+            self._run_first_step = step
+            self._rate_origin = (step, now)
+        self._run_last_step = step
+
+        origin_step, origin_time = self._rate_origin
+        if step > origin_step and now > origin_time:
+            self.steps_per_second = (step - origin_step) / (now - origin_time)
+
+    def progress(self) -> dict:
+        elapsed = self.clock() - self.started_at
+        fraction = eta = projected = None
+        if self.total_steps:
+            fraction = min(1.0, self.steps_done / self.total_steps)
+            if self.steps_per_second:
+                eta = max(0, self.total_steps - self.steps_done) / self.steps_per_second
+                projected = elapsed + eta
+
+        verdict = VERDICT_UNKNOWN
+        min_elapsed = PROGRESS_MIN_ELAPSED_SECONDS
+        if self.budget_seconds:
+            min_elapsed = min(min_elapsed, self.budget_seconds * PROGRESS_MIN_BUDGET_FRACTION)
+        if projected is not None and elapsed >= min_elapsed and fraction >= PROGRESS_MIN_FRACTION:
+            if not self.budget_seconds or projected <= self.budget_seconds:
+                verdict = VERDICT_ON_TRACK
+            elif projected <= self.budget_seconds * EARLY_STOP_MARGIN:
+                verdict = VERDICT_AT_RISK
+            else:
+                verdict = VERDICT_WILL_TIME_OUT
+
+        return {
+            "steps_done": self.steps_done,
+            "total_steps": self.total_steps,
+            "fraction": None if fraction is None else round(fraction, 4),
+            "steps_per_second": None if self.steps_per_second is None else round(self.steps_per_second, 3),
+            "elapsed_seconds": round(elapsed, 1),
+            "eta_seconds": None if eta is None else round(eta, 1),
+            "projected_seconds": None if projected is None else round(projected, 1),
+            "budget_seconds": self.budget_seconds,
+            "verdict": verdict,
+        }
+
+    def pop_progress_event(self, interval: float = PROGRESS_EVENT_SECONDS) -> Optional[dict]:
+        """the progress at most every `interval` seconds, for streams"""
+        now = self.clock()
+        if now - self._last_event_at < interval or self._run_first_step is None:
+            return None
+        self._last_event_at = now
+        return self.progress()
+
+
+def log_progress_verdict(progress: dict, job_dir: str):
+    if progress["verdict"] == VERDICT_AT_RISK:
+        logger.warning(f"lammps run will likely exceed its timeout: {job_dir=} {progress=}")
+    elif progress["verdict"] == VERDICT_WILL_TIME_OUT:
+        logger.warning(f"lammps run cannot finish within its timeout, stopping early: {job_dir=} {progress=}")
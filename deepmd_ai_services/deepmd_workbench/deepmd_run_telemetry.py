@@ -0,0 +1,278 @@
+#%%
+import asyncio
+import collections
+import os
+import re
+import shutil
+import time
+from typing import Optional, Union
+
+from loguru import logger
+
+try:
+    import psutil
+except ImportError:  # optional, falls back to /proc
+    psutil = None
+
+#%%
+# Configuration
+DEFAULT_TELEMETRY_INTERVAL_SECONDS = 5
+MAX_TELEMETRY_SAMPLES = 512          # series is downsampled in place once full
+MAX_GPU_SAMPLE_FAILURES = 3          # consecutive nvidia-smi failures before gpu sampling is disabled
+
+TELEMETRY_FIELDS = ("t", "cpu_percent", "rss_mb", "gpu_util_percent", "gpu_mem_mb")
+
+# Performance: 0.864 ns/day, 27.778 hours/ns, 10.000 timesteps/s, 32.000 katom-step/s
+LAMMPS_PERFORMANCE_PATTERN = re.compile(r"^\s*Performance:\s*(?P<body>.+)$")
+LAMMPS_PERFORMANCE_ITEM_PATTERN = re.compile(r"(?P<value>[-+\d.eE]+)\s+(?P<unit>[\w/-]+)")
+# Loop time of 12.3456 on 1 procs for 1000 steps with 3000 atoms
+LAMMPS_LOOP_TIME_PATTERN = re.compile(
+    r"^\s*Loop time of (?P<seconds>[\d.eE+-]+) on (?P<procs>\d+) procs for (?P<steps>\d+) steps with (?P<atoms>\d+) atoms"
+)
+
+PERFORMANCE_UNIT_KEYS = {
+    "ns/day": "ns_per_day",
+    "hours/ns": "hours_per_ns",
+    "tau/day": "tau_per_day",
+    "timesteps/s": "timesteps_per_second",
+    "katom-step/s": "katom_steps_per_second",
+}
+
+#%%
+
+def parse_lammps_performance_line(line: Union[str, bytes]) -> Optional[dict]:
+    """parse the `Performance:` / `Loop time of` summary lines printed by LAMMPS after each run."""
+    if isinstance(line, bytes):
+        line = line.decode(errors="replace")
+
+    match = LAMMPS_PERFORMANCE_PATTERN.match(line)
+    if match:
+        performance = {}
+        for item in LAMMPS_PERFORMANCE_ITEM_PATTERN.finditer(match.group("body")):
+            key = PERFORMANCE_UNIT_KEYS.get(item.group("unit"))
+            if key:
+                performance[key] = float(item.group("value"))
+        return performance or None
+
+    match = LAMMPS_LOOP_TIME_PATTERN.match(line)
+    if match:
+        return {
+            "loop_time_seconds": float(match.group("seconds")),
+            "procs": int(match.group("procs")),
+            "steps": int(match.group("steps")),
+            "atoms": int(match.group("atoms")),
+        }
+    return None
+
+
+class LammpsRunTelemetry:
+    """
+    Resource sampler running alongside a LAMMPS process.
+    Records CPU%, RSS and (if nvidia-smi is available) GPU utilization/memory into a compact
+    columnar time series, and collects the LAMMPS performance summary from the output lines.
+    """
+
+    def __init__(self, pid: int, *, interval: float = DEFAULT_TELEMETRY_INTERVAL_SECONDS, max_samples: int = MAX_TELEMETRY_SAMPLES):
+        self.pid = pid
+        self.interval = interval
+        self.max_samples = max_samples
+
+        self.series = {field: [] for field in TELEMETRY_FIELDS}
+        self.performance = []
+        self.sample_stride = 1
+        self._sample_count = 0
+        self._pending_samples = collections.deque(maxlen=max_samples)
+
+        self._started_at = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._last_cpu_times = None
+        self._nvidia_smi = shutil.which("nvidia-smi")
+        self._gpu_sample_failures = 0
+        self._process = None
+        self.gpu_name: Optional[str] = None
+
+        if psutil is not None:
+            try:
+                self._process = psutil.Process(pid)
+                self._process.cpu_percent(None)  # prime the counter
+            except psutil.Error as e:
+                # the process may already be gone (e.g. lammps failed on startup)
+                logger.warning(f"telemetry cannot attach to process: {pid=} {e=}")
+                self._process = None
+
+    async def start(self):
+        self.gpu_name = await self._query_gpu_name()
+        self._task = asyncio.create_task(self._sample_loop())
+        return self
+
+    async def stop(self) -> dict:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        return self.summary()
+
+    def feed_output_line(self, line: Union[str, bytes]):
+        performance = parse_lammps_performance_line(line)
+        if performance is None:
+            return
+        # `Loop time` comes first, `Performance` right after, both belong to the same run
+        if "loop_time_seconds" in performance or not self.performance or "timesteps_per_second" in self.performance[-1]:
+            self.performance.append(performance)
+        else:
+            self.performance[-1].update(performance)
+
+    def pop_pending_samples(self) -> list[dict]:
+        samples = list(self._pending_samples)
+        self._pending_samples.clear()
+        return samples
+
+    def summary(self) -> dict:
+        columns = {field: values for field, values in self.series.items() if any(v is not None for v in values)}
+
+        def _peak(field):
+            values = [v for v in self.series[field] if v is not None]
+            return max(values) if values else None
+
+        return {
+            "interval_seconds": self.interval * self.sample_stride,
+            "elapsed_seconds": round(time.monotonic() - self._started_at, 3),
+            "gpu_available": self._nvidia_smi is not None,
+            "gpu_name": self.gpu_name,
+            "peak_cpu_percent": _peak("cpu_percent"),
+            "peak_rss_mb": _peak("rss_mb"),
+            "peak_gpu_util_percent": _peak("gpu_util_percent"),
+            "peak_gpu_mem_mb": _peak("gpu_mem_mb"),
+            "performance": self.performance[-1] if self.performance else None,
+            "performance_per_run": self.performance,
+            "series": columns,
+        }
+
+    async def _sample_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                sample = await self.sample()
+            except Exception as e:
+                logger.warning(f"telemetry sample failed: {self.pid=} {e=}")
+                continue
+            self._record(sample)
+
+    async def sample(self) -> dict:
+        cpu_percent, rss_mb = self._sample_cpu_and_memory()
+        gpu_util_percent, gpu_mem_mb = await self._sample_gpu()
+        return {
+            "t": round(time.monotonic() - self._started_at, 1),
+            "cpu_percent": cpu_percent,
+            "rss_mb": rss_mb,
+            "gpu_util_percent": gpu_util_percent,
+            "gpu_mem_mb": gpu_mem_mb,
+        }
+
+    def _record(self, sample: dict):
+        self._pending_samples.append(sample)
+        sample_index = self._sample_count
+        self._sample_count += 1
+        # the series keeps the samples whose index is a multiple of the stride
+        if sample_index % self.sample_stride:
+            return
+
+        for field in TELEMETRY_FIELDS:
+            self.series[field].append(sample[field])
+
+        if len(self.series["t"]) >= self.max_samples:
+            # keep every other sample, halve the resolution of the rest of the run
+            for field in TELEMETRY_FIELDS:
+                self.series[field] = self.series[field][::2]
+            self.sample_stride *= 2
+
+    def _sample_cpu_and_memory(self) -> tuple[Optional[float], Optional[float]]:
+        if self._process is not None:
+            try:
+                processes = [self._process] + self._process.children(recursive=True)
+                cpu_percent = sum(p.cpu_percent(None) for p in processes)
+                rss = sum(p.memory_info().rss for p in processes)
+                return round(cpu_percent, 1), round(rss / 2**20, 1)
+            except psutil.Error:
+                return None, None
+        return self._sample_proc_stat()
+
+    def _sample_proc_stat(self) -> tuple[Optional[float], Optional[float]]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{self.pid}/statm") as f:
+                rss_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None, None
+
+        # utime and stime are fields 14 and 15 of /proc/<pid>/stat (index 11 and 12 after the comm field)
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        now = time.monotonic()
+        cpu_percent = None
+        if self._last_cpu_times is not None:
+            last_cpu_seconds, last_now = self._last_cpu_times
+            if now > last_now:
+                cpu_percent = round(100 * (cpu_seconds - last_cpu_seconds) / (now - last_now), 1)
+        self._last_cpu_times = (cpu_seconds, now)
+        return cpu_percent, round(rss_pages * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+
+    async def _query_gpu_name(self) -> Optional[str]:
+        """e.g. `Tesla T4`, the key of the throughput table"""
+        if self._nvidia_smi is None:
+            return None
+        process = None
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self._nvidia_smi, "--query-gpu=name", "--format=csv,noheader",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout=self.interval)
+        except (OSError, asyncio.TimeoutError) as e:
+            if process is not None and process.returncode is None:
+                process.kill()
+                await process.wait()
+            logger.warning(f"nvidia-smi gpu name query failed: {e=}")
+            return None
+        names = [line.strip() for line in stdout.decode().splitlines() if line.strip()]
+        return names[0] if names else None
+
+    async def _sample_gpu(self) -> tuple[Optional[float], Optional[float]]:
+        if self._nvidia_smi is None:
+            return None, None
+        process = None
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self._nvidia_smi,
+                "--query-gpu=utilization.gpu,memory.used",
+                "--format=csv,noheader,nounits",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout=self.interval)
+            rows = [line.split(",") for line in stdout.decode().strip().splitlines() if line.strip()]
+            gpu_util_percent = sum(float(row[0]) for row in rows)
+            gpu_mem_mb = sum(float(row[1]) for row in rows)
+        except FileNotFoundError as e:
+            logger.warning(f"nvidia-smi not found, disabling gpu telemetry: {e=}")
+            self._nvidia_smi = None
+            return None, None
+        except (OSError, ValueError, IndexError, asyncio.TimeoutError) as e:
+            if process is not None and process.returncode is None:
+                # do not leave a hung nvidia-smi behind on timeout
+                process.kill()
+                await process.wait()
+            self._gpu_sample_failures += 1
+            if self._gpu_sample_failures >= MAX_GPU_SAMPLE_FAILURES:
+                logger.warning(f"nvidia-smi sampling failed {self._gpu_sample_failures} times, disabling gpu telemetry: {e=}")
+                self._nvidia_smi = None
+            else:
+                logger.warning(f"nvidia-smi sampling failed: {self._gpu_sample_failures=} {e=}")
+            return None, None
+
+        self._gpu_sample_failures = 0
+        return gpu_util_percent, gpu_mem_mb
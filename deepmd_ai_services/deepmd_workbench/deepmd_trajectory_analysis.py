@@ -0,0 +1,368 @@
+#%%
+import itertools
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+#%%
+# Configuration
+DEFAULT_RDF_BINS = 200
+DEFAULT_DENSITY_BINS = 100
+PAIR_BLOCK_ELEMENTS = 4 * 1024**2     # rows x atoms per distance block, bounds the rdf kernel memory
+FRAMES_PER_TASK = 16
+SUMMARY_MAX_POINTS = 100
+
+SUPPORTED_ANALYSES = ("rdf", "msd", "density")
+
+#%%
+
+class LammpsDumpFormatError(ValueError):
+    pass
+
+
+def iter_lammps_dump_frames(dump_path: str) -> Iterator[dict]:
+    """
+    Read a LAMMPS text dump (`dump custom`/`dump atom`) one frame at a time.
+    Yields dict(timestep, box (3, 2) lo/hi, columns, data (n_atoms, n_columns) float64).
+    """
+    with open(dump_path, "rb") as f:
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            if not line.startswith(b"ITEM: TIMESTEP"):
+                continue
+
+            try:
+                timestep = int(f.readline())
+                if not f.readline().startswith(b"ITEM: NUMBER OF ATOMS"):
+                    raise LammpsDumpFormatError(f"expected NUMBER OF ATOMS after timestep {timestep} in {dump_path}")
+                n_atoms = int(f.readline())
+            except ValueError as e:
+                if isinstance(e, LammpsDumpFormatError):
+                    raise
+                raise LammpsDumpFormatError(f"truncated or malformed frame header in {dump_path}: {e}") from e
+
+            box_header = f.readline()
+            if not box_header.startswith(b"ITEM: BOX BOUNDS"):
+                raise LammpsDumpFormatError(f"expected BOX BOUNDS after timestep {timestep} in {dump_path}")
+            box = np.array([f.readline().split()[:2] for _ in range(3)], dtype=np.float64)
+            triclinic = b"xy" in box_header
+
+            atoms_header = f.readline()
+            if not atoms_header.startswith(b"ITEM: ATOMS"):
+                raise LammpsDumpFormatError(f"expected ATOMS after timestep {timestep} in {dump_path}")
+            columns = atoms_header.decode().split()[2:]
+
+            rows = b" ".join(itertools.islice(f, n_atoms)).split()
+            if len(rows) != n_atoms * len(columns):
+                raise LammpsDumpFormatError(f"truncated frame at timestep {timestep} in {dump_path}")
+            data = np.array(rows, dtype=np.float64).reshape(n_atoms, len(columns))
+
+            yield {"timestep": timestep, "box": box, "triclinic": triclinic, "columns": columns, "data": data}
+
+
+def _frame_positions(frame: dict) -> tuple[np.ndarray, np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """(ids, types, wrapped positions, image-unwrapped positions or None) sorted by atom id"""
+    columns = {name: index for index, name in enumerate(frame["columns"])}
+    data = frame["data"]
+    box = frame["box"]
+    lengths = box[:, 1] - box[:, 0]
+
+    if "id" not in columns:
+        raise LammpsDumpFormatError(f"dump has no `id` column: {frame['columns']=}")
+    order = np.argsort(data[:, columns["id"]], kind="stable")
+    data = data[order]
+    ids = data[:, columns["id"]].astype(np.int64)
+    types = data[:, columns["type"]].astype(np.int64) if "type" in columns else np.ones(len(ids), dtype=np.int64)
+
+    unwrapped = None
+    if all(c in columns for c in ("x", "y", "z")):
+        positions = data[:, [columns["x"], columns["y"], columns["z"]]]
+        if all(c in columns for c in ("ix", "iy", "iz")):
+            unwrapped = positions + data[:, [columns["ix"], columns["iy"], columns["iz"]]] * lengths
+    elif all(c in columns for c in ("xu", "yu", "zu")):
+        unwrapped = data[:, [columns["xu"], columns["yu"], columns["zu"]]]
+        positions = box[:, 0] + np.mod(unwrapped - box[:, 0], lengths)
+    elif all(c in columns for c in ("xs", "ys", "zs")):
+        positions = box[:, 0] + data[:, [columns["xs"], columns["ys"], columns["zs"]]] * lengths
+        if all(c in columns for c in ("ix", "iy", "iz")):
+            unwrapped = positions + data[:, [columns["ix"], columns["iy"], columns["iz"]]] * lengths
+    else:
+        raise LammpsDumpFormatError(f"dump has no x/y/z, xu/yu/zu or xs/ys/zs columns: {frame['columns']=}")
+
+    return ids, types, positions, unwrapped
+
+
+class MemmapTrajectory:
+    """
+    A dump converted frame by frame into memory-mapped float32 arrays on local disk:
+    positions (wrapped) and unwrapped positions of shape (n_frames, n_atoms, 3), boxes (n_frames, 3, 2).
+    Only one frame is held in memory while converting.
+    """
+
+    def __init__(self, work_dir: str, n_frames: int, n_atoms: int, types: np.ndarray, timesteps: np.ndarray, boxes: np.ndarray, triclinic: bool):
+        self.work_dir = work_dir
+        self.n_frames = n_frames
+        self.n_atoms = n_atoms
+        self.types = types
+        self.timesteps = timesteps
+        self.boxes = boxes
+        self.triclinic = triclinic
+
+    @property
+    def positions_path(self) -> str:
+        return os.path.join(self.work_dir, "positions.f32")
+
+    @property
+    def unwrapped_path(self) -> str:
+        return os.path.join(self.work_dir, "unwrapped.f32")
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return (self.n_frames, self.n_atoms, 3)
+
+    def positions(self) -> np.ndarray:
+        return np.memmap(self.positions_path, dtype=np.float32, mode="r", shape=self.shape)
+
+    def unwrapped(self) -> np.ndarray:
+        return np.memmap(self.unwrapped_path, dtype=np.float32, mode="r", shape=self.shape)
+
+    @classmethod
+    def from_dump(cls, dump_path: str, work_dir: str, *, stride: int = 1, max_frames: Optional[int] = None) -> "MemmapTrajectory":
+        timesteps, boxes = [], []
+        types = None
+        n_atoms = None
+        triclinic = False
+        previous_wrapped = previous_unwrapped = None
+
+        with open(os.path.join(work_dir, "positions.f32"), "wb") as positions_file, \
+                open(os.path.join(work_dir, "unwrapped.f32"), "wb") as unwrapped_file:
+            frames = itertools.islice(iter_lammps_dump_frames(dump_path), 0, None, stride)
+            for frame in itertools.islice(frames, max_frames):
+                ids, frame_types, positions, unwrapped = _frame_positions(frame)
+                if n_atoms is None:
+                    n_atoms, types = len(ids), frame_types
+                elif len(ids) != n_atoms:
+                    raise LammpsDumpFormatError(f"atom count changed at timestep {frame['timestep']}: {len(ids)} != {n_atoms}")
+
+                lengths = frame["box"][:, 1] - frame["box"][:, 0]
+                if unwrapped is None:
+                    # no image flags: unwrap by accumulating minimum image displacements
+                    if previous_wrapped is None:
+                        unwrapped = positions.copy()
+                    else:
+                        delta = positions - previous_wrapped
+                        delta -= lengths * np.round(delta / lengths)
+                        unwrapped = previous_unwrapped + delta
+                previous_wrapped, previous_unwrapped = positions, unwrapped
+
+                positions.astype(np.float32).tofile(positions_file)
+                unwrapped.astype(np.float32).tofile(unwrapped_file)
+                timesteps.append(frame["timestep"])
+                boxes.append(frame["box"])
+                triclinic = triclinic or frame["triclinic"]
+
+        if n_atoms is None:
+            raise LammpsDumpFormatError(f"no frames found in {dump_path}")
+
+        return cls(work_dir, len(timesteps), n_atoms, types, np.array(timesteps), np.array(boxes), triclinic)
+
+#%%
+# vectorized kernels, run per chunk of frames (in a worker process when parallel)
+
+def _rdf_histogram(positions: np.ndarray, lengths: np.ndarray, mask_a: np.ndarray, mask_b: np.ndarray, r_max: float, n_bins: int) -> np.ndarray:
+    """pair distance histogram of one frame, minimum image convention, orthogonal box"""
+    positions_a = positions[mask_a]
+    positions_b = positions[mask_b]
+    index_a = np.flatnonzero(mask_a)
+    index_b = np.flatnonzero(mask_b)
+    histogram = np.zeros(n_bins, dtype=np.int64)
+    block = max(1, PAIR_BLOCK_ELEMENTS // max(len(positions_b), 1))
+
+    for start in range(0, len(positions_a), block):
+        delta = positions_a[start:start + block, None, :] - positions_b[None, :, :]
+        delta -= lengths * np.round(delta / lengths)
+        distances = np.sqrt(np.einsum("ijk,ijk->ij", delta, delta))
+        # exclude self pairs
+        distances[index_a[start:start + block, None] == index_b[None, :]] = np.inf
+        bins = (distances[distances < r_max] * (n_bins / r_max)).astype(np.int64)
+        histogram += np.bincount(bins, minlength=n_bins)[:n_bins]
+    return histogram
+
+
+def _analyze_frame_chunk(trajectory: MemmapTrajectory, start: int, stop: int, params: dict) -> dict:
+    positions = trajectory.positions()
+    unwrapped = trajectory.unwrapped()
+    types = trajectory.types
+    result = {}
+
+    if "rdf" in params["analyses"]:
+        mask_a = np.isin(types, params["rdf_types_a"]) if params["rdf_types_a"] else np.ones(len(types), dtype=bool)
+        mask_b = np.isin(types, params["rdf_types_b"]) if params["rdf_types_b"] else np.ones(len(types), dtype=bool)
+        histogram = np.zeros(params["rdf_bins"], dtype=np.int64)
+        volumes = 0.0
+        for frame in range(start, stop):
+            lengths = trajectory.boxes[frame, :, 1] - trajectory.boxes[frame, :, 0]
+            histogram += _rdf_histogram(np.asarray(positions[frame], dtype=np.float64), lengths, mask_a, mask_b, params["rdf_r_max"], params["rdf_bins"])
+            volumes += float(np.prod(lengths))
+        result["rdf_histogram"] = histogram
+        result["rdf_volume_sum"] = volumes
+
+    if "density" in params["analyses"]:
+        axis = params["density_axis"]
+        counts = np.zeros((len(params["type_ids"]), params["density_bins"]), dtype=np.int64)
+        bin_volume_sum = 0.0
+        for frame in range(start, stop):
+            box = trajectory.boxes[frame]
+            lengths = box[:, 1] - box[:, 0]
+            fractions = (np.asarray(positions[frame, :, axis], dtype=np.float64) - box[axis, 0]) / lengths[axis]
+            bins = np.clip((fractions * params["density_bins"]).astype(np.int64), 0, params["density_bins"] - 1)
+            for row, type_id in enumerate(params["type_ids"]):
+                counts[row] += np.bincount(bins[types == type_id], minlength=params["density_bins"])
+            bin_volume_sum += float(np.prod(lengths)) / params["density_bins"]
+        result["density_counts"] = counts
+        result["density_bin_volume_sum"] = bin_volume_sum
+
+    if "msd" in params["analyses"]:
+        reference = np.asarray(unwrapped[0], dtype=np.float64)
+        displacement = np.asarray(unwrapped[start:stop], dtype=np.float64) - reference
+        result["msd"] = np.einsum("fij,fij->f", displacement, displacement) / trajectory.n_atoms
+
+    return result
+
+
+def _analyze_frame_chunk_task(args):
+    return _analyze_frame_chunk(*args)
+
+#%%
+
+def _downsample(x: np.ndarray, y: np.ndarray, max_points: int = SUMMARY_MAX_POINTS) -> tuple[list, list]:
+    step = max(1, int(np.ceil(len(x) / max_points)))
+    return np.round(x[::step], 4).tolist(), np.round(y[..., ::step], 5).tolist()
+
+
+def analyze_lammps_dump(
+    dump_path: str,
+    analyses: Sequence[str] = SUPPORTED_ANALYSES,
+    *,
+    rdf_types_a: Sequence[int] = (),
+    rdf_types_b: Sequence[int] = (),
+    rdf_r_max: Optional[float] = None,
+    rdf_bins: int = DEFAULT_RDF_BINS,
+    density_axis: int = 2,
+    density_bins: int = DEFAULT_DENSITY_BINS,
+    timestep_ps: Optional[float] = None,
+    stride: int = 1,
+    max_frames: Optional[int] = None,
+    workers: int = 1,
+    work_dir: Optional[str] = None,
+) -> dict:
+    """
+    Streaming RDF / MSD / density profile analysis of a LAMMPS text dump.
+    The dump is converted frame by frame into memory-mapped arrays, the kernels run over
+    chunks of frames (optionally in a process pool), so memory stays bounded for dumps larger than RAM.
+    Returns a compact, json serializable summary.
+    """
+    analyses = [analysis for analysis in analyses if analysis in SUPPORTED_ANALYSES]
+    if not analyses:
+        raise ValueError(f"no supported analysis requested, choose from {SUPPORTED_ANALYSES}")
+
+    started_at = time.monotonic()
+    with tempfile.TemporaryDirectory(dir=work_dir, prefix="deepmd-trajectory-") as scratch_dir:
+        trajectory = MemmapTrajectory.from_dump(dump_path, scratch_dir, stride=stride, max_frames=max_frames)
+        converted_at = time.monotonic()
+
+        min_length = float(np.min(trajectory.boxes[:, :, 1] - trajectory.boxes[:, :, 0]))
+        type_ids = sorted(int(t) for t in np.unique(trajectory.types))
+        params = {
+            "analyses": analyses,
+            "rdf_types_a": list(rdf_types_a or ()),
+            "rdf_types_b": list(rdf_types_b or ()),
+            "rdf_r_max": min(rdf_r_max or min_length / 2, min_length / 2),
+            "rdf_bins": rdf_bins,
+            "density_axis": density_axis,
+            "density_bins": density_bins,
+            "type_ids": type_ids,
+        }
+
+        chunks = [(trajectory, start, min(start + FRAMES_PER_TASK, trajectory.n_frames), params)
+            for start in range(0, trajectory.n_frames, FRAMES_PER_TASK)]
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                partials = list(pool.map(_analyze_frame_chunk_task, chunks))
+        else:
+            partials = [_analyze_frame_chunk_task(chunk) for chunk in chunks]
+
+    summary = {
+        "dump_path": dump_path,
+        "n_frames": trajectory.n_frames,
+        "n_atoms": trajectory.n_atoms,
+        "atom_types": {str(type_id): int(np.sum(trajectory.types == type_id)) for type_id in type_ids},
+        "timesteps": [int(trajectory.timesteps[0]), int(trajectory.timesteps[-1])],
+        "triclinic": trajectory.triclinic,
+        "timing_seconds": {
+            "convert": round(converted_at - started_at, 3),
+            "analyze": round(time.monotonic() - converted_at, 3),
+        },
+    }
+    if trajectory.triclinic:
+        summary["warning"] = "triclinic box detected, distances use the orthogonal bounds only"
+
+    if "rdf" in analyses:
+        histogram = sum(partial["rdf_histogram"] for partial in partials)
+        mean_volume = sum(partial["rdf_volume_sum"] for partial in partials) / trajectory.n_frames
+        n_a = int(np.sum(np.isin(trajectory.types, params["rdf_types_a"]))) if params["rdf_types_a"] else trajectory.n_atoms
+        n_b = int(np.sum(np.isin(trajectory.types, params["rdf_types_b"]))) if params["rdf_types_b"] else trajectory.n_atoms
+        edges = np.linspace(0, params["rdf_r_max"], rdf_bins + 1)
+        shell_volumes = 4 / 3 * np.pi * (edges[1:] ** 3 - edges[:-1] ** 3)
+        g_r = histogram / (trajectory.n_frames * n_a * (n_b / mean_volume) * shell_volumes)
+        r = (edges[1:] + edges[:-1]) / 2
+        peak = int(np.argmax(g_r))
+        r_points, g_points = _downsample(r, g_r)
+        summary["rdf"] = {
+            "types_a": params["rdf_types_a"] or "all",
+            "types_b": params["rdf_types_b"] or "all",
+            "r_max": round(params["rdf_r_max"], 4),
+            "first_peak": {"r": round(float(r[peak]), 4), "g": round(float(g_r[peak]), 4)},
+            "r": r_points,
+            "g": g_points,
+        }
+
+    if "msd" in analyses:
+        msd = np.concatenate([partial["msd"] for partial in partials])
+        steps = (trajectory.timesteps - trajectory.timesteps[0]).astype(np.float64)
+        # diffusion coefficient from the second half of the msd curve (einstein relation, 3d).
+        # steps are lammps timesteps, so the slope is per md timestep and timestep_ps is the lammps `timestep` in ps
+        half = len(msd) // 2
+        slope = float(np.polyfit(steps[half:], msd[half:], 1)[0]) if len(msd) - half >= 2 and np.ptp(steps[half:]) > 0 else None
+        step_points, msd_points = _downsample(steps, msd)
+        summary["msd"] = {
+            "steps": step_points,
+            "msd": msd_points,
+            "final_msd": round(float(msd[-1]), 5),
+            "slope_per_step": slope,
+            "diffusion_coefficient_per_step": slope / 6 if slope is not None else None,
+            "diffusion_coefficient_per_ps": slope / 6 / timestep_ps if slope is not None and timestep_ps else None,
+            "diffusion_coefficient_units": "Angstrom^2/ps (per_step: Angstrom^2/timestep)",
+        }
+
+    if "density" in analyses:
+        counts = sum(partial["density_counts"] for partial in partials)
+        mean_bin_volume = sum(partial["density_bin_volume_sum"] for partial in partials) / trajectory.n_frames
+        number_density = counts / (trajectory.n_frames * mean_bin_volume)
+        fractions = (np.arange(density_bins) + 0.5) / density_bins
+        fraction_points, density_points = _downsample(fractions, number_density)
+        summary["density"] = {
+            "axis": "xyz"[density_axis],
+            "bin_fraction": fraction_points,
+            "number_density_by_type": dict(zip((str(t) for t in type_ids), density_points)),
+        }
+
+    logger.info(f"trajectory analysis finished: {dump_path=} {trajectory.n_frames=} {trajectory.n_atoms=} {summary['timing_seconds']=}")
+    return summary
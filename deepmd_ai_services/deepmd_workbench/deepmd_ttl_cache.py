@@ -0,0 +1,108 @@
+#%%
+import asyncio
+import collections
+import threading
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+#%%
+# Configuration
+DEFAULT_CACHE_TTL_SECONDS = 10
+DEFAULT_CACHE_MAX_ENTRIES = 1024
+
+#%%
+
+class TtlCache:
+    """
+    Small LRU cache whose entries expire after a ttl, for results of backend calls that
+    clients poll (job status, log tails). Concurrent loads of the same key share one call.
+    Thread safe: sync callers (worker threads, JWT checks) use the same instance as the event loop,
+    loads are only shared between callers on the same event loop.
+    """
+
+    def __init__(self, *, ttl: float = DEFAULT_CACHE_TTL_SECONDS, max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+            clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: collections.OrderedDict[Hashable, tuple[float, Any]] = collections.OrderedDict()
+        self._loading: dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if self.clock() >= expires_at:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, *, ttl: Optional[float] = None):
+        with self._lock:
+            self._entries[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], *,
+            ttl: Optional[Callable[[Any], Optional[float]]] = None) -> Any:
+        """
+        cached value of key, or the result of `await loader()` which is cached for
+        `ttl(value)` seconds (the default ttl if None, not cached if 0). Exceptions are not cached.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loading = self._loading.get(key)
+            if value is not sentinel or (loading is not None and loading.get_loop() is loop):
+                self.hits += 1
+            else:
+                self.misses += 1
+                loading = None
+                future = loop.create_future()
+                self._loading[key] = future
+        if value is not sentinel:
+            return value
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # waiters see the exception, nobody else has to retrieve it
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                if self._loading.get(key) is future:
+                    del self._loading[key]
+
+        future.set_result(value)
+        value_ttl = ttl(value) if ttl is not None else None
+        if value_ttl != 0:
+            self.set(key, value, ttl=value_ttl)
+        return value
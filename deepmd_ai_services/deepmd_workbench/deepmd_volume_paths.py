@@ -0,0 +1,31 @@
+#%%
+import posixpath
+
+#%%
+WORKSPACE_MOUNT_PATH = "/workspace/"
+PUBLIC_MOUNT_PATH = "/public/"
+
+#%%
+
+def workspace_path_to_volume_path(path: str) -> str:
+    """
+    Map a path in the executor's /workspace/ mount (or already relative to the volume root)
+    to the path inside the personal volume. '/workspace/jobs/run1/' -> 'jobs/run1'.
+    Paths escaping the volume root are rejected.
+    """
+    path = (path or "").replace("\\", "/")
+    if path.rstrip("/") == WORKSPACE_MOUNT_PATH.rstrip("/"):
+        path = ""
+    elif path.startswith(WORKSPACE_MOUNT_PATH):
+        path = path[len(WORKSPACE_MOUNT_PATH):]
+    elif path.startswith("workspace/"):
+        path = path[len("workspace/"):]
+
+    normalized = posixpath.normpath("/" + path).lstrip("/")
+    if any(part == ".." for part in path.split("/")):
+        raise ValueError(f"path escapes the workspace: {path=}")
+    return "" if normalized == "." else normalized
+
+
+def volume_path_to_workspace_path(volume_path: str) -> str:
+    return posixpath.join(WORKSPACE_MOUNT_PATH, volume_path.lstrip("/"))
@@ -0,0 +1,137 @@
+#%%
+import asyncio
+import base64
+import binascii
+import collections
+import hashlib
+import io
+import posixpath
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+from loguru import logger
+
+from deepmd_volume_paths import workspace_path_to_volume_path, volume_path_to_workspace_path
+
+#%%
+# Configuration
+MAX_BULK_UPLOAD_FILES = 64
+MAX_BULK_UPLOAD_BYTES = 64 * 2**20   # decoded size of one bulk upload
+UPLOAD_ENCODINGS = ("text", "base64", "gzip+base64")
+
+UPLOAD_CREATED = "created"
+UPLOAD_UPDATED = "updated"
+UPLOAD_UNCHANGED = "unchanged"       # same sha256 as the file in the volume, not written
+
+#%%
+
+class UploadError(ValueError):
+    pass
+
+
+@dataclass
+class PlannedUpload:
+    workspace_path: str
+    volume_path: str
+    content: bytes
+    sha256: str
+    status: str = UPLOAD_CREATED
+
+    def to_dict(self) -> dict:
+        return {"path": self.workspace_path, "size": len(self.content), "sha256": self.sha256, "status": self.status}
+
+
+def decode_upload_content(content: str, encoding: str = "text") -> bytes:
+    """file content as sent by a client: plain text, base64, or gzip compressed base64"""
+    if encoding == "text":
+        return content.encode()
+    if encoding not in UPLOAD_ENCODINGS:
+        raise UploadError(f"unknown encoding {encoding!r}, expected one of {UPLOAD_ENCODINGS}")
+    try:
+        data = base64.b64decode(content, validate=True)
+        if encoding == "gzip+base64":
+            # bounded, a small payload must not expand into gigabytes
+            decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            data = decompressor.decompress(data, MAX_BULK_UPLOAD_BYTES + 1)
+            if len(data) > MAX_BULK_UPLOAD_BYTES or decompressor.unconsumed_tail:
+                raise UploadError(f"decompressed content exceeds {MAX_BULK_UPLOAD_BYTES} bytes")
+            if not decompressor.eof:
+                raise UploadError("truncated gzip+base64 content")
+    except (binascii.Error, zlib.error) as e:
+        raise UploadError(f"invalid {encoding} content: {e}") from e
+    return data
+
+
+async def _sha256_of_volume_file(backend, volume_path: str, size: int) -> str:
+    digest = hashlib.sha256()
+    async for chunk in backend.iter_bytes(volume_path, 0, size):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def plan_bulk_upload(backend, job_dir: str, files: list[tuple[str, bytes]]) -> list[PlannedUpload]:
+    """
+    The uploads of (relative path, content) pairs into job_dir, compared with the volume:
+    a file is only hashed in the volume if its size matches, equal hashes are left out of the write.
+    """
+    if len(files) > MAX_BULK_UPLOAD_FILES:
+        raise UploadError(f"too many files: {len(files)} > {MAX_BULK_UPLOAD_FILES}")
+    total_bytes = sum(len(content) for _, content in files)
+    if total_bytes > MAX_BULK_UPLOAD_BYTES:
+        raise UploadError(f"upload too large: {total_bytes} > {MAX_BULK_UPLOAD_BYTES} bytes")
+
+    planned: dict[str, PlannedUpload] = {}
+    for path, content in files:
+        if not path or path.startswith("/") or path.endswith("/"):
+            raise UploadError(f"file path must be a file relative to job_dir: {path!r}")
+        volume_path = workspace_path_to_volume_path(posixpath.join(job_dir, path))
+        # the last of duplicate paths wins, as it would when written in order
+        planned[volume_path] = PlannedUpload(volume_path_to_workspace_path(volume_path), volume_path, content,
+            hashlib.sha256(content).hexdigest())
+
+    by_parent = collections.defaultdict(list)
+    for upload in planned.values():
+        by_parent[posixpath.dirname(upload.volume_path)].append(upload)
+
+    for parent, uploads in by_parent.items():
+        try:
+            existing = {posixpath.basename(entry.path.rstrip("/")): entry for entry in await backend.list(parent)}
+        except Exception as e:  # missing dir (modal NotFoundError / FileNotFoundError), everything is new
+            logger.debug(f"upload dir not listed: {parent=} {e=}")
+            continue
+        for upload in uploads:
+            entry = existing.get(posixpath.basename(upload.volume_path))
+            if entry is None:
+                continue
+            if entry.is_dir:
+                raise UploadError(f"a directory exists at {upload.workspace_path}")
+            upload.status = UPLOAD_UPDATED
+            if entry.size == len(upload.content) and await _sha256_of_volume_file(backend, upload.volume_path, entry.size) == upload.sha256:
+                upload.status = UPLOAD_UNCHANGED
+
+    return list(planned.values())
+
+
+def write_planned_uploads(volume, uploads: list[PlannedUpload]) -> int:
+    """write the changed files in one batch (one volume commit), blocking, returns the number written"""
+    changed = [upload for upload in uploads if upload.status != UPLOAD_UNCHANGED]
+    if not changed:
+        return 0
+    with volume.batch_upload(force=True) as batch:
+        for upload in changed:
+            batch.put_file(io.BytesIO(upload.content), upload.volume_path)
+    return len(changed)
+
+
+async def bulk_upload_job_files(volume, backend, job_dir: str, files: list[tuple[str, bytes]]) -> dict:
+    """plan, write and report: the manifest of every file with its size, sha256 and status"""
+    uploads = await plan_bulk_upload(backend, job_dir, files)
+    written = await asyncio.to_thread(write_planned_uploads, volume, uploads)
+    logger.info(f"bulk upload: {job_dir=} files={len(uploads)} {written=}")
+    return {
+        "job_dir": job_dir,
+        "written": written,
+        "unchanged": len(uploads) - written,
+        "files": [upload.to_dict() for upload in uploads],
+    }
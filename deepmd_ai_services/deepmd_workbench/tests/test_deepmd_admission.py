@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from deepmd_admission import (
+    AdmissionController, AdmissionLimits, AdmissionTimeout, InMemoryAdmissionStore, SqliteAdmissionStore,
+    decide_admission, QUEUE_TICKET_TTL_SECONDS,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def controller(store=None, *, user_limits=AdmissionLimits(2, 6, 10), org_limits=AdmissionLimits(100, 600, 100), clock=None):
+    return AdmissionController(store or InMemoryAdmissionStore(), user_limits=user_limits, org_limits=org_limits,
+        poll_seconds=0.01, clock=clock or FakeClock())
+
+
+def test_burst_then_sustained_rate():
+    admission = controller()
+    states = {}
+    tickets = [admission.ticket("alice") for _ in range(3)]
+    assert decide_admission(states, tickets[0], 1000).admitted
+    assert decide_admission(states, tickets[1], 1000).admitted
+    decision = decide_admission(states, tickets[2], 1000)
+    # 6 per minute: the next token is 10 s away
+    assert not decision.admitted and decision.position == 1 and decision.retry_after == pytest.approx(10)
+    assert "rate limit" in decision.reason
+    assert not decide_admission(states, tickets[2], 1005).admitted
+    assert decide_admission(states, tickets[2], 1010).admitted
+    # the bucket never holds more than the burst
+    later = [admission.ticket("alice") for _ in range(3)]
+    assert [decide_admission(states, ticket, 5000).admitted for ticket in later] == [True, True, False]
+
+
+def test_in_flight_limit_and_release():
+    admission = controller(user_limits=AdmissionLimits(10, 600, 1))
+    states = {}
+    first, second = admission.ticket("alice"), admission.ticket("alice")
+    assert decide_admission(states, first, 1000).admitted
+    decision = decide_admission(states, second, 1000)
+    assert not decision.admitted and "in flight" in decision.reason
+
+    asyncio.run(InMemoryAdmissionStore().remove(first))  # another store does not know the ticket
+    store = InMemoryAdmissionStore()
+    store.states = states
+    asyncio.run(store.remove(first))
+    assert decide_admission(states, second, 1001).admitted
+
+
+def test_slot_lease_expires():
+    admission = controller(user_limits=AdmissionLimits(10, 600, 1))
+    states = {}
+    assert decide_admission(states, admission.ticket("alice", lease_seconds=60), 1000).admitted
+    waiting = admission.ticket("alice")
+    assert not decide_admission(states, waiting, 1030).admitted
+    assert decide_admission(states, waiting, 1061).admitted
+
+
+def test_waiting_calls_keep_their_fifo_position():
+    admission = controller(user_limits=AdmissionLimits(1, 6, 10))
+    states = {}
+    assert decide_admission(states, admission.ticket("alice"), 1000).admitted
+    second, third = admission.ticket("alice"), admission.ticket("alice")
+    assert decide_admission(states, second, 1000).position == 1
+    assert decide_admission(states, third, 1000).position == 2
+    # the third polls first once the token is back, it still waits for the second
+    assert decide_admission(states, third, 1011).position == 2
+    assert decide_admission(states, second, 1011).admitted
+    assert decide_admission(states, third, 1011).position == 1
+    # other users are not queued behind alice
+    assert decide_admission(states, admission.ticket("bob"), 1011).admitted
+
+
+def test_abandoned_tickets_leave_the_queue():
+    admission = controller(user_limits=AdmissionLimits(1, 6, 10))
+    states = {}
+    assert decide_admission(states, admission.ticket("alice"), 1000).admitted
+    abandoned, waiting = admission.ticket("alice"), admission.ticket("alice")
+    decide_admission(states, abandoned, 1000)
+    assert decide_admission(states, waiting, 1000).position == 2
+    assert decide_admission(states, waiting, 1000 + QUEUE_TICKET_TTL_SECONDS + 1).admitted
+
+
+def test_organization_limit_spans_users():
+    admission = controller(user_limits=AdmissionLimits(10, 600, 10), org_limits=AdmissionLimits(10, 600, 2))
+    states = {}
+    assert decide_admission(states, admission.ticket("alice", "lab"), 1000).admitted
+    assert decide_admission(states, admission.ticket("bob", "lab"), 1000).admitted
+    decision = decide_admission(states, admission.ticket("carol", "lab"), 1000)
+    assert not decision.admitted and "org:lab" in decision.reason
+    assert decide_admission(states, admission.ticket("dave", "other"), 1000).admitted
+    assert decide_admission(states, admission.ticket("erin"), 1000).admitted
+
+
+def test_sqlite_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "admission.sqlite3")
+    limits = AdmissionLimits(10, 600, 1)
+    first, second = controller(SqliteAdmissionStore(path), user_limits=limits), controller(SqliteAdmissionStore(path), user_limits=limits)
+
+    async def scenario():
+        ticket = await first.acquire("alice", timeout=0)
+        with pytest.raises(AdmissionTimeout):
+            await second.acquire("alice", timeout=0)
+        await first.release(ticket)
+        return await second.acquire("alice", timeout=0)
+
+    ticket = asyncio.run(scenario())
+    assert ticket.scope_keys == ["user:alice"]
+
+
+def test_acquire_reports_positions_and_withdraws_on_timeout():
+    clock = FakeClock()
+    admission = controller(user_limits=AdmissionLimits(10, 600, 1), clock=clock)
+    queued = []
+
+    async def on_queued(decision):
+        queued.append(decision.position)
+        clock.now += 100
+
+    async def scenario():
+        held = await admission.acquire("alice")
+        with pytest.raises(AdmissionTimeout):
+            await admission.acquire("alice", timeout=50, on_queued=on_queued)
+        # the timed out call left the queue, the next one is first in line
+        await admission.release(held)
+        return await admission.acquire("alice", timeout=0)
+
+    asyncio.run(scenario())
+    assert queued == [1]
+
+
+def test_admitted_waits_for_the_slot():
+    admission = AdmissionController(InMemoryAdmissionStore(), user_limits=AdmissionLimits(10, 600, 1), poll_seconds=0.01)
+    order = []
+
+    async def call(name):
+        async with admission.admitted("alice"):
+            order.append(f"{name} start")
+            await asyncio.sleep(0.05)
+            order.append(f"{name} end")
+
+    async def scenario():
+        await asyncio.gather(call("first"), call("second"))
+
+    asyncio.run(scenario())
+    assert order == ["first start", "first end", "second start", "second end"]
@@ -0,0 +1,117 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+from fastmcp import FastMCP
+
+from deepmd_agent import agent
+from deepmd_agent.connection_pool import AgentConnectionPool, PooledLiteLlm, PooledMcpToolset
+
+
+@pytest.fixture(scope="module")
+def stand_in_mcp_url():
+    """a local MCP server in place of the remote lammps one"""
+    stand_in = FastMCP("deepmd-stand-in")
+
+    @stand_in.tool
+    def add(a: int, b: int) -> int:
+        return a + b
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(stand_in.http_app(), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{port}/mcp"
+    server.should_exit = True
+    thread.join(timeout=10)
+
+
+class FakeTool:
+    name = "fake"
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def run_async(self, *, args, tool_context):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return args
+
+
+class FakeToolset:
+    def __init__(self, tool):
+        self.tool = tool
+        self.closed = False
+
+    async def get_tools(self, readonly_context=None):
+        return [self.tool]
+
+    async def close(self):
+        self.closed = True
+
+
+def test_importing_the_agent_connects_nowhere():
+    assert agent.agent_pool.toolsets == {} and agent.agent_pool.llms == {}
+    assert agent.agent_pool.metrics["startup_seconds"] > 0
+    assert agent.deepmd_lammps_mcp_toolset.url == agent.DEEPMD_LAMMPS_MCP_URL
+    assert agent.root_agent.model is agent.coding_model and agent.coding_model.model == agent.CODING_MODEL
+
+
+def test_toolsets_of_an_endpoint_share_one_connection(stand_in_mcp_url):
+    async def scenario():
+        pool = AgentConnectionPool()
+        first, second = PooledMcpToolset(pool, stand_in_mcp_url), PooledMcpToolset(pool, stand_in_mcp_url)
+        assert pool.toolsets == {}
+        tools = await first.get_tools()
+        await second.get_tools()
+        result = await tools[0].run_async(args={"a": 2, "b": 3}, tool_context=None)
+        await first.close()
+        return pool, tools, result
+
+    pool, tools, result = asyncio.run(scenario())
+    assert [tool.name for tool in tools] == ["add"]
+    assert result["structuredContent"]["result"] == 5
+    assert pool.toolsets == {} and pool.metrics["calls"] == {stand_in_mcp_url: 1}
+    assert set(pool.metrics["first_list_seconds"]) == set(pool.metrics["first_call_seconds"]) == {stand_in_mcp_url}
+
+
+def test_tool_calls_per_endpoint_are_bounded():
+    tool = FakeTool(delay=0.05)
+    built = []
+    pool = AgentConnectionPool(max_concurrent_calls=2, toolset_factory=lambda url, **kwargs: built.append(url) or FakeToolset(tool))
+
+    async def scenario():
+        (bounded,) = await PooledMcpToolset(pool, "http://mcp.test/mcp").get_tools()
+        return await asyncio.gather(*(bounded.run_async(args={"i": i}, tool_context=None) for i in range(6)))
+
+    assert asyncio.run(scenario()) == [{"i": i} for i in range(6)]
+    assert tool.max_in_flight == 2 and built == ["http://mcp.test/mcp"]
+
+
+def test_model_client_is_built_on_the_first_request():
+    built = []
+
+    class FakeLlm:
+        async def generate_content_async(self, llm_request, stream=False):
+            yield f"response to {llm_request}"
+
+    pool = AgentConnectionPool(llm_factory=lambda model, **kwargs: built.append((model, kwargs)) or FakeLlm())
+    general, coding = (PooledLiteLlm("gemini/gemini-2.5-flash", pool, api_base="http://litellm.test") for _ in range(2))
+    assert built == []
+
+    async def scenario():
+        return [response for model in (general, coding) async for response in model.generate_content_async("hello")]
+
+    assert asyncio.run(scenario()) == ["response to hello"] * 2
+    assert built == [("gemini/gemini-2.5-flash", {"api_base": "http://litellm.test"})]
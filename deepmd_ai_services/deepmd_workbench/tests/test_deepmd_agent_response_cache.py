@@ -0,0 +1,155 @@
+import asyncio
+
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+from deepmd_agent.connection_pool import AgentConnectionPool, PooledLiteLlm, PooledMcpToolset
+from deepmd_agent.response_cache import ResponseCache, ToolResultCache, parse_cacheable_tools
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingLlm:
+    def __init__(self):
+        self.requests = []
+
+    async def generate_content_async(self, llm_request, stream=False):
+        self.requests.append(llm_request)
+        question = llm_request.contents[-1].parts[0].text
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=f"answer {len(self.requests)}: {question}")]))
+
+
+def request(question: str, system: str = "You answer DeePMD questions.", history=()) -> LlmRequest:
+    contents = [*history, types.Content(role="user", parts=[types.Part(text=question)])]
+    return LlmRequest(contents=contents, config=types.GenerateContentConfig(system_instruction=system))
+
+
+def ask(model, llm_request) -> list[str]:
+    async def scenario():
+        return [response.content.parts[0].text async for response in model.generate_content_async(llm_request)]
+
+    return asyncio.run(scenario())
+
+
+def pooled_model(cache: ResponseCache):
+    llm = CountingLlm()
+    pool = AgentConnectionPool(llm_factory=lambda model, **kwargs: llm, response_cache=cache)
+    return PooledLiteLlm("gemini/gemini-2.5-flash", pool), llm
+
+
+def test_repeated_request_skips_the_model_until_the_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(ttl=60, similarity_threshold=0, clock=clock)
+    model, llm = pooled_model(cache)
+
+    first = ask(model, request("How do I  train a DPA model?"))
+    # whitespace differences normalize to the same key
+    assert ask(model, request("How do I train a DPA model?\n")) == first
+    assert len(llm.requests) == 1
+    # another system instruction or history is another request
+    ask(model, request("How do I train a DPA model?", system="You write LAMMPS inputs."))
+    ask(model, request("How do I train a DPA model?", history=[types.Content(role="user", parts=[types.Part(text="hi")])]))
+    assert len(llm.requests) == 3
+
+    clock.now = 61
+    assert ask(model, request("How do I train a DPA model?")) == ["answer 4: How do I train a DPA model?"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 4) and stats["hit_rate"] == 0.2
+
+
+def test_similar_questions_are_served_from_the_embedding_tier():
+    cache = ResponseCache(ttl=60, similarity_threshold=0.8)
+    model, llm = pooled_model(cache)
+
+    first = ask(model, request("How do I train a DPA-3 model on my water dataset?"))
+    assert ask(model, request("how do I train a DPA-3 model on my water dataset")) == first
+    ask(model, request("What is the melting point of ice Ih with DPA?"))
+    assert len(llm.requests) == 2
+    # a different number is a different question however close the wording
+    ask(model, request("Run an NVT simulation of 64 water molecules at 300 K"))
+    ask(model, request("Run an NVT simulation of 64 water molecules at 330 K"))
+    assert len(llm.requests) == 4
+    assert cache.stats()["similar_hits"] == 1 and cache.stats()["exact_hits"] == 0
+
+
+def test_errors_and_function_calls_stay_out_of_the_similarity_tier():
+    cache = ResponseCache(ttl=60, similarity_threshold=0.5)
+    call = LlmResponse(content=types.Content(role="model", parts=[
+        types.Part(function_call=types.FunctionCall(name="select_dpa_model", args={"structure": "H2O"}))]))
+    cache.set("m", request("Which model for water?"), [call])
+    cache.set("m", request("Which model for ice?"), [LlmResponse(error_code="429", error_message="rate limited")])
+
+    assert cache.get("m", request("Which model for water?"))[0].content.parts[0].function_call.args == {"structure": "H2O"}
+    assert cache.get("m", request("Which model for water ?")) is None
+    assert cache.get("m", request("Which model for ice?")) is None
+
+
+class FakeTool:
+    def __init__(self, name: str, annotations=None):
+        self.name = name
+        self.raw_mcp_tool = type("RawTool", (), {"annotations": annotations})()
+        self.calls = 0
+
+    async def run_async(self, *, args, tool_context):
+        self.calls += 1
+        return {"content": [{"type": "text", "text": f"{self.name} {args}"}], "isError": False}
+
+
+class FakeToolset:
+    def __init__(self, tools):
+        self.tools = tools
+
+    async def get_tools(self, readonly_context=None):
+        return self.tools
+
+    async def close(self):
+        pass
+
+
+def test_only_idempotent_tool_calls_are_cached():
+    from mcp.types import ToolAnnotations
+
+    clock = FakeClock()
+    search = FakeTool("search_docs", ToolAnnotations(readOnlyHint=True, idempotentHint=True))
+    version = FakeTool("get_version")
+    run = FakeTool("run_lammps", ToolAnnotations(readOnlyHint=False))
+    tool_cache = ToolResultCache(cacheable_tools=parse_cacheable_tools("get_version:3600"), ttl=60, clock=clock)
+    pool = AgentConnectionPool(toolset_factory=lambda url, **kwargs: FakeToolset([search, version, run]), tool_cache=tool_cache)
+
+    async def scenario():
+        tools = await PooledMcpToolset(pool, "http://mcp.test/mcp").get_tools()
+        return [await tool.run_async(args={"q": "dpa"}, tool_context=None) for tool in tools for _ in range(2)]
+
+    results = asyncio.run(scenario())
+    assert results[0] == results[1] and (search.calls, version.calls, run.calls) == (1, 1, 2)
+    clock.now = 61
+    asyncio.run(scenario())
+    assert (search.calls, version.calls) == (2, 1)
+    assert pool.cache_stats()["tools"]["hits"] == 5
+
+
+def test_tool_results_are_cached_per_user_and_for_lookup_endpoints():
+    from mcp.types import ToolAnnotations
+
+    docs = FakeTool("ask_docs")
+    log = FakeTool("get_lammps_run_log", ToolAnnotations(readOnlyHint=True, idempotentHint=True))
+    tool_cache = ToolResultCache(cacheable_tools={}, cacheable_endpoints={"http://docs.test/mcp": 60})
+    pool = AgentConnectionPool(toolset_factory=lambda url, **kwargs: FakeToolset([docs] if "docs" in url else [log]), tool_cache=tool_cache)
+
+    async def scenario(url, user_id):
+        [tool] = await PooledMcpToolset(pool, url).get_tools()
+        return await tool.run_async(args={"log_file": "log.lammps"}, tool_context=type("Context", (), {"user_id": user_id})())
+
+    for user_id in ("alice", "alice", "bob"):
+        asyncio.run(scenario("http://lammps.test/mcp", user_id))
+        asyncio.run(scenario("http://docs.test/mcp", user_id))
+    # the same log path of another user is another file
+    assert (log.calls, docs.calls) == (2, 2)
+    assert pool.cache_stats()["tools"]["hits"] == 2
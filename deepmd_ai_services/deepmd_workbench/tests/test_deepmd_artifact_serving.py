@@ -0,0 +1,85 @@
+import os
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import deepmd_artifact_serving
+from deepmd_artifact_serving import LocalArtifactBackend, content_disposition, get_artifact_response, parse_range_header
+from deepmd_volume_paths import workspace_path_to_volume_path
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / "job").mkdir()
+    (tmp_path / "job" / "log.lammps").write_text("Step Temp PotEng\n" * 1000)
+    (tmp_path / "job" / "restart.bin").write_bytes(os.urandom(5000))
+    (tmp_path / "job" / "traj.dump").write_text("ITEM: TIMESTEP\n0\n" * 1000)
+    (tmp_path / "job" / "log.水.lammps").write_text("Step Temp\n")
+    backend = LocalArtifactBackend(str(tmp_path))
+
+    app = FastAPI()
+
+    @app.api_route("/artifacts/{path:path}", methods=["GET", "HEAD"])
+    async def download(path: str):
+        response = await get_artifact_response(backend, path)
+        if response is None:
+            raise HTTPException(status_code=404)
+        return response
+
+    return TestClient(app)
+
+
+def test_parse_range_header():
+    assert parse_range_header(None, 100) is None
+    assert parse_range_header("bytes=10-19", 100) == (10, 10)
+    assert parse_range_header("bytes=90-", 100) == (90, 10)
+    assert parse_range_header("bytes=-5", 100) == (95, 5)
+    assert parse_range_header("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parse_range_header("bytes=100-", 100)
+
+
+def test_workspace_path_to_volume_path():
+    assert workspace_path_to_volume_path("/workspace/") == ""
+    assert workspace_path_to_volume_path("/workspace/spec/") == "spec"
+    assert workspace_path_to_volume_path("workspace/jobs/run1/log.lammps") == "jobs/run1/log.lammps"
+    with pytest.raises(ValueError):
+        workspace_path_to_volume_path("/workspace/../other")
+
+
+def test_range_request(client):
+    response = client.get("/artifacts/job/restart.bin", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 10-19/5000"
+    assert len(response.content) == 10
+
+    assert client.get("/artifacts/job/restart.bin", headers={"Range": "bytes=9000-"}).status_code == 416
+
+
+def test_gzip_and_conditional_get(client):
+    response = client.get("/artifacts/job/log.lammps")
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == "Step Temp PotEng\n" * 1000
+
+    not_modified = client.get("/artifacts/job/log.lammps", headers={"If-None-Match": response.headers["etag"]})
+    assert not_modified.status_code == 304
+
+
+def test_large_text_artifacts_are_not_compressed(client, monkeypatch):
+    monkeypatch.setattr(deepmd_artifact_serving, "GZIP_MAX_SIZE", 4096)
+    response = client.get("/artifacts/job/traj.dump")
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-length"] == str(len("ITEM: TIMESTEP\n0\n" * 1000))
+
+
+def test_non_ascii_download_name(client):
+    response = client.get("/artifacts/job/log.水.lammps")
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == "attachment; filename=\"log._.lammps\"; filename*=UTF-8''log.%E6%B0%B4.lammps"
+    assert content_disposition('a"b.log') == "attachment; filename=\"a\\\"b.log\"; filename*=UTF-8''a%22b.log"
+
+
+def test_missing_artifact(client):
+    assert client.get("/artifacts/job/missing.dump").status_code == 404
@@ -0,0 +1,213 @@
+import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from jose import jwk, jwt
+
+import deepmd_auth_midware
+from deepmd_auth_midware import AuthMiddleware, JwksKeySet
+
+
+@pytest.fixture(scope="module")
+def private_key() -> bytes:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+
+
+@pytest.fixture
+def signing_key(private_key, monkeypatch):
+    public_key = serialization.load_pem_private_key(private_key, None).public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    monkeypatch.setattr(deepmd_auth_midware, "DJANGO_JWT_PUBLIC_KEY", public_key)
+    AuthMiddleware.verified_tokens.clear()
+    yield private_key
+    AuthMiddleware.verified_tokens.clear()
+
+
+@pytest.fixture
+def decode_calls(monkeypatch):
+    calls = []
+    decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(jwt, "decode", counting_decode)
+    return calls
+
+
+def make_token(key: bytes, user_id: str = "alice", expires_in: float = 3600) -> str:
+    return jwt.encode({"user_id": user_id, "exp": int(time.time() + expires_in)}, key, algorithm="RS256")
+
+
+def test_token_is_verified_once_per_lifetime(signing_key, decode_calls):
+    token = make_token(signing_key)
+    assert AuthMiddleware._validate_token(token)["user_id"] == "alice"
+    payload = AuthMiddleware._validate_token(token)
+    payload["user_id"] = "mallory"  # callers get a copy
+    assert AuthMiddleware._validate_token(token)["user_id"] == "alice"
+    assert len(decode_calls) == 1
+
+
+def test_expired_and_invalid_tokens_are_not_cached(signing_key, decode_calls):
+    AuthMiddleware._validate_token(make_token(signing_key, expires_in=30))
+    expires_at, _ = next(iter(AuthMiddleware.verified_tokens._entries.values()))
+    assert expires_at - time.monotonic() <= 30
+
+    with pytest.raises(jwt.JWTError):
+        AuthMiddleware._validate_token(make_token(signing_key, expires_in=-10))
+    with pytest.raises(jwt.JWTError):
+        AuthMiddleware._validate_token(make_token(signing_key) + "x")
+    assert len(AuthMiddleware.verified_tokens) == 1
+
+
+def test_request_verifies_the_token_once(signing_key, decode_calls):
+    app = FastAPI()
+    app.add_middleware(AuthMiddleware)
+
+    @app.get("/whoami")
+    async def whoami():
+        return {"ok": True}
+
+    client = TestClient(app)
+    token = make_token(signing_key)
+    for _ in range(3):
+        response = client.get("/whoami", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200
+    assert len(decode_calls) == 1
+
+
+def make_app(**middleware_kwargs) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(AuthMiddleware, **middleware_kwargs)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    @app.get("/claims")
+    async def claims(request: Request):
+        return {"user": getattr(request.state, "user", None), "payload": AuthMiddleware.get_optional_token_payload(request)}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(3):
+                yield f"data: {i}\n\n".encode()
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+def test_middleware_rejects_with_json_errors(signing_key):
+    client = TestClient(make_app())
+    assert client.get("/health").status_code == 200
+    response = client.get("/claims")
+    assert response.status_code == 401 and response.json() == {"detail": "Missing auth token"}
+    assert client.get("/claims", headers={"Authorization": "Bearer nonsense"}).status_code == 401
+    token = make_token(signing_key)
+    response = client.get("/claims", params={"owner_user_id": "bob"}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 403
+    # the explicit default user needs no token
+    assert client.get("/claims", params={"owner_user_id": "default_unnamed_user"}).json()["user"] is None
+
+
+def test_middleware_passes_claims_and_streams(signing_key, decode_calls):
+    client = TestClient(make_app())
+    headers = {"Authorization": f"Bearer {make_token(signing_key)}"}
+    body = client.get("/claims", headers=headers).json()
+    assert body["user"]["user_id"] == "alice" and body["payload"] == body["user"]
+    response = client.get("/stream", headers=headers)
+    assert response.status_code == 200 and response.text == "data: 0\n\ndata: 1\n\ndata: 2\n\n"
+    assert len(decode_calls) == 1
+
+
+def test_anonymous_requests_for_the_mcp_app(signing_key):
+    client = TestClient(make_app(allow_anonymous=True))
+    assert client.get("/claims").json() == {"user": None, "payload": None}
+    # a token that is sent must be valid
+    assert client.get("/claims", headers={"Authorization": "Bearer nonsense"}).status_code == 401
+    assert client.get("/claims", params={"owner_user_id": "bob"}).status_code == 401
+
+
+class FakeJwks:
+    def __init__(self, private_keys: dict):
+        self.private_keys = private_keys
+        self.calls = 0
+        self.fail = False
+        self.now = 0.0
+
+    def fetch(self) -> dict:
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("users api down")
+        keys = []
+        for kid, key in self.private_keys.items():
+            entry = jwk.construct(key, "RS256").public_key().to_dict()
+            keys.append({**entry, "kid": kid, "use": "sig"})
+        return {"keys": keys}
+
+
+@pytest.fixture
+def jwks(private_key, monkeypatch):
+    fake = FakeJwks({"k1": private_key})
+    key_set = JwksKeySet("http://users.test/jwks.json", min_refetch_seconds=30, fetch=fake.fetch, clock=lambda: fake.now)
+    monkeypatch.setattr(key_set, "start", lambda: None)
+    monkeypatch.setattr(AuthMiddleware, "jwks", key_set)
+    return fake
+
+
+def make_kid_token(key: bytes, kid: str, user_id: str = "alice") -> str:
+    return jwt.encode({"user_id": user_id, "exp": int(time.time() + 3600)}, key, algorithm="RS256", headers={"kid": kid})
+
+
+def claims_of(client: TestClient, token: str):
+    return client.get("/claims", headers={"Authorization": f"Bearer {token}"})
+
+
+def test_tokens_are_verified_with_the_jwks_key_of_their_kid(signing_key, jwks):
+    client = TestClient(make_app())
+    rotated_key = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    assert claims_of(client, make_kid_token(signing_key, "k1")).json()["user"]["user_id"] == "alice"
+    assert claims_of(client, make_kid_token(signing_key, "k1", "bob")).json()["user"]["user_id"] == "bob"
+    assert jwks.calls == 1
+
+    # a key rotated in after the last fetch: one refetch (in a worker thread) finds it
+    jwks.private_keys["k2"] = rotated_key
+    jwks.now += 31
+    assert claims_of(client, make_kid_token(rotated_key, "k2")).json()["user"]["user_id"] == "alice"
+    assert jwks.calls == 2
+
+
+def test_unknown_kids_refetch_at_most_every_min_refetch_seconds(signing_key, jwks):
+    client = TestClient(make_app())
+    for user_id in ("alice", "bob", "carol"):
+        assert claims_of(client, make_kid_token(signing_key, "nope", user_id) + "x").status_code == 401
+    assert jwks.calls == 1
+    # a token without kid (or with a kid not in the JWKS) falls back to the built-in key
+    assert claims_of(client, make_token(signing_key)).status_code == 200
+    assert jwks.calls == 1
+    jwks.now += 31
+    assert claims_of(client, make_kid_token(signing_key, "nope", "dave")).status_code == 200
+    assert jwks.calls == 2
+
+
+def test_sync_lookup_of_an_unknown_kid_does_not_fetch(signing_key, jwks):
+    # e.g. a token checked on the event loop outside the middleware: the refresher thread is woken instead
+    assert AuthMiddleware._validate_token(make_kid_token(signing_key, "k1"))["user_id"] == "alice"
+    assert jwks.calls == 0 and AuthMiddleware.jwks._wake.is_set()
+
+
+def test_failed_jwks_fetch_keeps_the_known_keys(signing_key, jwks):
+    AuthMiddleware.jwks.refresh()
+    jwks.fail = True
+    jwks.now += 31
+    AuthMiddleware.jwks.refresh()
+    assert AuthMiddleware._validate_token(make_kid_token(signing_key, "k1"))["user_id"] == "alice"
+    assert AuthMiddleware.jwks.get("k1") is not None
@@ -0,0 +1,82 @@
+import dataclasses
+import json
+
+from google.adk.tools.function_tool import FunctionTool
+
+from deepmd_agent import agent
+from deepmd_agent.dpa_model_registry import (DPA_MODEL_DIR, DPA_MODELS, PERIODIC_TABLE, DpaModelSelector, build_registry,
+    load_registry, parse_elements, select_dpa_model)
+
+# the built-in table as if every entry had been read from its model file
+verified_selector = DpaModelSelector(dataclasses.replace(model, verified=True) for model in DPA_MODELS)
+
+
+def select_verified(structure: str, task: str = "") -> dict:
+    return verified_selector.select(parse_elements(structure), task)
+
+
+def test_parse_elements_from_formulas_decks_and_structures():
+    assert parse_elements("LiCoO2") == ["Li", "Co", "O"]
+    assert parse_elements("Al, Mg; Cu") == ["Al", "Mg", "Cu"]
+    deck = "pair_style deepmd /public/DPA-3.1-3M/branch_models/H2O_H2O_PD.pth\npair_coeff * * O H  # O then H\nmass 1 15.9994\n"
+    assert parse_elements(deck) == ["O", "H"]
+    assert parse_elements("3\nwater Lattice=\"10 0 0 0 10 0 0 0 10\"\nO 0.0 0.0 0.0\nH 0.96 0.0 0.0\nH -0.24 0.93 0.0\n") == ["O", "H"]
+    assert parse_elements("liquid water") == []
+
+
+def test_system_specific_models_and_task_keywords_decide():
+    water = select_verified("H2O")
+    assert water["model"] == f"{DPA_MODEL_DIR}H2O_H2O_PD.pth" and not water["ambiguous"]
+    # the drug head also covers H and O, the task singles it out
+    assert select_verified("H O", task="drug ligand binding")["model"].endswith("Domains_Drug.pth")
+    assert select_verified("Al Cu")["model"].endswith("Metals_AlMgCu.pth")
+    assert select_verified("Al Cu", task="high entropy alloy")["model"].endswith("Domains_Alloy.pth")
+    # "ice" is a water keyword, "lattice" is not
+    assert select_verified("Si", task="lattice constant")["ambiguous"]
+
+
+def test_built_in_coverage_is_advisory():
+    water = select_dpa_model("H2O")
+    assert water["ambiguous"] and water["model"] is None and "type_map" in water["reason"]
+    assert water["candidates"][0]["model"] == "H2O_H2O_PD.pth" and not water["candidates"][0]["elements_verified"]
+
+
+def test_ties_and_uncovered_elements_fall_back_to_the_llm():
+    organic = select_dpa_model("H C N O")
+    assert organic["ambiguous"] and organic["model"] is None
+    assert {"Organic_Reactions.pth", "solvated_protein_fragments.pt", "Domains_Drug.pth"} <= {c["model"] for c in organic["candidates"]}
+    uranium = select_dpa_model("UO2")
+    assert uranium["ambiguous"] and uranium["candidates"] == [] and "U" in uranium["reason"]
+    assert select_dpa_model("")["reason"].startswith("no element symbols")
+
+
+def test_registry_override_from_json(tmp_path):
+    path = tmp_path / "registry.json"
+    path.write_text(json.dumps([{"file": "custom_LiF.pth", "elements": ["Li", "F"], "domains": ["molten salt"]}]))
+    selector = DpaModelSelector(load_registry(str(path)))
+    # hand-written elements stay advisory
+    lif = selector.select(["Li", "F"])
+    assert lif["ambiguous"] and lif["candidates"][0]["model"] == "custom_LiF.pth"
+    assert selector.select(["Li", "Cl"])["candidates"] == []
+    path.write_text(json.dumps([{"file": "custom_LiF.pth", "elements": ["Li", "F"], "elements_from_type_map": True}]))
+    assert DpaModelSelector(load_registry(str(path))).select(["Li", "F"])["model"].endswith("custom_LiF.pth")
+
+
+def test_build_registry_reads_the_type_maps(tmp_path):
+    for file in ("H2O_H2O_PD.pth", "Domains_Drug.pth", "custom_LiF.pb", "README.md"):
+        (tmp_path / file).touch()
+    type_maps = {"H2O_H2O_PD.pth": ["O", "H"], "Domains_Drug.pth": list(PERIODIC_TABLE), "custom_LiF.pb": ["Li", "F"]}
+    registry = {entry["file"]: entry for entry in build_registry(str(tmp_path), type_map_reader=lambda path: type_maps[path.rsplit("/", 1)[1]])}
+    assert set(registry) == {"H2O_H2O_PD.pth", "Domains_Drug.pth", "custom_LiF.pb"}
+    water = registry["H2O_H2O_PD.pth"]
+    assert water["elements"] == ["O", "H"] and water["elements_from_type_map"] and water["system_specific"]
+    # a type_map shared by all heads keeps the built-in estimate
+    drug = registry["Domains_Drug.pth"]
+    assert not drug["elements_from_type_map"] and len(drug["elements"]) < len(PERIODIC_TABLE)
+    assert registry["custom_LiF.pb"]["elements_from_type_map"]
+
+
+def test_root_agent_calls_the_selector_directly():
+    assert select_dpa_model in agent.root_agent.tools
+    declaration = FunctionTool(select_dpa_model)._get_declaration()
+    assert declaration.name == "select_dpa_model" and declaration.parameters_json_schema["required"] == ["structure"]
@@ -0,0 +1,69 @@
+import asyncio
+
+from deepmd_artifact_serving import LocalArtifactBackend
+from deepmd_job_status import job_log_path, last_thermo_step, run_result_status, summarize_thermo_log, tail_log_lines
+
+
+LOG = """LAMMPS (29 Aug 2024)
+read_data data.lmp
+   Step          Temp          PotEng
+         0   300           -1000
+WARNING: Lost atoms at step 50 (../thermo.cpp:488)
+       100   310           -1002
+       200   290           -1004
+Loop time of 2.5 on 1 procs for 200 steps with 192 atoms
+
+Performance: 6.912 ns/day, 3.472 hours/ns, 80.000 timesteps/s, 15.360 katom-step/s
+   Step          Temp          PotEng          Press
+       200   290           -1004           1.0
+       300   300           -1003           2.0
+Total wall time: 0:00:05
+"""
+
+
+def test_job_log_path():
+    job = {"queuejob_type": "LAMMPS_SIMULATION", "command": "lmp -in in.lammps -log run.log",
+        "environment_vars": {"job_dir": "/workspace/job/"}}
+    assert job_log_path(job) == "/workspace/job/run.log"
+    assert job_log_path({**job, "modal_function_name": "managed_lammps_run"}) == "/workspace/job/log.managed.lammps"
+    assert job_log_path({**job, "queuejob_type": "LAMMPS_ENSEMBLE", "command": "lmp -in in.lammps"}, replica=3) \
+        == "/workspace/job/ensemble/replica-003/log.lammps"
+    assert job_log_path({**job, "queuejob_type": "TRAJECTORY_ANALYSIS"}) is None
+    assert job_log_path({"queuejob_type": "LAMMPS_SIMULATION"}) is None
+
+
+def test_last_thermo_step():
+    assert last_thermo_step(LOG.splitlines()) == 300
+    assert last_thermo_step(["Loop time of 2.5 on 1 procs for 200 steps with 192 atoms"]) is None
+
+
+def test_tail_and_thermo_summary(tmp_path):
+    (tmp_path / "job").mkdir()
+    (tmp_path / "job" / "log.lammps").write_text("setup line\n" * 5000 + LOG)
+    backend = LocalArtifactBackend(str(tmp_path))
+
+    tail = asyncio.run(tail_log_lines(backend, "/workspace/job/log.lammps", lines=3))
+    assert tail["lines"] == ["       200   290           -1004           1.0", "       300   300           -1003           2.0",
+        "Total wall time: 0:00:05"]
+    tail = asyncio.run(tail_log_lines(backend, "/workspace/job/log.lammps", lines=200))
+    assert len(tail["lines"]) == 200 and tail["lines"][0] == "setup line"
+
+    summary = asyncio.run(summarize_thermo_log(backend, "/workspace/job/log.lammps", max_rows=2))
+    first, second = summary["runs"]
+    assert first["rows"] == 3 and (first["first_step"], first["last_step"]) == (0, 200)
+    assert first["observables"]["Temp"] == {"mean": 300, "std": 10, "min": 290, "max": 310, "first": 300, "last": 290}
+    assert first["performance"]["katom_steps_per_second"] == 15.36
+    assert first["sampled_rows"][-1] == [200, 290, -1004]
+    assert second["columns"] == ["Step", "Temp", "PotEng", "Press"]
+    assert second["observables"]["Press"]["std"] is not None
+    assert summary["warnings"] == [{"line": "WARNING: Lost atoms at step 50 (../thermo.cpp:488)", "count": 1}]
+
+
+def test_run_result_status():
+    assert run_result_status({"return_code": 0}) == ("COMPLETED", "return_code=0")
+    assert run_result_status({"return_code": 1})[0] == "FAILED"
+    # killed by the in-container timeout
+    assert run_result_status({"return_code": None, "stopped_early": False})[0] == "TIMEOUT"
+    status, message = run_result_status({"return_code": None, "stopped_early": True,
+        "telemetry": {"progress": {"projected_seconds": 7200, "budget_seconds": 3600}}})
+    assert status == "TIMEOUT" and "7200" in message
@@ -0,0 +1,154 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from deepmd_lammps_ensemble import (
+    WelfordAccumulator, LammpsThermoParser, EnsembleAggregator, ReplicaSlots, EnsembleError,
+    prepare_ensemble_replicas, generate_replica_seeds, estimate_replicas_per_gpu,
+)
+
+THERMO_OUTPUT = """LAMMPS (29 Aug 2024)
+Per MPI rank memory allocation (min/avg/max) = 3.1 | 3.1 | 3.1 Mbytes
+   Step          Temp          E_pair         Press
+         0   300           -1000.5         120.0
+       100   290.5         -1001.25        110.5
+       200   295           -1000.75       -15
+Loop time of 1.5 on 1 procs for 200 steps with 192 atoms
+"""
+
+
+def test_welford_matches_numpy():
+    rng = np.random.default_rng(0)
+    rows = rng.normal(size=(1000, 3)) * [1, 10, 100] + [5, -3, 1e4]
+
+    accumulator = WelfordAccumulator(3)
+    for chunk in np.array_split(rows, 7):
+        accumulator.update_batch(chunk)
+    accumulator.update(rows[0])
+    expected = np.vstack([rows, rows[:1]])
+
+    assert accumulator.count == 1001
+    np.testing.assert_allclose(accumulator.mean, expected.mean(axis=0))
+    np.testing.assert_allclose(accumulator.variance, expected.var(axis=0, ddof=1))
+
+
+def test_welford_merge():
+    rng = np.random.default_rng(1)
+    a_rows, b_rows = rng.normal(size=(50, 2)), rng.normal(3, 2, size=(80, 2))
+    a, b = WelfordAccumulator(2), WelfordAccumulator(2)
+    a.update_batch(a_rows)
+    b.update_batch(b_rows)
+    a.merge(b)
+    a.merge(WelfordAccumulator(2))
+
+    np.testing.assert_allclose(a.std, np.vstack([a_rows, b_rows]).std(axis=0, ddof=1))
+    assert np.isnan(WelfordAccumulator(2).variance).all()
+
+
+def test_thermo_parser():
+    parser = LammpsThermoParser()
+    rows = [row for row in map(parser.feed_line, THERMO_OUTPUT.encode().splitlines(keepends=True)) if row is not None]
+
+    assert parser.columns == ["Step", "Temp", "E_pair", "Press"]
+    assert [row[0] for row in rows] == [0, 100, 200]
+    assert rows[1].tolist() == [100, 290.5, -1001.25, 110.5]
+    assert parser.feed_line("  300 1 2 3") is None  # after `Loop time`
+
+
+def test_ensemble_aggregator():
+    aggregator = EnsembleAggregator(3, equilibration_steps=100)
+    columns = ["Step", "Temp", "Press"]
+    temps = [[310, 300, 302, 298], [320, 299, 301, 300], [330, 305, 303, 301]]
+    for replica, replica_temps in enumerate(temps):
+        for i, temp in enumerate(replica_temps):
+            aggregator.update(replica, columns, np.array([i * 100, temp, 1.0]))
+    # a thermo table with other columns (second run with another thermo_style) is ignored
+    aggregator.update(0, ["Step", "Temp"], np.array([400, 1000.0]))
+
+    summary = aggregator.summary()
+    replica_means = [np.mean(t[1:]) for t in temps]
+    temp = summary["ensemble"]["Temp"]
+    assert summary["observables"] == ["Temp", "Press"]
+    assert temp["mean"] == pytest.approx(np.mean(replica_means))
+    assert temp["std_between_replicas"] == pytest.approx(np.std(replica_means, ddof=1))
+    assert temp["stderr"] == pytest.approx(np.std(replica_means, ddof=1) / np.sqrt(3))
+    assert summary["ensemble"]["Press"]["std_between_replicas"] == 0
+    assert [replica["rows"] for replica in summary["replicas"]] == [3, 3, 3]
+    assert summary["series"]["step"] == [0, 100, 200, 300]
+    assert summary["series"]["Temp"]["mean"][0] == pytest.approx(320)
+    assert summary["series"]["Temp"]["std"][0] == pytest.approx(10)
+
+
+def test_replica_slots_resize():
+    async def scenario():
+        slots = ReplicaSlots(1)
+        await slots.acquire()
+        waiter = asyncio.create_task(slots.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await slots.resize(2)
+        await asyncio.wait_for(waiter, 1)
+        assert slots.in_use == 2
+
+    asyncio.run(scenario())
+
+
+def test_seeds_and_packing():
+    seeds = generate_replica_seeds(16)
+    assert len(set(seeds)) == 16 and all(0 < seed < 900_000_000 for seed in seeds)
+    assert seeds == generate_replica_seeds(16)
+    assert estimate_replicas_per_gpu(16000, 3000) == 4
+    assert estimate_replicas_per_gpu(16000, None) == 1
+
+
+@pytest.fixture
+def job_dir(tmp_path):
+    (tmp_path / "in.lammps").write_text("read_data conf.lmp\ninclude vel.in\nrun 1000\n")
+    (tmp_path / "vel.in").write_text("velocity all create 300 ${SEED}\n")
+    (tmp_path / "conf.lmp").write_text("data")
+    return str(tmp_path)
+
+
+def test_prepare_ensemble_replicas(job_dir):
+    specs = prepare_ensemble_replicas("lmp -in in.lammps -sf gpu", job_dir, 2, seeds=[11, 22])
+
+    assert [spec.seed for spec in specs] == [11, 22]
+    assert specs[1].commands_list == ["lmp", "-in", "in.lammps", "-sf", "gpu", "-var", "SEED", "22", "-var", "REPLICA", "1"]
+    assert specs[1].work_dir == os.path.join(job_dir, "ensemble", "replica-001")
+    with open(os.path.join(specs[0].work_dir, "conf.lmp")) as f:
+        assert f.read() == "data"
+    assert not os.path.exists(os.path.join(specs[0].work_dir, "ensemble"))
+    # a second preparation in the same job dir reuses the replica dirs
+    prepare_ensemble_replicas("lmp -in in.lammps", job_dir, 2, seeds=[11, 22])
+
+
+def test_replicas_link_only_the_inputs(job_dir):
+    os.makedirs(os.path.join(job_dir, "models"))
+    with open(os.path.join(job_dir, "in.lammps"), "a") as f:
+        f.write("pair_style deepmd models/dpa.pth\n")
+    for name in ("models/dpa.pth", "log.lammps", "traj.dump"):
+        with open(os.path.join(job_dir, name), "w") as f:
+            f.write(name)
+    work_dir = os.path.join(job_dir, "ensemble", "replica-000")
+    os.makedirs(work_dir)
+    # link of an earlier preparation that linked every entry of the job dir
+    os.symlink(os.path.join(job_dir, "log.lammps"), os.path.join(work_dir, "log.lammps"))
+
+    specs = prepare_ensemble_replicas("lmp -in in.lammps", job_dir, 2, seeds=[11, 22])
+
+    for spec in specs:
+        assert sorted(os.listdir(spec.work_dir)) == ["conf.lmp", "in.lammps", "models", "vel.in"]
+        assert os.listdir(os.path.join(spec.work_dir, "models")) == ["dpa.pth"]
+
+
+def test_prepare_ensemble_replicas_errors(job_dir):
+    with pytest.raises(EnsembleError, match="does not use"):
+        prepare_ensemble_replicas("lmp -in in.lammps", job_dir, 2, seed_variable="VSEED")
+    with pytest.raises(EnsembleError, match="distinct seeds"):
+        prepare_ensemble_replicas("lmp -in in.lammps", job_dir, 2, seeds=[1, 1])
+    with pytest.raises(EnsembleError, match="n_replicas"):
+        prepare_ensemble_replicas("lmp -in in.lammps", job_dir, 0)
+    with pytest.raises(EnsembleError, match="input script"):
+        prepare_ensemble_replicas("lmp -h", job_dir, 2)
@@ -0,0 +1,41 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+from deepmd_lammps_executor import analysis_worker_count, run_lammps_process, terminate_lammps_process
+
+WORKBENCH_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_executor_does_not_import_the_web_stack():
+    # a fresh interpreter, the test session has fastapi / fastmcp loaded already
+    script = (
+        "import sys, deepmd_lammps_executor\n"
+        "heavy = ('google.adk', 'fastmcp', 'fastapi', 'starlette', 'jose', 'deepmd_modal_run_service', 'deepmd_trajectory_analysis')\n"
+        "print(sorted(m for m in sys.modules if m in heavy or m.startswith(tuple(h + '.' for h in heavy))))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=WORKBENCH_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_run_lammps_process_collects_the_return_code(tmp_path):
+    result = asyncio.run(run_lammps_process([sys.executable, "-c", "print('Loop time of 1.0 on 1 procs')"], str(tmp_path), timeout=30))
+    assert result["return_code"] == 0 and not result["stopped_early"]
+    assert "telemetry" in result
+
+
+def test_terminate_lammps_process_stops_a_running_process():
+    async def scenario():
+        process = await asyncio.create_subprocess_exec(sys.executable, "-c", "import time; time.sleep(60)")
+        return await terminate_lammps_process(process, grace_seconds=5)
+
+    assert asyncio.run(scenario()) != 0
+
+
+def test_analysis_worker_count_stays_within_the_container(monkeypatch):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(64)), raising=False)
+    assert analysis_worker_count(cpu_limit=4.0, memory_mb=4096) == 4
+    assert analysis_worker_count(cpu_limit=4.0, memory_mb=2048) == 2
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0}, raising=False)
+    assert analysis_worker_count(cpu_limit=4.0, memory_mb=4096) == 1
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from deepmd_lammps_managed_run import (
+    prepare_managed_segment, finish_managed_segment, find_latest_restart, ManagedRunError, MANAGED_LOG_NAME,
+)
+
+INPUT_SCRIPT = """variable        NSTEPS equal 3000
+units           metal
+atom_style      atomic
+read_data       conf.lmp
+include         potential.in
+velocity        all create 300 42
+minimize        1e-6 1e-8 100 1000
+reset_timestep  0
+fix             1 all nvt temp 300 300 0.1
+dump            1 all custom 100 traj.dump id type x y z
+run             1000
+unfix           1
+fix             2 all npt temp 300 300 0.1 iso 1 1 1
+run             ${NSTEPS}
+"""
+
+
+@pytest.fixture
+def job_dir(tmp_path):
+    (tmp_path / "in.lammps").write_text(INPUT_SCRIPT)
+    (tmp_path / "potential.in").write_text("pair_style deepmd /public/models/dpa3.pth\npair_coeff * * O H\n")
+    return str(tmp_path)
+
+
+def touch_restart(job_dir, name):
+    with open(os.path.join(job_dir, "managed", name), "w") as f:
+        f.write("restart")
+
+
+def read(job_dir, path):
+    with open(os.path.join(job_dir, path)) as f:
+        return f.read()
+
+
+def test_first_segment(job_dir):
+    segment = prepare_managed_segment("lmp -in in.lammps -sf gpu -log old.log", job_dir, 0, segment_seconds=3000, restart_every=500)
+
+    assert segment.commands_list == ["lmp", "-in", "managed/segment-000.in", "-sf", "gpu", "-log", "managed/segment-000.log"]
+    assert segment.target_step == 4000
+    script = read(job_dir, segment.script_path)
+    assert "timer timeout 00:50:00" in script
+    assert "pair_coeff * * O H" in script  # include inlined
+    assert "restart 500 managed/periodic.*.restart\nrun 1000 upto" in script
+    assert "run 4000 upto" in script
+    assert script.rstrip().endswith("write_restart managed/segment-000.*.restart")
+
+
+def test_continuation_segment(job_dir):
+    prepare_managed_segment("lmp -in in.lammps", job_dir, 0, segment_seconds=600)
+    touch_restart(job_dir, "periodic.1500.restart")
+    touch_restart(job_dir, "segment-000.1730.restart")
+
+    segment = prepare_managed_segment("lmp -in in.lammps", job_dir, 1, segment_seconds=600)
+
+    assert (segment.restart_file, segment.restart_step) == ("managed/segment-000.1730.restart", 1730)
+    script = read(job_dir, segment.script_path)
+    assert "read_restart managed/segment-000.1730.restart" in script
+    assert "\nread_data" not in script
+    assert "# setup already done: velocity" in script
+    assert "# setup already done: minimize" in script
+    assert "# done in an earlier segment: run             1000" in script
+    assert "run 4000 upto" in script
+    assert "dump_modify 1 append yes" in script
+
+
+def test_finish_segment_stitches_logs_and_prunes_restarts(job_dir):
+    segment = prepare_managed_segment("lmp -in in.lammps", job_dir, 0, segment_seconds=600)
+    with open(os.path.join(job_dir, segment.log_path), "w") as f:
+        f.write("Step Temp\n0 300\n")
+    for step in (500, 1000, 1500):
+        touch_restart(job_dir, f"periodic.{step}.restart")
+    touch_restart(job_dir, "segment-000.1600.restart")
+
+    result = finish_managed_segment(job_dir, segment)
+
+    assert result["restart_step"] == 1600
+    assert not result["completed"]
+    assert sorted(os.listdir(os.path.join(job_dir, "managed"))) == [
+        "periodic.1500.restart", "segment-000.1600.restart", "segment-000.in", "segment-000.log",
+    ]
+    assert "0 300" in read(job_dir, MANAGED_LOG_NAME)
+
+    touch_restart(job_dir, "segment-001.4000.restart")
+    assert finish_managed_segment(job_dir, segment)["completed"]
+
+
+def test_new_run_ignores_old_restarts(job_dir):
+    os.makedirs(os.path.join(job_dir, "managed"))
+    touch_restart(job_dir, "segment-003.9999.restart")
+    prepare_managed_segment("lmp -in in.lammps", job_dir, 0, segment_seconds=600)
+    assert find_latest_restart(job_dir) == (None, 0)
+
+
+@pytest.mark.parametrize("script, message", [
+    ("read_data conf.lmp\nlabel loop\nrun 100\njump SELF loop\n", "not supported"),
+    ("read_data conf.lmp\nrun ${unknown}\n", "run steps"),
+    ("read_data conf.lmp\nfix 1 all nve\n", "no `run`"),
+    ("read_data conf.lmp\nrun 100\nreset_timestep 0\nrun 100\n", "after the first run"),
+])
+def test_unsupported_scripts(job_dir, script, message):
+    with open(os.path.join(job_dir, "in.lammps"), "w") as f:
+        f.write(script)
+    with pytest.raises(ManagedRunError, match=message):
+        prepare_managed_segment("lmp -in in.lammps", job_dir, 0, segment_seconds=600)
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from deepmd_artifact_serving import LocalArtifactBackend
+from deepmd_lammps_preflight import preflight_lammps_input, iter_lammps_input_lines, parse_lammps_command_line
+
+DATA_FILE = """water box
+
+192 atoms
+2 atom types
+
+0.0 12.44 xlo xhi
+0.0 12.44 ylo yhi
+0.0 12.44 zlo zhi
+
+Masses
+
+1 16.00
+2 1.008
+"""
+
+INPUT_SCRIPT = """# water
+variable        NSTEPS equal 1000
+variable        DATA index conf.lmp
+units           metal
+boundary        p p p
+atom_style      atomic
+read_data       ${DATA}
+include         settings.in
+pair_style      deepmd /public/models/dpa3.pth out_freq 100 &
+                out_file model_devi.out
+pair_coeff      * * O H
+run             ${NSTEPS}
+"""
+
+
+@pytest.fixture
+def volumes(tmp_path):
+    workspace, public = tmp_path / "workspace", tmp_path / "public"
+    (workspace / "job").mkdir(parents=True)
+    (public / "models").mkdir(parents=True)
+    (workspace / "job" / "in.lammps").write_text(INPUT_SCRIPT)
+    (workspace / "job" / "conf.lmp").write_text(DATA_FILE)
+    (workspace / "job" / "settings.in").write_text("timestep 0.0005\nthermo 100\n")
+    (public / "models" / "dpa3.pth").write_bytes(b"model")
+    return workspace, public
+
+
+def preflight(volumes, commands="lmp -in in.lammps", **kwargs):
+    workspace, public = volumes
+    backends = {"/workspace/": LocalArtifactBackend(str(workspace)), "/public/": LocalArtifactBackend(str(public))}
+    return asyncio.run(preflight_lammps_input(commands, backends, "/workspace/job/", **kwargs))
+
+
+def error_codes(result):
+    return [issue.code for issue in result.errors]
+
+
+def test_valid_deck(volumes):
+    result = preflight(volumes)
+    assert result.ok, result.to_dict()
+    assert result.atom_types == 2
+    assert result.atoms == 192
+    assert result.elements == ["O", "H"]
+    assert result.models == ["/public/models/dpa3.pth"]
+    assert result.total_run_steps == 1000
+    assert result.files["/workspace/job/settings.in"] is True
+
+
+def test_missing_files(volumes):
+    workspace, public = volumes
+    (workspace / "job" / "settings.in").unlink()
+    (public / "models" / "dpa3.pth").unlink()
+
+    result = preflight(volumes)
+    assert error_codes(result) == ["FILE_NOT_FOUND", "FILE_NOT_FOUND"]
+    assert [issue.line for issue in result.errors] == [8, 9]
+    assert all(issue.file == "/workspace/job/in.lammps" for issue in result.errors)
+
+
+def test_missing_input_script(volumes):
+    result = preflight(volumes, "lmp -in missing.in")
+    assert error_codes(result) == ["FILE_NOT_FOUND"]
+
+
+def test_pair_coeff_type_mismatch(volumes):
+    workspace, _ = volumes
+    (workspace / "job" / "in.lammps").write_text(INPUT_SCRIPT.replace("* * O H", "* * O H Na"))
+    result = preflight(volumes)
+    assert error_codes(result) == ["PAIR_COEFF_TYPE_MISMATCH"]
+    assert result.errors[0].line == 11
+
+
+def test_command_line_variable_overrides_index(volumes):
+    result = preflight(volumes, "lmp -in in.lammps -var DATA other.lmp")
+    assert error_codes(result) == ["FILE_NOT_FOUND"]
+    assert "other.lmp" in result.errors[0].message
+
+
+def test_inline_script_and_undefined_variable(volumes):
+    result = preflight(volumes, "lmp", input_script_text="read_data ${missing}\n")
+    assert error_codes(result) == ["UNDEFINED_VARIABLE"]
+
+
+def test_include_cycle(volumes):
+    workspace, _ = volumes
+    (workspace / "job" / "settings.in").write_text("include settings.in\n")
+    result = preflight(volumes)
+    assert "INCLUDE_CYCLE" in error_codes(result)
+
+
+def test_paths_outside_volumes_and_files_written_by_the_script(volumes):
+    script = "read_data /etc/conf.lmp\nwrite_restart eq.restart\nclear\nread_restart eq.restart\n"
+    result = preflight(volumes, "lmp", input_script_text=script)
+    assert error_codes(result) == ["PATH_OUTSIDE_VOLUMES"]
+
+
+def test_no_input_script_is_a_warning(volumes):
+    result = preflight(volumes, "lmp -h")
+    assert result.ok
+    assert result.to_dict()["warnings"][0]["code"] == "NO_INPUT_SCRIPT"
+
+
+def test_input_lines():
+    text = 'print "a # b" # comment\nfix 1 all &\n  nve\n\n# only comment\n'
+    assert list(iter_lammps_input_lines(text)) == [(1, 'print "a # b"'), (2, "fix 1 all    nve")]
+    assert parse_lammps_command_line("lmp -v T 300 600 -in in.lammps -sf gpu") == ("in.lammps", {"T": "300"})
@@ -0,0 +1,61 @@
+import asyncio
+from unittest import mock
+
+from fastmcp import Client
+
+import deepmd_dpa_lammps_mcp
+from deepmd_dpa_lammps_mcp import DeepmdMcpProviderPool, DEFAULT_OWNER_USER_ID, mcp_instance, mcp_providers
+
+
+def test_providers_are_reused_and_evicted_lru():
+    pool = DeepmdMcpProviderPool(max_providers=2, idle_seconds=3600)
+    alice = pool.get("alice")
+    assert pool.get("alice") is alice and alice.owner_user_id == "alice"
+
+    bob = pool.get("bob")
+    with bob.in_use():
+        pool.get("alice")
+        pool.get("carol")  # bob is the least recently used but has a running call
+        assert len(pool) == 2 and pool.get("bob") is bob
+    assert alice.closed and pool.get("alice") is not alice
+    # watchers of spawned runs are kept by the pool, not by the provider
+    assert pool.get("alice")._background_tasks is bob._background_tasks
+
+
+def test_idle_providers_are_closed():
+    pool = DeepmdMcpProviderPool(idle_seconds=60)
+    alice = pool.get("alice")
+    alice.last_used_at -= 120
+    pool.get("bob")
+    assert alice.closed and len(pool) == 1
+
+
+def test_tools_are_routed_to_the_user_provider():
+    async def scenario():
+        async with Client(mcp_instance) as client:
+            tools = {tool.name: tool for tool in await client.list_tools()}
+            assert set(DeepmdMcpProviderPool.tool_names) <= set(tools)
+            assert "ctx" not in tools["tail_lammps_job_log"].input_schema["properties"]
+            assert tools["tail_lammps_job_log"].input_schema["properties"]["lines"]["maximum"] == 200
+            # agents cache the results of the read only tools only
+            assert tools["check_lammps_input"].annotations.readOnlyHint and tools["get_lammps_run_log"].annotations.idempotentHint
+            assert tools["cancel_lammps_simulation"].annotations is None
+            # stdio / in-memory calls have no auth token, they run as the default user
+            result = await client.call_tool("cancel_lammps_simulation", {"job_id": "fc-unknown"}, raise_on_error=False)
+        return result
+
+    result = asyncio.run(scenario())
+    assert "job not found" in result.content[0].text
+    assert mcp_providers.get(DEFAULT_OWNER_USER_ID).in_flight == 0
+
+
+def test_analysis_watcher_records_the_final_status():
+    summary = {"n_frames": 10, "n_atoms": 192, "timing_seconds": {"convert": 0.1, "analyze": 0.2}, "rdf": {}}
+    function_call = mock.Mock()
+    function_call.get.aio = mock.AsyncMock(return_value=summary)
+    provider = DeepmdMcpProviderPool().get("alice")
+    with mock.patch.object(deepmd_dpa_lammps_mcp.queue_client, "record_telemetry") as record_telemetry:
+        asyncio.run(provider.watch_long_run(function_call, "token", "queuejob-1", analysis=True))
+    record_telemetry.assert_called_once_with("token", "queuejob-1",
+        {"analysis": {"n_frames": 10, "n_atoms": 192, "timing_seconds": {"convert": 0.1, "analyze": 0.2}}},
+        "COMPLETED", "10 frames analyzed")
@@ -0,0 +1,47 @@
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+from jose import jwt
+
+import deepmd_modal_run_service
+from deepmd_modal_run_service import _managed_run_stop_reason, cancel_lammps_job, register_spawned_function_call
+from deepmd_queue_client import DeepmdQueueApiError
+
+
+@pytest.fixture
+def queue_configured(monkeypatch):
+    monkeypatch.setattr(deepmd_modal_run_service.queue_client, "api_base", "https://queue.example.com/api/queue")
+
+
+def test_cancel_without_auth_token_falls_back_to_registered_calls(queue_configured):
+    register_spawned_function_call("alice", "fc-alice-1")
+    with mock.patch("modal.FunctionCall.from_id") as from_id:
+        result = cancel_lammps_job("fc-alice-1", None, owner_user_id="alice")
+    from_id.assert_called_once_with("fc-alice-1")
+    assert result["cancelled"] and "no auth token" in result["message"]
+
+
+def test_cancel_without_auth_token_of_unregistered_job_asks_for_a_token(queue_configured):
+    with mock.patch("modal.FunctionCall.from_id") as from_id, pytest.raises(PermissionError, match="auth token required"):
+        cancel_lammps_job("queuejob-of-someone", None, owner_user_id="alice")
+    from_id.assert_not_called()
+
+
+def _token(exp: float) -> str:
+    return jwt.encode({"sub": "alice", "exp": int(exp)}, "secret", algorithm="HS256")
+
+
+def test_managed_run_stops_when_the_token_is_rejected_or_expiring(queue_configured):
+    token = _token(time.time() + 7 * 86400)
+    with mock.patch.object(deepmd_modal_run_service.queue_client, "get_job",
+            side_effect=DeepmdQueueApiError(401, "token expired")):
+        assert "rejected" in asyncio.run(_managed_run_stop_reason(token, "fc-managed-run", 1800))
+    with mock.patch.object(deepmd_modal_run_service.queue_client, "get_job", return_value={"current_status": "CANCELLED"}):
+        assert asyncio.run(_managed_run_stop_reason(token, "fc-managed-run", 1800)) == "cancelled"
+    with mock.patch.object(deepmd_modal_run_service.queue_client, "get_job", return_value={"current_status": "RUNNING"}) as get_job:
+        assert asyncio.run(_managed_run_stop_reason(token, "fc-managed-run", 1800)) is None
+        # the segment would outlive the token
+        assert "expires" in asyncio.run(_managed_run_stop_reason(_token(time.time() + 600), "fc-managed-run", 1800))
+    get_job.assert_called_once()
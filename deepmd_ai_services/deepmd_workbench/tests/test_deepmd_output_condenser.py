@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+from deepmd_artifact_serving import LocalArtifactBackend
+from deepmd_output_condenser import LammpsOutputCondenser, find_lammps_log_file, read_log_lines
+
+
+def feed_run(condenser, steps, *, warnings=()):
+    condenser.feed("LAMMPS (29 Aug 2024)\n")
+    for i in range(50):
+        condenser.feed(f"setup line {i}\n")
+    condenser.feed("   Step          Temp          PotEng\n")
+    for step in range(steps):
+        if step in warnings:
+            condenser.feed(f"WARNING: Lost atoms at step {step} (../thermo.cpp:488)\n")
+        condenser.feed(f"  {step * 10}  {300 + step % 7}.0  -1000.0\n")
+        condenser.feed(f'event: [DEEPMD] [TELEMETRY] {{"t": {step}}}\n')
+    condenser.feed("Loop time of 12.5 on 1 procs for 100000 steps with 192 atoms\n")
+    condenser.feed("Total wall time: 0:00:13\n")
+
+
+def test_short_output_is_kept_verbatim():
+    condenser = LammpsOutputCondenser()
+    for line in ["LAMMPS (29 Aug 2024)", "ERROR: Unknown command: foo (../input.cpp:314)", "Last command: foo"]:
+        condenser.feed(line + "\n")
+    text = condenser.render(log_reference="/workspace/job/log.lammps")
+    assert "omitted" not in text
+    assert "ERROR: Unknown command: foo" in text and "Last command: foo" in text
+    assert "/workspace/job/log.lammps" in text
+
+
+def test_long_output_fits_budget_and_keeps_notices():
+    condenser = LammpsOutputCondenser()
+    feed_run(condenser, 10_000, warnings={5_000, 9_000})
+    condenser.feed('event: [DEEPMD] [TELEMETRY_SUMMARY] {"peak_gpu_mem_mb": 900, "series": {"t": [1, 2, 3]}}\n')
+
+    assert len(condenser.thermo_rows) < condenser.max_thermo_rows
+    assert condenser.sample_count == 10_000
+    assert condenser.telemetry_summary == {"peak_gpu_mem_mb": 900}
+
+    for max_chars in (12_000, 3_000):
+        text = condenser.render(max_chars)
+        assert len(text) <= max_chars
+        assert "Lost atoms at step 5000" in text and "Lost atoms at step 9000" in text
+        assert "Total wall time" in text
+        # the last thermo row always survives the downsampling
+        assert "99990  " in text
+
+
+def test_thermo_table_restarts_with_new_columns():
+    condenser = LammpsOutputCondenser()
+    feed_run(condenser, 100)
+    condenser.feed("   Step          Temp          Press          Volume\n")
+    condenser.feed("  0  300.0  1.0  1000.0\n")
+    assert condenser.thermo_columns == ["Step", "Temp", "Press", "Volume"]
+    assert condenser.thermo_rows == ["0  300.0  1.0  1000.0"]
+
+
+def test_find_lammps_log_file():
+    assert find_lammps_log_file("lmp -in in.lammps", "/workspace/job/") == "/workspace/job/log.lammps"
+    assert find_lammps_log_file("lmp -in in.lammps -log run.log", "/workspace/job/") == "/workspace/job/run.log"
+    assert find_lammps_log_file("lmp -in in.lammps -log none", "/workspace/job/") is None
+
+
+def test_read_log_lines_pages_and_greps(tmp_path):
+    (tmp_path / "job").mkdir()
+    (tmp_path / "job" / "log.lammps").write_text("".join(
+        f"WARNING: line {i}\n" if i % 100 == 0 else f"line {i}\n" for i in range(1, 1001)))
+    backend = LocalArtifactBackend(str(tmp_path))
+
+    page = asyncio.run(read_log_lines(backend, "/workspace/job/log.lammps", start_line=10, max_lines=5))
+    assert page["lines"] == [f"{i}: line {i}" for i in range(11, 16)]
+    assert page["total_lines"] == 1000 and page["last_line"] == 15 and page["truncated"]
+
+    page = asyncio.run(read_log_lines(backend, "/workspace/job/log.lammps", pattern="WARNING"))
+    assert len(page["lines"]) == 10 and page["lines"][-1] == "1000: WARNING: line 1000"
+    assert not page["truncated"]
+    json.dumps(page)
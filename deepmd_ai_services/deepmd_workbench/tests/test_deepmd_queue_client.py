@@ -0,0 +1,53 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from deepmd_queue_client import DeepmdQueueClient, DeepmdQueueApiError
+
+
+def make_client(status_code: int, payload: dict = None) -> DeepmdQueueClient:
+    client = DeepmdQueueClient("https://queue.example.com/api/queue/")
+    response = mock.Mock(status_code=status_code, text="detail")
+    response.json.return_value = payload or {}
+    client.session = mock.Mock(request=mock.Mock(return_value=response))
+    return client
+
+
+def test_not_configured_returns_none():
+    client = DeepmdQueueClient("")
+    assert client.cancel_job("token", "fc-1") is None
+
+
+def test_request_sends_bearer_token():
+    client = make_client(200, {"queuejob_id": "queuejob-1"})
+    assert client.get_job("token", "queuejob-1") == {"queuejob_id": "queuejob-1"}
+    client.session.request.assert_called_once()
+    args, kwargs = client.session.request.call_args
+    assert args == ("GET", "https://queue.example.com/api/queue/jobs/queuejob-1")
+    assert kwargs["headers"] == {"Authorization": "Bearer token"}
+
+
+def test_telemetry_carries_the_service_token():
+    client = make_client(200)
+    client.telemetry_service_token = "run-service-secret"
+    client.record_telemetry("token", "queuejob-1", {"performance": {}}, "COMPLETED")
+    assert client.session.request.call_args.kwargs["headers"] == {
+        "Authorization": "Bearer token", "X-Telemetry-Service-Token": "run-service-secret"}
+
+
+@pytest.mark.parametrize("status_code", [403, 404])
+def test_cancel_passes_not_found_through(status_code):
+    client = make_client(status_code)
+    with pytest.raises(DeepmdQueueApiError) as e:
+        client.cancel_job("token", "fc-of-someone-else")
+    assert e.value.status_code == status_code
+
+
+def test_bookkeeping_errors_never_raise():
+    assert make_client(404).update_status("token", "queuejob-1", "RUNNING") is None
+    assert make_client(500).cancel_job("token", "queuejob-1") is None
+
+    client = DeepmdQueueClient("https://queue.example.com/api/queue")
+    client.session = mock.Mock(request=mock.Mock(side_effect=requests.ConnectionError("down")))
+    assert client.record_telemetry("token", "queuejob-1", {}) is None
@@ -0,0 +1,63 @@
+from deepmd_run_progress import LammpsProgressEstimator, VERDICT_UNKNOWN, VERDICT_ON_TRACK, VERDICT_AT_RISK, VERDICT_WILL_TIME_OUT
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_thermo(estimator, clock, steps, seconds_per_step, *, start_at=0):
+    estimator.feed_output_line("   Step          Temp\n")
+    for step in steps:
+        clock.now = start_at + step * seconds_per_step
+        estimator.feed_output_line(f"  {step}  300.0\n")
+
+
+def test_eta_and_verdicts():
+    clock = FakeClock()
+    estimator = LammpsProgressEstimator(100_000, 1000, clock=clock)
+    clock.now = 30  # setup, not part of the rate
+    estimator.feed_output_line("   Step          Temp\n")
+    estimator.feed_output_line("  0  300.0\n")
+    assert estimator.progress()["verdict"] == VERDICT_UNKNOWN
+
+    clock.now = 130
+    estimator.feed_output_line("  10000  300.0\n")
+    progress = estimator.progress()
+    assert progress["steps_per_second"] == 100
+    assert progress["eta_seconds"] == 900
+    assert progress["projected_seconds"] == 1030
+    assert progress["verdict"] == VERDICT_AT_RISK
+
+    estimator.budget_seconds = 2000
+    assert estimator.progress()["verdict"] == VERDICT_ON_TRACK
+    estimator.budget_seconds = 500
+    assert estimator.progress()["verdict"] == VERDICT_WILL_TIME_OUT
+
+
+def test_steps_accumulate_over_runs():
+    clock = FakeClock()
+    estimator = LammpsProgressEstimator(3000, None, clock=clock)
+    run_thermo(estimator, clock, [0, 500, 1000], 0.01)
+    # second run after reset_timestep, Step starts from 0 again
+    run_thermo(estimator, clock, [0, 1000], 0.02, start_at=10)
+    progress = estimator.progress()
+    assert progress["steps_done"] == 2000
+    assert progress["fraction"] == round(2 / 3, 4)
+    assert progress["steps_per_second"] == 50  # rate of the current run
+    assert progress["verdict"] == VERDICT_UNKNOWN  # before the minimum elapsed time
+
+
+def test_unknown_total_steps_and_events():
+    clock = FakeClock()
+    estimator = LammpsProgressEstimator(None, 100, clock=clock)
+    assert estimator.pop_progress_event() is None
+    run_thermo(estimator, clock, [0, 100, 200], 1)
+    progress = estimator.pop_progress_event(interval=30)
+    assert progress["eta_seconds"] is None and progress["verdict"] == VERDICT_UNKNOWN
+    assert estimator.pop_progress_event(interval=30) is None
+    clock.now += 30
+    assert estimator.pop_progress_event(interval=30) is not None
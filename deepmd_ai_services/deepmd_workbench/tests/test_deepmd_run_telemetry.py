@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+from deepmd_run_telemetry import LammpsRunTelemetry, parse_lammps_performance_line, TELEMETRY_FIELDS
+
+
+def make_sample(t):
+    return {"t": t, "cpu_percent": 100.0, "rss_mb": 10.0 + t, "gpu_util_percent": None, "gpu_mem_mb": None}
+
+
+def test_parse_performance_line():
+    line = "Performance: 0.864 ns/day, 27.778 hours/ns, 10.000 timesteps/s, 32.000 katom-step/s"
+    assert parse_lammps_performance_line(line) == {
+        "ns_per_day": 0.864,
+        "hours_per_ns": 27.778,
+        "timesteps_per_second": 10.0,
+        "katom_steps_per_second": 32.0,
+    }
+    # lj units report tau/day instead of ns/day
+    assert parse_lammps_performance_line(b"Performance: 43200.000 tau/day, 100.000 timesteps/s\n") == {
+        "tau_per_day": 43200.0,
+        "timesteps_per_second": 100.0,
+    }
+
+
+def test_parse_loop_time_line():
+    line = "Loop time of 12.3456 on 4 procs for 1000 steps with 3000 atoms"
+    assert parse_lammps_performance_line(line) == {"loop_time_seconds": 12.3456, "procs": 4, "steps": 1000, "atoms": 3000}
+    assert parse_lammps_performance_line("Step Temp E_pair TotEng Press") is None
+    assert parse_lammps_performance_line("Performance: n/a") is None
+
+
+def test_feed_output_line_merges_each_run():
+    telemetry = LammpsRunTelemetry(os.getpid())
+    for line in [
+        "Loop time of 10.0 on 1 procs for 100 steps with 10 atoms",
+        "Performance: 1.000 ns/day, 24.000 hours/ns, 10.000 timesteps/s, 0.100 katom-step/s",
+        "Loop time of 20.0 on 1 procs for 100 steps with 10 atoms",
+        "Performance: 0.500 ns/day, 48.000 hours/ns, 5.000 timesteps/s, 0.050 katom-step/s",
+    ]:
+        telemetry.feed_output_line(line)
+
+    assert len(telemetry.performance) == 2
+    assert telemetry.performance[0]["loop_time_seconds"] == 10.0
+    assert telemetry.performance[0]["timesteps_per_second"] == 10.0
+    assert telemetry.summary()["performance"]["ns_per_day"] == 0.5
+
+
+def test_record_downsamples_when_full():
+    telemetry = LammpsRunTelemetry(os.getpid(), interval=1, max_samples=8)
+    for t in range(20):
+        telemetry._record(make_sample(t))
+
+    assert len(telemetry.series["t"]) < 8
+    assert all(len(telemetry.series[field]) == len(telemetry.series["t"]) for field in TELEMETRY_FIELDS)
+    assert telemetry.sample_stride == 4
+    # evenly spaced after downsampling
+    steps = {b - a for a, b in zip(telemetry.series["t"], telemetry.series["t"][1:])}
+    assert steps == {telemetry.sample_stride}
+
+    summary = telemetry.summary()
+    assert summary["interval_seconds"] == 4
+    assert "gpu_util_percent" not in summary["series"]
+    assert len(telemetry.pop_pending_samples()) == 8
+    assert telemetry.pop_pending_samples() == []
+
+
+def test_missing_process_does_not_raise():
+    # pid above the kernel pid_max limit, never exists
+    telemetry = LammpsRunTelemetry(2**22 + 12345)
+    assert telemetry._process is None
+    assert telemetry._sample_cpu_and_memory() == (None, None)
+
+
+def test_gpu_sampling_disabled_after_repeated_failures(tmp_path):
+    fake_nvidia_smi = tmp_path / "nvidia-smi"
+    fake_nvidia_smi.write_text("#!/bin/sh\necho garbage\n")
+    fake_nvidia_smi.chmod(0o755)
+
+    telemetry = LammpsRunTelemetry(os.getpid(), interval=1)
+    telemetry._nvidia_smi = str(fake_nvidia_smi)
+
+    async def sample_three_times():
+        return [await telemetry._sample_gpu() for _ in range(3)]
+
+    assert asyncio.run(sample_three_times()) == [(None, None)] * 3
+    assert telemetry._nvidia_smi is None
+
+
+def test_gpu_sampling_disabled_when_binary_missing(tmp_path):
+    telemetry = LammpsRunTelemetry(os.getpid(), interval=1)
+    telemetry._nvidia_smi = str(tmp_path / "missing-nvidia-smi")
+    assert asyncio.run(telemetry._sample_gpu()) == (None, None)
+    assert telemetry._nvidia_smi is None
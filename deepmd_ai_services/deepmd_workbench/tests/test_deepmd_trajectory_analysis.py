@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from deepmd_trajectory_analysis import analyze_lammps_dump, LammpsDumpFormatError
+
+
+def write_dump(path, n_frames=6, n_atoms=27, box=9.0, drift=0.1):
+    rng = np.random.default_rng(0)
+    grid = np.stack(np.meshgrid(*[np.arange(3) * 3.0] * 3, indexing="ij"), axis=-1).reshape(-1, 3)[:n_atoms]
+    lines = []
+    for frame in range(n_frames):
+        positions = grid + drift * frame + rng.normal(scale=0.05, size=grid.shape)
+        lines += ["ITEM: TIMESTEP", str(frame * 100), "ITEM: NUMBER OF ATOMS", str(n_atoms),
+            "ITEM: BOX BOUNDS pp pp pp"] + [f"0.0 {box}"] * 3 + ["ITEM: ATOMS id type xu yu zu"]
+        lines += [f"{i + 1} {1 + i % 2} {x:.5f} {y:.5f} {z:.5f}" for i, (x, y, z) in enumerate(positions)]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_analyze_lammps_dump_summary(tmp_path):
+    dump_path = write_dump(tmp_path / "traj.dump")
+    summary = analyze_lammps_dump(dump_path, rdf_types_a=None, timestep_ps=0.1, work_dir=str(tmp_path))
+
+    assert summary["n_frames"] == 6
+    assert summary["n_atoms"] == 27
+    assert summary["atom_types"] == {"1": 14, "2": 13}
+    # no pairs closer than the lattice spacing of the synthetic crystal
+    r, g = np.array(summary["rdf"]["r"]), np.array(summary["rdf"]["g"])
+    assert g[r < 2.5].sum() == 0
+    assert r[np.nonzero(g)[0][0]] == pytest.approx(3.0, abs=0.2)
+    # uniform drift of 0.1 per frame along each axis
+    assert summary["msd"]["final_msd"] == pytest.approx(3 * 0.5 ** 2, rel=0.1)
+    assert "density" in summary
+
+
+def test_analyze_lammps_dump_workers_match_serial(tmp_path):
+    dump_path = write_dump(tmp_path / "traj.dump", n_frames=40)
+    serial = analyze_lammps_dump(dump_path, ["rdf", "msd"], work_dir=str(tmp_path))
+    parallel = analyze_lammps_dump(dump_path, ["rdf", "msd"], workers=2, work_dir=str(tmp_path))
+
+    assert serial["rdf"]["g"] == parallel["rdf"]["g"]
+    assert serial["msd"]["msd"] == parallel["msd"]["msd"]
+
+
+def test_analyze_lammps_dump_rejects_unknown_analysis(tmp_path):
+    dump_path = write_dump(tmp_path / "traj.dump")
+    with pytest.raises(ValueError):
+        analyze_lammps_dump(dump_path, ["vacf"])
+
+
+def test_analyze_lammps_dump_rejects_truncated_dump(tmp_path):
+    dump_path = tmp_path / "broken.dump"
+    dump_path.write_text("ITEM: TIMESTEP\n0\nITEM: NUMBER OF ATOMS\n")
+    with pytest.raises(LammpsDumpFormatError):
+        analyze_lammps_dump(str(dump_path), ["msd"])
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+import pytest
+
+from deepmd_ttl_cache import TtlCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_and_evict_least_recently_used():
+    clock = FakeClock()
+    cache = TtlCache(ttl=10, max_entries=2, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=100)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # b is the least recently used
+    assert cache.get("b") is None and cache.get("a") == 1
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+    assert len(cache) == 0
+
+
+def test_concurrent_loads_share_one_call():
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"current_status": "RUNNING"}
+
+    async def scenario():
+        cache = TtlCache(ttl=10)
+        results = await asyncio.gather(*(cache.get_or_load("job", load) for _ in range(20)))
+        assert all(result is results[0] for result in results)
+        await cache.get_or_load("job", load)
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert cache.misses == 1 and cache.hits == 20
+
+
+def test_ttl_per_value_and_errors_are_not_cached():
+    clock = FakeClock()
+    cache = TtlCache(ttl=10, clock=clock)
+    calls = []
+
+    async def load():
+        calls.append(1)
+        if len(calls) == 1:
+            raise LookupError("not found")
+        return None
+
+    async def scenario():
+        with pytest.raises(LookupError):
+            await cache.get_or_load("job", load)
+        # a ttl of 0 does not cache the value
+        assert await cache.get_or_load("job", load, ttl=lambda value: 0) is None
+        assert await cache.get_or_load("job", load, ttl=lambda value: 600) is None
+        clock.now = 500
+        assert await cache.get_or_load("job", load) is None
+
+    asyncio.run(scenario())
+    assert len(calls) == 3
+
+
+def test_threads_share_the_cache():
+    cache = TtlCache(ttl=60, max_entries=50)
+
+    def worker(offset: int):
+        for i in range(2000):
+            cache.set((offset, i % 80), i)
+            cache.get((offset, (i * 7) % 80))
+            if i % 100 == 0:
+                asyncio.run(cache.get_or_load(("loaded", i % 10), lambda: asyncio.sleep(0, result=i)))
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) == 50
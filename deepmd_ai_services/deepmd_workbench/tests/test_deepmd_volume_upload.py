@@ -0,0 +1,78 @@
+import asyncio
+import base64
+import gzip
+import os
+
+import pytest
+
+from deepmd_artifact_serving import LocalArtifactBackend
+from deepmd_volume_upload import UploadError, bulk_upload_job_files, decode_upload_content
+
+
+class FakeVolume:
+    """batch_upload of a modal volume, writing into a local dir"""
+
+    def __init__(self, root):
+        self.root = root
+        self.batches = []
+
+    def batch_upload(self, force=False):
+        volume = self
+
+        class Batch:
+            def __enter__(self):
+                self.files = {}
+                return self
+
+            def put_file(self, file, remote_path):
+                self.files[remote_path] = file.read()
+
+            def __exit__(self, *exc):
+                for remote_path, content in self.files.items():
+                    path = os.path.join(volume.root, remote_path)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, "wb") as f:
+                        f.write(content)
+                volume.batches.append(sorted(self.files))
+
+        return Batch()
+
+
+def test_decode_upload_content():
+    assert decode_upload_content("units metal\n") == b"units metal\n"
+    assert decode_upload_content(base64.b64encode(b"\x00\x01").decode(), "base64") == b"\x00\x01"
+    packed = base64.b64encode(gzip.compress(b"Step Temp\n" * 1000)).decode()
+    assert decode_upload_content(packed, "gzip+base64") == b"Step Temp\n" * 1000
+    with pytest.raises(UploadError):
+        decode_upload_content("not base64!", "base64")
+    with pytest.raises(UploadError):
+        decode_upload_content(packed[:40], "gzip+base64")
+
+
+def test_bulk_upload_skips_unchanged_files(tmp_path):
+    volume = FakeVolume(str(tmp_path))
+    backend = LocalArtifactBackend(str(tmp_path))
+    files = [("in.lammps", b"read_data data.lmp\n"), ("data.lmp", b"3 atoms\n"), ("potentials/graph.pb", b"\x00" * 10)]
+
+    manifest = asyncio.run(bulk_upload_job_files(volume, backend, "/workspace/job/", files))
+    assert [file["status"] for file in manifest["files"]] == ["created"] * 3
+    assert manifest["files"][2]["path"] == "/workspace/job/potentials/graph.pb"
+    assert (tmp_path / "job" / "potentials" / "graph.pb").read_bytes() == b"\x00" * 10
+
+    # same size, other content: hashed and rewritten; identical files are skipped
+    files[1] = ("data.lmp", b"4 atoms\n")
+    manifest = asyncio.run(bulk_upload_job_files(volume, backend, "/workspace/job/", files))
+    assert {file["path"]: file["status"] for file in manifest["files"]} == {
+        "/workspace/job/in.lammps": "unchanged", "/workspace/job/data.lmp": "updated", "/workspace/job/potentials/graph.pb": "unchanged"}
+    assert manifest["written"] == 1 and volume.batches[-1] == ["job/data.lmp"]
+
+    asyncio.run(bulk_upload_job_files(volume, backend, "/workspace/job/", files))
+    assert len(volume.batches) == 2  # nothing changed, no commit
+
+
+def test_bulk_upload_rejects_escaping_paths(tmp_path):
+    volume, backend = FakeVolume(str(tmp_path)), LocalArtifactBackend(str(tmp_path))
+    for path in ("../other/in.lammps", "/etc/passwd", ""):
+        with pytest.raises(ValueError):
+            asyncio.run(bulk_upload_job_files(volume, backend, "/workspace/job/", [(path, b"x")]))
+    assert volume.batches == []
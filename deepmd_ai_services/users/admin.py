@@ -5,7 +5,8 @@ from django.contrib.auth.models import Group
 from django.contrib.auth.admin import GroupAdmin as BaseGroupAdmin
 from unfold.admin import ModelAdmin
 from unfold.forms import AdminPasswordChangeForm, UserChangeForm, UserCreationForm
-from .models import User
+from django.utils import timezone
+from .models import User, SigningKey
 
 
 # admin.site.unregister(User) # has been unregistered in settings.py via  AUTH_USER_MODEL = 'users.User' 
@@ -44,3 +45,21 @@ class CustomUserAdmin(BaseUserAdmin, ModelAdmin):
 class GroupAdmin(BaseGroupAdmin, ModelAdmin):
     pass
 
+
+@admin.register(SigningKey)
+class SigningKeyAdmin(ModelAdmin):
+    """JWT signing keys: the newest active key signs, retire old keys once their tokens have expired"""
+    list_display = ('kid', 'created_at', 'retired_at')
+    readonly_fields = ('kid', 'public_key', 'created_at', 'retired_at')
+    exclude = ('private_key',)
+    actions = ['retire_keys']
+
+    def has_add_permission(self, request):
+        # keys are generated by `manage.py rotate_jwt_signing_key`, never entered
+        return False
+
+    @admin.action(description="Retire selected keys (their tokens are rejected)")
+    def retire_keys(self, request, queryset):
+        for key in queryset.filter(retired_at__isnull=True):
+            key.retired_at = timezone.now()
+            key.save()
@@ -1,3 +1,4 @@
+import inspect
 import os
 from jose import jwt
 import json
@@ -6,13 +7,19 @@ from datetime import timedelta
 from functools import wraps
 from typing import Optional
 
+from asgiref.sync import sync_to_async
 from ninja import Router, Schema, Field, Form
 from ninja import ModelSchema
 from django.http import HttpResponseRedirect, JsonResponse, HttpResponse, HttpRequest
+from django.db import IntegrityError
 from django.utils import timezone
-from workos import WorkOSClient
+from workos import AsyncWorkOSClient, WorkOSClient
 from urllib.parse import urlencode
 from users.models import User
+from users.provisioning import (aupsert_user, bohrium_proxy_user, find_username_conflicts, provider_user_id, upsert_users,
+    workos_user, BOHRIUM_PROXY_FILL_FIELDS, BOHRIUM_PROXY_UPDATE_FIELDS, IMPORT_UPDATE_FIELDS, WORKOS_UPDATE_FIELDS)
+from users.auth_cache import get_cached_token_payload, cache_token_payload, get_cached_user, get_user
+from users.signing_keys import keyring, parse_key, env_key_kid, JWT_ALGORITHM, KEYRING_REFRESH_SECONDS
 from loguru import logger
 
 
@@ -37,6 +44,17 @@ class JWTExchangeSchema(Schema):
 class JWTValidateSchema(Schema):
     token: str
 
+class OrgImportUserSchema(Schema):
+    external_id: str
+    email: str
+    auth_provider: str = "bohrium-proxy"
+    username: Optional[str] = None
+    first_name: str = ""
+    last_name: str = ""
+
+class OrgImportSchema(Schema):
+    users: list[OrgImportUserSchema]
+
 # Services
 class WorkOSService:
     def __init__(self):
@@ -44,6 +62,11 @@ class WorkOSService:
             api_key=os.getenv("WORKOS_API_KEY"),
             client_id=os.getenv("WORKOS_CLIENT_ID")
         )
+        # code exchange of the async login path, awaited without holding a worker thread
+        self.async_client = AsyncWorkOSClient(
+            api_key=os.getenv("WORKOS_API_KEY"),
+            client_id=os.getenv("WORKOS_CLIENT_ID")
+        )
     
     def get_authorization_url(self, nexturl: str = None):
         state = base64.urlsafe_b64encode(
@@ -61,27 +84,78 @@ class WorkOSService:
             code=code,
         )
 
+    async def aauthenticate_with_code(self, code: str):
+        return await self.async_client.user_management.authenticate_with_code(
+            code=code,
+        )
+
 class JWTService:
     def __init__(self):
+        # the key pair of the env vars signs until a SigningKey is added, it keeps verifying afterwards
         self.django_jwt_private_key = os.getenv("DJANGO_JWT_PRIVATE_KEY")
         self.django_jwt_public_key = os.getenv("DJANGO_JWT_PUBLIC_KEY")
+        self.keyring = keyring
         # self.algorithm = "RS256"
-    
+
+    def signing_key(self) -> tuple[str, str]:
+        """(kid, private PEM) of the newest active key"""
+        keys = self.keyring.keys()
+        if keys:
+            kid, private_key, _ = keys[0]
+            return kid, private_key
+        return env_key_kid(self.django_jwt_public_key or ""), self.django_jwt_private_key
+
+    def verification_keys(self) -> dict[str, str]:
+        """public PEM by kid of every key whose tokens are accepted"""
+        keys = {kid: public_key for kid, _, public_key in self.keyring.keys()}
+        if self.django_jwt_public_key:
+            keys.setdefault(env_key_kid(self.django_jwt_public_key), self.django_jwt_public_key)
+        return keys
+
+    def jwks(self) -> dict:
+        return {"keys": [
+            {**parse_key(public_key).to_dict(), "kid": kid, "use": "sig"}
+            for kid, public_key in self.verification_keys().items()
+        ]}
+
     def generate_token(self, user: User, expire_in: int = 7*24*3600):
         payload = {
             "user_id": user.user_id,
             "username": user.username,
             "auth_provider": user.auth_provider,
+            "organization": user.organization,
             "exp": timezone.now() + timedelta(seconds=expire_in)
         }
-        return jwt.encode(payload, self.django_jwt_private_key, algorithm="RS256")
+        kid, private_key = self.signing_key()
+        return jwt.encode(payload, parse_key(private_key), algorithm=JWT_ALGORITHM, headers={"kid": kid})
     
+    def public_key_for(self, token: str) -> str:
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            # issued before the keys had ids
+            return self.django_jwt_public_key
+        public_key = self.verification_keys().get(kid)
+        if public_key is None and self.keyring.reload_for_unknown_kid():
+            public_key = self.verification_keys().get(kid)
+        if public_key is None:
+            raise jwt.JWTError(f"unknown or retired signing key: {kid=}")
+        return public_key
+
+    def validate_cached_token(self, token: str) -> Optional[tuple[User, dict]]:
+        """(user, claims) if both are cached, None otherwise; cache lookups only, no query and no signature check"""
+        payload = get_cached_token_payload(token)
+        user = get_cached_user(payload["user_id"]) if payload is not None else None
+        return (user, payload) if user is not None else None
+
     def validate_token(self, token: str):
-        payload = jwt.decode(token, self.django_jwt_public_key, algorithms=["RS256"])
-        user_id = payload["user_id"]
-        if user_id is None:
-            raise jwt.InvalidTokenError("user_id cannot be None")
-        user = User.objects.get(user_id=user_id)
+        """(user, claims) of a token; verified claims and user rows are cached, no query on a hit"""
+        payload = get_cached_token_payload(token)
+        if payload is None:
+            payload = jwt.decode(token, parse_key(self.public_key_for(token)), algorithms=[JWT_ALGORITHM])
+            if payload["user_id"] is None:
+                raise jwt.JWTError("user_id cannot be None")
+            cache_token_payload(token, payload)
+        user = get_user(payload["user_id"])
         return user, payload
 
 # Services instances
@@ -89,52 +163,60 @@ workos_service = WorkOSService()
 jwt_service = JWTService()
 
 # Decorators
+def get_request_auth_token(request: HttpRequest) -> Optional[str]:
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header[7:]
+    return request.COOKIES.get('auth_token') or request.GET.get('auth_token')
+
 def auth_required(view_func):
+    """
+    sets request.user from the JWT, for sync and async views. For the latter the cached claims and user row
+    are looked up in a pool thread (thread_sensitive=False), only a cache miss (signature check, user query)
+    goes through the request's sync thread where the ORM runs.
+    """
+    if inspect.iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request: HttpRequest, *args, **kwargs):
+            auth_token = get_request_auth_token(request)
+            if not auth_token:
+                return JsonResponse({'error': 'Missing or invalid Authorization header'}, status=401)
+            cached = await sync_to_async(jwt_service.validate_cached_token, thread_sensitive=False)(auth_token)
+            user, payload = cached or await sync_to_async(jwt_service.validate_token)(auth_token)
+            request.user = user
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
     @wraps(view_func)
     def wrapper(request: HttpRequest, *args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        if auth_header and auth_header.startswith('Bearer '):
-            auth_token = auth_header[7:]
-        elif request.COOKIES.get('auth_token'):
-            auth_token = request.COOKIES.get('auth_token')
-        elif request.GET.get('auth_token'):
-            auth_token = request.GET.get('auth_token')
-        else:
+        auth_token = get_request_auth_token(request)
+        if not auth_token:
             return JsonResponse({'error': 'Missing or invalid Authorization header'}, status=401)
         user, payload = jwt_service.validate_token(auth_token)
         request.user = user
         return view_func(request, *args, **kwargs)
     return wrapper
 
+@users_router.get("/.well-known/jwks.json")
+async def get_jwks(request):
+    """Public keys the JWTs are signed with, by kid (RFC 7517), for verifiers outside django"""
+    response = JsonResponse(await sync_to_async(jwt_service.jwks)())
+    response["Cache-Control"] = f"public, max-age={KEYRING_REFRESH_SECONDS}"
+    return response
+
 # Auth endpoints
 @users_router.get("/auth/authorize")
-def get_authorization_url(request, provider: str = "authkit", nexturl: str = None):
+async def get_authorization_url(request, provider: str = "authkit", nexturl: str = None):
     """Get WorkOS authkit authorization URL"""
     authorization_url = workos_service.get_authorization_url(nexturl)
     return HttpResponseRedirect(authorization_url)
 
 @users_router.get("/auth/callback")
-def workos_callback(request, code: str, state: str = None):
+async def workos_callback(request, code: str, state: str = None):
     """Handle WorkOS callback"""
-    auth_response = workos_service.authenticate_with_code(code)
-    workos_user = auth_response.user
-
-    user_id = f"user__workos__{workos_user.id}"
-    username = f"default_username__workos__{workos_user.id}"
-    
-    user, created = User.objects.get_or_create(
-        user_id=user_id,
-        defaults={
-            'username': username,
-            'email': workos_user.email,
-            'first_name': workos_user.first_name,
-            'last_name': workos_user.last_name,
-            'external_id': workos_user.id,
-            'auth_provider': 'workos'
-        }
-    )
-    
-    auth_token = jwt_service.generate_token(user)
+    auth_response = await workos_service.aauthenticate_with_code(code)
+    user = await aupsert_user(workos_user(auth_response.user), WORKOS_UPDATE_FIELDS)
+    auth_token = await sync_to_async(jwt_service.generate_token)(user)
     
     
     if state:
@@ -144,12 +226,13 @@ def workos_callback(request, code: str, state: str = None):
         nexturl = DEFAULT_NEXTURL
     
     redirect_url = f"/api/users/auth/success?auth_token={auth_token}&nexturl={nexturl}"
-    response = HttpResponseRedirect(redirect_url, status_code=303)
+    response = HttpResponseRedirect(redirect_url)
+    response.status_code = 303
 
     return response
 
 @users_router.get("/auth/success")
-def auth_success(request, auth_token: str, nexturl: str):
+async def auth_success(request, auth_token: str, nexturl: str):
     html = f"""
     <html>
         <head><title>auth success</title></head>
@@ -180,7 +263,7 @@ def auth_success(request, auth_token: str, nexturl: str):
 
 @users_router.get("/dashboard")
 @auth_required  
-def dashboard(request):
+async def dashboard(request):
     """Debug dashboard - reuse existing get_current_user logic"""
 
     user_schema = _get_current_user(request)
@@ -198,7 +281,7 @@ def dashboard(request):
 
 
 @users_router.post("/auth/logout")
-def logout(request, nexturl: str = '/'):
+async def logout(request, nexturl: str = '/'):
     """Logout user"""
     response = HttpResponseRedirect(nexturl)
     return response
@@ -206,9 +289,9 @@ def logout(request, nexturl: str = '/'):
 # JWT endpoints
 @users_router.post("/jwt/issue")
 @auth_required
-def issue_jwt(request):
+async def issue_jwt(request):
     """Issue new JWT token"""
-    auth_token = jwt_service.generate_token(request.user)
+    auth_token = await sync_to_async(jwt_service.generate_token)(request.user)
     return {
         "access_token": auth_token,
         "token_type": "bearer",
@@ -216,51 +299,66 @@ def issue_jwt(request):
     }
 
 @users_router.post("/jwt/bohrium-proxy/callback")
-def callback_bohrium_proxy_jwt(request, external_jwt: str = Form(...), nexturl: str = Form(DEFAULT_NEXTURL)):
+async def callback_bohrium_proxy_jwt(request, external_jwt: str = Form(...), nexturl: str = Form(DEFAULT_NEXTURL)):
     """Callback for external JWT"""
 
     BOHRIUM_PROXY_JWT_PUBLIC_KEY = os.getenv("BOHRIUM_PROXY_JWT_PUBLIC_KEY")
     external_payload = jwt.decode(
         external_jwt,
-        key=BOHRIUM_PROXY_JWT_PUBLIC_KEY,
+        key=parse_key(BOHRIUM_PROXY_JWT_PUBLIC_KEY),
         algorithms=["RS256"]
     )
     user_data = external_payload['user_data']
-    # user_id = 
     logger.info(f"user_data: {user_data}")
 
-
-    external_id = user_data['user_id']
-    user_id = f"user__bohrium-proxy__{external_id}"
-    username = f"default_username__bohrium-proxy__{user_data['name']}"
-    email = f"mock-email__bohrium-proxy__{external_id}@bohrium.com"
-    organization = f"bohrium-proxy__org__{user_data['org_id']}"
-
-    user, created = User.objects.get_or_create(
-        user_id=user_id,
-        defaults={
-            'username': username,
-            'email': email,
-            'auth_provider': 'bohrium-proxy',
-            'external_id': external_id,
-            'organization': organization
-        }
-    )
+    user = await aupsert_user(bohrium_proxy_user(user_data), BOHRIUM_PROXY_UPDATE_FIELDS, BOHRIUM_PROXY_FILL_FIELDS)
 
     # nexturl = f"{MODAL_JUPYTER_SERVICE_ENDPOINT}/users/{user_id}/sandbox"
     # nexturl = f"/api/users/dashboard"
     # nexturl = data.nexturl
     
-    auth_token = jwt_service.generate_token(user)
+    auth_token = await sync_to_async(jwt_service.generate_token)(user)
 
     redirect_url = f"/api/users/auth/success?auth_token={auth_token}&nexturl={nexturl}"
     return HttpResponseRedirect(redirect_url)
     
 
+@users_router.post("/orgs/{organization}/import")
+@auth_required
+async def import_org_users(request, organization: str, data: OrgImportSchema):
+    """Pre-provision the users of an organization (e.g. a class roster) before their first login, staff only"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    users = [
+        User(
+            user_id=provider_user_id(row.auth_provider, row.external_id),
+            username=row.username or f"default_username__{row.auth_provider}__{row.external_id}",
+            email=row.email,
+            first_name=row.first_name,
+            last_name=row.last_name,
+            external_id=row.external_id,
+            auth_provider=row.auth_provider,
+            organization=organization,
+        )
+        for row in data.users
+    ]
+    # nothing is imported when a row conflicts, the roster is fixed and sent again
+    conflicts = await sync_to_async(find_username_conflicts)(users)
+    if conflicts:
+        return JsonResponse({'error': f'{len(conflicts)} rows conflict, nothing imported', 'conflicts': conflicts}, status=409)
+    try:
+        count = await sync_to_async(upsert_users)(users, IMPORT_UPDATE_FIELDS)
+    except IntegrityError as e:
+        # a user created with the same username since the check
+        return JsonResponse({'error': f'import conflict, nothing imported: {e}'}, status=409)
+    logger.info(f"org import: {organization=} {count=} by {request.user.user_id=}")
+    return {"organization": organization, "count": count}
+
+
 @users_router.post("/jwt/validate")
-def validate_jwt(request, data: JWTValidateSchema):
+async def validate_jwt(request, data: JWTValidateSchema):
     """Validate JWT token"""
-    user, payload = jwt_service.validate_token(data.token)
+    user, payload = await sync_to_async(jwt_service.validate_token)(data.token)
     
     return {
         "valid": True,
@@ -275,12 +373,12 @@ def validate_jwt(request, data: JWTValidateSchema):
 
 @users_router.get("/jwt")
 @auth_required
-def get_jwt(request, expire_in: int = 7*24*3600):
+async def get_jwt(request, expire_in: int = 7*24*3600):
     """Get user JWT"""
     if expire_in > 90*24*3600:
         res = {"error": "Expire time too long"}, 400 
     else:
-        auth_token = jwt_service.generate_token(request.user, expire_in=expire_in)
+        auth_token = await sync_to_async(jwt_service.generate_token)(request.user, expire_in=expire_in)
         res = {"auth_token": auth_token, "expires_in": expire_in}
     return res
     
@@ -297,7 +395,7 @@ def _get_current_user(request) -> UserResponseSchema:
 
 @users_router.get("/me", response=UserResponseSchema)
 @auth_required  
-def api_me(request):
+async def api_me(request):
     user_schema = _get_current_user(request)
     user_dict = user_schema.dict()
     return user_dict
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "users"
+
+    def ready(self):
+        # signal receivers invalidating the cached user rows and signing keys
+        from users import auth_cache, signing_keys  # noqa: F401
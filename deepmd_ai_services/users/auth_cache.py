@@ -0,0 +1,61 @@
+import hashlib
+import time
+from typing import Optional
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from users.models import User
+
+
+# Configuration
+TOKEN_CACHE_MAX_SECONDS = 3600       # verified claims are kept until the token expires, at most this long
+USER_CACHE_SECONDS = 300             # user rows, also dropped on every save / delete of the user
+TOKEN_CACHE_PREFIX = "users:token:"
+USER_CACHE_PREFIX = "users:user:"
+
+
+def token_cache_key(token: str) -> str:
+    return TOKEN_CACHE_PREFIX + hashlib.sha256(token.encode()).hexdigest()
+
+
+def user_cache_key(user_id: str) -> str:
+    return USER_CACHE_PREFIX + hashlib.sha256(user_id.encode()).hexdigest()
+
+
+def get_cached_token_payload(token: str) -> Optional[dict]:
+    return cache.get(token_cache_key(token))
+
+
+def cache_token_payload(token: str, payload: dict):
+    """keep the claims of a verified token, never beyond its exp"""
+    timeout = TOKEN_CACHE_MAX_SECONDS
+    if payload.get("exp") is not None:
+        timeout = min(timeout, int(payload["exp"] - time.time()))
+    if timeout > 0:
+        cache.set(token_cache_key(token), payload, timeout)
+
+
+def get_cached_user(user_id: str) -> Optional[User]:
+    return cache.get(user_cache_key(user_id))
+
+
+def get_user(user_id: str) -> User:
+    """the user row, cached; raises User.DoesNotExist (not cached) like User.objects.get"""
+    user = get_cached_user(user_id)
+    if user is None:
+        user = User.objects.get(user_id=user_id)
+        cache.set(user_cache_key(user_id), user, USER_CACHE_SECONDS)
+    return user
+
+
+def invalidate_user(user_id: Optional[str]):
+    if user_id:
+        cache.delete(user_cache_key(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_on_change(sender, instance: User, **kwargs):
+    invalidate_user(instance.user_id)
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.models import SigningKey
+
+
+class Command(BaseCommand):
+    help = "Generate a new JWT signing key (it signs from now on), optionally retire keys older than the previous one"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retire-older-than-days", type=int, default=None,
+            help="Retire active keys created before this many days ago, except the two newest")
+
+    def handle(self, *args, retire_older_than_days=None, **options):
+        key = SigningKey.generate()
+        self.stdout.write(f"new signing key: {key.kid}")
+
+        if retire_older_than_days is not None:
+            cutoff = timezone.now() - timedelta(days=retire_older_than_days)
+            # the new key and the one before it keep verifying whatever their age
+            keep = SigningKey.objects.filter(retired_at__isnull=True).order_by("-created_at").values_list("pk", flat=True)[:2]
+            for old_key in SigningKey.objects.filter(retired_at__isnull=True, created_at__lt=cutoff).exclude(pk__in=list(keep)):
+                old_key.retired_at = timezone.now()
+                old_key.save()
+                self.stdout.write(f"retired signing key: {old_key.kid}")
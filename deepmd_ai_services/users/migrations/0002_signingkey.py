@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SigningKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kid', models.CharField(max_length=64, unique=True)),
+                ('private_key', models.TextField(help_text='PEM, PKCS8')),
+                ('public_key', models.TextField(help_text='PEM, SubjectPublicKeyInfo')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('retired_at', models.DateTimeField(blank=True, help_text='Tokens of retired keys are rejected, the key is left out of the JWKS', null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
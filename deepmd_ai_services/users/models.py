@@ -39,4 +39,42 @@ class User(AbstractUser):
     
     # supabase__a1b2c345-1789-xxx or django__1234567890
 
-    
\ No newline at end of file
+    
+
+class SigningKey(models.Model):
+    """
+    RS256 key pair the JWTs are signed with, tagged with the `kid` of the token header.
+    The newest active key signs, every active key verifies and is published in the JWKS.
+    Rotation: add a key (admin action), retire the old one once its tokens have expired.
+    """
+    kid = models.CharField(max_length=64, unique=True)
+    private_key = models.TextField(help_text="PEM, PKCS8")
+    public_key = models.TextField(help_text="PEM, SubjectPublicKeyInfo")
+    created_at = models.DateTimeField(default=timezone.now)
+    retired_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Tokens of retired keys are rejected, the key is left out of the JWKS"
+    )
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return self.kid
+
+    @classmethod
+    def generate(cls) -> "SigningKey":
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        return cls.objects.create(
+            kid=f"{timezone.now():%Y%m%d}-{uuid.uuid4().hex[:8]}",
+            private_key=key.private_bytes(
+                serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+            ).decode(),
+            public_key=key.public_key().public_bytes(
+                serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+            ).decode(),
+        )
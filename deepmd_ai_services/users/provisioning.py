@@ -0,0 +1,108 @@
+from typing import Iterable, Optional
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+
+from users.auth_cache import get_user, invalidate_user
+from users.models import User
+
+
+# Configuration
+UPSERT_BATCH_SIZE = 2000             # rows per INSERT ... ON CONFLICT statement, within the postgres parameter limit
+# provider fields refreshed on every login / import; username and everything edited in the admin are kept
+WORKOS_UPDATE_FIELDS = ["email", "first_name", "last_name", "external_id", "auth_provider"]
+BOHRIUM_PROXY_UPDATE_FIELDS = ["external_id", "auth_provider"]
+# the proxy sends a placeholder email and its own org id: only filled in when empty, an org import or the admin wins
+BOHRIUM_PROXY_FILL_FIELDS = ["email", "organization"]
+IMPORT_UPDATE_FIELDS = ["email", "first_name", "last_name", "external_id", "auth_provider", "organization"]
+
+
+def provider_user_id(auth_provider: str, external_id: str) -> str:
+    return f"user__{auth_provider}__{external_id}"
+
+
+def workos_user(workos_user) -> User:
+    return User(
+        user_id=provider_user_id("workos", workos_user.id),
+        username=f"default_username__workos__{workos_user.id}",
+        email=workos_user.email,
+        first_name=workos_user.first_name or "",
+        last_name=workos_user.last_name or "",
+        external_id=workos_user.id,
+        auth_provider="workos",
+    )
+
+
+def bohrium_proxy_user(user_data: dict) -> User:
+    external_id = str(user_data["user_id"])
+    return User(
+        user_id=provider_user_id("bohrium-proxy", external_id),
+        username=f"default_username__bohrium-proxy__{user_data['name']}",
+        email=f"mock-email__bohrium-proxy__{external_id}@bohrium.com",
+        auth_provider="bohrium-proxy",
+        external_id=external_id,
+        organization=f"bohrium-proxy__org__{user_data['org_id']}",
+    )
+
+
+def upsert_users(users: Iterable[User], update_fields: list[str], batch_size: Optional[int] = UPSERT_BATCH_SIZE) -> int:
+    """
+    INSERT ... ON CONFLICT (user_id) DO UPDATE of update_fields, one statement per batch_size rows.
+    Concurrent logins of the same user cannot race into an IntegrityError like get_or_create.
+    No post_save is sent, the cached rows are dropped here.
+    """
+    users = list(users)
+    # all batches or none, e.g. when a username is taken
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=batch_size,
+            update_conflicts=True, unique_fields=["user_id"], update_fields=update_fields)
+    for user in users:
+        invalidate_user(user.user_id)
+    return len(users)
+
+
+def find_username_conflicts(users: list[User]) -> list[dict]:
+    """
+    rows whose insert would fail on the unique username: taken by another user, or twice in the batch.
+    Rows of existing users are updates, their username is kept and cannot conflict.
+    """
+    existing_user_ids = set(User.objects.filter(user_id__in=[user.user_id for user in users]).values_list("user_id", flat=True))
+    taken = dict(User.objects.filter(username__in=[user.username for user in users]).values_list("username", "user_id"))
+    conflicts = []
+    seen_usernames, seen_user_ids = {}, set()
+    for index, user in enumerate(users):
+        if user.user_id in seen_user_ids:
+            reason = "user listed twice"
+        elif user.user_id in existing_user_ids:
+            reason = None
+        elif taken.get(user.username, user.user_id) != user.user_id:
+            reason = f"username taken by {taken[user.username]}"
+        elif user.username in seen_usernames:
+            reason = f"username also used by row {seen_usernames[user.username]}"
+        else:
+            reason = None
+        seen_user_ids.add(user.user_id)
+        seen_usernames.setdefault(user.username, index)
+        if reason is not None:
+            conflicts.append({"row": index, "external_id": user.external_id, "username": user.username, "reason": reason})
+    return conflicts
+
+
+def upsert_user(user: User, update_fields: list[str], fill_fields: list[str] = ()) -> User:
+    """
+    the upserted row as stored (the username of an existing user is kept), also warms the user cache.
+    fill_fields are only written where the stored value is empty.
+    """
+    upsert_users([user], update_fields)
+    if fill_fields:
+        User.objects.filter(user_id=user.user_id).update(**{
+            field: Case(When(Q(**{f"{field}__isnull": True}) | Q(**{field: ""}), then=Value(getattr(user, field))), default=F(field),
+                output_field=User._meta.get_field(field))
+            for field in fill_fields
+        })
+        invalidate_user(user.user_id)
+    return get_user(user.user_id)
+
+
+aupsert_user = sync_to_async(upsert_user)
@@ -0,0 +1,69 @@
+import functools
+import hashlib
+import time
+from typing import Callable, Optional
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from jose import jwk
+from jose.backends.base import Key
+
+from users.models import SigningKey
+
+
+# Configuration
+JWT_ALGORITHM = "RS256"
+KEYRING_REFRESH_SECONDS = 60         # keys added / retired in the database reach every worker within this time
+KEYRING_MIN_RELOAD_SECONDS = 5       # tokens with an unknown kid reload the keys at most this often
+
+
+@functools.lru_cache(maxsize=64)
+def parse_key(pem: str) -> Key:
+    """the key object of a PEM, parsed once per process (jose parses PEM strings on every encode / decode)"""
+    return jwk.construct(pem, JWT_ALGORITHM)
+
+
+def env_key_kid(public_pem: str) -> str:
+    """stable kid of the key pair of the DJANGO_JWT_*_KEY env vars"""
+    return "env-" + hashlib.sha256(public_pem.strip().encode()).hexdigest()[:12]
+
+
+class SigningKeyring:
+    """(kid, private PEM, public PEM) of the active database keys, newest first, reloaded every refresh_seconds"""
+
+    def __init__(self, *, refresh_seconds: float = KEYRING_REFRESH_SECONDS,
+            min_reload_seconds: float = KEYRING_MIN_RELOAD_SECONDS, clock: Callable[[], float] = time.monotonic):
+        self.refresh_seconds = refresh_seconds
+        self.min_reload_seconds = min_reload_seconds
+        self.clock = clock
+        self._keys: list[tuple[str, str, str]] = []
+        self._loaded_at: Optional[float] = None
+
+    def keys(self) -> list[tuple[str, str, str]]:
+        if self._loaded_at is None or self.clock() - self._loaded_at >= self.refresh_seconds:
+            self.reload()
+        return self._keys
+
+    def reload(self):
+        self._keys = list(SigningKey.objects.filter(retired_at__isnull=True)
+            .order_by("-created_at").values_list("kid", "private_key", "public_key"))
+        self._loaded_at = self.clock()
+
+    def reload_for_unknown_kid(self) -> bool:
+        """reload if the keys are older than min_reload_seconds, a key may have been added by another worker"""
+        if self._loaded_at is not None and self.clock() - self._loaded_at < self.min_reload_seconds:
+            return False
+        self.reload()
+        return True
+
+    def invalidate(self):
+        self._loaded_at = None
+
+
+keyring = SigningKeyring()
+
+
+@receiver(post_save, sender=SigningKey)
+@receiver(post_delete, sender=SigningKey)
+def invalidate_keyring_on_change(sender, instance: SigningKey, **kwargs):
+    keyring.invalidate()
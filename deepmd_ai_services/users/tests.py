@@ -1,3 +1,242 @@
-from django.test import TestCase
+import io
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.core.cache import cache
+from django.conf import settings
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from jose import jwt
+
+from deepmd_ai_services.middleware import AsyncSecurityMiddleware
+from users import auth_cache
+from users.api import jwt_service, workos_service
+from users.models import SigningKey, User
+from users.signing_keys import env_key_kid, keyring, parse_key
+
+
+def generate_rsa_key_pair() -> tuple[str, str]:
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+    return private_pem, public_pem
+
+
+class TemporaryKeyTestCase(TestCase):
+    """signs with a throwaway env key pair"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._saved_keys = (jwt_service.django_jwt_private_key, jwt_service.django_jwt_public_key)
+        jwt_service.django_jwt_private_key, jwt_service.django_jwt_public_key = generate_rsa_key_pair()
+
+    @classmethod
+    def tearDownClass(cls):
+        jwt_service.django_jwt_private_key, jwt_service.django_jwt_public_key = cls._saved_keys
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        keyring.invalidate()
+        self.user = User.objects.create(username="alice", user_id="user__test__alice", email="alice@example.com",
+            organization="lab")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {jwt_service.generate_token(self.user)}"}
+
+
+class AuthCacheTests(TemporaryKeyTestCase):
+    def test_me_issues_no_query_on_a_cache_hit(self):
+        self.assertEqual(self.client.get("/api/users/me", **self.headers).status_code, 200)
+        with mock.patch("users.api.jwt.decode", wraps=jwt.decode) as decode, self.assertNumQueries(0):
+            response = self.client.get("/api/users/me", **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["organization"], "lab")
+        decode.assert_not_called()
+
+    async def test_me_over_asgi(self):
+        # the ASGI handler, async middleware chain and the async auth_required wrapper
+        response = await self.async_client.get("/api/users/me", headers={"Authorization": self.headers["HTTP_AUTHORIZATION"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["user_id"], self.user.user_id)
+        self.assertEqual((await self.async_client.get("/api/users/me")).status_code, 401)
+
+    def test_api_requests_skip_the_site_middleware_under_asgi(self):
+        from deepmd_ai_services.asgi import ApiASGIHandler
+        with mock.patch("django.core.handlers.base.import_string", wraps=import_string) as imported:
+            ApiASGIHandler()
+        self.assertEqual([call.args[0] for call in imported.call_args_list], list(reversed(settings.API_MIDDLEWARE)))
+        self.assertIn("django.contrib.sessions.middleware.SessionMiddleware", settings.MIDDLEWARE)
+
+    async def test_security_headers_without_a_thread_hop(self):
+        async def view(request):
+            return HttpResponse("ok")
+
+        with mock.patch("django.utils.deprecation.sync_to_async", side_effect=AssertionError("thread hop")):
+            response = await AsyncSecurityMiddleware(view)(RequestFactory().get("/api/users/me"))
+        self.assertEqual(response["X-Content-Type-Options"], "nosniff")
+
+    def test_user_changes_invalidate_the_cached_row(self):
+        self.client.get("/api/users/me", **self.headers)
+        self.user.organization = "other-lab"
+        self.user.save()
+        self.assertEqual(self.client.get("/api/users/me", **self.headers).json()["organization"], "other-lab")
+
+        self.user.delete()
+        with self.assertRaises(User.DoesNotExist):
+            jwt_service.validate_token(self.headers["HTTP_AUTHORIZATION"][7:])
+
+    def test_token_claims_are_kept_until_exp(self):
+        token = jwt_service.generate_token(self.user, expire_in=60)
+        jwt_service.validate_token(token)
+        self.assertIsNotNone(auth_cache.get_cached_token_payload(token))
+        with mock.patch.object(auth_cache.cache, "set") as cache_set:
+            auth_cache.cache_token_payload("expired", {"user_id": "x", "exp": int(time.time()) - 1})
+            auth_cache.cache_token_payload("short", {"user_id": "x", "exp": int(time.time()) + 60})
+        cache_set.assert_called_once()
+        self.assertLessEqual(cache_set.call_args.args[2], 60)
+
+
+class SigningKeyTests(TemporaryKeyTestCase):
+    def validate(self, token: str) -> dict:
+        cache.clear()
+        return jwt_service.validate_token(token)[1]
+
+    def test_env_key_until_the_first_rotation(self):
+        token = jwt_service.generate_token(self.user)
+        env_kid = env_key_kid(jwt_service.django_jwt_public_key)
+        self.assertEqual(jwt.get_unverified_header(token)["kid"], env_kid)
+        self.assertEqual(self.validate(token)["user_id"], self.user.user_id)
+
+        jwks = self.client.get("/api/users/.well-known/jwks.json").json()
+        self.assertEqual([key["kid"] for key in jwks["keys"]], [env_kid])
+        self.assertTrue({"kty", "n", "e", "alg", "use"}.issubset(jwks["keys"][0]))
+
+    def test_rotation_keeps_old_tokens_until_retired(self):
+        old_token = jwt_service.generate_token(self.user)
+        call_command("rotate_jwt_signing_key", stdout=io.StringIO())
+        new_key = SigningKey.objects.get()
+        new_token = jwt_service.generate_token(self.user)
+        self.assertEqual(jwt.get_unverified_header(new_token)["kid"], new_key.kid)
+        self.assertEqual(self.validate(old_token)["user_id"], self.user.user_id)
+        self.assertEqual(self.validate(new_token)["user_id"], self.user.user_id)
+        kids = [key["kid"] for key in self.client.get("/api/users/.well-known/jwks.json").json()["keys"]]
+        self.assertEqual(kids, [new_key.kid, env_key_kid(jwt_service.django_jwt_public_key)])
+
+        new_key.retired_at = timezone.now()
+        new_key.save()
+        with self.assertRaises(jwt.JWTError):
+            self.validate(new_token)
+
+    def test_tokens_without_kid_and_parsed_keys(self):
+        legacy_token = jwt.encode({"user_id": self.user.user_id, "exp": int(time.time()) + 60},
+            jwt_service.django_jwt_private_key, algorithm="RS256")
+        self.assertEqual(self.validate(legacy_token)["user_id"], self.user.user_id)
+
+        parse_key.cache_clear()
+        for _ in range(3):
+            self.validate(jwt_service.generate_token(self.user))
+        # one parse of the private and of the public key
+        self.assertEqual(parse_key.cache_info().misses, 2)
+
+    def test_keys_added_by_another_worker_are_found(self):
+        jwt_service.generate_token(self.user)  # the keyring is loaded
+        other_key = SigningKey.generate()
+        # as if created in another process: no signal reached this keyring
+        keyring._loaded_at = keyring.clock() - 10
+        keyring._keys = []
+        token = jwt.encode({"user_id": self.user.user_id, "exp": int(time.time()) + 60},
+            other_key.private_key, algorithm="RS256", headers={"kid": other_key.kid})
+        self.assertEqual(self.validate(token)["user_id"], self.user.user_id)
+        with self.assertRaises(jwt.JWTError):
+            self.validate(jwt.encode({"user_id": "x"}, other_key.private_key, algorithm="RS256", headers={"kid": "unknown"}))
+
+
+class ProvisioningTests(TemporaryKeyTestCase):
+    def login_workos(self, email: str):
+        workos_user = SimpleNamespace(id="wos_01", email=email, first_name="Ada", last_name=None)
+        exchange = mock.AsyncMock(return_value=SimpleNamespace(user=workos_user))
+        with mock.patch.object(workos_service, "aauthenticate_with_code", exchange):
+            response = self.client.get("/api/users/auth/callback", {"code": "code-1"})
+        exchange.assert_awaited_once_with("code-1")
+        return response
+
+    def test_workos_login_upserts_the_user(self):
+        self.assertEqual(self.login_workos("ada@example.com").status_code, 303)
+        self.assertEqual(self.login_workos("ada@new.example.com").status_code, 303)
+        user = User.objects.get(user_id="user__workos__wos_01")
+        self.assertEqual((user.username, user.email, user.last_name), ("default_username__workos__wos_01", "ada@new.example.com", ""))
+
+    def test_bohrium_proxy_login_keeps_the_username(self):
+        private_key, public_key = generate_rsa_key_pair()
+
+        def login(name: str, org_id: int):
+            external_jwt = jwt.encode({"user_data": {"user_id": 42, "name": name, "org_id": org_id}}, private_key, algorithm="RS256")
+            with mock.patch.dict("os.environ", {"BOHRIUM_PROXY_JWT_PUBLIC_KEY": public_key}):
+                return self.client.post("/api/users/jwt/bohrium-proxy/callback", {"external_jwt": external_jwt})
+
+        self.assertEqual(login("ada", 1).status_code, 302)
+        response = login("ada-renamed", 2)
+        user = User.objects.get(user_id="user__bohrium-proxy__42")
+        # the organization of the first login is kept
+        self.assertEqual((user.username, user.organization), ("default_username__bohrium-proxy__ada", "bohrium-proxy__org__1"))
+        token = response["Location"].split("auth_token=")[1].split("&")[0]
+        self.assertEqual(jwt_service.validate_token(token)[1]["organization"], "bohrium-proxy__org__1")
+
+    def test_bohrium_proxy_login_keeps_the_imported_organization_and_email(self):
+        private_key, public_key = generate_rsa_key_pair()
+        self.user.is_staff = True
+        self.user.save()
+        self.client.post("/api/users/orgs/class-a/import", {"users": [{"external_id": "42", "email": "ada@example.com"}]},
+            content_type="application/json", **self.headers)
+
+        external_jwt = jwt.encode({"user_data": {"user_id": 42, "name": "ada", "org_id": 7}}, private_key, algorithm="RS256")
+        with mock.patch.dict("os.environ", {"BOHRIUM_PROXY_JWT_PUBLIC_KEY": public_key}):
+            self.client.post("/api/users/jwt/bohrium-proxy/callback", {"external_jwt": external_jwt})
+        user = User.objects.get(user_id="user__bohrium-proxy__42")
+        self.assertEqual((user.organization, user.email), ("class-a", "ada@example.com"))
+
+    def test_org_import_is_one_statement_and_staff_only(self):
+        # 50 rows stay below the bind variable limit of sqlite, postgres takes UPSERT_BATCH_SIZE rows per statement
+        roster = {"users": [{"external_id": str(i), "email": f"student{i}@example.com"} for i in range(50)]}
+        url = "/api/users/orgs/class-a/import"
+        response = self.client.post(url, roster, content_type="application/json", **self.headers)
+        self.assertEqual(response.status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        # the user row of auth_required (dropped by the save above), the conflict check (2), the upsert in a savepoint (3)
+        with self.assertNumQueries(6):
+            response = self.client.post(url, roster, content_type="application/json", **self.headers)
+        self.assertEqual(response.json(), {"organization": "class-a", "count": 50})
+
+        roster["users"][0]["email"] = "renamed@example.com"
+        self.client.post("/api/users/orgs/class-b/import", roster, content_type="application/json", **self.headers)
+        self.assertEqual(User.objects.filter(organization="class-b").count(), 50)
+        self.assertEqual(User.objects.get(user_id="user__bohrium-proxy__0").email, "renamed@example.com")
+
+    def test_org_import_reports_username_conflicts(self):
+        self.user.is_staff = True
+        self.user.save()
+        User.objects.create(username="ada", user_id="user__workos__wos_ada", email="ada@example.com")
+        roster = {"users": [
+            {"external_id": "1", "email": "ada@school.edu", "username": "ada"},
+            {"external_id": "2", "email": "bob@school.edu", "username": "bob"},
+            {"external_id": "3", "email": "bob2@school.edu", "username": "bob"},
+            {"external_id": "4", "email": "cy@school.edu"},
+        ]}
+
+        response = self.client.post("/api/users/orgs/class-a/import", roster, content_type="application/json", **self.headers)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([(c["row"], c["username"]) for c in response.json()["conflicts"]], [(0, "ada"), (2, "bob")])
+        self.assertFalse(User.objects.filter(organization="class-a").exists())